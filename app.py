@@ -13,14 +13,23 @@ import traceback
 
 # Importa l'istanza db dai modelli
 from models import db
+from utils.sql_compat import normalize_database_url
 
 # Inizializzazione delle altre estensioni
 login_manager = LoginManager()
 csrf = CSRFProtect()
 
-def create_app():
-    """Factory function per creare l'applicazione Flask"""
+def create_app(start_background_tasks=True):
+    """
+    Factory function per creare l'applicazione Flask
+
+    Args:
+        start_background_tasks: Avvia il ripristino dei job interrotti e i thread
+            periodici (checkpoint del WAL, copia per le statistiche). Va disattivato
+            nel processo che sorveglia i file per il reloader, che non serve richieste.
+    """
     app = Flask(__name__)
+    app.config['START_BACKGROUND_TASKS'] = start_background_tasks
     
     # Configurazione con supporto per ambienti multipli
     app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', 'dev-secret-key-change-in-production')
@@ -30,11 +39,67 @@ def create_app():
     if os.environ.get('DEV_MODE') == '1':
         default_db = 'sqlite:///analisi_mu_dev.db'
     
-    app.config['SQLALCHEMY_DATABASE_URI'] = os.environ.get('DATABASE_URL', default_db)
+    database_url = normalize_database_url(os.environ.get('DATABASE_URL', default_db))
+    app.config['SQLALCHEMY_DATABASE_URI'] = database_url
     app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    if database_url.startswith('postgresql'):
+        # Pool per più worker: connessioni verificate prima dell'uso e riciclate
+        # prima dei timeout lato server/proxy
+        app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {
+            'pool_size': int(os.environ.get('DB_POOL_SIZE', 10)),
+            'max_overflow': int(os.environ.get('DB_MAX_OVERFLOW', 20)),
+            'pool_timeout': int(os.environ.get('DB_POOL_TIMEOUT', 30)),
+            'pool_recycle': int(os.environ.get('DB_POOL_RECYCLE', 1800)),
+            'pool_pre_ping': True,
+        }
     # Consenti override via env
     app.config['UPLOAD_FOLDER'] = os.environ.get('UPLOAD_FOLDER', 'uploads')
     app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+    # Numero di celle per batch durante l'ingestione dei file Excel
+    app.config['INGESTION_CHUNK_SIZE'] = int(os.environ.get('INGESTION_CHUNK_SIZE', 5000))
+    # Ingestione in background: thread di lavoro dedicati (0 = esecuzione sincrona)
+    app.config['INGESTION_WORKER_THREADS'] = int(os.environ.get('INGESTION_WORKER_THREADS', 1))
+    app.config['INGESTION_ASYNC'] = app.config['INGESTION_WORKER_THREADS'] > 0
+    # Processi per l'analisi parallela dei fogli xlsx (1 = analisi seriale, predefinita).
+    # Conviene solo con più core liberi e workbook con molti fogli grandi: ogni processo
+    # rilegge le stringhe condivise del file (vedi benchmarks/bench_parallel_ingestion.py)
+    app.config['INGESTION_PROCESS_WORKERS'] = int(os.environ.get('INGESTION_PROCESS_WORKERS', 1))
+    # Rimette in coda all'avvio i job interrotti e sblocca i file rimasti in eliminazione
+    # (0 con più processi sullo stesso database)
+    app.config['INGESTION_RECOVER_ON_STARTUP'] = int(os.environ.get('INGESTION_RECOVER_ON_STARTUP', 1))
+    # Caricamenti a blocchi (/uploads): ogni blocco deve restare sotto MAX_CONTENT_LENGTH
+    app.config['UPLOAD_CHUNK_SIZE'] = int(os.environ.get('UPLOAD_CHUNK_SIZE', 8 * 1024 * 1024))
+    app.config['UPLOAD_MAX_SIZE'] = int(os.environ.get('UPLOAD_MAX_SIZE', 2 * 1024 * 1024 * 1024))
+    app.config['UPLOAD_SESSION_TTL_HOURS'] = int(os.environ.get('UPLOAD_SESSION_TTL_HOURS', 24))
+    # File con più celle di così vengono eliminati in background (0 = sempre nella richiesta)
+    app.config['BULK_DELETE_ASYNC_CELLS'] = int(os.environ.get('BULK_DELETE_ASYNC_CELLS', 50000))
+    # Profilo SQLite (utils/sqlite_tuning.py): 'production' (WAL), 'safe' o 'none'
+    app.config['SQLITE_PRAGMA_PROFILE'] = os.environ.get('SQLITE_PRAGMA_PROFILE', 'production')
+    app.config['SQLITE_CHECKPOINT_INTERVAL'] = int(os.environ.get('SQLITE_CHECKPOINT_INTERVAL', 300))
+    # Registro delle azioni (services/action_log.py): giorni mantenuti in annotation_action,
+    # poi riepilogo giornaliero e archivio in tabella ('table') o in file JSONL compressi ('jsonl')
+    app.config['ACTION_LOG_RETENTION_DAYS'] = int(os.environ.get('ACTION_LOG_RETENTION_DAYS', 90))
+    app.config['ACTION_ARCHIVE_BACKEND'] = os.environ.get('ACTION_ARCHIVE_BACKEND', 'table')
+    app.config['ACTION_ARCHIVE_DIR'] = os.environ.get(
+        'ACTION_ARCHIVE_DIR', os.path.join(os.environ.get('INSTANCE_FOLDER', 'instance'), 'action_archive'))
+    
+    # Matrice di accordo tra tutti gli annotatori (services/agreement.py): processi per i blocchi
+    # di etichette (1 = calcolo seriale), usati solo dagli ambiti con almeno N annotazioni
+    app.config['AGREEMENT_PROCESS_WORKERS'] = int(os.environ.get('AGREEMENT_PROCESS_WORKERS', 1))
+    app.config['AGREEMENT_PARALLEL_MIN_ANNOTATIONS'] = int(os.environ.get('AGREEMENT_PARALLEL_MIN_ANNOTATIONS', 500000))
+    
+    # Statistiche lette da una copia in sola lettura (utils/analytics_snapshot.py):
+    # replica indicata da ANALYTICS_DATABASE_URL o, con SQLite, copia aggiornata ogni N secondi (0 = disattivata)
+    app.config['ANALYTICS_DATABASE_URL'] = os.environ.get('ANALYTICS_DATABASE_URL')
+    app.config['ANALYTICS_SNAPSHOT_INTERVAL'] = int(os.environ.get('ANALYTICS_SNAPSHOT_INTERVAL', 300))
+    app.config['ANALYTICS_SNAPSHOT_PATH'] = os.environ.get(
+        'ANALYTICS_SNAPSHOT_PATH', os.path.join(app.instance_path, 'analytics_snapshot.db'))
+    
+    # Cache delle statistiche (services/stats_cache.py) in un file SQLite condiviso dai worker,
+    # invalidata dalle scritture; STATS_CACHE_TTL = scadenza in secondi (0 = disattivata)
+    app.config['STATS_CACHE_TTL'] = int(os.environ.get('STATS_CACHE_TTL', 300))
+    app.config['STATS_CACHE_PATH'] = os.environ.get(
+        'STATS_CACHE_PATH', os.path.join(app.instance_path, 'stats_cache.db'))
     
     # Configurazioni specifiche per ambiente
     if os.environ.get('DEV_MODE') == '1':
@@ -46,9 +111,21 @@ def create_app():
     
     # Inizializzazione estensioni
     db.init_app(app)
+    from utils.sqlite_tuning import configure_sqlite
+    configure_sqlite(app, db)
+    from utils.analytics_snapshot import configure_analytics_bind, start_snapshot_refresher
+    configure_analytics_bind(app, db)
     login_manager.init_app(app)
     csrf.init_app(app)
     
+    # Aggiornamento incrementale degli aggregati e invalidazione della cache alla scrittura delle annotazioni
+    from services.annotation_events import register_annotation_events
+    from services.question_stats import apply_annotation_changes
+    from services.annotation_counters import apply_annotation_counters
+    from services.stats_cache import apply_annotation_scopes, configure_stats_cache
+    register_annotation_events(apply_annotation_changes, apply_annotation_counters, apply_annotation_scopes)
+    configure_stats_cache(app)
+    
     # Esenzione CSRF per route specifiche
     csrf.exempt('labels.update_category_colors')
     csrf.exempt('labels.reset_category_color')
@@ -73,6 +150,8 @@ def create_app():
     from routes.decisions import decisions_bp
     from routes.diary import diary_bp
     from routes.projects import projects_bp
+    from routes.uploads import uploads_bp
+    from routes.search import search_bp
     
     app.register_blueprint(auth_bp, url_prefix='/auth')
     app.register_blueprint(main_bp, url_prefix='/')
@@ -88,6 +167,8 @@ def create_app():
     app.register_blueprint(decisions_bp)
     app.register_blueprint(diary_bp, url_prefix='/diary')
     app.register_blueprint(projects_bp)
+    app.register_blueprint(uploads_bp, url_prefix='/uploads')
+    app.register_blueprint(search_bp)
     
     # Creazione delle cartelle necessarie con permessi corretti
     upload_folder = app.config['UPLOAD_FOLDER']
@@ -169,9 +250,14 @@ def create_app():
     # Creazione delle tabelle del database
     with app.app_context():
         from models import (User, Label, ExcelFile, TextCell, CellAnnotation, 
-                           TextDocument, TextAnnotation)
+                           TextDocument, TextAnnotation, IngestionJob,
+                           UploadSession, UploadChunk, QuestionStats)
         db.create_all()
         
+        # Indici della ricerca full-text (tabelle FTS5 e trigger / indici GIN)
+        from services.search import install_search_index
+        install_search_index(db.engine)
+        
         # Creazione utente admin di default se non esiste
         admin = User.query.filter_by(username='admin').first()
         if not admin:
@@ -245,8 +331,35 @@ def create_app():
             
             db.session.commit()
     
+    if start_background_tasks:
+        # Job di ingestione ed eliminazioni rimasti a metà dall'esecuzione precedente
+        if app.config['INGESTION_RECOVER_ON_STARTUP']:
+            from services.bulk_delete import recover_interrupted_deletes
+            from services.ingestion_jobs import recover_interrupted_jobs
+            recover_interrupted_jobs(app)
+            recover_interrupted_deletes(app)
+        
+        # Copia periodica del database per le statistiche (solo SQLite)
+        start_snapshot_refresher(app, db)
+    
     return app
 
+def is_serving_process(use_reloader):
+    """
+    Indica se il processo corrente servirà le richieste
+
+    Con il reloader di Werkzeug il processo avviato resta a sorvegliare i file
+    e le richieste sono servite da un processo figlio (WERKZEUG_RUN_MAIN).
+
+    Args:
+        use_reloader: True se app.run verrà chiamato con il reloader attivo
+
+    Returns:
+        True se il processo serve le richieste
+    """
+    from werkzeug.serving import is_running_from_reloader
+    return not use_reloader or is_running_from_reloader()
+
 if __name__ == '__main__':
-    app = create_app()
+    app = create_app(start_background_tasks=is_serving_process(use_reloader=True))
     app.run(debug=True, host='0.0.0.0', port=5018)
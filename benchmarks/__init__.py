@@ -0,0 +1 @@
+# Questo file rende 'benchmarks' un package Python
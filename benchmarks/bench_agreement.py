@@ -0,0 +1,83 @@
+#!/usr/bin/env python3
+"""
+Benchmark: matrice di accordo tra tutte le coppie di annotatori
+(services/agreement.py) su un dataset sintetico.
+
+Confronta il calcolo coppia per coppia (pairwise_agreement per ognuna delle
+N·(N-1)/2 coppie) con il calcolo in blocco di pairwise_matrix, seriale e su
+un pool di processi, e verifica che i risultati coincidano.
+
+Uso:
+    python -m benchmarks.bench_agreement --annotators 12 --rows 2000
+    python -m benchmarks.bench_agreement --annotators 30 --labels 200 --workers 4
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+import numpy as np
+
+from benchmarks.common import create_annotation_dataset, create_benchmark_app
+from benchmarks.synthetic import generate_workbook
+from services.agreement import load_annotation_matrix, pairwise_agreement, pairwise_matrix
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--annotators', type=int, default=12)
+    parser.add_argument('--labels', type=int, default=50)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'survey.xlsx')
+        generate_workbook(file_path, rows=args.rows, columns=args.columns)
+        app = create_benchmark_app(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+
+        with app.app_context():
+            print(f"📄 Dataset: {args.rows} righe × {args.columns} colonne, {args.annotators} annotatori, "
+                  f"{args.labels} etichette")
+            dataset = create_annotation_dataset(file_path, annotators=args.annotators, labels=args.labels)
+            print(f"📋 Annotazioni: {dataset['annotations']}")
+
+            start = time.perf_counter()
+            matrix = load_annotation_matrix(file_id=dataset['excel_file_id'])
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            pairs = {}
+            for i, first in enumerate(dataset['user_ids']):
+                for second in dataset['user_ids'][i + 1:]:
+                    pairs[(first, second)] = pairwise_agreement(matrix, first, second)
+            pairwise_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            serial = pairwise_matrix(matrix)
+            serial_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            parallel = pairwise_matrix(matrix, workers=args.workers)
+            parallel_time = time.perf_counter() - start
+
+        index = {user_id: i for i, user_id in enumerate(serial['user_ids'])}
+        identical = all(
+            serial['overlap'][index[a], index[b]] == result['common_cells']
+            and serial['exact_matches'][index[a], index[b]] == result['exact_matches']
+            and (result['kappa'] is None and np.isnan(serial['kappa'][index[a], index[b]])
+                 or abs(serial['kappa'][index[a], index[b]] - result['kappa']) < 1e-9)
+            for (a, b), result in pairs.items()
+        ) and np.allclose(serial['kappa'], parallel['kappa'], equal_nan=True)
+
+        print(f"⏱️  Lettura (una query):   {load_time:.3f}s")
+        print(f"⏱️  Coppia per coppia:     {pairwise_time:.3f}s ({len(pairs)} coppie)")
+        print(f"⏱️  Matrice, seriale:      {serial_time:.3f}s")
+        print(f"⏱️  Matrice, {args.workers} processi: {parallel_time:.3f}s (compreso l'avvio del pool)")
+        print(f"🔍 Risultati identici: {'sì' if identical else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+"""
+Benchmark: co-occorrenza delle etichette (services/cooccurrence.py) su un
+dataset sintetico.
+
+Confronta il conteggio con un ciclo Python sulle coppie di etichette di ogni
+cella con il prodotto sparso Xᵀ·X di LabelCooccurrence, verifica che i
+conteggi coincidano e misura la seconda lettura dalla cache delle statistiche.
+
+Uso:
+    python -m benchmarks.bench_cooccurrence --rows 5000 --labels 200
+    python -m benchmarks.bench_cooccurrence --labels 3000 --labels-per-cell 6
+"""
+
+import argparse
+import os
+import tempfile
+import time
+from collections import Counter
+from itertools import combinations
+
+from benchmarks.common import create_annotation_dataset, create_benchmark_app
+from benchmarks.synthetic import generate_workbook
+from services.cooccurrence import LabelCooccurrence, label_cooccurrence, load_label_units
+from services.stats_cache import STATS_CACHE, StatsCache
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--annotators', type=int, default=5)
+    parser.add_argument('--labels', type=int, default=200)
+    parser.add_argument('--labels-per-cell', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'survey.xlsx')
+        generate_workbook(file_path, rows=args.rows, columns=args.columns)
+        app = create_benchmark_app(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+        app.extensions[STATS_CACHE] = StatsCache(os.path.join(tmp_dir, 'stats_cache.db'), ttl=300)
+
+        with app.app_context():
+            print(f"📄 Dataset: {args.rows} righe × {args.columns} colonne, {args.annotators} annotatori, "
+                  f"{args.labels} etichette")
+            dataset = create_annotation_dataset(file_path, annotators=args.annotators, labels=args.labels,
+                                                labels_per_cell=args.labels_per_cell)
+            print(f"📋 Annotazioni: {dataset['annotations']}")
+            file_id = dataset['excel_file_id']
+
+            start = time.perf_counter()
+            units, labels = load_label_units(file_id=file_id)
+            load_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cell_labels = {}
+            for unit, label in zip(units.tolist(), labels.tolist()):
+                cell_labels.setdefault(unit, set()).add(label)
+            loop_counts = Counter(pair for label_set in cell_labels.values()
+                                  for pair in combinations(sorted(label_set), 2))
+            loop_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            cooc = LabelCooccurrence.from_annotations(units, labels)
+            cooc.measures()
+            sparse_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            label_cooccurrence(file_id=file_id)
+            cold_time = time.perf_counter() - start
+
+            start = time.perf_counter()
+            label_cooccurrence(file_id=file_id)
+            cached_time = time.perf_counter() - start
+
+        sparse_counts = dict(zip(zip(cooc.label_ids[cooc.first].tolist(), cooc.label_ids[cooc.second].tolist()),
+                                 cooc.counts.tolist()))
+        identical = sparse_counts == dict(loop_counts)
+
+        print(f"⏱️  Lettura (una query):   {load_time:.3f}s")
+        print(f"⏱️  Ciclo sulle coppie:    {loop_time:.3f}s ({len(loop_counts)} coppie)")
+        print(f"⏱️  Prodotto sparso:       {sparse_time:.3f}s (con jaccard, lift e PMI)")
+        print(f"⏱️  Ambito, prima lettura: {cold_time:.3f}s")
+        print(f"⏱️  Ambito, dalla cache:   {cached_time:.3f}s")
+        print(f"🔍 Conteggi identici: {'sì' if identical else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
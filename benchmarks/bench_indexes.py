@@ -0,0 +1,264 @@
+#!/usr/bin/env python3
+"""
+Piani di esecuzione e tempi delle query frequenti prima e dopo gli indici composti.
+
+Le query riproducono la forma di quelle di routes/statistics.py,
+routes/annotation.py e services/ai_annotator.py. Per ognuna vengono mostrati
+il piano (EXPLAIN QUERY PLAN su SQLite, EXPLAIN su PostgreSQL), gli indici
+usati e il tempo migliore su più esecuzioni, prima senza indici secondari e
+poi con gli indici dichiarati nei modelli.
+
+Uso:
+    python -m benchmarks.bench_indexes                                # dataset sintetico
+    python -m benchmarks.bench_indexes --rows 5000 --annotators 8
+    python -m benchmarks.bench_indexes --database instance/analisi_mu.db   # copia del DB reale
+
+Il database indicato con --database viene copiato in una cartella temporanea
+e non viene modificato.
+"""
+
+import argparse
+import json
+import os
+import re
+import shutil
+import tempfile
+import time
+from datetime import datetime
+
+from sqlalchemy import and_, desc, distinct, func, or_, select
+
+from benchmarks.common import create_annotation_dataset, create_benchmark_app
+from benchmarks.synthetic import generate_workbook
+from models import db, AnnotationAction, CellAnnotation, Label, TextCell
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+# Tabelle su cui vengono confrontati gli indici
+INDEXED_MODELS = (TextCell, CellAnnotation, AnnotationAction)
+
+INDEX_PATTERN = re.compile(r'(?:USING (?:COVERING )?INDEX|Index (?:Only )?Scan using) (\w+)')
+
+
+def hot_queries(p):
+    """
+    Query frequenti dell'applicazione con i parametri del dataset
+
+    Args:
+        p: Dizionario con file_id, column, user1, user2, label_id, cell_id
+
+    Returns:
+        Lista di tuple (nome, origine, statement)
+    """
+    ca = CellAnnotation
+    tc = TextCell
+    annotable = or_(tc.question_type == 'aperta', tc.question_type.is_(None))
+    return [
+        ('user_annotation_count', 'statistics.user_detail',
+         select(func.count(ca.id)).where(ca.user_id == p['user1'])),
+        ('user_distinct_cells', 'statistics.user_detail',
+         select(func.count(distinct(ca.text_cell_id))).where(ca.user_id == p['user1'])),
+        ('user_first_annotation', 'statistics.user_detail',
+         select(func.min(ca.created_at)).where(ca.user_id == p['user1'])),
+        ('user_daily_timeline', 'statistics.user_detail',
+         select(func.date(ca.created_at), func.count(ca.id)).where(ca.user_id == p['user1'])
+         .group_by(func.date(ca.created_at))),
+        ('user_label_usage', 'statistics.user_detail',
+         select(Label.name, func.count(ca.id)).join(ca, ca.label_id == Label.id)
+         .where(ca.user_id == p['user1']).group_by(Label.id)),
+        ('compare_common_cells', 'statistics.compare_users',
+         select(ca.text_cell_id).where(ca.user_id == p['user1'])
+         .intersect(select(ca.text_cell_id).where(ca.user_id == p['user2']))),
+        ('compare_label_count', 'statistics.compare_users',
+         select(func.count(ca.id)).where(ca.user_id == p['user1'], ca.label_id == p['label_id'])),
+        ('recent_actions', 'statistics.user_detail',
+         select(AnnotationAction.id).where(AnnotationAction.performed_by == p['user1'])
+         .order_by(desc(AnnotationAction.timestamp)).limit(20)),
+        ('labels_histogram', 'statistics._get_labels_histogram_data',
+         select(Label.name, func.count(ca.id)).join(ca, ca.label_id == Label.id)
+         .join(tc, tc.id == ca.text_cell_id)
+         .where(tc.excel_file_id == p['file_id'], tc.column_name == p['column'])
+         .group_by(Label.id)),
+        ('browse_default_page', 'annotation.browse_annotations',
+         select(tc.id).where(tc.excel_file_id == p['file_id'], annotable)
+         .order_by(tc.excel_file_id, tc.sheet_name, tc.row_index, tc.column_index).limit(20)),
+        ('browse_question_annotated', 'annotation.browse_annotations',
+         select(tc.id).distinct().join(ca, ca.text_cell_id == tc.id)
+         .where(tc.excel_file_id == p['file_id'], tc.column_name == p['column'])),
+        ('navigation_same_question', 'annotation.get_navigation_context',
+         select(tc.id).where(tc.column_name == p['column'], annotable)
+         .order_by(tc.excel_file_id, tc.sheet_name, tc.row_index, tc.column_index)),
+        ('cell_annotations', 'annotation.annotate_cell',
+         select(ca.id).where(ca.text_cell_id == p['cell_id']).order_by(ca.created_at.desc())),
+        ('ai_target_cells', 'ai_annotator.annotate_file',
+         select(tc.id).where(tc.excel_file_id == p['file_id'],
+                             tc.id.notin_(select(ca.text_cell_id).distinct()))),
+        ('ai_pending_review', 'ai_annotator.get_pending_annotations',
+         select(ca.id).where(and_(ca.is_ai_generated.is_(True), ca.status == 'pending_review'))),
+    ]
+
+
+def dataset_parameters(connection):
+    """Sceglie file, domanda, utenti, etichetta e cella più rappresentativi del dataset"""
+    ca = CellAnnotation.__table__
+    tc = TextCell.__table__
+    file_id, column = connection.execute(
+        select(tc.c.excel_file_id, tc.c.column_name).group_by(tc.c.excel_file_id, tc.c.column_name)
+        .order_by(func.count().desc()).limit(1)
+    ).one()
+    users = [row[0] for row in connection.execute(
+        select(ca.c.user_id).group_by(ca.c.user_id).order_by(func.count().desc()).limit(2)
+    )]
+    if not users:
+        raise SystemExit('Il database non contiene annotazioni')
+    label_id = connection.execute(
+        select(ca.c.label_id).group_by(ca.c.label_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    cell_id = connection.execute(
+        select(ca.c.text_cell_id).group_by(ca.c.text_cell_id).order_by(func.count().desc()).limit(1)
+    ).scalar()
+    return {
+        'file_id': file_id, 'column': column, 'user1': users[0], 'user2': users[-1],
+        'label_id': label_id, 'cell_id': cell_id,
+    }
+
+
+def compile_sql(statement, engine):
+    """SQL con i parametri inclusi, per EXPLAIN"""
+    return str(statement.compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True}))
+
+
+def explain(connection, statement):
+    """
+    Piano di esecuzione di una query
+
+    Returns:
+        Tupla (righe del piano, indici usati)
+    """
+    engine = connection.engine
+    sql = compile_sql(statement, engine)
+    if engine.dialect.name == 'sqlite':
+        plan = [row[-1] for row in connection.exec_driver_sql(f'EXPLAIN QUERY PLAN {sql}')]
+    else:
+        plan = [row[0] for row in connection.exec_driver_sql(f'EXPLAIN {sql}')]
+    indexes = sorted({match for line in plan for match in INDEX_PATTERN.findall(line)})
+    return plan, indexes
+
+
+def time_query(connection, statement, repeat):
+    """Tempo migliore di esecuzione (in millisecondi) su repeat esecuzioni"""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        connection.execute(statement).fetchall()
+        elapsed = (time.perf_counter() - start) * 1000
+        best = elapsed if best is None else min(best, elapsed)
+    return round(best, 3)
+
+
+def analyze(connection):
+    """Aggiorna le statistiche del planner"""
+    connection.exec_driver_sql('ANALYZE')
+
+
+def drop_secondary_indexes(connection):
+    """Elimina gli indici dichiarati sui modelli confrontati"""
+    for model in INDEXED_MODELS:
+        for index in model.__table__.indexes:
+            index.drop(connection, checkfirst=True)
+    analyze(connection)
+
+
+def create_secondary_indexes(connection):
+    """Crea gli indici dichiarati sui modelli confrontati"""
+    for model in INDEXED_MODELS:
+        for index in model.__table__.indexes:
+            index.create(connection, checkfirst=True)
+    analyze(connection)
+
+
+def measure(connection, queries, repeat):
+    """Piano e tempo di ogni query"""
+    results = {}
+    for name, origin, statement in queries:
+        plan, indexes = explain(connection, statement)
+        results[name] = {
+            'origin': origin,
+            'milliseconds': time_query(connection, statement, repeat),
+            'plan': plan,
+            'indexes': indexes,
+        }
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--database', default=None, help='Database SQLite esistente da copiare')
+    parser.add_argument('--database-url', default=None,
+                        help='Database dedicato (es. PostgreSQL) su cui generare il dataset')
+    parser.add_argument('--rows', type=int, default=3000)
+    parser.add_argument('--columns', type=int, default=10)
+    parser.add_argument('--annotators', type=int, default=5)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', default=None, help='File JSON dei risultati')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        if args.database:
+            database_path = os.path.join(tmp_dir, 'bench.db')
+            shutil.copyfile(args.database, database_path)
+            app = create_benchmark_app(f'sqlite:///{database_path}')
+            dataset = {'source': os.path.abspath(args.database)}
+        else:
+            app = create_benchmark_app(args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+            file_path = os.path.join(tmp_dir, 'survey.xlsx')
+            generate_workbook(file_path, rows=args.rows, columns=args.columns, length_distribution='lognormal')
+            with app.app_context():
+                print(f"📄 Dataset sintetico: {args.rows} righe × {args.columns} colonne, "
+                      f"{args.annotators} annotatori")
+                info = create_annotation_dataset(file_path, annotators=args.annotators)
+            dataset = {'source': 'synthetic', 'rows': args.rows, 'columns': args.columns,
+                       'annotators': args.annotators, 'cells': info['cells'],
+                       'annotations': info['annotations']}
+
+        with app.app_context():
+            engine = db.engine
+            with engine.begin() as connection:
+                params = dataset_parameters(connection)
+                queries = hot_queries(params)
+
+                drop_secondary_indexes(connection)
+                before = measure(connection, queries, args.repeat)
+                create_secondary_indexes(connection)
+                after = measure(connection, queries, args.repeat)
+            dialect = engine.dialect.name
+
+    print(f"\n{'Query':<28} {'prima (ms)':>11} {'dopo (ms)':>10} {'speedup':>8}  indici usati")
+    print('-' * 100)
+    for name, _, _ in queries:
+        speedup = before[name]['milliseconds'] / after[name]['milliseconds'] if after[name]['milliseconds'] else 0
+        print(f"{name:<28} {before[name]['milliseconds']:>11.2f} {after[name]['milliseconds']:>10.2f} "
+              f"{speedup:>7.1f}×  {', '.join(after[name]['indexes']) or '⚠️  nessuno'}")
+
+    results = {
+        'benchmark': 'indexes',
+        'timestamp': datetime.utcnow().isoformat(),
+        'engine': dialect,
+        'dataset': dataset,
+        'parameters': params,
+        'queries': {
+            name: {'origin': origin, 'before': before[name], 'after': after[name]}
+            for name, origin, _ in queries
+        },
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"indexes_{dialect}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"\n📊 Risultati salvati in {output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+#!/usr/bin/env python3
+"""
+Benchmark dell'ingestione (extract_text_cells) su workbook sintetici.
+
+Per ogni ripetizione misura il tempo di estrazione e quello delle elaborazioni
+successive (classificazione delle colonne e aggregati per domanda), poi esegue
+un'ingestione aggiuntiva con tracemalloc per il picco di memoria Python.
+I risultati, insieme ai parametri e alla dimensione del database, vengono
+scritti in JSON per confrontare versioni e motori (SQLite e PostgreSQL).
+
+Uso:
+    python -m benchmarks.bench_ingestion --rows 5000 --columns 20 --sheets 2
+    python -m benchmarks.bench_ingestion --length-distribution lognormal --empty-ratio 0.4
+    python -m benchmarks.bench_ingestion --database-url postgresql://user:pw@localhost/bench
+
+Con --database-url le tabelle vengono ricreate a ogni ripetizione: usare un
+database dedicato al benchmark.
+"""
+
+import argparse
+import json
+import os
+import platform
+import subprocess
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+from benchmarks.common import (
+    create_benchmark_app, create_excel_file_record, database_size, peak_rss_bytes
+)
+from benchmarks.synthetic import LENGTH_DISTRIBUTIONS, generate_workbook
+from models import db
+from routes.excel import extract_text_cells
+from services.column_profiler import ColumnProfiler
+from services.question_stats import rebuild_question_stats
+from services.search import install_search_index, rebuild_search_index
+
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'results')
+
+
+def git_revision():
+    """Commit corrente del repository (None se git non è disponibile)"""
+    try:
+        return subprocess.check_output(
+            ['git', 'rev-parse', '--short', 'HEAD'],
+            cwd=os.path.dirname(RESULTS_DIR), stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def reset_database(app):
+    """Ricrea le tabelle (e l'indice di ricerca) per partire da un database vuoto"""
+    with app.app_context():
+        db.drop_all()
+        if db.engine.dialect.name == 'sqlite':
+            with db.engine.connect() as connection:
+                connection.exec_driver_sql('VACUUM')
+        db.create_all()
+        # drop_all elimina anche i trigger: vanno ricreati e le tabelle FTS svuotate
+        install_search_index(db.engine)
+        rebuild_search_index(db.engine)
+
+
+def run_once(app, file_path, trace_memory=False):
+    """
+    Esegue un'ingestione completa su un database vuoto
+
+    Returns:
+        Dizionario con celle, tempi delle fasi, dimensione del database e memoria
+    """
+    reset_database(app)
+    with app.app_context():
+        excel_file_id = create_excel_file_record(file_path)
+
+        if trace_memory:
+            tracemalloc.start()
+        start = time.perf_counter()
+        cells = extract_text_cells(file_path, excel_file_id)
+        extract_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        profiler = ColumnProfiler()
+        detected_types = profiler.profile_file(excel_file_id)
+        rebuild_question_stats(excel_file_id)
+        profiler.store_suggestions(excel_file_id, detected_types)
+        db.session.commit()
+        post_seconds = time.perf_counter() - start
+
+        result = {
+            'cells': cells,
+            'extract_seconds': round(extract_seconds, 4),
+            'post_processing_seconds': round(post_seconds, 4),
+            'cells_per_second': round(cells / extract_seconds, 1) if extract_seconds else None,
+            'database_bytes': database_size(db.engine),
+            'peak_rss_bytes': peak_rss_bytes(),
+        }
+        if trace_memory:
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+            result['tracemalloc_peak_bytes'] = peak
+        db.session.remove()
+    return result
+
+
+def summarize(runs, key):
+    """Minimo, mediana e massimo di una misura sulle ripetizioni"""
+    values = sorted(run[key] for run in runs)
+    return {
+        'min': values[0],
+        'median': values[len(values) // 2],
+        'max': values[-1],
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=1)
+    parser.add_argument('--rows', type=int, default=2000)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--length-distribution', choices=LENGTH_DISTRIBUTIONS, default='uniform')
+    parser.add_argument('--min-words', type=int, default=3)
+    parser.add_argument('--max-words', type=int, default=40)
+    parser.add_argument('--empty-ratio', type=float, default=0.2)
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--repeat', type=int, default=3, help='Ripetizioni cronometrate')
+    parser.add_argument('--workers', type=int, default=None, help='Processi per il parsing dei fogli')
+    parser.add_argument('--chunk-size', type=int, default=None, help='Celle per batch di inserimento')
+    parser.add_argument('--database-url', default=None,
+                        help='Database da usare (default: SQLite temporaneo)')
+    parser.add_argument('--no-tracemalloc', action='store_true',
+                        help="Salta l'esecuzione aggiuntiva con tracemalloc")
+    parser.add_argument('--output', default=None, help='File JSON dei risultati')
+    args = parser.parse_args()
+    if args.repeat < 1:
+        parser.error('--repeat deve essere almeno 1')
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'survey.xlsx')
+        print(f"📄 Generazione workbook: {args.sheets} fogli × {args.rows} righe × {args.columns} colonne "
+              f"({args.length_distribution}, {args.empty_ratio:.0%} vuote)")
+        generate_workbook(file_path, sheets=args.sheets, rows=args.rows, columns=args.columns,
+                          empty_ratio=args.empty_ratio, seed=args.seed,
+                          length_distribution=args.length_distribution,
+                          min_words=args.min_words, max_words=args.max_words)
+
+        database_url = args.database_url or f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}"
+        app = create_benchmark_app(database_url)
+        app.config['INGESTION_CHUNK_SIZE'] = args.chunk_size
+        app.config['INGESTION_PROCESS_WORKERS'] = args.workers
+        with app.app_context():
+            engine = db.engine.dialect.name
+
+        runs = []
+        for attempt in range(1, args.repeat + 1):
+            run = run_once(app, file_path)
+            runs.append(run)
+            print(f"⏱️  Esecuzione {attempt}: {run['extract_seconds']:.2f}s estrazione, "
+                  f"{run['post_processing_seconds']:.2f}s elaborazioni, {run['cells']} celle "
+                  f"({run['cells_per_second']:.0f} celle/s)")
+
+        memory = None
+        if not args.no_tracemalloc:
+            traced = run_once(app, file_path, trace_memory=True)
+            memory = {
+                'tracemalloc_peak_bytes': traced['tracemalloc_peak_bytes'],
+                'peak_rss_bytes': traced['peak_rss_bytes'],
+            }
+            print(f"🧠 Picco tracemalloc: {traced['tracemalloc_peak_bytes'] / 2**20:.1f} MB")
+
+        results = {
+            'benchmark': 'ingestion',
+            'timestamp': datetime.utcnow().isoformat(),
+            'git_revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'engine': engine,
+            'parameters': {
+                'sheets': args.sheets,
+                'rows': args.rows,
+                'columns': args.columns,
+                'length_distribution': args.length_distribution,
+                'min_words': args.min_words,
+                'max_words': args.max_words,
+                'empty_ratio': args.empty_ratio,
+                'seed': args.seed,
+                'workers': args.workers,
+                'chunk_size': args.chunk_size,
+            },
+            'file_bytes': os.path.getsize(file_path),
+            'runs': runs,
+            'summary': {
+                'extract_seconds': summarize(runs, 'extract_seconds'),
+                'post_processing_seconds': summarize(runs, 'post_processing_seconds'),
+                'cells_per_second': summarize(runs, 'cells_per_second'),
+                'database_bytes': runs[-1]['database_bytes'],
+            },
+            'memory': memory,
+        }
+
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"ingestion_{engine}_{datetime.now():%Y%m%d_%H%M%S}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(results, f, indent=2)
+
+    if results['summary']['database_bytes']:
+        print(f"💾 Database: {results['summary']['database_bytes'] / 2**20:.1f} MB")
+    print(f"📊 Risultati salvati in {output}")
+
+
+if __name__ == '__main__':
+    main()
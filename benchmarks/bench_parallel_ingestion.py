@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+"""
+Benchmark: ingestione seriale vs parallela (fogli distribuiti tra più
+processi) su un workbook sintetico a 20 fogli.
+
+La modalità parallela usa al più os.cpu_count() processi: con un solo core
+l'ingestione resta seriale. Ogni processo legge da sé le stringhe condivise
+del workbook, quindi il guadagno compare solo con più core liberi e fogli
+grandi, quando l'analisi XML pesa più della scrittura nel database.
+
+Uso:
+    python -m benchmarks.bench_parallel_ingestion --workers 4 --rows 2000
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from benchmarks.common import create_benchmark_app, create_excel_file_record
+from benchmarks.synthetic import generate_workbook
+from models import db, TextCell
+from services.excel_ingestion import ExcelIngestionService
+
+
+def run_ingestion(app, file_path, workers):
+    """Esegue un'ingestione e restituisce (secondi, celle, firma delle celle)"""
+    with app.app_context():
+        excel_file_id = create_excel_file_record(file_path)
+        service = ExcelIngestionService(workers=workers)
+        start = time.perf_counter()
+        cells = service.ingest(file_path, excel_file_id)
+        db.session.commit()
+        elapsed = time.perf_counter() - start
+
+        signature = db.session.query(
+            TextCell.sheet_name, TextCell.row_index, TextCell.column_index, TextCell.column_name
+        ).filter_by(excel_file_id=excel_file_id).order_by(TextCell.id).all()
+        return elapsed, cells, signature
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sheets', type=int, default=20)
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--columns', type=int, default=20)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        file_path = os.path.join(tmp_dir, 'survey.xlsx')
+        print(f"🖥️  Core disponibili: {os.cpu_count()}")
+        print(f"📄 Generazione workbook: {args.sheets} fogli × {args.rows} righe × {args.columns} colonne")
+        generate_workbook(file_path, sheets=args.sheets, rows=args.rows, columns=args.columns)
+
+        app = create_benchmark_app(f"sqlite:///{os.path.join(tmp_dir, 'bench.db')}")
+        serial_time, serial_cells, serial_sig = run_ingestion(app, file_path, workers=1)
+        parallel_time, parallel_cells, parallel_sig = run_ingestion(app, file_path, workers=args.workers)
+
+        print(f"⏱️  Seriale:   {serial_time:.2f}s ({serial_cells} celle, {serial_cells / serial_time:.0f} celle/s)")
+        print(f"⏱️  Parallelo: {parallel_time:.2f}s ({parallel_cells} celle, "
+              f"{parallel_cells / parallel_time:.0f} celle/s, {args.workers} processi)")
+        print(f"🚀 Speedup: {serial_time / parallel_time:.2f}×")
+        print(f"🔍 Risultati identici: {'sì' if serial_sig == parallel_sig else 'NO'}")
+
+
+if __name__ == '__main__':
+    main()
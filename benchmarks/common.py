@@ -0,0 +1,170 @@
+"""
+Utilità condivise dagli script di benchmark
+"""
+
+import os
+import random
+import sys
+from datetime import datetime, timedelta
+
+from flask import Flask
+
+# Aggiungi il percorso del progetto
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from models import db, User, ExcelFile, Label, TextCell, CellAnnotation
+from utils.sql_compat import normalize_database_url
+
+
+def create_benchmark_app(database_url):
+    """
+    Crea un'app minimale collegata a un database dedicato al benchmark
+
+    Args:
+        database_url: URL SQLAlchemy del database da usare
+
+    Returns:
+        Istanza Flask con le tabelle e l'indice di ricerca creati
+    """
+    from services.search import install_search_index
+
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(database_url)
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    with app.app_context():
+        db.create_all()
+        # Come nell'applicazione: gli inserimenti pagano anche l'aggiornamento dell'indice
+        install_search_index(db.engine)
+    return app
+
+
+def create_excel_file_record(file_path):
+    """Registra un ExcelFile (e l'utente proprietario se manca) e ne restituisce l'ID"""
+    user = User.query.filter_by(username='benchmark').first()
+    if user is None:
+        user = User(username='benchmark', email='benchmark@example.com')
+        user.set_password('benchmark')
+        db.session.add(user)
+        db.session.flush()
+
+    excel_file = ExcelFile(
+        filename=os.path.basename(file_path),
+        original_filename=os.path.basename(file_path),
+        file_path=file_path,
+        uploaded_by=user.id
+    )
+    db.session.add(excel_file)
+    db.session.commit()
+    return excel_file.id
+
+
+def database_size(engine):
+    """
+    Dimensione su disco del database del benchmark in byte
+
+    Per SQLite somma il file principale e l'eventuale WAL, per PostgreSQL
+    usa pg_database_size(); per gli altri motori restituisce None.
+    """
+    if engine.dialect.name == 'sqlite':
+        path = engine.url.database
+        if not path or path == ':memory:':
+            return None
+        return sum(os.path.getsize(p) for p in (path, f'{path}-wal') if os.path.exists(p))
+    if engine.dialect.name == 'postgresql':
+        with engine.connect() as connection:
+            return connection.exec_driver_sql('SELECT pg_database_size(current_database())').scalar()
+    return None
+
+
+def peak_rss_bytes():
+    """Picco di memoria residente del processo in byte (None se non disponibile)"""
+    try:
+        import resource
+    except ImportError:  # Windows
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss è in kilobyte su Linux e in byte su macOS
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def create_annotation_dataset(file_path, annotators=5, labels=30, annotated_ratio=0.6,
+                              labels_per_cell=2, days=60, seed=42):
+    """
+    Importa un workbook e aggiunge annotazioni casuali di più annotatori
+
+    Le annotazioni vengono scritte con un insert Core executemany (senza
+    eventi ORM): gli aggregati derivati vanno ricalcolati se servono.
+
+    Args:
+        file_path: Workbook da importare (es. generato da benchmarks.synthetic)
+        annotators: Numero di utenti annotatori
+        labels: Numero di etichette
+        annotated_ratio: Quota di celle annotate da ciascun annotatore
+        labels_per_cell: Etichette massime per cella e annotatore
+        days: Intervallo di date su cui distribuire le annotazioni
+        seed: Seme del generatore casuale
+
+    Returns:
+        Dizionario con excel_file_id, user_ids, label_ids, cells e annotations
+    """
+    from services.excel_ingestion import ExcelIngestionService
+
+    rng = random.Random(seed)
+    excel_file_id = create_excel_file_record(file_path)
+    cells = ExcelIngestionService().ingest(file_path, excel_file_id)
+
+    user_ids = []
+    for idx in range(annotators):
+        username = f'annotatore_bench_{idx + 1}'
+        user = User.query.filter_by(username=username).first()
+        if user is None:
+            user = User(username=username, email=f'{username}@example.com')
+            user.set_password('benchmark')
+            db.session.add(user)
+            db.session.flush()
+        user_ids.append(user.id)
+
+    label_ids = []
+    for idx in range(labels):
+        name = f'Etichetta bench {idx + 1}'
+        label = Label.query.filter_by(name=name).first()
+        if label is None:
+            label = Label(name=name)
+            db.session.add(label)
+            db.session.flush()
+        label_ids.append(label.id)
+    db.session.commit()
+
+    cell_ids = [cell_id for (cell_id,) in db.session.query(TextCell.id).filter_by(excel_file_id=excel_file_id)]
+    start = datetime.utcnow() - timedelta(days=days)
+    insert_stmt = CellAnnotation.__table__.insert()
+    batch = []
+    total = 0
+    for user_id in user_ids:
+        for cell_id in cell_ids:
+            if rng.random() >= annotated_ratio:
+                continue
+            for label_id in rng.sample(label_ids, rng.randint(1, labels_per_cell)):
+                created_at = start + timedelta(seconds=rng.randint(0, days * 86400))
+                batch.append({
+                    'text_cell_id': cell_id, 'label_id': label_id, 'user_id': user_id,
+                    'created_at': created_at, 'updated_at': created_at,
+                    'is_ai_generated': False, 'status': 'active',
+                })
+            if len(batch) >= 5000:
+                db.session.execute(insert_stmt, batch)
+                total += len(batch)
+                batch = []
+    if batch:
+        db.session.execute(insert_stmt, batch)
+        total += len(batch)
+    db.session.commit()
+
+    return {
+        'excel_file_id': excel_file_id,
+        'user_ids': user_ids,
+        'label_ids': label_ids,
+        'cells': cells,
+        'annotations': total,
+    }
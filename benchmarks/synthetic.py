@@ -0,0 +1,91 @@
+"""
+Generatore di workbook sintetici che imitano gli export dei questionari
+"""
+
+import math
+import random
+
+from openpyxl import Workbook
+
+WORDS = (
+    "intelligenza artificiale studenti docenti scuola apprendimento valutazione "
+    "compiti scrittura ricerca fonti plagio dipendenza creatività tempo efficienza "
+    "formazione regole privacy dati strumenti lezione università esame feedback"
+).split()
+
+# Distribuzioni disponibili per il numero di parole delle risposte
+LENGTH_DISTRIBUTIONS = ('uniform', 'lognormal', 'fixed', 'short')
+
+
+def answer_length(rng, distribution='uniform', min_words=3, max_words=40):
+    """
+    Estrae il numero di parole di una risposta
+
+    Args:
+        rng: Generatore casuale
+        distribution: 'uniform' (tra min e max), 'lognormal' (molte risposte
+            brevi e una coda di risposte lunghe, come nei questionari reali),
+            'fixed' (sempre max_words) o 'short' (1-3 parole, risposte chiuse)
+        min_words: Numero minimo di parole
+        max_words: Numero massimo di parole
+
+    Returns:
+        Numero di parole
+    """
+    if distribution == 'uniform':
+        return rng.randint(min_words, max_words)
+    if distribution == 'lognormal':
+        # Mediana attorno a un quarto del massimo, troncata all'intervallo
+        median = max(min_words, max_words / 4)
+        words = int(rng.lognormvariate(math.log(median), 0.8))
+        return max(min_words, min(max_words, words))
+    if distribution == 'fixed':
+        return max_words
+    if distribution == 'short':
+        return rng.randint(1, 3)
+    raise ValueError(f"Distribuzione non supportata: {distribution}")
+
+
+def random_answer(rng, min_words=3, max_words=40, distribution='uniform'):
+    """Genera una risposta aperta di lunghezza casuale"""
+    words = answer_length(rng, distribution, min_words, max_words)
+    return ' '.join(rng.choice(WORDS) for _ in range(words))
+
+
+def generate_workbook(path, sheets=1, rows=1000, columns=20, empty_ratio=0.2, seed=42,
+                      length_distribution='uniform', min_words=3, max_words=40):
+    """
+    Scrive un workbook sintetico in modalità write_only
+
+    Args:
+        path: Percorso del file .xlsx da creare
+        sheets: Numero di fogli (es. un foglio per ondata del questionario)
+        rows: Righe di risposte per foglio
+        columns: Colonne (domande) per foglio
+        empty_ratio: Quota di celle lasciate vuote
+        seed: Seme del generatore casuale
+        length_distribution: Distribuzione delle lunghezze (vedi answer_length)
+        min_words: Numero minimo di parole per risposta
+        max_words: Numero massimo di parole per risposta
+
+    Returns:
+        Percorso del file creato
+    """
+    if length_distribution not in LENGTH_DISTRIBUTIONS:
+        raise ValueError(f"Distribuzione non supportata: {length_distribution}")
+    if not 0 <= empty_ratio <= 1:
+        raise ValueError("empty_ratio deve essere compreso tra 0 e 1")
+
+    rng = random.Random(seed)
+    workbook = Workbook(write_only=True)
+    for sheet_idx in range(sheets):
+        worksheet = workbook.create_sheet(title=f'Ondata {sheet_idx + 1}')
+        worksheet.append([f'Domanda {col + 1}' for col in range(columns)])
+        for _ in range(rows):
+            worksheet.append([
+                None if rng.random() < empty_ratio
+                else random_answer(rng, min_words, max_words, length_distribution)
+                for _ in range(columns)
+            ])
+    workbook.save(path)
+    return path
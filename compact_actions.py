@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Compattazione del registro delle azioni sulle annotazioni.
+
+Le azioni più vecchie della finestra recente (ACTION_LOG_RETENTION_DAYS,
+default 90 giorni) vengono riassunte in annotation_action_daily e spostate
+nell'archivio (tabella annotation_action_archive o file JSONL compressi).
+Da eseguire periodicamente, ad esempio con cron una volta al giorno.
+
+Uso:
+    python compact_actions.py                          # finestra di 90 giorni
+    python compact_actions.py --retention-days 30
+    python compact_actions.py --backend jsonl --archive-dir instance/action_archive
+    python compact_actions.py --dry-run                # mostra solo cosa verrebbe compattato
+"""
+
+import argparse
+import os
+import sys
+
+# Aggiungi il percorso del progetto
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from migrate_schema import create_app
+from models import db, AnnotationAction
+from services.action_log import (ARCHIVE_BACKENDS, DEFAULT_RETENTION_DAYS, compact_action_log,
+                                 daily_action_counts, retention_cutoff)
+
+
+def _totals_by_type():
+    totals = {}
+    for row in daily_action_counts():
+        totals[row.action_type] = totals.get(row.action_type, 0) + row.count
+    return totals
+
+
+def compact_actions(retention_days, backend, archive_dir=None, dry_run=False):
+    """
+    Compatta le azioni più vecchie della finestra recente
+
+    Args:
+        retention_days: Giorni di azioni da mantenere in annotation_action
+        backend: 'table' o 'jsonl'
+        archive_dir: Cartella dei segmenti JSONL
+        dry_run: Se True non modifica il database
+
+    Returns:
+        True se la compattazione è riuscita
+    """
+    app = create_app()
+    app.config['ACTION_LOG_RETENTION_DAYS'] = retention_days
+    app.config['ACTION_ARCHIVE_BACKEND'] = backend
+    if archive_dir:
+        app.config['ACTION_ARCHIVE_DIR'] = archive_dir
+
+    with app.app_context():
+        db.create_all()
+        cutoff = retention_cutoff()
+        pending = AnnotationAction.query.filter(AnnotationAction.timestamp < cutoff).count()
+        print(f"📋 Azioni precedenti al {cutoff:%d/%m/%Y}: {pending}")
+        if dry_run or not pending:
+            return True
+
+        before = _totals_by_type()
+        print(f"🔄 Compattazione in corso (archivio: {backend})...")
+        try:
+            result = compact_action_log()
+        except Exception as e:
+            print(f"❌ Errore durante la compattazione: {str(e)}")
+            return False
+        print(f"  ✅ {result['archived']} azioni archiviate, {result['summaries']} riepiloghi giornalieri aggiornati")
+
+        # I riepiloghi devono contare le stesse azioni di prima
+        after = _totals_by_type()
+        if before != after:
+            print(f"⚠️  Totali per tipo di azione diversi: prima {before}, dopo {after}")
+            return False
+        print("\n🎉 Compattazione completata con successo!")
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compatta e archivia il registro delle azioni')
+    parser.add_argument('--retention-days', type=int,
+                        default=int(os.environ.get('ACTION_LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)),
+                        help='Giorni di azioni da mantenere in annotation_action')
+    parser.add_argument('--backend', choices=ARCHIVE_BACKENDS,
+                        default=os.environ.get('ACTION_ARCHIVE_BACKEND', 'table'),
+                        help="Archivio: tabella annotation_action_archive o file JSONL compressi")
+    parser.add_argument('--archive-dir', default=os.environ.get('ACTION_ARCHIVE_DIR'),
+                        help='Cartella dei segmenti JSONL')
+    parser.add_argument('--dry-run', action='store_true', help='Mostra solo il numero di azioni da compattare')
+    args = parser.parse_args()
+    sys.exit(0 if compact_actions(args.retention_days, args.backend, args.archive_dir, args.dry_run) else 1)
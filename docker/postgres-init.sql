@@ -0,0 +1,2 @@
+-- Database dedicato ai benchmark (benchmarks/bench_*.py --database-url)
+CREATE DATABASE analisi_bench OWNER analisi;
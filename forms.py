@@ -35,11 +35,24 @@ class RegisterForm(FlaskForm):
     ])
 
 class UploadForm(FlaskForm):
-    """Form per il caricamento di file Excel"""
+    """Form per il caricamento di file Excel e degli altri formati tabellari"""
     file = FileField('File Excel', validators=[
         FileRequired(message='Seleziona un file'),
-        FileAllowed(['xlsx', 'xls'], message='Sono supportati solo file Excel (.xlsx, .xls)')
+        FileAllowed(['xlsx', 'xlsm', 'xls', 'ods', 'csv', 'tsv', 'parquet'],
+                    message='Formati supportati: .xlsx, .xls, .ods, .csv, .parquet')
     ])
+    allow_duplicate = BooleanField('Carica comunque anche se il file è già presente')
+
+class NewVersionForm(FlaskForm):
+    """Form per caricare una nuova versione di un file già importato"""
+    file = FileField('Nuova versione del file', validators=[
+        FileRequired(message='Seleziona un file'),
+        FileAllowed(['xlsx', 'xlsm', 'xls', 'ods', 'csv', 'tsv', 'parquet'],
+                    message='Formati supportati: .xlsx, .xls, .ods, .csv, .parquet')
+    ])
+    key_column = SelectField('Colonna chiave del rispondente', choices=[], validate_choice=False,
+                             description='Identifica la stessa risposta tra le versioni. '
+                                         'Senza colonna chiave le righe vengono confrontate per posizione.')
 
 class LabelForm(FlaskForm):
     """Form per creare/modificare etichette"""
@@ -0,0 +1,345 @@
+#!/usr/bin/env python3
+"""
+Script di migrazione incrementale dello schema del database.
+
+Ogni passo è idempotente: aggiunge solo le colonne, le tabelle e gli indici
+mancanti, quindi lo script può essere rieseguito senza effetti collaterali
+dopo ogni aggiornamento dell'applicazione.
+
+Uso:
+    python migrate_schema.py
+"""
+
+import os
+import sys
+
+from flask import Flask
+from sqlalchemy import inspect, text
+
+# Aggiungi il percorso del progetto
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from models import db
+from utils.sql_compat import normalize_database_url
+
+
+def create_app():
+    """
+    Crea un'istanza minimale dell'app per la migrazione.
+
+    Non usa app.create_app() perché quest'ultima interroga le tabelle
+    (utente admin, etichette di default) prima che lo schema sia aggiornato.
+    """
+    app = Flask(__name__)
+    basedir = os.path.abspath(os.path.dirname(__file__))
+    default_db = f'sqlite:///{os.path.join(basedir, "instance", "analisi_mu.db")}'
+    app.config['SQLALCHEMY_DATABASE_URI'] = normalize_database_url(os.environ.get('DATABASE_URL', default_db))
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def add_missing_columns(table_name, columns):
+    """
+    Aggiunge a una tabella esistente le colonne non ancora presenti
+
+    Args:
+        table_name: Nome della tabella
+        columns: Lista di tuple (nome_colonna, definizione SQL)
+
+    Returns:
+        Lista delle colonne aggiunte
+    """
+    inspector = inspect(db.engine)
+    if table_name not in inspector.get_table_names():
+        return []
+
+    existing = {col['name'] for col in inspector.get_columns(table_name)}
+    # Quota i nomi riservati (es. "user" su PostgreSQL)
+    quoted_name = db.engine.dialect.identifier_preparer.quote(table_name)
+    added = []
+    with db.engine.begin() as conn:
+        for column_name, ddl in columns:
+            if column_name not in existing:
+                conn.execute(text(f'ALTER TABLE {quoted_name} ADD COLUMN {column_name} {ddl}'))
+                added.append(column_name)
+    return added
+
+
+def create_missing_indexes(model, names=None):
+    """
+    Crea gli indici dichiarati sul modello che non esistono ancora
+
+    Args:
+        model: Modello SQLAlchemy
+        names: Nomi degli indici da considerare (None = tutti)
+
+    Returns:
+        Lista dei nomi degli indici creati
+    """
+    existing = {idx['name'] for idx in inspect(db.engine).get_indexes(model.__tablename__)}
+    created = []
+    for index in model.__table__.indexes:
+        if names is not None and index.name not in names:
+            continue
+        if index.name not in existing:
+            index.create(db.engine, checkfirst=True)
+            created.append(index.name)
+    return created
+
+
+def step_ingestion_jobs():
+    """Stato di ingestione su excel_file e tabella ingestion_jobs"""
+    added = add_missing_columns('excel_file', [
+        ('status', "VARCHAR(20) NOT NULL DEFAULT 'ready'"),
+    ])
+    db.create_all()
+    return added
+
+
+def step_file_versions():
+    """Versioni dei file: chiave di riga e rimozione logica delle celle"""
+    added = add_missing_columns('excel_file', [
+        ('version', 'INTEGER NOT NULL DEFAULT 1'),
+        ('row_key_column', 'VARCHAR(255)'),
+    ])
+    added += add_missing_columns('text_cell', [
+        ('row_key', 'VARCHAR(255)'),
+        ('removed_at', 'TIMESTAMP'),
+    ])
+    added += add_missing_columns('ingestion_jobs', [
+        ('mode', "VARCHAR(20) NOT NULL DEFAULT 'full'"),
+        ('source_path', 'VARCHAR(500)'),
+        ('key_column', 'VARCHAR(255)'),
+        ('summary', 'TEXT'),
+        ('claimed_by', 'VARCHAR(64)'),
+    ])
+    return added
+
+
+def step_content_hashes():
+    """Hash dei file caricati e dei testi normalizzati, con backfill delle righe esistenti"""
+    from models import ExcelFile, TextCell
+    from services.deduplication import file_sha256, text_hash
+
+    added = add_missing_columns('excel_file', [('file_sha256', 'VARCHAR(64)')])
+    added += add_missing_columns('text_cell', [('text_hash', 'VARCHAR(32)')])
+    added += add_missing_columns('ingestion_jobs', [('file_sha256', 'VARCHAR(64)')])
+    added += create_missing_indexes(ExcelFile)
+    added += create_missing_indexes(TextCell, ['ix_text_cell_text_hash'])
+
+    # Backfill a blocchi degli hash mancanti
+    cells = TextCell.__table__
+    filled = 0
+    while True:
+        rows = db.session.execute(
+            db.select(cells.c.id, cells.c.text_content).where(cells.c.text_hash.is_(None)).limit(5000)
+        ).all()
+        if not rows:
+            break
+        db.session.execute(
+            cells.update().where(cells.c.id == db.bindparam('b_id')).values(text_hash=db.bindparam('b_hash')),
+            [{'b_id': row.id, 'b_hash': text_hash(row.text_content)} for row in rows]
+        )
+        db.session.commit()
+        filled += len(rows)
+
+    for excel_file in ExcelFile.query.filter(ExcelFile.file_sha256.is_(None)).all():
+        if excel_file.file_path and os.path.exists(excel_file.file_path):
+            excel_file.file_sha256 = file_sha256(excel_file.file_path)
+            filled += 1
+    db.session.commit()
+
+    if filled:
+        added.append(f'{filled} hash calcolati')
+    return added
+
+
+def step_upload_sessions():
+    """Tabelle dei caricamenti a blocchi riprendibili"""
+    from models import UploadChunk, UploadSession  # noqa: F401 (registra le tabelle)
+
+    existing = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    return [name for name in ('upload_sessions', 'upload_chunks') if name not in existing]
+
+
+def step_question_stats():
+    """Aggregati per domanda (con il tipo suggerito) e indici usati per aggiornarli"""
+    from models import CellAnnotation, QuestionStats, TextCell
+    from services.question_stats import rebuild_question_stats
+
+    created = 'question_stats' not in inspect(db.engine).get_table_names()
+    db.create_all()
+    added = (create_missing_indexes(TextCell, ['ix_text_cell_scope']) +
+             create_missing_indexes(CellAnnotation, ['ix_cell_annotation_text_cell_id']))
+    added += add_missing_columns('question_stats', [('suggested_type', 'VARCHAR(20)')])
+    if created or not db.session.query(QuestionStats.id).first():
+        count = rebuild_question_stats()
+        db.session.commit()
+        added.append(f'{count} domande calcolate')
+    return added
+
+
+def step_hot_indexes():
+    """Indici composti per le query di statistiche, sfoglia e AI"""
+    from models import AnnotationAction, CellAnnotation, TextCell
+
+    added = []
+    for model in (TextCell, CellAnnotation, AnnotationAction):
+        added += create_missing_indexes(model)
+    if added and db.engine.dialect.name == 'sqlite':
+        # Statistiche per il planner (sqlite_stat1): senza, SQLite può ignorare gli indici composti
+        with db.engine.begin() as connection:
+            connection.exec_driver_sql('ANALYZE')
+    return added
+
+
+def step_annotation_counters():
+    """Contatori delle annotazioni su celle, etichette e utenti"""
+    from services.annotation_counters import rebuild_annotation_counters
+
+    counters = [
+        ('annotation_count', 'INTEGER NOT NULL DEFAULT 0'),
+        ('distinct_annotators', 'INTEGER NOT NULL DEFAULT 0'),
+        ('last_annotated_at', 'TIMESTAMP'),
+    ]
+    added = []
+    for table_name in ('text_cell', 'label', 'user'):
+        columns = [column for column in counters if not (table_name == 'user' and column[0] == 'distinct_annotators')]
+        added += [f'{table_name}.{name}' for name in add_missing_columns(table_name, columns)]
+    if added:
+        updated = rebuild_annotation_counters()
+        db.session.commit()
+        added.append(f"{sum(updated.values())} righe calcolate")
+    return added
+
+
+def step_project_collaborators():
+    """Collaboratori dei progetti: dal JSON in projects.collaborators alla tabella project_collaborators"""
+    import json
+    from datetime import datetime
+    from models import Project, ProjectCollaborator, User
+
+    inspector = inspect(db.engine)
+    if 'projects' not in inspector.get_table_names():
+        return []
+    created = 'project_collaborators' not in inspector.get_table_names()
+    db.create_all()
+    added = ['project_collaborators'] if created else []
+    # Le tabelle create dal vecchio script SQL hanno colonne diverse dal modello
+    new_columns = add_missing_columns('project_collaborators', [
+        ('can_view_private_notes', 'BOOLEAN DEFAULT FALSE'),
+        ('can_export_data', 'BOOLEAN DEFAULT FALSE'),
+        ('can_manage_files', 'BOOLEAN DEFAULT FALSE'),
+        ('added_at', 'TIMESTAMP'),
+        ('added_by_id', 'INTEGER'),
+    ])
+    legacy_columns = {col['name'] for col in inspect(db.engine).get_columns('project_collaborators')}
+    with db.engine.begin() as connection:
+        if 'added_at' in new_columns and {'joined_at', 'invited_at'} <= legacy_columns:
+            connection.execute(text('UPDATE project_collaborators SET added_at = COALESCE(joined_at, invited_at) '
+                                    'WHERE added_at IS NULL'))
+        if 'added_by_id' in new_columns and 'invited_by' in legacy_columns:
+            connection.execute(text('UPDATE project_collaborators SET added_by_id = invited_by '
+                                    'WHERE added_by_id IS NULL'))
+    added += [f'project_collaborators.{name}' for name in new_columns]
+    added += create_missing_indexes(ProjectCollaborator, ['ix_project_collaborators_user'])
+
+    if 'collaborators' not in {col['name'] for col in inspector.get_columns('projects')}:
+        return added
+    projects = Project.__table__
+    collaborators = ProjectCollaborator.__table__
+    user_ids = {user_id for (user_id,) in db.session.query(User.id)}
+    existing = {tuple(row) for row in db.session.execute(
+        db.select(collaborators.c.project_id, collaborators.c.user_id))}
+    rows = []
+    legacy = db.session.execute(
+        db.select(projects.c.id, projects.c.owner_id, projects.c.collaborators)
+        .where(projects.c.collaborators.isnot(None))
+    ).all()
+    for project_id, owner_id, raw in legacy:
+        try:
+            entries = json.loads(raw) or []
+        except ValueError:
+            entries = []
+        for entry in entries:
+            if not isinstance(entry, dict):
+                continue
+            user_id = entry.get('user_id')
+            if user_id not in user_ids or user_id == owner_id or (project_id, user_id) in existing:
+                continue
+            try:
+                added_at = datetime.fromisoformat(entry['added_at'])
+            except (KeyError, TypeError, ValueError):
+                added_at = datetime.utcnow()
+            existing.add((project_id, user_id))
+            rows.append({'project_id': project_id, 'user_id': user_id,
+                         'role': entry.get('role') or 'viewer', 'added_at': added_at})
+    if legacy:
+        if rows:
+            db.session.execute(collaborators.insert(), rows)
+        # Migrazione una tantum: il JSON svuotato non viene più riletto
+        db.session.execute(projects.update().where(projects.c.collaborators.isnot(None))
+                           .values(collaborators=None))
+        db.session.commit()
+        added.append(f'{len(rows)} collaboratori migrati da {len(legacy)} progetti')
+    return added
+
+
+def step_search_index():
+    """Ricerca full-text: tabelle FTS5 con trigger (SQLite) o indici GIN tsvector (PostgreSQL)"""
+    from services.search import install_search_index
+
+    db.create_all()
+    return install_search_index(db.engine)
+
+
+def step_action_archive():
+    """Archivio e riepilogo giornaliero del registro delle azioni"""
+    from models import AnnotationAction
+
+    tables = set(inspect(db.engine).get_table_names())
+    db.create_all()
+    added = [name for name in ('annotation_action_archive', 'annotation_action_daily') if name not in tables]
+    return added + create_missing_indexes(AnnotationAction, ['ix_annotation_action_timestamp'])
+
+
+# Passi di migrazione in ordine di applicazione
+STEPS = [
+    ('Job di ingestione in background', step_ingestion_jobs),
+    ('Versioni dei file', step_file_versions),
+    ('Hash dei file e dei testi', step_content_hashes),
+    ('Caricamenti a blocchi', step_upload_sessions),
+    ('Aggregati per domanda', step_question_stats),
+    ('Indici per le query frequenti', step_hot_indexes),
+    ('Contatori delle annotazioni', step_annotation_counters),
+    ('Collaboratori dei progetti', step_project_collaborators),
+    ('Indice di ricerca full-text', step_search_index),
+    ('Archivio delle azioni', step_action_archive),
+]
+
+
+def migrate_database():
+    """Esegue tutti i passi di migrazione"""
+    app = create_app()
+
+    with app.app_context():
+        print("🔄 Migrazione dello schema in corso...")
+        try:
+            for description, step in STEPS:
+                result = step()
+                if result:
+                    print(f"  ✅ {description}: {result}")
+                else:
+                    print(f"  ⏭️  {description}: già aggiornato")
+            print("\n🎉 Migrazione completata con successo!")
+            return True
+        except Exception as e:
+            print(f"❌ Errore durante la migrazione: {str(e)}")
+            return False
+
+
+if __name__ == '__main__':
+    success = migrate_database()
+    sys.exit(0 if success else 1)
@@ -4,12 +4,16 @@ Modelli del database per l'applicazione di etichettatura tematica.
 
 from flask_sqlalchemy import SQLAlchemy
 from flask_login import UserMixin
+from sqlalchemy.ext.hybrid import hybrid_property
 from werkzeug.security import generate_password_hash, check_password_hash
 from datetime import datetime
 import json
 
+from utils.analytics_snapshot import AnalyticsSession
+
 # Questa istanza db sarà importata da app.py
-db = SQLAlchemy()
+# (le letture delle statistiche possono andare sul bind 'analytics', vedi utils/analytics_snapshot.py)
+db = SQLAlchemy(session_options={'class_': AnalyticsSession})
 
 class User(UserMixin, db.Model):
     """Modello per gli utenti/etichettatori"""
@@ -23,6 +27,10 @@ class User(UserMixin, db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Contatori mantenuti da services.annotation_counters
+    annotation_count = db.Column(db.Integer, default=0, nullable=False)
+    last_annotated_at = db.Column(db.DateTime)
+    
     # Relazioni
     annotations = db.relationship('CellAnnotation', foreign_keys='CellAnnotation.user_id', backref='user', lazy=True)
     
@@ -173,6 +181,11 @@ class Label(db.Model):
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
+    # Contatori mantenuti da services.annotation_counters
+    annotation_count = db.Column(db.Integer, default=0, nullable=False)
+    distinct_annotators = db.Column(db.Integer, default=0, nullable=False)
+    last_annotated_at = db.Column(db.DateTime)
+    
     # Relazioni
     annotations = db.relationship('CellAnnotation', backref='label', lazy=True, cascade='all, delete-orphan')
     category_obj = db.relationship('Category', foreign_keys=[category_id], back_populates='labels')
@@ -248,13 +261,216 @@ class ExcelFile(db.Model):
     # Associazione al progetto
     project_id = db.Column(db.Integer, db.ForeignKey('projects.id'), nullable=True)
     
+    # Stato dell'ingestione: 'pending', 'processing', 'ready', 'failed' ('deleting' durante l'eliminazione in background)
+    status = db.Column(db.String(20), default='ready', nullable=False)
+    
+    # SHA-256 del contenuto per riconoscere i caricamenti duplicati
+    file_sha256 = db.Column(db.String(64), index=True)
+    
+    # Versioni successive caricate con "nuova versione del file"
+    version = db.Column(db.Integer, default=1, nullable=False)
+    row_key_column = db.Column(db.String(255))  # Colonna che identifica il rispondente tra le versioni
+    
     # Relazioni
     uploader = db.relationship('User', backref='uploaded_files')
     text_cells = db.relationship('TextCell', backref='excel_file', lazy=True, cascade='all, delete-orphan')
+    ingestion_jobs = db.relationship('IngestionJob', backref='excel_file', lazy=True, cascade='all, delete-orphan')
+    question_stats = db.relationship('QuestionStats', backref='excel_file', lazy=True, cascade='all, delete-orphan')
+    
+    @property
+    def is_ready(self):
+        """True se le celle del file sono state estratte completamente"""
+        return self.status == 'ready'
+    
+    @property
+    def latest_job(self):
+        """Restituisce l'ultimo job di ingestione del file (se esiste)"""
+        return IngestionJob.query.filter_by(excel_file_id=self.id)\
+            .order_by(IngestionJob.created_at.desc()).first()
     
     def __repr__(self):
         return f'<ExcelFile {self.original_filename}>'
 
+class IngestionJob(db.Model):
+    """Job di ingestione in background di un file caricato"""
+    __tablename__ = 'ingestion_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True)  # UUID restituito al client
+    excel_file_id = db.Column(db.Integer, db.ForeignKey('excel_file.id'), nullable=False)
+    status = db.Column(db.String(20), default='pending', nullable=False)  # pending, processing, ready, failed
+    
+    # 'full' = prima importazione, 'version' = nuova versione di un file esistente
+    mode = db.Column(db.String(20), default='full', nullable=False)
+    source_path = db.Column(db.String(500))  # File da importare (per mode='version')
+    key_column = db.Column(db.String(255))
+    file_sha256 = db.Column(db.String(64))  # Hash della nuova versione, copiato sul file solo a job riuscito
+    summary = db.Column(db.Text)  # JSON con i conteggi del confronto tra versioni
+    
+    # Avanzamento
+    rows_total = db.Column(db.Integer)  # Stima dalle dimensioni dei fogli
+    rows_parsed = db.Column(db.Integer, default=0)
+    cells_inserted = db.Column(db.Integer, default=0)
+    error_message = db.Column(db.Text)
+    
+    # Processo che ha preso in carico il job al riavvio (vedi recover_interrupted_jobs)
+    claimed_by = db.Column(db.String(64))
+    
+    created_by = db.Column(db.Integer, db.ForeignKey('user.id'))
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    started_at = db.Column(db.DateTime)
+    finished_at = db.Column(db.DateTime)
+    
+    # Relazioni
+    creator = db.relationship('User', foreign_keys=[created_by])
+    
+    @property
+    def is_finished(self):
+        return self.status in ('ready', 'failed')
+    
+    def can_view(self, user):
+        """Verifica se l'utente può seguire il job (chi lo ha avviato o un amministratore)"""
+        if not user:
+            return False
+        return user.is_admin or self.created_by == user.id
+    
+    @property
+    def progress_percentage(self):
+        """Percentuale di righe elaborate (None se il totale non è noto)"""
+        if self.status == 'ready':
+            return 100.0
+        if not self.rows_total:
+            return None
+        return round(min(100.0, (self.rows_parsed or 0) * 100.0 / self.rows_total), 1)
+    
+    @property
+    def eta_seconds(self):
+        """Stima del tempo rimanente in secondi in base alla velocità osservata"""
+        if self.status != 'processing' or not self.started_at or not self.rows_total or not self.rows_parsed:
+            return None
+        elapsed = (datetime.utcnow() - self.started_at).total_seconds()
+        if elapsed <= 0:
+            return None
+        rate = self.rows_parsed / elapsed
+        remaining = max(0, self.rows_total - self.rows_parsed)
+        return round(remaining / rate, 1)
+    
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'excel_file_id': self.excel_file_id,
+            'status': self.status,
+            'rows_total': self.rows_total,
+            'rows_parsed': self.rows_parsed or 0,
+            'cells_inserted': self.cells_inserted or 0,
+            'progress': self.progress_percentage,
+            'eta_seconds': self.eta_seconds,
+            'error': self.error_message,
+            'mode': self.mode,
+            'summary': json.loads(self.summary) if self.summary else None,
+            'created_at': self.created_at.isoformat() if self.created_at else None,
+            'started_at': self.started_at.isoformat() if self.started_at else None,
+            'finished_at': self.finished_at.isoformat() if self.finished_at else None
+        }
+    
+    def __repr__(self):
+        return f'<IngestionJob {self.id} ({self.status})>'
+
+class QuestionStats(db.Model):
+    """
+    Aggregati per domanda (file, foglio, colonna) calcolati in ingestione e
+    aggiornati in modo incrementale a ogni scrittura di CellAnnotation
+    (vedi services.question_stats)
+    """
+    __tablename__ = 'question_stats'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    excel_file_id = db.Column(db.Integer, db.ForeignKey('excel_file.id'), nullable=False)
+    sheet_name = db.Column(db.String(100), nullable=False)
+    column_name = db.Column(db.String(100))
+    
+    total_responses = db.Column(db.Integer, default=0, nullable=False)  # Celle attive
+    annotated_responses = db.Column(db.Integer, default=0, nullable=False)  # Celle con almeno un'annotazione
+    annotation_count = db.Column(db.Integer, default=0, nullable=False)
+    distinct_annotators = db.Column(db.Integer, default=0, nullable=False)
+    question_type = db.Column(db.String(20))
+    suggested_type = db.Column(db.String(20))  # Tipo rilevato in ingestione, da confermare
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('excel_file_id', 'sheet_name', 'column_name', name='unique_question_stats'),)
+    
+    def __repr__(self):
+        return f'<QuestionStats {self.excel_file_id}:{self.sheet_name}:{self.column_name}>'
+
+class UploadSession(db.Model):
+    """Caricamento a blocchi riprendibile di un file più grande di MAX_CONTENT_LENGTH"""
+    __tablename__ = 'upload_sessions'
+    
+    id = db.Column(db.String(36), primary_key=True)  # UUID restituito al client
+    user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
+    original_filename = db.Column(db.String(255), nullable=False)
+    # Destinazione al termine del caricamento: 'excel' o 'text_document'
+    target = db.Column(db.String(20), nullable=False)
+    document_type = db.Column(db.String(50))  # Solo per target='text_document'
+    
+    total_size = db.Column(db.BigInteger, nullable=False)
+    chunk_size = db.Column(db.Integer, nullable=False)
+    total_chunks = db.Column(db.Integer, nullable=False)
+    file_sha256 = db.Column(db.String(64))  # Hash dell'intero file, calcolato alla finalizzazione
+    
+    status = db.Column(db.String(20), default='uploading', nullable=False)  # uploading, finalized, failed
+    result = db.Column(db.Text)  # JSON restituito dalla finalizzazione
+    error_message = db.Column(db.Text)
+    
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    # Relazioni
+    user = db.relationship('User')
+    chunks = db.relationship('UploadChunk', backref='session', lazy='dynamic', cascade='all, delete-orphan')
+    
+    @property
+    def received_indexes(self):
+        return sorted(index for (index,) in self.chunks.with_entities(UploadChunk.chunk_index))
+    
+    def expected_chunk_size(self, index):
+        """Dimensione attesa del blocco (l'ultimo può essere più corto)"""
+        if index == self.total_chunks - 1:
+            return self.total_size - index * self.chunk_size
+        return self.chunk_size
+    
+    def to_dict(self):
+        received = self.received_indexes
+        return {
+            'upload_id': self.id,
+            'filename': self.original_filename,
+            'target': self.target,
+            'status': self.status,
+            'total_size': self.total_size,
+            'chunk_size': self.chunk_size,
+            'total_chunks': self.total_chunks,
+            'received_chunks': received,
+            'missing_chunks': sorted(set(range(self.total_chunks)) - set(received)) if self.status == 'uploading' else [],
+            'result': json.loads(self.result) if self.result else None,
+            'error': self.error_message
+        }
+    
+    def __repr__(self):
+        return f'<UploadSession {self.id} ({self.status})>'
+
+class UploadChunk(db.Model):
+    """Blocco ricevuto di un caricamento a blocchi, con il suo checksum"""
+    __tablename__ = 'upload_chunks'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    session_id = db.Column(db.String(36), db.ForeignKey('upload_sessions.id'), nullable=False)
+    chunk_index = db.Column(db.Integer, nullable=False)
+    size = db.Column(db.Integer, nullable=False)
+    sha256 = db.Column(db.String(64), nullable=False)
+    received_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (db.UniqueConstraint('session_id', 'chunk_index', name='unique_upload_chunk'),)
+
 class TextCell(db.Model):
     """Modello per le celle testuali estratte dai file Excel"""
     id = db.Column(db.Integer, primary_key=True)
@@ -265,20 +481,62 @@ class TextCell(db.Model):
     column_name = db.Column(db.String(100))
     text_content = db.Column(db.Text, nullable=False)
     
-    # Classificazione manuale del tipo di domanda
+    # Tipo di domanda: assegnato per colonna in ingestione (services.column_profiler), modificabile a mano
     question_type = db.Column(db.String(20))  # 'aperta', 'chiusa_binaria', 'chiusa_multipla', 'likert', 'anagrafica', 'numerica'
     
+    # Versionamento: chiave della riga (valore della colonna chiave o '#<riga>')
+    # e data di rimozione per le celle annotate non più presenti nell'ultima versione
+    row_key = db.Column(db.String(255))
+    removed_at = db.Column(db.DateTime)
+    
+    # Hash del testo normalizzato (vedi services.deduplication.text_hash) per trovare risposte identiche
+    text_hash = db.Column(db.String(32), index=True)
+    
+    # Contatori mantenuti da services.annotation_counters
+    annotation_count = db.Column(db.Integer, default=0, nullable=False)
+    distinct_annotators = db.Column(db.Integer, default=0, nullable=False)
+    last_annotated_at = db.Column(db.DateTime)
+    
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     
+    __table_args__ = (
+        # Celle di una domanda: aggregati di question_stats e viste per domanda
+        db.Index('ix_text_cell_scope', 'excel_file_id', 'sheet_name', 'column_name'),
+        # Sfoglia/navigazione: filtro per file e ordinamento foglio, riga, colonna
+        db.Index('ix_text_cell_file_position', 'excel_file_id', 'sheet_name', 'row_index', 'column_index'),
+        # Istogrammi per domanda e celle annotabili di un file (filtro su question_type)
+        db.Index('ix_text_cell_file_question', 'excel_file_id', 'column_name', 'question_type'),
+        # Classificazione e navigazione per nome di domanda su tutti i file
+        db.Index('ix_text_cell_question_type', 'column_name', 'question_type'),
+    )
+    
     # Relazioni
     # annotations verranno creati automaticamente dal backref in CellAnnotation
     
+    @hybrid_property
+    def is_current(self):
+        """
+        True se la cella è presente nell'ultima versione del file.
+
+        Le celle ritirate da una nuova versione (removed_at) restano solo per
+        lo storico delle annotazioni: le query che elencano o contano le celle
+        filtrano con .filter(TextCell.is_current).
+        """
+        return self.removed_at == None  # noqa: E711 (IS NULL nelle query)
+    
     @property
     def cell_reference(self):
         """Restituisce il riferimento della cella (es. A1, B2)"""
         from openpyxl.utils import get_column_letter
         return f"{get_column_letter(self.column_index + 1)}{self.row_index + 1}"
     
+    def identical_cells(self, same_file=True):
+        """Restituisce le altre celle con la stessa risposta normalizzata"""
+        query = TextCell.query.filter(TextCell.text_hash == self.text_hash, TextCell.id != self.id, TextCell.is_current)
+        if same_file:
+            query = query.filter(TextCell.excel_file_id == self.excel_file_id)
+        return query.all() if self.text_hash else []
+    
     def __repr__(self):
         return f'<TextCell {self.sheet_name}:{self.cell_reference}>'
 
@@ -348,7 +606,7 @@ class OllamaModel(db.Model):
 class CellAnnotation(db.Model):
     """Modello per le annotazioni delle celle"""
     id = db.Column(db.Integer, primary_key=True)
-    text_cell_id = db.Column(db.Integer, db.ForeignKey('text_cell.id'), nullable=False)
+    text_cell_id = db.Column(db.Integer, db.ForeignKey('text_cell.id'), nullable=False, index=True)
     label_id = db.Column(db.Integer, db.ForeignKey('label.id'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
@@ -363,6 +621,17 @@ class CellAnnotation(db.Model):
     reviewed_by = db.Column(db.Integer, db.ForeignKey('user.id'))  # Chi ha approvato/rifiutato
     reviewed_at = db.Column(db.DateTime)
     
+    __table_args__ = (
+        # Statistiche per utente e confronto tra annotatori (celle ed etichette senza leggere la tabella)
+        db.Index('ix_cell_annotation_user_cell', 'user_id', 'text_cell_id', 'label_id'),
+        # Andamento temporale e prima/ultima annotazione di un utente
+        db.Index('ix_cell_annotation_user_created', 'user_id', 'created_at'),
+        # Utilizzo delle etichette (anche per utente)
+        db.Index('ix_cell_annotation_label_user', 'label_id', 'user_id'),
+        # Coda di revisione delle annotazioni AI
+        db.Index('ix_cell_annotation_review', 'is_ai_generated', 'status'),
+    )
+    
     # Relazioni
     text_cell = db.relationship('TextCell', backref='annotations')
     reviewer = db.relationship('User', foreign_keys=[reviewed_by])
@@ -403,6 +672,15 @@ class AnnotationAction(db.Model):
     ai_model = db.Column(db.String(100))
     ai_provider = db.Column(db.String(20))
     
+    __table_args__ = (
+        # Attività recente di un utente
+        db.Index('ix_annotation_action_performer', 'performed_by', 'timestamp'),
+        # Storico di una cella (anche per decidere se una cella ritirata va conservata)
+        db.Index('ix_annotation_action_cell', 'text_cell_id'),
+        # Compattazione delle azioni più vecchie della finestra recente
+        db.Index('ix_annotation_action_timestamp', 'timestamp'),
+    )
+    
     # Relazioni
     text_cell = db.relationship('TextCell', foreign_keys=[text_cell_id])
     label = db.relationship('Label', foreign_keys=[label_id])
@@ -413,6 +691,61 @@ class AnnotationAction(db.Model):
     def __repr__(self):
         return f'<AnnotationAction {self.id}: {self.action_type} on Cell {self.text_cell_id} by User {self.performed_by}>'
 
+class AnnotationActionArchive(db.Model):
+    """
+    Azioni sulle annotazioni spostate fuori dalla finestra recente
+    (services.action_log). Stesse colonne di AnnotationAction senza chiavi
+    esterne: celle e annotazioni possono non esistere più.
+    """
+    __tablename__ = 'annotation_action_archive'
+
+    id = db.Column(db.Integer, primary_key=True)
+    action_id = db.Column(db.Integer, nullable=False)  # ID originale in annotation_action
+    text_cell_id = db.Column(db.Integer, nullable=False)
+    label_id = db.Column(db.Integer, nullable=False)
+    action_type = db.Column(db.String(20), nullable=False)
+    performed_by = db.Column(db.Integer, nullable=False)
+    target_user_id = db.Column(db.Integer)
+    annotation_id = db.Column(db.Integer)
+    notes = db.Column(db.Text)
+    timestamp = db.Column(db.DateTime, nullable=False)
+    was_ai_generated = db.Column(db.Boolean, default=False)
+    ai_confidence = db.Column(db.Float)
+    ai_model = db.Column(db.String(100))
+    ai_provider = db.Column(db.String(20))
+    archived_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+    __table_args__ = (
+        db.Index('ix_annotation_action_archive_performer', 'performed_by', 'timestamp'),
+        db.Index('ix_annotation_action_archive_cell', 'text_cell_id'),
+    )
+
+    def __repr__(self):
+        return f'<AnnotationActionArchive {self.action_id}: {self.action_type} on Cell {self.text_cell_id}>'
+
+class AnnotationActionDaily(db.Model):
+    """Riepilogo giornaliero delle azioni compattate, per utente, etichetta e tipo di azione"""
+    __tablename__ = 'annotation_action_daily'
+
+    id = db.Column(db.Integer, primary_key=True)
+    day = db.Column(db.Date, nullable=False)
+    performed_by = db.Column(db.Integer, nullable=False)
+    label_id = db.Column(db.Integer, nullable=False)
+    action_type = db.Column(db.String(20), nullable=False)
+    action_count = db.Column(db.Integer, default=0, nullable=False)
+    ai_generated_count = db.Column(db.Integer, default=0, nullable=False)
+    first_at = db.Column(db.DateTime)
+    last_at = db.Column(db.DateTime)
+
+    __table_args__ = (
+        db.UniqueConstraint('day', 'performed_by', 'label_id', 'action_type', name='uq_annotation_action_daily'),
+        db.Index('ix_annotation_action_daily_performer', 'performed_by', 'day'),
+        db.Index('ix_annotation_action_daily_label', 'label_id', 'day'),
+    )
+
+    def __repr__(self):
+        return f'<AnnotationActionDaily {self.day} user {self.performed_by} label {self.label_id} {self.action_type}: {self.action_count}>'
+
 class AIPromptTemplate(db.Model):
     """Template per prompt AI dinamici"""
     __tablename__ = 'ai_prompt_template'
@@ -1077,8 +1410,9 @@ class Project(db.Model):
     total_annotations = db.Column(db.Integer, default=0)
     last_activity = db.Column(db.DateTime, default=datetime.utcnow)
     
-    # Gestione collaboratori (JSON)
-    collaborators = db.Column(db.Text)  # JSON array di collaboratori con ruoli
+    # Collaboratori in formato JSON: obsoleto, i dati sono in project_collaborators
+    # (migrate_schema.py li copia e svuota la colonna)
+    collaborators = db.Column(db.Text)
     
     # Ownership e timestamp
     owner_id = db.Column(db.Integer, db.ForeignKey('user.id'), nullable=False)
@@ -1090,6 +1424,9 @@ class Project(db.Model):
     notes = db.relationship('ProjectNote', backref='project', lazy=True, cascade='all, delete-orphan')
     excel_files = db.relationship('ExcelFile', backref='project', lazy=True)
     text_documents = db.relationship('TextDocument', backref='project', lazy=True)
+    collaborator_links = db.relationship('ProjectCollaborator', backref='project', lazy=True,
+                                         cascade='all, delete-orphan',
+                                         order_by='ProjectCollaborator.added_at')
     
     def __repr__(self):
         return f'<Project {self.name}>'
@@ -1111,18 +1448,61 @@ class Project(db.Model):
     
     @property
     def collaborators_list(self):
-        """Restituisce la lista dei collaboratori"""
-        if self.collaborators:
-            try:
-                return json.loads(self.collaborators)
-            except:
-                return []
-        return []
+        """Restituisce la lista dei collaboratori (dizionari user_id, role, added_at)"""
+        return [
+            {
+                'user_id': link.user_id,
+                'role': link.role,
+                'added_at': link.added_at.isoformat() if link.added_at else None
+            }
+            for link in self.collaborator_links
+        ]
     
-    @collaborators_list.setter
-    def collaborators_list(self, value):
-        """Imposta la lista dei collaboratori"""
-        self.collaborators = json.dumps(value) if value else None
+    def set_collaborators(self, roles, added_by=None):
+        """
+        Allinea i collaboratori del progetto a quelli indicati
+        
+        Le righe esistenti vengono aggiornate (mantenendo la data di aggiunta),
+        quelle nuove inserite e le altre rimosse.
+        
+        Args:
+            roles: Dizionario user_id -> ruolo
+            added_by: Utente che effettua la modifica
+        """
+        existing = {link.user_id: link for link in self.collaborator_links}
+        for user_id, link in existing.items():
+            if user_id not in roles:
+                self.collaborator_links.remove(link)
+        for user_id, role in roles.items():
+            if user_id == self.owner_id:
+                continue
+            link = existing.get(user_id)
+            if link is None:
+                self.collaborator_links.append(ProjectCollaborator(
+                    user_id=user_id,
+                    role=role,
+                    added_by_id=added_by.id if added_by else None
+                ))
+            else:
+                link.role = role
+    
+    def collaborator_role(self, user):
+        """Ruolo dell'utente tra i collaboratori (None se non è collaboratore)"""
+        return db.session.query(ProjectCollaborator.role).filter_by(
+            project_id=self.id, user_id=user.id
+        ).scalar()
+    
+    @staticmethod
+    def accessible_filter(user):
+        """
+        Condizione SQL dei progetti visibili all'utente (proprietario,
+        pubblici o collaboratore), da usare in Project.query.filter()
+        """
+        return db.or_(
+            Project.owner_id == user.id,
+            Project.visibility == 'public',
+            Project.id.in_(db.select(ProjectCollaborator.project_id).where(ProjectCollaborator.user_id == user.id))
+        )
     
     def can_access(self, user):
         """Verifica se l'utente può accedere al progetto"""
@@ -1133,10 +1513,7 @@ class Project(db.Model):
         if self.visibility == 'public':
             return True
         # Verifica se è un collaboratore
-        for collab in self.collaborators_list:
-            if isinstance(collab, dict) and collab.get('user_id') == user.id:
-                return True
-        return False
+        return self.collaborator_role(user) is not None
     
     def can_edit(self, user):
         """Verifica se l'utente può modificare il progetto"""
@@ -1145,11 +1522,7 @@ class Project(db.Model):
         if user.is_admin or self.owner_id == user.id:
             return True
         # Verifica se è un collaboratore con permessi di edit
-        for collab in self.collaborators_list:
-            if isinstance(collab, dict) and collab.get('user_id') == user.id:
-                role = collab.get('role', 'viewer')
-                return role in ['editor', 'moderator']
-        return False
+        return self.collaborator_role(user) in ['editor', 'moderator']
     
     def can_manage(self, user):
         """Verifica se l'utente può gestire il progetto (collaboratori, impostazioni)"""
@@ -1158,11 +1531,7 @@ class Project(db.Model):
         if user.is_admin or self.owner_id == user.id:
             return True
         # Solo moderatori possono gestire
-        for collab in self.collaborators_list:
-            if isinstance(collab, dict) and collab.get('user_id') == user.id:
-                role = collab.get('role', 'viewer')
-                return role == 'moderator'
-        return False
+        return self.collaborator_role(user) == 'moderator'
     
     def update_statistics(self):
         """Aggiorna le statistiche del progetto"""
@@ -1280,8 +1649,12 @@ class ProjectCollaborator(db.Model):
     user = db.relationship('User', foreign_keys=[user_id], backref='project_collaborations')
     added_by = db.relationship('User', foreign_keys=[added_by_id])
     
-    # Indice univoco per evitare duplicati
-    __table_args__ = (db.UniqueConstraint('project_id', 'user_id', name='unique_project_collaborator'),)
+    __table_args__ = (
+        # Indice univoco per evitare duplicati (usato anche dai controlli di accesso)
+        db.UniqueConstraint('project_id', 'user_id', name='unique_project_collaborator'),
+        # Progetti in cui l'utente è collaboratore (elenco dei progetti)
+        db.Index('ix_project_collaborators_user', 'user_id', 'project_id'),
+    )
     
     def __repr__(self):
         return f'<ProjectCollaborator {self.user.username} in {self.project_id}>'
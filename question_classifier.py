@@ -24,6 +24,10 @@ class QuestionClassifier:
     
     def __init__(self):
         self.patterns = self._initialize_patterns()
+        # Le espressioni regolari vengono compilate una sola volta per istanza
+        for patterns in self.patterns.values():
+            for pattern_info in patterns:
+                pattern_info['regex'] = re.compile(pattern_info['pattern'], re.IGNORECASE)
     
     def _initialize_patterns(self) -> Dict[QuestionType, List[Dict]]:
         """Inizializza i pattern per riconoscere i diversi tipi di domande"""
@@ -139,21 +143,23 @@ class QuestionClassifier:
             Tuple con (tipo_domanda, confidenza)
         """
         scores = {qtype: 0.0 for qtype in QuestionType}
+        question_lower = question_text.lower() if question_text else ''
+        response_lower = response_text.lower() if response_text else ''
         
         # Analizza ogni tipo di domanda
         for question_type, patterns in self.patterns.items():
             for pattern_info in patterns:
-                pattern = pattern_info['pattern']
+                regex = pattern_info['regex']
                 weight = pattern_info['weight']
                 contexts = pattern_info['context']
                 
                 # Controlla se il pattern si applica al contesto
-                if 'question' in contexts and question_text:
-                    matches = len(re.findall(pattern, question_text.lower(), re.IGNORECASE))
+                if 'question' in contexts and question_lower:
+                    matches = len(regex.findall(question_lower))
                     scores[question_type] += matches * weight
                 
-                if 'response' in contexts and response_text:
-                    matches = len(re.findall(pattern, response_text.lower(), re.IGNORECASE))
+                if 'response' in contexts and response_lower:
+                    matches = len(regex.findall(response_lower))
                     scores[question_type] += matches * weight
         
         # Euristica aggiuntiva per domande aperte
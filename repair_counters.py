@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+"""
+Verifica e ricalcolo dei contatori delle annotazioni.
+
+I contatori di celle, etichette e utenti (annotation_count,
+distinct_annotators, last_annotated_at) vengono mantenuti a ogni scrittura
+tramite la sessione; le modifiche fatte in blocco o direttamente sul database
+(script di importazione, merge) li lasciano disallineati. Lo script mostra
+le righe non allineate e le ricalcola.
+
+Uso:
+    python repair_counters.py            # verifica e ricalcola
+    python repair_counters.py --check    # solo verifica (exit code 1 se disallineati)
+"""
+
+import argparse
+import os
+import sys
+
+# Aggiungi il percorso del progetto
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from migrate_schema import create_app
+from models import db
+from services.annotation_counters import find_counter_drift, rebuild_annotation_counters
+
+
+def repair_counters(check_only=False):
+    """
+    Confronta i contatori con i valori calcolati e li ricalcola
+
+    Args:
+        check_only: Se True non modifica il database
+
+    Returns:
+        True se i contatori sono (o sono stati resi) allineati
+    """
+    app = create_app()
+
+    with app.app_context():
+        drift = find_counter_drift()
+        for table_name, rows in drift.items():
+            icon = '✅' if not rows else '⚠️ '
+            print(f"  {icon} {table_name}: {rows} righe non allineate")
+
+        if not any(drift.values()):
+            print("\n🎉 Contatori allineati")
+            return True
+        if check_only:
+            return False
+
+        print("🔄 Ricalcolo dei contatori in corso...")
+        try:
+            updated = rebuild_annotation_counters()
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            print(f"❌ Errore durante il ricalcolo: {str(e)}")
+            return False
+        for table_name, rows in updated.items():
+            print(f"  ✅ {table_name}: {rows} righe ricalcolate")
+        print("\n🎉 Ricalcolo completato con successo!")
+        return True
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Verifica e ricalcola i contatori delle annotazioni')
+    parser.add_argument('--check', action='store_true', help='Solo verifica, senza modificare il database')
+    args = parser.parse_args()
+    sys.exit(0 if repair_counters(check_only=args.check) else 1)
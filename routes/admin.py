@@ -15,6 +15,8 @@ from models import User, Label, ExcelFile, TextCell, CellAnnotation, db
 from models import AIConfiguration, OpenRouterModel, OllamaModel
 from services.ollama_client import OllamaClient
 from services.openrouter_client import OpenRouterClient, KNOWN_FREE_MODELS, POPULAR_PAID_MODELS
+from services.stats_cache import cached, get_stats_cache
+from utils.sqlite_tuning import checkpoint_wal
 
 admin_bp = Blueprint('admin', __name__)
 
@@ -197,13 +199,13 @@ def profile():
 def backup_page():
     """Pagina di gestione backup"""
     # Statistiche del sistema
-    stats = {
+    stats = cached('admin.backup_page', lambda: {
         'users_count': User.query.count(),
         'labels_count': Label.query.count(),
         'files_count': ExcelFile.query.count(),
         'cells_count': TextCell.query.count(),
         'annotations_count': CellAnnotation.query.count()
-    }
+    })
     
     return render_template('admin/backup.html', stats=stats)
 
@@ -224,6 +226,9 @@ def create_backup():
         # Backup del database
         db_source = 'instance/analisi_mu.db'
         if os.path.exists(db_source):
+            # In modalità WAL le ultime transazioni sono ancora nel file -wal
+            if db.engine.dialect.name == 'sqlite':
+                checkpoint_wal(db.engine, 'FULL')
             shutil.copy2(db_source, os.path.join(backup_path, 'analisi_mu.db'))
         
         # Backup dei file caricati
@@ -284,7 +289,7 @@ def create_backup():
 @admin_required
 def system_stats():
     """Statistiche del sistema"""
-    stats = {
+    stats = cached('admin.system_stats', lambda: {
         'users': {
             'total': User.query.count(),
             'active': User.query.filter_by(is_active=True).count(),
@@ -296,14 +301,32 @@ def system_stats():
             'excel_files': ExcelFile.query.count(),
             'text_cells': TextCell.query.count(),
             'annotations': CellAnnotation.query.count()
-        },
-        'recent_activity': {
-            'recent_users': User.query.order_by(User.last_login.desc()).limit(5).all(),
-            'recent_files': ExcelFile.query.order_by(ExcelFile.uploaded_at.desc()).limit(5).all()
         }
+    })
+    # Oggetti del database: letti a ogni richiesta
+    stats['recent_activity'] = {
+        'recent_users': User.query.order_by(User.last_login.desc()).limit(5).all(),
+        'recent_files': ExcelFile.query.order_by(ExcelFile.uploaded_at.desc()).limit(5).all()
     }
+    cache = get_stats_cache()
     
-    return render_template('admin/system_stats.html', stats=stats)
+    return render_template('admin/system_stats.html', stats=stats,
+                         cache_stats=cache.stats() if cache is not None else None)
+
+@admin_bp.route('/api/stats_cache')
+@login_required
+@admin_required
+def api_stats_cache():
+    """Contatori della cache delle statistiche (hits e misses per statistica)"""
+    cache = get_stats_cache()
+    if cache is None:
+        return jsonify({'success': True, 'enabled': False, 'entries': []})
+    return jsonify({
+        'success': True,
+        'enabled': True,
+        'ttl': cache.ttl,
+        'entries': cache.stats()
+    })
 
 @admin_bp.route('/ai-config')
 @login_required
@@ -167,6 +167,7 @@ def preview_prompt():
         # Prendi celle da annotare (migliore gestione dell'ordine)
         cells = TextCell.query.filter(
             TextCell.excel_file_id == file_id,
+            TextCell.is_current,
             ~TextCell.id.in_(db.session.query(CellAnnotation.text_cell_id).distinct())
         ).order_by(TextCell.row_index, TextCell.column_index).limit(batch_size).all()
         
@@ -339,9 +340,10 @@ def review_file_annotations(file_id):
         pending_annotations = ai_service.get_pending_annotations(file_id)
         
         # Statistiche
-        total_cells = TextCell.query.filter_by(excel_file_id=file_id).count()
+        total_cells = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current).count()
         annotated_cells = db.session.query(CellAnnotation.text_cell_id).join(TextCell).filter(
             TextCell.excel_file_id == file_id,
+            TextCell.is_current,
             CellAnnotation.status == 'active'
         ).distinct().count()
         
@@ -374,9 +376,10 @@ def test_review_file_annotations(file_id):
         pending_annotations = ai_service.get_pending_annotations(file_id)
         
         # Statistiche
-        total_cells = TextCell.query.filter_by(excel_file_id=file_id).count()
+        total_cells = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current).count()
         annotated_cells = db.session.query(CellAnnotation.text_cell_id).join(TextCell).filter(
             TextCell.excel_file_id == file_id,
+            TextCell.is_current,
             CellAnnotation.status == 'active'
         ).distinct().count()
         
@@ -14,6 +14,9 @@ from collections import defaultdict
 
 from models import TextCell, Label, CellAnnotation, ExcelFile, User, AnnotationAction, Category, db
 from sqlalchemy import func
+from services.question_stats import question_stats_query
+from services.stats_cache import cached
+from utils.pagination import keyset_paginate
 
 annotation_bp = Blueprint('annotation', __name__)
 
@@ -112,7 +115,7 @@ def get_navigation_context(current_cell, request_args):
     """Calcola il contesto di navigazione per celle della stessa domanda"""
     
     # Costruisci query per celle della stessa domanda
-    query = TextCell.query.filter_by(column_name=current_cell.column_name)
+    query = TextCell.query.filter_by(column_name=current_cell.column_name).filter(TextCell.is_current)
     
     # Applica gli stessi filtri della pagina browse_annotations
     file_id = request_args.get('file_id', type=int)
@@ -219,6 +222,10 @@ def api_add_annotation():
         logger.error(f"ADD_ANNOTATION: Cell {cell_id} or Label {label_id} not found - cell: {cell}, label: {label}")
         return jsonify({'success': False, 'message': 'Cella o etichetta non trovata'}), 404
     
+    if not cell.is_current:
+        # Cella ritirata da una nuova versione del file: le sue annotazioni restano solo come storico
+        return jsonify({'success': False, 'message': 'La cella non è più presente nell\'ultima versione del file'}), 409
+    
     logger.info(f"ADD_ANNOTATION: Found cell '{cell.text_content[:50]}...' and label '{label.name}'")
     
     try:
@@ -445,7 +452,8 @@ def browse_annotations():
     if ajax == '1' and file_id:
         # Per i fogli, considera solo celle annotabili o non classificate se non c'è filtro specifico
         sheets_query = db.session.query(TextCell.sheet_name)\
-                                .filter_by(excel_file_id=file_id)
+                                .filter_by(excel_file_id=file_id)\
+                                .filter(TextCell.is_current)
         
         if not question_type_filter:
             sheets_query = sheets_query.filter(db.or_(
@@ -460,7 +468,8 @@ def browse_annotations():
         
         # Per le domande, applica lo stesso filtro
         questions_query = db.session.query(TextCell.column_name)\
-                                   .filter_by(excel_file_id=file_id)
+                                   .filter_by(excel_file_id=file_id)\
+                                   .filter(TextCell.is_current)
         
         if not question_type_filter:
             questions_query = questions_query.filter(db.or_(
@@ -480,7 +489,8 @@ def browse_annotations():
             'questions': question_names
         })
     
-    query = TextCell.query
+    # Le celle ritirate da una nuova versione del file non si annotano più
+    query = TextCell.query.filter(TextCell.is_current)
     
     # FILTRO PER TIPO DOMANDA
     if question_type_filter == 'all':
@@ -508,15 +518,23 @@ def browse_annotations():
         query = query.filter_by(column_name=selected_question)
     
     if annotated_only == '1':
-        # Solo celle che hanno almeno un'annotazione
-        query = query.join(CellAnnotation).distinct()
+        # Solo celle che hanno almeno un'annotazione (contatore mantenuto sulla cella)
+        query = query.filter(TextCell.annotation_count > 0)
     elif annotated_only == '0':
         # Solo celle non annotate
-        query = query.outerjoin(CellAnnotation).filter(CellAnnotation.id.is_(None))
-    
-    cells = query.order_by(TextCell.excel_file_id, TextCell.sheet_name, 
-                          TextCell.row_index, TextCell.column_index)\
-                 .paginate(page=page, per_page=20, error_out=False)
+        query = query.filter(TextCell.annotation_count == 0)
+    
+    # Paginazione a chiave: ogni pagina riparte dall'ultima cella della precedente.
+    # Il totale è il COUNT(*) in cache: gli aggregati per domanda non seguono i
+    # filtri per cella (tipo, annotata) e un totale stimato sposterebbe i
+    # confini dell'ultima pagina e di quelle lette a ritroso
+    cells = keyset_paginate(
+        query,
+        [TextCell.excel_file_id, TextCell.sheet_name, TextCell.row_index, TextCell.column_index, TextCell.id],
+        cursor=request.args.get('cursor'),
+        page=page,
+        per_page=20
+    )
     
     # Per i filtri
     files = ExcelFile.query.order_by(ExcelFile.original_filename).all()
@@ -526,12 +544,14 @@ def browse_annotations():
         # Se è selezionato un file, mostra solo i fogli di quel file
         sheets = db.session.query(TextCell.sheet_name)\
                           .filter_by(excel_file_id=file_id)\
+                          .filter(TextCell.is_current)\
                           .distinct().all()
         sheet_names = [sheet[0] for sheet in sheets]
         
         # Ottieni tutte le domande/colonne per il file selezionato
         questions = db.session.query(TextCell.column_name)\
                              .filter_by(excel_file_id=file_id)\
+                             .filter(TextCell.is_current)\
                              .distinct()\
                              .order_by(TextCell.column_name)\
                              .all()
@@ -539,11 +559,13 @@ def browse_annotations():
     else:
         # Se non è selezionato nessun file, mostra tutti i fogli di tutti i file
         sheets = db.session.query(TextCell.sheet_name)\
+                          .filter(TextCell.is_current)\
                           .distinct().all()
         sheet_names = [sheet[0] for sheet in sheets]
         
         # Ottieni tutte le domande/colonne di tutti i file
         questions = db.session.query(TextCell.column_name)\
+                             .filter(TextCell.is_current)\
                              .distinct()\
                              .order_by(TextCell.column_name)\
                              .all()
@@ -552,32 +574,14 @@ def browse_annotations():
     # Per la Vista per Domanda, calcola le statistiche per domanda
     questions_stats = []
     if view_mode == 'per_domanda':
-        # Ottieni statistiche per ogni domanda come in questions_overview
-        base_query = db.session.query(
-            TextCell.column_name,
-            db.func.count(TextCell.id).label('total_responses'),
-            db.func.count(CellAnnotation.id).label('annotated_responses')
-        ).outerjoin(CellAnnotation)
-        
-        # Applica filtro per file se selezionato
-        if file_id:
-            base_query = base_query.filter(TextCell.excel_file_id == file_id)
-        
-        # Applica filtro per domanda specifica se selezionata
-        if selected_question:
-            base_query = base_query.filter(TextCell.column_name == selected_question)
-        
-        # Applica filtro per foglio se selezionato
-        if sheet_name:
-            base_query = base_query.filter(TextCell.sheet_name == sheet_name)
-        
-        questions_stats = base_query.group_by(TextCell.column_name)\
-                                   .order_by(TextCell.column_name)\
-                                   .all()
+        # Statistiche precalcolate per domanda, con i filtri di file, foglio e domanda
+        questions_stats = question_stats_query(
+            file_id, sheet_name=sheet_name, column_name=selected_question
+        ).all()
     
     # Ottieni tutti i tipi di domanda disponibili per il filtro
     available_question_types = db.session.query(TextCell.question_type)\
-                                        .filter(TextCell.question_type.isnot(None))\
+                                        .filter(TextCell.question_type.isnot(None), TextCell.is_current)\
                                         .distinct()\
                                         .order_by(TextCell.question_type)\
                                         .all()
@@ -601,9 +605,14 @@ def browse_annotations():
 @login_required
 def statistics():
     """Statistiche sulle annotazioni"""
+    return render_template('annotation/statistics.html', **cached('annotation.statistics', _statistics_data))
+
+def _statistics_data():
+    """Aggregati e grafici della pagina delle statistiche (valori della cache)"""
     # Statistiche generali
-    total_cells = TextCell.query.count()
+    total_cells = TextCell.query.filter(TextCell.is_current).count()
     annotated_cells = db.session.query(TextCell.id)\
+        .filter(TextCell.is_current)\
         .join(CellAnnotation)\
         .distinct().count()
     
@@ -621,7 +630,7 @@ def statistics():
         db.func.count(CellAnnotation.id)
     ).join(CellAnnotation)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .group_by(Label.id)\
+     .group_by(Label.id, Category.id)\
      .order_by(db.desc(db.func.count(CellAnnotation.id)))\
      .limit(20)\
      .all()
@@ -632,7 +641,7 @@ def statistics():
         db.func.count(TextCell.id).label('total_cells'),
         db.func.count(CellAnnotation.id).label('annotated_cells')
     ).select_from(ExcelFile)\
-     .outerjoin(TextCell, ExcelFile.id == TextCell.excel_file_id)\
+     .outerjoin(TextCell, db.and_(ExcelFile.id == TextCell.excel_file_id, TextCell.is_current))\
      .outerjoin(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
      .group_by(ExcelFile.id)\
      .all()
@@ -640,23 +649,26 @@ def statistics():
     # Nuove statistiche dettagliate per file
     file_label_stats = get_file_label_statistics()
     overview_charts = create_overview_charts(file_label_stats)
+    for file_stat in file_label_stats:
+        file_stat['file'] = {'id': file_stat['file'].id, 'original_filename': file_stat['file'].original_filename}
 
     # Genera i grafici per le statistiche generali
     user_stats_chart = create_user_stats_chart(user_stats)
     label_stats_chart = create_label_stats_chart(label_stats)
     file_progress_chart = create_file_progress_chart(file_progress)
     
-    return render_template('annotation/statistics.html',
-                          total_cells=total_cells,
-                          annotated_cells=annotated_cells,
-                          user_stats=user_stats,
-                          label_stats=label_stats,
-                          file_progress=file_progress,
-                          file_label_stats=file_label_stats,
-                          overview_charts=overview_charts,
-                          user_stats_chart=user_stats_chart,
-                          label_stats_chart=label_stats_chart,
-                          file_progress_chart=file_progress_chart)
+    return {
+        'total_cells': total_cells,
+        'annotated_cells': annotated_cells,
+        'user_stats': user_stats,
+        'label_stats': label_stats,
+        'file_progress': file_progress,
+        'file_label_stats': file_label_stats,
+        'overview_charts': overview_charts,
+        'user_stats_chart': user_stats_chart,
+        'label_stats_chart': label_stats_chart,
+        'file_progress_chart': file_progress_chart
+    }
 
 @annotation_bp.route('/file_statistics/<int:file_id>')
 @login_required
@@ -689,9 +701,10 @@ def get_file_label_statistics():
     
     for file in files:
         # Statistiche base del file
-        total_cells = TextCell.query.filter_by(excel_file_id=file.id).count()
+        total_cells = TextCell.query.filter_by(excel_file_id=file.id).filter(TextCell.is_current).count()
         annotated_cells = db.session.query(TextCell.id)\
             .filter_by(excel_file_id=file.id)\
+            .filter(TextCell.is_current)\
             .join(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
             .distinct().count()
         
@@ -705,8 +718,8 @@ def get_file_label_statistics():
          .join(CellAnnotation, Label.id == CellAnnotation.label_id)\
          .outerjoin(Category, Label.category_id == Category.id)\
          .join(TextCell, CellAnnotation.text_cell_id == TextCell.id)\
-         .filter(TextCell.excel_file_id == file.id)\
-         .group_by(Label.id)\
+         .filter(TextCell.excel_file_id == file.id, TextCell.is_current)\
+         .group_by(Label.id, Category.id)\
          .order_by(db.desc('count'))\
          .all()
         
@@ -717,7 +730,7 @@ def get_file_label_statistics():
         ).select_from(Label)\
          .join(CellAnnotation, Label.id == CellAnnotation.label_id)\
          .join(TextCell, CellAnnotation.text_cell_id == TextCell.id)\
-         .filter(TextCell.excel_file_id == file.id)\
+         .filter(TextCell.excel_file_id == file.id, TextCell.is_current)\
          .group_by(Label.category)\
          .order_by(db.desc('count'))\
          .all()
@@ -729,7 +742,7 @@ def get_file_label_statistics():
         ).select_from(User)\
          .join(CellAnnotation, User.id == CellAnnotation.user_id)\
          .join(TextCell, CellAnnotation.text_cell_id == TextCell.id)\
-         .filter(TextCell.excel_file_id == file.id)\
+         .filter(TextCell.excel_file_id == file.id, TextCell.is_current)\
          .group_by(User.id)\
          .order_by(db.desc('count'))\
          .all()
@@ -1051,7 +1064,7 @@ def get_annotatable_cells(file_id):
     
     # Ottieni le celle che sono domande aperte o non classificate
     annotatable_cells = TextCell.query.filter_by(excel_file_id=file_id)\
-        .filter(db.or_(
+        .filter(TextCell.is_current, db.or_(
             TextCell.question_type == 'aperta',
             TextCell.question_type.is_(None)
         )).all()
@@ -6,6 +6,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from sqlalchemy import desc, and_, or_
 from models import db, DiaryEntry, DiaryAttachment, User, ExcelFile
+from services.search import matching_ids
 from datetime import datetime, timedelta
 import os
 import json
@@ -67,14 +68,7 @@ def index():
         query = query.filter(DiaryEntry.status == status)
     
     if search:
-        search_term = f"%{search}%"
-        query = query.filter(
-            or_(
-                DiaryEntry.title.ilike(search_term),
-                DiaryEntry.content.ilike(search_term),
-                DiaryEntry.tags.ilike(search_term)
-            )
-        )
+        query = query.filter(DiaryEntry.id.in_(matching_ids('diary', search)))
     
     # Ordina per data (più recenti primi)
     query = query.order_by(desc(DiaryEntry.created_at))
@@ -4,51 +4,43 @@ Routes per la gestione dei file Excel
 
 import os
 import pandas as pd
-from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, send_file
+from flask import Blueprint, render_template, request, flash, redirect, url_for, current_app, send_file, jsonify, abort
 from flask_login import login_required, current_user
 from werkzeug.utils import secure_filename
 
-from models import ExcelFile, TextCell, CellAnnotation, Label, Category, db
-from forms import UploadForm
+from models import ExcelFile, IngestionJob, QuestionStats, TextCell, CellAnnotation, Label, Category, db
+from forms import UploadForm, NewVersionForm
+from services.bulk_delete import delete_excel_file, delete_job_status, submit_excel_file_delete
+from services.deduplication import find_duplicate_file, save_with_sha256
+from services.excel_ingestion import ExcelIngestionService
+from services.file_loaders import SUPPORTED_EXTENSIONS, read_headers
+from services.ingestion_jobs import create_job, submit_job
+from services.question_stats import ensure_question_stats, question_stats_query
+from services.stats_cache import GLOBAL, file_scope, invalidate_on_commit
+from utils.pagination import keyset_paginate
 
 excel_bp = Blueprint('excel', __name__)
 
+def wants_json_response():
+    """True se il client (fetch/XHR) preferisce una risposta JSON"""
+    return request.accept_mimetypes.best == 'application/json' or \
+        request.headers.get('X-Requested-With') == 'XMLHttpRequest'
+
 def allowed_file(filename):
     """Verifica se il file ha un'estensione consentita"""
-    return '.' in filename and filename.rsplit('.', 1)[1].lower() in ['xlsx', 'xls']
+    return '.' in filename and filename.rsplit('.', 1)[1].lower() in SUPPORTED_EXTENSIONS
 
 def extract_text_cells(file_path, excel_file_id):
     """Estrae le celle testuali da un file Excel"""
     try:
-        # Leggi tutti i fogli del file Excel
-        excel_data = pd.read_excel(file_path, sheet_name=None, engine='openpyxl', header=0)
-        
-        cells_extracted = 0
-        
-        for sheet_name, df in excel_data.items():
-            # Salva le intestazioni (prima riga)
-            headers = df.columns.tolist()
-            
-            # Itera su tutte le righe (escludendo l'header)
-            for row_idx, row in df.iterrows():
-                for col_idx, cell_value in enumerate(row):
-                    # Verifica se la cella contiene testo non vuoto
-                    if pd.notna(cell_value) and isinstance(cell_value, str) and len(cell_value.strip()) > 0:
-                        # Il nome della colonna è l'intestazione (quesito)
-                        question_text = headers[col_idx] if col_idx < len(headers) else f'Colonna_{col_idx}'
-                        
-                        # Crea un nuovo oggetto TextCell
-                        text_cell = TextCell(
-                            excel_file_id=excel_file_id,
-                            sheet_name=sheet_name,
-                            row_index=row_idx + 1,  # +1 perché row_idx parte da 0 ma saltiamo l'header
-                            column_index=col_idx,
-                            column_name=question_text,
-                            text_content=cell_value.strip()
-                        )
-                        db.session.add(text_cell)
-                        cells_extracted += 1
+        # Lettura in streaming e inserimento a blocchi (vedi ExcelIngestionService)
+        service = ExcelIngestionService(
+            chunk_size=current_app.config.get('INGESTION_CHUNK_SIZE'),
+            workers=current_app.config.get('INGESTION_PROCESS_WORKERS')
+        )
+        cells_extracted = service.ingest(file_path, excel_file_id)
         
+        invalidate_on_commit(db.session, GLOBAL, file_scope(excel_file_id))
         db.session.commit()
         return cells_extracted
         
@@ -56,6 +48,38 @@ def extract_text_cells(file_path, excel_file_id):
         db.session.rollback()
         raise e
 
+def duplicate_payload(duplicate):
+    """Risposta JSON per un file già caricato con lo stesso contenuto"""
+    return {
+        'success': False,
+        'duplicate': True,
+        'file_id': duplicate.id,
+        'file_url': url_for('excel.view_file', file_id=duplicate.id),
+        'message': f'Il file è già stato caricato come "{duplicate.original_filename}"'
+    }
+
+def start_ingestion(file_path, safe_filename, original_filename, sha256=None):
+    """
+    Registra un file salvato in UPLOAD_FOLDER e avvia l'estrazione delle celle in background
+    
+    Returns:
+        Tupla (ExcelFile, IngestionJob) già committati
+    """
+    excel_file = ExcelFile(
+        filename=safe_filename,
+        original_filename=original_filename,
+        file_path=file_path,
+        file_sha256=sha256,
+        uploaded_by=current_user.id
+    )
+    db.session.add(excel_file)
+    db.session.flush()  # Per ottenere l'ID
+    
+    job = create_job(excel_file, current_user.id)
+    db.session.commit()
+    submit_job(current_app._get_current_object(), job.id)
+    return excel_file, job
+
 @excel_bp.route('/upload', methods=['GET', 'POST'])
 @login_required
 def upload():
@@ -71,27 +95,33 @@ def upload():
             timestamp = str(int(pd.Timestamp.now().timestamp()))
             safe_filename = f"{timestamp}_{filename}"
             
-            # Salva il file
+            # Salva il file calcolandone l'hash
             file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], safe_filename)
-            file.save(file_path)
+            sha256 = save_with_sha256(file, file_path)
+            
+            # Stesso contenuto già caricato: propone di riutilizzare il file esistente
+            duplicate = find_duplicate_file(sha256)
+            if duplicate and not form.allow_duplicate.data:
+                os.remove(file_path)
+                if wants_json_response():
+                    return jsonify(duplicate_payload(duplicate)), 409
+                flash(f'Questo file è già stato caricato come "{duplicate.original_filename}": '
+                      'puoi continuare a lavorare su quello. Per importarlo di nuovo seleziona '
+                      '"Carica comunque".', 'warning')
+                return redirect(url_for('excel.view_file', file_id=duplicate.id))
             
             try:
-                # Crea record nel database
-                excel_file = ExcelFile(
-                    filename=safe_filename,
-                    original_filename=filename,
-                    file_path=file_path,
-                    uploaded_by=current_user.id
-                )
-                db.session.add(excel_file)
-                db.session.flush()  # Per ottenere l'ID
-                
-                # Estrai le celle testuali
-                cells_count = extract_text_cells(file_path, excel_file.id)
+                excel_file, job = start_ingestion(file_path, safe_filename, filename, sha256)
                 
-                db.session.commit()
+                if wants_json_response():
+                    return jsonify({
+                        'success': True,
+                        'job_id': job.id,
+                        'file_id': excel_file.id,
+                        'status_url': url_for('excel.job_status', job_id=job.id)
+                    }), 202
                 
-                flash(f'File caricato con successo! Estratte {cells_count} celle testuali.', 'success')
+                flash('File caricato con successo! L\'estrazione delle celle testuali è in corso.', 'success')
                 return redirect(url_for('excel.view_file', file_id=excel_file.id))
                 
             except Exception as e:
@@ -101,10 +131,106 @@ def upload():
                     os.remove(file_path)
                 flash(f'Errore durante l\'elaborazione del file: {str(e)}', 'error')
         else:
-            flash('File non valido. Sono supportati solo file .xlsx e .xls', 'error')
+            flash('File non valido. Sono supportati file Excel (.xlsx, .xls), .ods, .csv e .parquet', 'error')
     
     return render_template('excel/upload.html', form=form)
 
+@excel_bp.route('/file/<int:file_id>/new_version', methods=['GET', 'POST'])
+@login_required
+def upload_new_version(file_id):
+    """Caricamento di una nuova versione di un file: vengono importate solo le differenze"""
+    excel_file = ExcelFile.query.get_or_404(file_id)
+    
+    if current_user.id != excel_file.uploaded_by and not current_user.is_admin:
+        flash('Non hai i permessi per aggiornare questo file.', 'error')
+        return redirect(url_for('excel.view_file', file_id=file_id))
+    
+    if not excel_file.is_ready:
+        flash('Attendi il termine dell\'elaborazione in corso prima di caricare una nuova versione.', 'warning')
+        return redirect(url_for('excel.view_file', file_id=file_id))
+    
+    form = NewVersionForm()
+    # Le colonne chiave (ID, timestamp) spesso non sono testuali: le intestazioni si leggono dal file
+    try:
+        columns = read_headers(excel_file.file_path)
+    except (OSError, ValueError):
+        columns = [c[0] for c in db.session.query(TextCell.column_name)
+                   .filter_by(excel_file_id=file_id).distinct().order_by(TextCell.column_name) if c[0]]
+    form.key_column.choices = [('', 'Nessuna (confronto per posizione della riga)')] + \
+        [(column, column) for column in columns]
+    if request.method == 'GET' and excel_file.row_key_column:
+        form.key_column.data = excel_file.row_key_column
+    
+    if form.validate_on_submit():
+        file = form.file.data
+        
+        if file and allowed_file(file.filename):
+            filename = secure_filename(file.filename)
+            timestamp = str(int(pd.Timestamp.now().timestamp()))
+            safe_filename = f"{timestamp}_{filename}"
+            file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], safe_filename)
+            sha256 = save_with_sha256(file, file_path)
+            
+            if sha256 == excel_file.file_sha256:
+                os.remove(file_path)
+                flash('Il file caricato è identico alla versione corrente: nessuna modifica da importare.', 'info')
+                return redirect(url_for('excel.view_file', file_id=excel_file.id))
+            
+            try:
+                job = create_job(excel_file, current_user.id, source_path=file_path,
+                                 key_column=form.key_column.data or None, file_sha256=sha256)
+                db.session.commit()
+                submit_job(current_app._get_current_object(), job.id)
+                
+                if wants_json_response():
+                    return jsonify({
+                        'success': True,
+                        'job_id': job.id,
+                        'file_id': excel_file.id,
+                        'status_url': url_for('excel.job_status', job_id=job.id)
+                    }), 202
+                
+                flash('Nuova versione caricata: il confronto con le celle esistenti è in corso.', 'success')
+                return redirect(url_for('excel.view_file', file_id=excel_file.id))
+                
+            except Exception as e:
+                db.session.rollback()
+                if os.path.exists(file_path):
+                    os.remove(file_path)
+                flash(f'Errore durante l\'elaborazione del file: {str(e)}', 'error')
+        else:
+            flash('File non valido. Sono supportati file Excel (.xlsx, .xls), .ods, .csv e .parquet', 'error')
+    
+    return render_template('excel/new_version.html', form=form, excel_file=excel_file)
+
+@excel_bp.route('/api/check_hash')
+@login_required
+def check_hash():
+    """Verifica se un file con lo SHA-256 indicato è già stato caricato (calcolato dal client prima dell'invio)"""
+    sha256 = request.args.get('sha256', '').strip().lower()
+    if len(sha256) != 64:
+        return jsonify({'success': False, 'message': 'Hash SHA-256 non valido'}), 400
+    
+    duplicate = find_duplicate_file(sha256)
+    if duplicate is None:
+        return jsonify({'success': True, 'duplicate': False})
+    return jsonify({
+        'success': True,
+        'duplicate': True,
+        'file_id': duplicate.id,
+        'original_filename': duplicate.original_filename,
+        'file_url': url_for('excel.view_file', file_id=duplicate.id)
+    })
+
+@excel_bp.route('/jobs/<job_id>')
+@login_required
+def job_status(job_id):
+    """Avanzamento di un job di ingestione (righe lette, celle inserite, ETA)"""
+    job = IngestionJob.query.get_or_404(job_id)
+    if not job.can_view(current_user):
+        abort(404)
+    return jsonify({'success': True, **job.to_dict()})
+
 @excel_bp.route('/files')
 @login_required
 def list_files():
@@ -126,79 +252,48 @@ def view_file(file_id):
     sheet_filter = request.args.get('sheet', '')
     view_mode = request.args.get('view', 'cells')  # 'cells' o 'questions'
     
-    # Query base
-    query = TextCell.query.filter_by(excel_file_id=file_id)
+    # Query base (le celle rimosse in una versione successiva non vengono mostrate)
+    query = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current)
     
     if sheet_filter:
         query = query.filter_by(sheet_name=sheet_filter)
     
-    # Lista dei fogli per il filtro
-    sheets = db.session.query(TextCell.sheet_name)\
-                      .filter_by(excel_file_id=file_id)\
-                      .distinct()\
-                      .all()
-    sheet_names = [sheet[0] for sheet in sheets]
-    
-    # Lista delle domande/colonne per il filtro
-    questions = db.session.query(TextCell.column_name)\
-                          .filter_by(excel_file_id=file_id)\
-                          .distinct()\
-                          .order_by(TextCell.column_name)\
-                          .all()
-    question_names = [q[0] for q in questions if q[0]]
+    # Aggregati per domanda già calcolati (fogli, domande, risposte annotate)
+    ensure_question_stats(excel_file)
+    file_stats = QuestionStats.query.filter_by(excel_file_id=file_id).all()
+    sheet_names = sorted({stats.sheet_name for stats in file_stats})
+    question_names = sorted({stats.column_name for stats in file_stats if stats.column_name})
     
     # Verifica disponibilità etichette
     available_labels_count = Label.query.count()
     
+    # Statistiche rapide (per il foglio selezionato, se presente)
+    sheet_stats = [stats for stats in file_stats if not sheet_filter or stats.sheet_name == sheet_filter]
+    total_responses = sum(stats.total_responses for stats in sheet_stats)
+    
+    # Paginazione a chiave con il totale degli aggregati (nessun OFFSET né COUNT per pagina)
+    cursor = request.args.get('cursor')
     if view_mode == 'questions':
         # Vista per quesiti: raggruppa per colonna/domanda
-        cells = query.order_by(TextCell.column_name, TextCell.row_index)\
-                     .paginate(page=page, per_page=50, error_out=False)
+        keys = [db.func.coalesce(TextCell.column_name, ''), TextCell.row_index, TextCell.id]
+        cells = keyset_paginate(query, keys, cursor=cursor, page=page, per_page=50, total=total_responses)
     else:
         # Vista tradizionale per celle
-        cells = query.order_by(TextCell.sheet_name, TextCell.row_index, TextCell.column_index)\
-                     .paginate(page=page, per_page=20, error_out=False)
-    
-    # Statistiche rapide
-    total_responses = query.count()
+        keys = [TextCell.sheet_name, TextCell.row_index, TextCell.column_index, TextCell.id]
+        cells = keyset_paginate(query, keys, cursor=cursor, page=page, per_page=20, total=total_responses)
+    annotated_cells_count = sum(stats.annotated_responses for stats in sheet_stats)
     questions_count = len(question_names)
     
-    # Calcola il numero di celle annotate per questo file
-    annotated_cells_count = db.session.query(TextCell.id)\
-        .filter_by(excel_file_id=file_id)\
-        .join(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
-        .distinct().count()
-    
-    # Se c'è un filtro foglio, calcola le annotazioni solo per quel foglio
-    if sheet_filter:
-        annotated_cells_count = db.session.query(TextCell.id)\
-            .filter_by(excel_file_id=file_id, sheet_name=sheet_filter)\
-            .join(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
-            .distinct().count()
-    
-    # Per la vista per domande, calcola le statistiche per ogni domanda
+    # Per la vista per domande, le statistiche di ogni domanda
     questions_stats = []
     if view_mode == 'questions':
-        base_query = db.session.query(
-            TextCell.column_name,
-            db.func.count(TextCell.id).label('total_responses'),
-            db.func.count(CellAnnotation.id).label('annotated_responses')
-        ).outerjoin(CellAnnotation)\
-         .filter(TextCell.excel_file_id == file_id)
-        
-        # Applica filtro per foglio se selezionato
-        if sheet_filter:
-            base_query = base_query.filter(TextCell.sheet_name == sheet_filter)
-        
-        questions_stats = base_query.group_by(TextCell.column_name)\
-                                   .order_by(TextCell.column_name)\
-                                   .all()
+        questions_stats = question_stats_query(file_id, sheet_name=sheet_filter).all()
     
     # Recupera tutte le annotazioni del file
     annotations = db.session.query(CellAnnotation, Label, TextCell)\
         .join(Label, CellAnnotation.label_id == Label.id)\
         .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-        .filter(TextCell.excel_file_id == file_id)\
+        .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
         .all()
 
     # Raggruppa i commenti per etichetta con tutte le info necessarie
@@ -214,8 +309,14 @@ def view_file(file_id):
         label_objs[label.id] = label
     label_comments = [(label_objs[lid], comments) for lid, comments in label_comments_dict.items()]
 
+    # Job di ingestione in corso (o l'ultimo fallito, es. una nuova versione non importata)
+    ingestion_job = excel_file.latest_job
+    if ingestion_job and excel_file.is_ready and ingestion_job.status != 'failed':
+        ingestion_job = None
+
     return render_template('excel/view_file.html', 
                          excel_file=excel_file, 
+                         ingestion_job=ingestion_job,
                          cells=cells,
                          sheet_names=sheet_names,
                          question_names=question_names,
@@ -248,19 +349,20 @@ def view_question(file_id, question_name):
     # Ottieni tutte le risposte per questa domanda
     page = request.args.get('page', 1, type=int)
     
-    responses = TextCell.query.filter_by(
-        excel_file_id=file_id,
-        column_name=question_name
-    ).order_by(TextCell.row_index)\
-     .paginate(page=page, per_page=30, error_out=False)
-    
     # Statistiche per questa domanda
+    ensure_question_stats(excel_file)
+    question_totals = question_stats_query(file_id, column_name=question_name).first()
+    annotated_responses = question_totals.annotated_responses if question_totals else 0
+    
+    responses = keyset_paginate(
+        TextCell.query.filter_by(excel_file_id=file_id, column_name=question_name).filter(TextCell.is_current),
+        [TextCell.row_index, TextCell.id],
+        cursor=request.args.get('cursor'),
+        page=page,
+        per_page=30,
+        total=question_totals.total_responses if question_totals else 0
+    )
     total_responses = responses.total
-    annotated_responses = db.session.query(TextCell.id)\
-        .join(CellAnnotation)\
-        .filter(TextCell.excel_file_id == file_id)\
-        .filter(TextCell.column_name == question_name)\
-        .distinct().count()
     
     # Etichette più usate per questa domanda
     popular_labels = db.session.query(
@@ -270,9 +372,24 @@ def view_question(file_id, question_name):
     ).join(CellAnnotation)\
         .join(TextCell)\
         .outerjoin(Category, Label.category_id == Category.id)\
-        .filter(TextCell.excel_file_id == file_id)\
+        .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
         .filter(TextCell.column_name == question_name)\
-        .group_by(Label.id)\
+        .group_by(Label.id, Category.id)\
+        .order_by(db.desc('count'))\
+        .limit(10)\
+        .all()
+    
+    # Risposte identiche (a meno di maiuscole e spazi) date più volte
+    repeated_answers = db.session.query(
+        db.func.min(TextCell.text_content).label('text'),
+        db.func.count(TextCell.id).label('count')
+    ).filter(
+        TextCell.excel_file_id == file_id,
+        TextCell.column_name == question_name,
+        TextCell.is_current,
+        TextCell.text_hash.isnot(None)
+    ).group_by(TextCell.text_hash)\
+        .having(db.func.count(TextCell.id) > 1)\
         .order_by(db.desc('count'))\
         .limit(10)\
         .all()
@@ -287,6 +404,7 @@ def view_question(file_id, question_name):
                          total_responses=total_responses,
                          annotated_responses=annotated_responses,
                          popular_labels=popular_labels,
+                         repeated_answers=repeated_answers,
                          categories=categories)
 
 @excel_bp.route('/file/<int:file_id>/questions')
@@ -295,16 +413,9 @@ def questions_overview(file_id):
     """Panoramica di tutte le domande del questionario"""
     excel_file = ExcelFile.query.get_or_404(file_id)
     
-    # Ottieni statistiche per ogni domanda
-    questions_stats = db.session.query(
-        TextCell.column_name,
-        db.func.count(TextCell.id).label('total_responses'),
-        db.func.count(CellAnnotation.id).label('annotated_responses')
-    ).outerjoin(CellAnnotation)\
-     .filter(TextCell.excel_file_id == file_id)\
-     .group_by(TextCell.column_name)\
-     .order_by(TextCell.column_name)\
-     .all()
+    # Statistiche per ogni domanda (precalcolate in question_stats)
+    ensure_question_stats(excel_file)
+    questions_stats = question_stats_query(file_id).all()
     
     return render_template('excel/questions_overview.html',
                          excel_file=excel_file,
@@ -321,17 +432,37 @@ def delete_file(file_id):
         flash('Non hai i permessi per eliminare questo file.', 'error')
         return redirect(url_for('excel.list_files'))
     
+    if excel_file.status == 'deleting':
+        flash(f'Il file "{excel_file.original_filename}" è già in fase di eliminazione.', 'info')
+        return redirect(url_for('excel.list_files'))
+    
+    # Durante l'ingestione le celle inserite dopo l'eliminazione resterebbero orfane
+    if not excel_file.is_ready and excel_file.status != 'failed':
+        flash(f'Attendi il termine dell\'elaborazione del file "{excel_file.original_filename}" '
+              'prima di eliminarlo.', 'warning')
+        return redirect(url_for('excel.list_files'))
+    
+    filename = excel_file.original_filename
     try:
-        # Elimina il file fisico
-        if os.path.exists(excel_file.file_path):
-            os.remove(excel_file.file_path)
+        # I file molto grandi vengono eliminati in background
+        threshold = current_app.config.get('BULK_DELETE_ASYNC_CELLS', 0)
+        cells_count = TextCell.query.filter_by(excel_file_id=file_id).count()
+        if threshold and cells_count > threshold:
+            job_id = submit_excel_file_delete(current_app._get_current_object(), file_id, current_user.id)
+            if wants_json_response():
+                return jsonify({'success': True, 'job_id': job_id,
+                                'status_url': url_for('excel.delete_job', job_id=job_id)}), 202
+            flash(f'Eliminazione del file "{filename}" ({cells_count} celle) avviata in background.', 'info')
+            return redirect(url_for('excel.list_files'))
         
-        # Le annotazioni e le celle testuali verranno eliminate automaticamente
-        # grazie alle relazioni cascade definite nei modelli
-        db.session.delete(excel_file)
-        db.session.commit()
-        
-        flash(f'File "{excel_file.original_filename}" eliminato con successo.', 'success')
+        # Celle, annotazioni, azioni, forum e aggregati con DELETE in blocco
+        counts = delete_excel_file(file_id)
+        if wants_json_response():
+            return jsonify({'success': True, 'counts': counts})
+        flash(f'File "{filename}" eliminato con successo '
+              f'({counts["text_cell"]} celle, {counts["cell_annotation"]} annotazioni, '
+              f'{counts["annotation_action"] + counts["annotation_action_archive"]} azioni, '
+              f'{counts["forum_post"]} post del forum).', 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -339,6 +470,16 @@ def delete_file(file_id):
     
     return redirect(url_for('excel.list_files'))
 
+@excel_bp.route('/delete-jobs/<job_id>')
+@login_required
+def delete_job(job_id):
+    """Stato di un'eliminazione in background e righe eliminate per tabella"""
+    job = delete_job_status(job_id)
+    # Come per i job di ingestione: solo chi ha avviato l'eliminazione o un amministratore
+    if job is None or not (current_user.is_admin or job['requested_by'] == current_user.id):
+        return jsonify({'success': False, 'error': 'Job non trovato'}), 404
+    return jsonify({'success': True, **job})
+
 @excel_bp.route('/file/<int:file_id>/download')
 @login_required
 def download_file(file_id):
@@ -15,7 +15,7 @@ def file_annota(file_id):
     annotated_only = request.args.get('annotated_only', '')
 
     excel_file = ExcelFile.query.get_or_404(file_id)
-    query = TextCell.query.filter_by(excel_file_id=file_id)
+    query = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current)
 
     if sheet:
         query = query.filter_by(sheet_name=sheet)
@@ -43,9 +43,9 @@ def file_annota(file_id):
         cells_by_question[cell.column_name].append(cell)
 
     # Per i filtri
-    sheets = db.session.query(TextCell.sheet_name).filter_by(excel_file_id=file_id).distinct().all()
+    sheets = db.session.query(TextCell.sheet_name).filter_by(excel_file_id=file_id).filter(TextCell.is_current).distinct().all()
     sheet_names = [s[0] for s in sheets]
-    columns = db.session.query(TextCell.column_name).filter_by(excel_file_id=file_id).distinct().all()
+    columns = db.session.query(TextCell.column_name).filter_by(excel_file_id=file_id).filter(TextCell.is_current).distinct().all()
     column_names = [c[0] for c in columns if c[0]]
 
     return render_template('file_annotation/file_annota.html',
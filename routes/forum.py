@@ -6,6 +6,7 @@ from flask import Blueprint, render_template, request, redirect, url_for, flash,
 from flask_login import login_required, current_user
 from sqlalchemy import func, desc, or_
 from models import db, ExcelFile, ForumCategory, ForumPost, ForumComment, TextCell
+from services.search import matching_ids
 from datetime import datetime
 
 forum_bp = Blueprint('forum', __name__, url_prefix='/forum')
@@ -304,9 +305,8 @@ def search():
         if file_id:
             post_query = post_query.join(ForumCategory).filter(ForumCategory.excel_file_id == file_id)
         
-        posts = post_query.filter(
-            or_(ForumPost.title.contains(query), ForumPost.content.contains(query))
-        ).order_by(ForumPost.created_at.desc()).limit(20).all()
+        posts = post_query.filter(ForumPost.id.in_(matching_ids('forum_posts', query)))\
+                          .order_by(ForumPost.created_at.desc()).limit(20).all()
         
         for post in posts:
             results.append({
@@ -364,6 +364,7 @@ def create_default_categories(file_id):
     # Categorie per ogni domanda (colonna)
     questions = db.session.query(TextCell.column_name)\
                          .filter_by(excel_file_id=file_id)\
+                         .filter(TextCell.is_current)\
                          .distinct()\
                          .all()
     
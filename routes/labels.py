@@ -5,8 +5,12 @@ Routes per la gestione delle etichette
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required, current_user
 
-from models import Label, CellAnnotation, Category, db
+from models import Label, CellAnnotation, Category, TextCell, db
 from forms import LabelForm, CategoryForm
+from services.annotation_counters import rebuild_annotation_counters
+from services.search import matching_ids
+from services.stats_cache import GLOBAL, file_scope, invalidate_on_commit, question_scope, user_scope
+from utils.pagination import keyset_paginate
 
 labels_bp = Blueprint('labels', __name__)
 
@@ -50,9 +54,8 @@ def list_labels():
         
         labels = FakePagination(labels)
     else:
-        labels = query.order_by(Label.name).paginate(
-            page=page, per_page=20, error_out=False
-        )
+        labels = keyset_paginate(query, [Label.name, Label.id], cursor=request.args.get('cursor'),
+                                 page=page, per_page=20)
 
     # Liste delle categorie attive per il filtro
     categories = Category.query.filter_by(is_active=True).order_by(Category.name).all()
@@ -233,7 +236,7 @@ def api_search_labels():
         return jsonify([])
     
     labels = Label.query.options(db.joinedload(Label.category_obj))\
-                       .filter(Label.name.contains(query))\
+                       .filter(Label.id.in_(matching_ids('labels', query)))\
                        .filter_by(is_active=True)\
                        .order_by(Label.name)\
                        .limit(10)\
@@ -287,10 +290,19 @@ def merge_labels():
                 annotation_count = CellAnnotation.query.filter_by(label_id=source_label.id).count()
                 total_annotations += annotation_count
             
+            # Ambiti della cache delle statistiche toccati dalle annotazioni spostate
+            moved = CellAnnotation.query.filter(CellAnnotation.label_id.in_(source_label_ids))
+            scopes = {user_scope(user_id) for (user_id,) in moved.with_entities(CellAnnotation.user_id).distinct()}
+            for file_id, column_name in moved.join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
+                    .with_entities(TextCell.excel_file_id, TextCell.column_name).distinct():
+                scopes.update((file_scope(file_id), question_scope(file_id, column_name)))
+            
             # Sposta tutte le annotazioni dalle etichette di origine a quella di destinazione
-            for source_label in source_labels:
-                CellAnnotation.query.filter_by(label_id=source_label.id)\
-                                  .update({'label_id': target_label_id})
+            moved.update({'label_id': target_label_id}, synchronize_session=False)
+            
+            # L'UPDATE in blocco non genera eventi: contatori e cache vanno aggiornati a mano
+            rebuild_annotation_counters({'label': [target_label_id, *source_label_ids]})
+            invalidate_on_commit(db.session, GLOBAL, *scopes)
             
             # Elimina le etichette di origine
             source_names = [label.name for label in source_labels]
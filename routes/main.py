@@ -6,40 +6,54 @@ from flask import Blueprint, render_template, request
 from flask_login import login_required, current_user
 
 from models import User, ExcelFile, TextCell, Label, CellAnnotation, Category, db
+from services.stats_cache import cached
 
 main_bp = Blueprint('main', __name__)
 
 @main_bp.route('/')
 def index():
     """Pagina principale"""
-    # Statistiche generali
-    stats = {
-        'total_files': ExcelFile.query.count(),
-        'total_cells': TextCell.query.count(),
-        'total_labels': Label.query.count(),
-        'total_annotations': CellAnnotation.query.count(),
-        'total_users': User.query.count()
-    }
+    # Statistiche generali ed etichette popolari (ID e conteggio) dalla cache delle statistiche
+    summary = cached('main.index', _index_summary)
+    stats = summary['stats']
     
     # File recenti
     recent_files = ExcelFile.query.order_by(ExcelFile.uploaded_at.desc()).limit(5).all()
     
     # Etichette popolari con colori calcolati
-    popular_labels = db.session.query(
-        Label,
-        db.func.count(CellAnnotation.id).label('count')
-    ).options(db.joinedload(Label.category_obj))\
-        .join(CellAnnotation)\
-        .group_by(Label.id)\
-        .order_by(db.desc('count'))\
-        .limit(10)\
-        .all()
+    labels = {
+        label.id: label
+        for label in Label.query.options(db.joinedload(Label.category_obj))
+        .filter(Label.id.in_([label_id for label_id, _ in summary['popular_labels']]))
+    }
+    popular_labels = [(labels[label_id], count)
+                      for label_id, count in summary['popular_labels'] if label_id in labels]
     
     return render_template('main/index.html', 
                          stats=stats, 
                          recent_files=recent_files,
                          popular_labels=popular_labels)
 
+def _index_summary():
+    """Conteggi della pagina principale e ID delle 10 etichette più usate"""
+    popular_labels = db.session.query(
+        CellAnnotation.label_id,
+        db.func.count(CellAnnotation.id).label('count')
+    ).group_by(CellAnnotation.label_id)\
+        .order_by(db.desc('count'))\
+        .limit(10)\
+        .all()
+    return {
+        'stats': {
+            'total_files': ExcelFile.query.count(),
+            'total_cells': TextCell.query.filter(TextCell.is_current).count(),
+            'total_labels': Label.query.count(),
+            'total_annotations': CellAnnotation.query.count(),
+            'total_users': User.query.count()
+        },
+        'popular_labels': [[label_id, count] for label_id, count in popular_labels]
+    }
+
 @main_bp.route('/dashboard')
 @login_required
 def dashboard():
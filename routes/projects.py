@@ -11,13 +11,14 @@ from sqlalchemy import or_, and_, desc, func
 from sqlalchemy.orm import joinedload
 
 from models import (
-    db, Project, ProjectNote, ProjectCollaborator, User, ExcelFile, TextDocument, 
+    db, Project, ProjectNote, ProjectCollaborator, User, ExcelFile, TextDocument, TextCell,
     CellAnnotation, TextAnnotation, Label, Category
 )
 from forms import (
     ProjectForm, ProjectNoteForm, CollaboratorInviteForm, 
     ProjectSearchForm, ProjectFileUploadForm
 )
+from services.search import matching_ids
 
 projects_bp = Blueprint('projects', __name__, url_prefix='/projects')
 
@@ -36,21 +37,13 @@ def list_projects():
     
     # Filtra per accessibilità
     if not current_user.is_admin:
-        accessible_projects = or_(
-            Project.owner_id == current_user.id,  # Progetti di proprietà
-            Project.visibility == 'public',        # Progetti pubblici
-            Project.collaborators.like(f'%"user_id": {current_user.id}%')  # Progetti dove è collaboratore
-        )
+        # Progetti di proprietà, pubblici o dove è collaboratore
+        accessible_projects = Project.accessible_filter(current_user)
         query = query.filter(accessible_projects)
     
     # Applica filtri di ricerca
     if search_form.search_query.data:
-        search_term = f"%{search_form.search_query.data}%"
-        query = query.filter(or_(
-            Project.name.like(search_term),
-            Project.description.like(search_term),
-            Project.tags.like(search_term)
-        ))
+        query = query.filter(Project.id.in_(matching_ids('projects', search_form.search_query.data)))
     
     if search_form.project_type.data:
         query = query.filter(Project.project_type == search_form.project_type.data)
@@ -72,7 +65,8 @@ def list_projects():
             query = query.filter(
                 and_(
                     Project.owner_id != current_user.id,
-                    Project.collaborators.like(f'%"user_id": {current_user.id}%')
+                    Project.id.in_(db.select(ProjectCollaborator.project_id)
+                                   .where(ProjectCollaborator.user_id == current_user.id))
                 )
             )
     
@@ -249,7 +243,18 @@ def project_files(project_id):
     files = []
     
     if file_type in ['all', 'excel']:
+        # Celle e annotazioni per file con una sola query aggregata
+        cell_totals = {
+            row.excel_file_id: row for row in db.session.query(
+                TextCell.excel_file_id,
+                func.count(TextCell.id).label('cells'),
+                func.coalesce(func.sum(TextCell.annotation_count), 0).label('annotations')
+            ).join(ExcelFile, ExcelFile.id == TextCell.excel_file_id)
+             .filter(ExcelFile.project_id == project.id, TextCell.is_current)
+             .group_by(TextCell.excel_file_id)
+        }
         for excel_file in project.excel_files:
+            totals = cell_totals.get(excel_file.id)
             files.append({
                 'id': excel_file.id,
                 'name': excel_file.original_filename,
@@ -257,8 +262,8 @@ def project_files(project_id):
                 'size': 'N/A',  # TODO: implementare dimensione file
                 'uploaded_at': excel_file.uploaded_at,
                 'uploader': excel_file.uploader.username,
-                'annotations_count': sum(len(cell.annotations) for cell in excel_file.text_cells),
-                'cells_count': len(excel_file.text_cells),
+                'annotations_count': totals.annotations if totals else 0,
+                'cells_count': totals.cells if totals else 0,
                 'object': excel_file
             })
     
@@ -685,8 +690,8 @@ def project_settings(project_id):
     
     # Tutti gli utenti per gestione collaboratori (eccetto owner visualizzato separatamente)
     all_users = User.query.order_by(User.username).all()
-    current_collaborator_ids = {c.get('user_id') for c in project.collaborators_list if isinstance(c, dict)}
     collaborators = get_project_collaborators(project, detailed=True)
+    current_collaborator_ids = {c['user'].id for c in collaborators if c.get('role') != 'owner'}
     collaborator_ids = [c['user'].id for c in collaborators if c.get('role') != 'owner']
     collaborator_roles_map = {c['user'].id: c.get('role') for c in collaborators if c.get('role') != 'owner'}
 
@@ -716,32 +721,13 @@ def update_collaborators(project_id):
     except ValueError:
         selected_ids = []
 
-    # Costruisci nuova lista collaboratori (mantieni ruoli esistenti, consenti aggiornamento ruolo da form)
-    existing = {c.get('user_id'): c for c in project.collaborators_list if isinstance(c, dict)}
-    new_list = []
-    now_iso = datetime.utcnow().isoformat()
-    for uid in selected_ids:
-        # salta l'owner se accidentalmente selezionato
-        if uid == project.owner_id:
-            continue
-        prev = existing.get(uid)
-        # ruolo dal form: role_<id>
-        role_key = f'role_{uid}'
-        role_val = request.form.get(role_key, (prev.get('role') if prev else 'viewer'))
-        if prev:
-            new_list.append({
-                'user_id': uid,
-                'role': role_val,
-                'added_at': prev.get('added_at', now_iso)
-            })
-        else:
-            new_list.append({
-                'user_id': uid,
-                'role': role_val,
-                'added_at': now_iso
-            })
-
-    project.collaborators_list = new_list
+    # Nuovi collaboratori (mantieni ruoli esistenti, consenti aggiornamento ruolo da form: role_<id>)
+    existing_roles = {link.user_id: link.role for link in project.collaborator_links}
+    roles = {
+        uid: request.form.get(f'role_{uid}', existing_roles.get(uid, 'viewer'))
+        for uid in selected_ids
+    }
+    project.set_collaborators(roles, added_by=current_user)
     project.last_activity = datetime.utcnow()
     try:
         db.session.commit()
@@ -782,7 +768,7 @@ def get_project_statistics(project):
         },
         'activity': {
             'last_activity': project.last_activity,
-            'total_collaborators': len(project.collaborators_list) + 1  # +1 per il proprietario
+            'total_collaborators': len(project.collaborator_links) + 1  # +1 per il proprietario
         }
     }
     
@@ -847,30 +833,34 @@ def get_project_collaborators(project, detailed=False):
         'last_activity': None   # TODO: calcolare
     })
     
-    # Aggiungi collaboratori dalla lista JSON
-    for collab_data in project.collaborators_list:
-        if isinstance(collab_data, dict):
-            user = User.query.get(collab_data.get('user_id'))
-            if user:
-                role = collab_data.get('role', 'viewer')
-                collaborators.append({
-                    'user': user,
-                    'role': role,
-                    'role_display': {
-                        'moderator': 'Moderatore',
-                        'editor': 'Editor',
-                        'annotator': 'Annotatore',
-                        'viewer': 'Visualizzatore'
-                    }.get(role, 'Sconosciuto'),
-                    'role_class': {
-                        'moderator': 'warning',
-                        'editor': 'primary',
-                        'annotator': 'success',
-                        'viewer': 'secondary'
-                    }.get(role, 'secondary'),
-                    'joined_at': datetime.fromisoformat(collab_data.get('added_at', project.created_at.isoformat())),
-                    'annotations_count': 0,  # TODO: calcolare
-                    'last_activity': None   # TODO: calcolare
-                })
+    # Aggiungi collaboratori (utenti caricati nella stessa query)
+    links = (
+        ProjectCollaborator.query
+        .options(joinedload(ProjectCollaborator.user))
+        .filter_by(project_id=project.id)
+        .order_by(ProjectCollaborator.added_at)
+        .all()
+    )
+    for link in links:
+        role = link.role or 'viewer'
+        collaborators.append({
+            'user': link.user,
+            'role': role,
+            'role_display': {
+                'moderator': 'Moderatore',
+                'editor': 'Editor',
+                'annotator': 'Annotatore',
+                'viewer': 'Visualizzatore'
+            }.get(role, 'Sconosciuto'),
+            'role_class': {
+                'moderator': 'warning',
+                'editor': 'primary',
+                'annotator': 'success',
+                'viewer': 'secondary'
+            }.get(role, 'secondary'),
+            'joined_at': link.added_at or project.created_at,
+            'annotations_count': 0,  # TODO: calcolare
+            'last_activity': None   # TODO: calcolare
+        })
     
     return collaborators
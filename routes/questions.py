@@ -5,8 +5,10 @@ Route per la gestione e classificazione manuale delle domande
 
 from flask import Blueprint, render_template, request, flash, redirect, url_for, jsonify
 from flask_login import login_required
-from models import db, TextCell
-from sqlalchemy import func, distinct
+from models import db, QuestionStats, TextCell
+from services.question_stats import sync_question_types
+from utils.sql_compat import string_agg
+from sqlalchemy import func
 import json
 
 questions_bp = Blueprint('questions', __name__, url_prefix='/questions')
@@ -19,18 +21,20 @@ def manage_questions():
     # Prima ottieni i dati sui file Excel
     from models import ExcelFile
     
-    # Ottieni tutte le domande raggruppate per file
+    # Ottieni tutte le domande raggruppate per file (dagli aggregati precalcolati)
     files_with_questions = db.session.query(
         ExcelFile.id.label('file_id'),
         ExcelFile.filename.label('filename'),
         ExcelFile.uploaded_at.label('uploaded_at'),
-        TextCell.column_name,
-        func.count(TextCell.id).label('total_cells'),
-        func.count(TextCell.question_type).label('classified_cells'),
-        func.group_concat(distinct(TextCell.question_type)).label('types_used')
-    ).join(TextCell, ExcelFile.id == TextCell.excel_file_id)\
-     .group_by(ExcelFile.id, TextCell.column_name)\
-     .order_by(ExcelFile.filename, TextCell.column_name).all()
+        QuestionStats.column_name,
+        func.sum(QuestionStats.total_responses).label('total_cells'),
+        func.sum(db.case((QuestionStats.question_type.isnot(None), QuestionStats.total_responses), else_=0))
+            .label('classified_cells'),
+        string_agg(QuestionStats.question_type, distinct=True).label('types_used'),
+        func.max(QuestionStats.suggested_type).label('suggested_type')
+    ).join(QuestionStats, ExcelFile.id == QuestionStats.excel_file_id)\
+     .group_by(ExcelFile.id, QuestionStats.column_name)\
+     .order_by(ExcelFile.filename, QuestionStats.column_name).all()
     
     # Raggruppa per file
     files_data = {}
@@ -54,7 +58,8 @@ def manage_questions():
             'column_name': row.column_name,
             'total_cells': row.total_cells,
             'classified_cells': row.classified_cells,
-            'types_used': row.types_used
+            'types_used': row.types_used,
+            'suggested_type': row.suggested_type
         }
         
         files_data[file_id]['questions'].append(question)
@@ -101,6 +106,7 @@ def classify_question():
         updated_count = db.session.query(TextCell)\
             .filter_by(column_name=column_name)\
             .update({'question_type': question_type})
+        sync_question_types([column_name])
         
         db.session.commit()
         
@@ -134,6 +140,7 @@ def bulk_classify():
                 .filter_by(column_name=question_name)\
                 .update({'question_type': question_type})
             total_updated += updated_count
+        sync_question_types(question_names)
         
         db.session.commit()
         
@@ -167,6 +174,7 @@ def bulk_reset():
                 .filter_by(column_name=question_name)\
                 .update({'question_type': None})
             total_updated += updated_count
+        sync_question_types(question_names)
         
         db.session.commit()
         
@@ -195,13 +203,22 @@ def auto_suggest():
         
         suggestions = []
         
+        # Tipi rilevati dalle risposte in ingestione (services/column_profiler.py)
+        profiled = dict(db.session.query(QuestionStats.column_name, func.max(QuestionStats.suggested_type))
+                        .filter(QuestionStats.column_name.in_(question_names),
+                                QuestionStats.suggested_type.isnot(None))
+                        .group_by(QuestionStats.column_name).all())
+        
         for question_name in question_names:
             question_lower = question_name.lower()
             suggested_type = None
             confidence = 0.0
             
             # Regole euristiche per suggerimenti
-            if any(word in question_lower for word in ['età', 'anno', 'nascita', 'data nascita']):
+            if question_name in profiled:
+                suggested_type = profiled[question_name]
+                confidence = 0.9
+            elif any(word in question_lower for word in ['età', 'anno', 'nascita', 'data nascita']):
                 suggested_type = 'anagrafica'
                 confidence = 0.9
             elif any(word in question_lower for word in ['genere', 'sesso', 'maschio', 'femmina']):
@@ -0,0 +1,144 @@
+"""
+API di ricerca unificata (services/search.py)
+"""
+
+from flask import Blueprint, jsonify, request, url_for
+from flask_login import current_user, login_required
+
+from models import db, Label, Project, TextCell, TextDocument
+from services.search import SEARCH_SOURCES, search, search_backend
+
+search_bp = Blueprint('search', __name__)
+
+MAX_LIMIT = 50
+
+
+def _describe_cell(cell):
+    return {
+        'title': f"{cell.column_name or cell.sheet_name} (riga {cell.row_index + 1})",
+        'subtitle': cell.excel_file.original_filename if cell.excel_file else None,
+        'url': url_for('annotation.annotate_cell', cell_id=cell.id),
+    }
+
+
+def _describe_document(document):
+    return {
+        'title': document.original_name,
+        'subtitle': document.document_type,
+        'url': url_for('text_documents.annotate', document_id=document.id),
+    }
+
+
+def _describe_post(post):
+    return {
+        'title': post.title,
+        'subtitle': post.author.username if post.author else None,
+        'url': url_for('forum.view_post', post_id=post.id),
+    }
+
+
+def _describe_comment(comment):
+    return {
+        'title': comment.post.title if comment.post else 'Commento',
+        'subtitle': comment.author.username if comment.author else None,
+        'url': url_for('forum.view_post', post_id=comment.post_id),
+    }
+
+
+def _describe_diary(entry):
+    return {
+        'title': entry.title,
+        'subtitle': entry.activity_type,
+        'url': url_for('diary.view', id=entry.id),
+    }
+
+
+def _describe_label(label):
+    return {
+        'title': label.name,
+        'subtitle': label.category,
+        'url': url_for('labels.edit_label', label_id=label.id),
+    }
+
+
+def _describe_project(project):
+    return {
+        'title': project.name,
+        'subtitle': project.project_type,
+        'url': url_for('projects.view_project', project_id=project.id),
+    }
+
+
+def _visible(source_name, query):
+    """Filtra gli oggetti che l'utente corrente può aprire"""
+    if source_name == 'cells':
+        return query.filter(TextCell.is_current)
+    if source_name == 'documents' and not current_user.is_admin:
+        return query.filter(TextDocument.user_id == current_user.id)
+    if source_name == 'labels':
+        return query.filter(Label.is_active.is_(True))
+    if source_name == 'projects':
+        return query.filter(Project.accessible_filter(current_user))
+    return query
+
+
+DESCRIBERS = {
+    'cells': _describe_cell,
+    'documents': _describe_document,
+    'forum_posts': _describe_post,
+    'forum_comments': _describe_comment,
+    'diary': _describe_diary,
+    'labels': _describe_label,
+    'projects': _describe_project,
+}
+
+
+@search_bp.route('/search')
+@login_required
+def search_all():
+    """
+    Ricerca full-text su tutte le entità
+
+    Parametri: q (testo), types (sorgenti separate da virgola, default tutte),
+    limit (risultati per sorgente, max 50). I risultati di ogni sorgente sono
+    in ordine di pertinenza, con l'estratto evidenziato in HTML.
+    """
+    query = request.args.get('q', '').strip()
+    types = [name.strip() for name in request.args.get('types', '').split(',') if name.strip()]
+    unknown = [name for name in types if name not in SEARCH_SOURCES]
+    if unknown:
+        return jsonify({
+            'success': False,
+            'error': f"Tipi non validi: {', '.join(unknown)}",
+            'types': list(SEARCH_SOURCES)
+        }), 400
+    limit = min(max(request.args.get('limit', 10, type=int), 1), MAX_LIMIT)
+
+    # La visibilità è applicata prima del limite per sorgente
+    hits = search(query, types or None, limit=limit, visible=_visible)
+
+    results = {}
+    for source_name, source_hits in hits.items():
+        model = SEARCH_SOURCES[source_name].model
+        ids = [hit.id for hit in source_hits]
+        objects = {}
+        if ids:
+            objects = {obj.id: obj for obj in model.query.filter(model.id.in_(ids)).all()}
+        results[source_name] = [
+            {
+                'id': hit.id,
+                'type': source_name,
+                'rank': hit.rank,
+                'snippet': hit.snippet,
+                **DESCRIBERS[source_name](objects[hit.id])
+            }
+            for hit in source_hits if hit.id in objects
+        ]
+
+    return jsonify({
+        'success': True,
+        'query': query,
+        'backend': search_backend(db.engine),
+        'results': results,
+        'total': sum(len(items) for items in results.values())
+    })
@@ -2,25 +2,84 @@
 Routes per le statistiche di annotazione
 """
 
-from flask import Blueprint, render_template, request, jsonify, flash, redirect, url_for
+from flask import Blueprint, abort, render_template, request, jsonify, flash, redirect, url_for, current_app
 from flask_login import login_required, current_user
-from sqlalchemy import func, desc, distinct
+from sqlalchemy import and_, func, desc, distinct
 from collections import defaultdict, Counter
 from datetime import datetime, timedelta
 import json
 
-from models import CellAnnotation, Label, User, TextCell, ExcelFile, Category, AnnotationAction, db
+from models import CellAnnotation, Label, User, TextCell, ExcelFile, Category, Project, db
+from utils.sql_compat import date_bucket
+from services.action_log import action_history
+from services.agreement import (AnnotationMatrix, agreement_summary, is_agreement_annotation,
+                                load_annotation_matrix, pairwise_agreement, pairwise_matrix)
+from services.cooccurrence import MEASURES, UNITS, label_cooccurrence
+from services.stats_cache import cached
+from utils.analytics_snapshot import (analytics_freshness, primary_reads, refresh_analytics_snapshot,
+                                      use_analytics_snapshot)
 
 statistics_bp = Blueprint('statistics', __name__, url_prefix='/statistics')
 
+@statistics_bp.before_request
+def read_from_analytics_snapshot():
+    """
+    Le letture delle statistiche vanno sulla copia in sola lettura, se
+    configurata; un file, un utente o un progetto creati dopo l'ultima copia
+    vengono letti dal database principale.
+    """
+    view_args = request.view_args or {}
+    created = []
+    # Il file può essere nell'URL o nei parametri (es. ambito della co-occorrenza)
+    file_id = view_args.get('file_id', request.args.get('file_id', type=int))
+    if file_id is not None:
+        created.append(db.session.query(ExcelFile.uploaded_at).filter_by(id=file_id).scalar())
+    # Utente nell'URL o utenti messi a confronto nei parametri (/compare)
+    user_ids = [view_args.get('user_id'), request.args.get('user1_id', type=int),
+                request.args.get('user2_id', type=int)]
+    for user_id in user_ids:
+        if user_id is not None:
+            created.append(db.session.query(User.created_at).filter_by(id=user_id).scalar())
+    project_id = request.args.get('project_id', type=int)
+    if project_id is not None:
+        created.append(db.session.query(Project.created_at).filter_by(id=project_id).scalar())
+        # Anche i file caricati nel progetto dopo l'ultima copia
+        last_upload = db.session.query(func.max(ExcelFile.uploaded_at)).filter_by(project_id=project_id).scalar()
+        if last_upload is not None:
+            created.append(last_upload)
+    if any(value is None for value in created):
+        required_since = datetime.max
+    else:
+        required_since = max(created, default=None)
+    use_analytics_snapshot(current_app, required_since)
+
+@statistics_bp.context_processor
+def inject_analytics_freshness():
+    """Data dei dati mostrati, per l'avviso nelle pagine"""
+    return {'analytics_freshness': analytics_freshness(current_app)}
+
+@statistics_bp.route('/snapshot/refresh', methods=['POST'])
+@login_required
+def refresh_snapshot():
+    """Aggiorna subito la copia delle statistiche (solo amministratori)"""
+    if not current_user.is_admin:
+        flash('Solo gli amministratori possono aggiornare i dati delle statistiche.', 'error')
+    elif refresh_analytics_snapshot(current_app._get_current_object(), db) is not None:
+        flash('Dati delle statistiche aggiornati.', 'success')
+    return redirect(request.referrer or url_for('statistics.overview'))
+
 @statistics_bp.route('/')
 @login_required
 def overview():
     """Pagina principale delle statistiche"""
+    return render_template('statistics/overview.html', **cached('statistics.overview', _overview_data))
+
+def _overview_data():
+    """Aggregati della pagina principale delle statistiche (valori della cache)"""
     # Statistiche generali
     total_annotations = CellAnnotation.query.count()
     total_users = User.query.count()
-    total_cells = TextCell.query.count()
+    total_cells = TextCell.query.filter(TextCell.is_current).count()
     total_labels = Label.query.count()
     
     # Top 10 annotatori
@@ -37,7 +96,7 @@ def overview():
         func.count(CellAnnotation.id).label('usage_count')
     ).join(CellAnnotation)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .group_by(Label.id).order_by(desc('usage_count')).limit(10).all()
+     .group_by(Label.id, Category.id).order_by(desc('usage_count')).limit(10).all()
     
     # Statistiche per file
     file_stats = db.session.query(
@@ -46,7 +105,7 @@ def overview():
         func.count(distinct(TextCell.id)).label('total_cells'),
         func.count(CellAnnotation.id).label('total_annotations'),
         func.count(distinct(CellAnnotation.user_id)).label('annotator_count')
-    ).outerjoin(TextCell, ExcelFile.id == TextCell.excel_file_id)\
+    ).outerjoin(TextCell, and_(ExcelFile.id == TextCell.excel_file_id, TextCell.is_current))\
      .outerjoin(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
      .group_by(ExcelFile.id)\
      .order_by(desc('total_annotations'))\
@@ -66,25 +125,26 @@ def overview():
         func.count(CellAnnotation.id).label('count')
     ).join(CellAnnotation)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .group_by(Label.id).order_by(desc('count')).limit(10).all()
+     .group_by(Label.id, Category.id).order_by(desc('count')).limit(10).all()
     
     # Timeline attività
     timeline_data = db.session.query(
-        func.date(CellAnnotation.created_at).label('date'),
+        date_bucket(CellAnnotation.created_at).label('date'),
         func.count(CellAnnotation.id).label('count')
-    ).group_by(func.date(CellAnnotation.created_at)).order_by('date').all()
+    ).group_by(date_bucket(CellAnnotation.created_at)).order_by('date').all()
     
-    return render_template('statistics/overview.html',
-                         total_annotations=total_annotations,
-                         total_users=total_users,
-                         total_cells=total_cells,
-                         total_labels=total_labels,
-                         top_annotators=top_annotators,
-                         top_labels=top_labels,
-                         file_stats=file_stats,
-                         user_chart_data=user_chart_data,
-                         label_chart_data=label_chart_data,
-                         timeline_data=timeline_data)
+    return {
+        'total_annotations': total_annotations,
+        'total_users': total_users,
+        'total_cells': total_cells,
+        'total_labels': total_labels,
+        'top_annotators': top_annotators,
+        'top_labels': top_labels,
+        'file_stats': file_stats,
+        'user_chart_data': user_chart_data,
+        'label_chart_data': label_chart_data,
+        'timeline_data': timeline_data
+    }
 
 @statistics_bp.route('/user/<int:user_id>')
 @login_required
@@ -113,7 +173,7 @@ def user_detail(user_id):
         func.count(CellAnnotation.id).label('count')
     ).select_from(CellAnnotation).join(Label).outerjoin(Category, Label.category_id == Category.id).filter(
         CellAnnotation.user_id == user_id
-    ).group_by(Label.id).order_by(desc('count')).all()
+    ).group_by(Label.id, Category.id).order_by(desc('count')).all()
     
     # Aggiungi percentuali
     label_usage_with_pct = []
@@ -128,14 +188,17 @@ def user_detail(user_id):
         })
     
     # Attività recente (ultime 20 azioni)
-    recent_actions = db.session.query(AnnotationAction).filter_by(
-        performed_by=user_id
-    ).order_by(desc(AnnotationAction.timestamp)).limit(20).all()
+    # (anche dall'archivio se le azioni recenti sono meno di 20)
+    recent_actions = action_history(performed_by=user_id, limit=20)
     
     # Aggiungi info etichetta alle azioni
+    action_labels = {
+        label.id: label
+        for label in Label.query.filter(Label.id.in_({action.label_id for action in recent_actions}))
+    }
     recent_actions_with_labels = []
     for action in recent_actions:
-        label = Label.query.get(action.label_id) if action.label_id else None
+        label = action_labels.get(action.label_id)
         recent_actions_with_labels.append({
             'timestamp': action.timestamp,
             'action': action.action_type,
@@ -146,10 +209,10 @@ def user_detail(user_id):
     
     # Timeline attività
     timeline_data = db.session.query(
-        func.date(CellAnnotation.created_at).label('date'),
+        date_bucket(CellAnnotation.created_at).label('date'),
         func.count(CellAnnotation.id).label('count')
     ).filter(CellAnnotation.user_id == user_id).group_by(
-        func.date(CellAnnotation.created_at)
+        date_bucket(CellAnnotation.created_at)
     ).order_by('date').all()
     
     timeline_dates = []
@@ -190,7 +253,7 @@ def user_detail(user_id):
         ).select_from(CellAnnotation).join(Label).join(Category).filter(
             CellAnnotation.user_id == user_id,
             Category.name == cat_stat.name
-        ).group_by(Label.id).order_by(desc('count')).first()
+        ).group_by(Label.id, Category.id).order_by(desc('count')).first()
         
         category_stats_with_pct.append({
             'name': cat_stat.name,
@@ -254,29 +317,79 @@ def compare():
                          comparison=comparison)
 
 def _calculate_comparison(user1, user2):
-    """Calcola dati di confronto tra due utenti"""
+    """
+    Calcola dati di confronto tra due utenti
+
+    Il numero di query non dipende dalla quantità di dati: una lettura delle
+    annotazioni di entrambi, un conteggio per etichetta e utente e uno per
+    giorno e utente. Statistiche, accordo, conflitti e grafici sono derivati
+    in memoria da questi tre risultati.
+    """
+    user_ids = [user1.id, user2.id]
+
+    # Annotazioni di entrambi gli utenti
+    annotations = db.session.query(
+        CellAnnotation.text_cell_id,
+        CellAnnotation.user_id,
+        CellAnnotation.label_id,
+        CellAnnotation.status,
+        TextCell.removed_at
+    ).join(TextCell, TextCell.id == CellAnnotation.text_cell_id).filter(
+        CellAnnotation.user_id.in_(user_ids)
+    ).all()
+
+    # Conteggi per etichetta e utente
+    label_counts = db.session.query(
+        CellAnnotation.user_id,
+        Label.id,
+        Label.name,
+        Label.color,
+        Category.name.label('category_name'),
+        func.count(CellAnnotation.id).label('count')
+    ).join(Label, Label.id == CellAnnotation.label_id).outerjoin(
+        Category, Category.id == Label.category_id
+    ).filter(
+        CellAnnotation.user_id.in_(user_ids)
+    ).group_by(CellAnnotation.user_id, Label.id, Label.name, Label.color, Category.name).all()
+
+    # Conteggi per giorno e utente
+    daily_counts = db.session.query(
+        CellAnnotation.user_id,
+        date_bucket(CellAnnotation.created_at).label('date'),
+        func.count(CellAnnotation.id).label('count'),
+        func.min(CellAnnotation.created_at).label('first_at')
+    ).filter(
+        CellAnnotation.user_id.in_(user_ids),
+        CellAnnotation.created_at.isnot(None)
+    ).group_by(CellAnnotation.user_id, date_bucket(CellAnnotation.created_at)).order_by('date').all()
+
+    labels = {row.id: row for row in label_counts}
+    counts_by_user = {user_id: {} for user_id in user_ids}
+    for row in label_counts:
+        counts_by_user[row.user_id][row.id] = row.count
+
     # Statistiche base per entrambi gli utenti
-    user1_stats = _get_user_basic_stats(user1.id)
-    user2_stats = _get_user_basic_stats(user2.id)
-    
-    # Celle annotate da entrambi
-    common_cells_query = db.session.query(CellAnnotation.text_cell_id).filter_by(user_id=user1.id).intersect(
-        db.session.query(CellAnnotation.text_cell_id).filter_by(user_id=user2.id)
-    )
-    common_cells = [row[0] for row in common_cells_query.all()]
-    
-    # Calcola accordo inter-annotatore
-    agreement = _calculate_inter_annotator_agreement(user1.id, user2.id, common_cells)
-    
+    user1_stats = _get_user_basic_stats(user1.id, annotations, counts_by_user, daily_counts)
+    user2_stats = _get_user_basic_stats(user2.id, annotations, counts_by_user, daily_counts)
+
+    # Calcola accordo inter-annotatore (stesse annotazioni di services/agreement.py)
+    compared = [
+        (row.text_cell_id, row.user_id, row.label_id) for row in annotations
+        if is_agreement_annotation(row.status, row.removed_at)
+    ]
+    agreement = _calculate_inter_annotator_agreement(AnnotationMatrix(compared), user1.id, user2.id, labels)
+
     # Conflitti (celle con etichette diverse)
-    conflicts = _find_annotation_conflicts(user1.id, user2.id, common_cells)
-    
+    conflicts = _find_annotation_conflicts(user1.id, user2.id, compared, labels)
+
     # Etichette comuni e specifiche
-    common_labels, user1_only, user2_only = _compare_label_usage(user1.id, user2.id)
-    
+    common_labels, user1_only, user2_only = _compare_label_usage(
+        counts_by_user[user1.id], counts_by_user[user2.id], labels
+    )
+
     # Dati per grafici
-    chart_data = _prepare_chart_data(user1.id, user2.id)
-    timeline_data = _prepare_timeline_data(user1.id, user2.id)
+    chart_data = _prepare_chart_data(counts_by_user[user1.id], counts_by_user[user2.id], labels)
+    timeline_data = _prepare_timeline_data(user1.id, user2.id, daily_counts)
     
     # Confronto per quesito - TODO: implementare
     # question_comparison = _compare_by_question(user1.id, user2.id)
@@ -295,14 +408,15 @@ def _calculate_comparison(user1, user2):
         'question_comparison': question_comparison
     }
 
-def _get_user_basic_stats(user_id):
-    """Ottieni statistiche base per un utente"""
-    total_annotations = CellAnnotation.query.filter_by(user_id=user_id).count()
-    unique_cells = db.session.query(distinct(CellAnnotation.text_cell_id)).filter_by(user_id=user_id).count()
-    unique_labels = db.session.query(distinct(CellAnnotation.label_id)).filter_by(user_id=user_id).count()
+def _get_user_basic_stats(user_id, annotations, counts_by_user, daily_counts):
+    """Statistiche base di un utente dai risultati di _calculate_comparison"""
+    label_counts = counts_by_user[user_id]
+    total_annotations = sum(label_counts.values())
+    unique_cells = len({row.text_cell_id for row in annotations if row.user_id == user_id})
+    unique_labels = len(label_counts)
     
     # Media annotazioni per giorno
-    first_annotation = db.session.query(func.min(CellAnnotation.created_at)).filter_by(user_id=user_id).scalar()
+    first_annotation = min((row.first_at for row in daily_counts if row.user_id == user_id), default=None)
     days_active = 1
     if first_annotation:
         days_active = max(1, (datetime.now() - first_annotation).days + 1)
@@ -315,216 +429,117 @@ def _get_user_basic_stats(user_id):
         'avg_per_day': avg_per_day
     }
 
-def _calculate_inter_annotator_agreement(user1_id, user2_id, common_cells):
-    """Calcola l'accordo inter-annotatore (Cohen's Kappa)"""
-    if not common_cells:
-        return {
-            'common_cells': 0,
-            'exact_matches': 0,
-            'agreement_percentage': 0.0,
-            'kappa': 0.0
+def _calculate_inter_annotator_agreement(matrix, user1_id, user2_id, labels=None):
+    """Calcola l'accordo inter-annotatore (kappa di Cohen per etichetta, Jaccard, alpha di Krippendorff)"""
+    agreement = pairwise_agreement(matrix, user1_id, user2_id)
+    agreement['label_kappa'] = _named_label_scores(agreement['label_kappa'], labels)
+    return agreement
+
+def _named_label_scores(scores, labels=None):
+    """
+    Converte {label_id: valore} in una lista con nome e colore, dal valore più basso
+
+    Args:
+        scores: Valori per ID etichetta
+        labels: Etichette già lette (ID -> riga con name e color); se None
+            vengono lette con una query
+    """
+    if labels is None:
+        labels = {label.id: label for label in Label.query.filter(Label.id.in_(list(scores))).all()}
+    return sorted([
+        {
+            'label_id': label_id,
+            'name': labels[label_id].name if label_id in labels else f'#{label_id}',
+            'color': labels[label_id].color if label_id in labels else None,
+            'value': value
         }
-    
-    exact_matches = 0
-    total_comparisons = 0
-    
-    for cell_id in common_cells:
-        # Etichette dell'utente 1 per questa cella
-        user1_labels = set([
-            ann.label_id for ann in CellAnnotation.query.filter_by(
-                user_id=user1_id, text_cell_id=cell_id
-            ).all()
-        ])
-        
-        # Etichette dell'utente 2 per questa cella
-        user2_labels = set([
-            ann.label_id for ann in CellAnnotation.query.filter_by(
-                user_id=user2_id, text_cell_id=cell_id
-            ).all()
-        ])
-        
-        # Confronta i set di etichette
-        if user1_labels == user2_labels:
-            exact_matches += 1
-        total_comparisons += 1
-    
-    agreement_percentage = (exact_matches / total_comparisons * 100) if total_comparisons > 0 else 0
-    
-    # Calcolo semplificato di Cohen's Kappa (versione base)
-    # Per un calcolo più preciso servirebbero più considerazioni statistiche
-    pe = 0.5  # Probabilità di accordo casuale (semplificata)
-    po = agreement_percentage / 100  # Probabilità di accordo osservato
-    kappa = (po - pe) / (1 - pe) if (1 - pe) != 0 else 0
-    
-    return {
-        'common_cells': len(common_cells),
-        'exact_matches': exact_matches,
-        'agreement_percentage': agreement_percentage,
-        'kappa': max(0, kappa)  # Non può essere negativo in questa semplificazione
-    }
+        for label_id, value in scores.items()
+    ], key=lambda item: (item['value'] is None, item['value'] if item['value'] is not None else 0))
+
+def _find_annotation_conflicts(user1_id, user2_id, annotations, labels):
+    """Trova le celle annotate da entrambi con etichette diverse"""
+    label_sets = defaultdict(lambda: {user1_id: set(), user2_id: set()})
+    for cell_id, user_id, label_id in annotations:
+        label_sets[cell_id][user_id].add(label_id)
+
+    def describe(label_ids):
+        return [
+            {'name': labels[label_id].name, 'color': labels[label_id].color}
+            for label_id in sorted(label_ids, key=lambda label_id: labels[label_id].name)
+            if label_id in labels
+        ]
 
-def _find_annotation_conflicts(user1_id, user2_id, common_cells):
-    """Trova conflitti di annotazione tra due utenti"""
     conflicts = []
-    
-    for cell_id in common_cells:
-        # Etichette dell'utente 1
-        user1_annotations = db.session.query(CellAnnotation, Label, Category).join(
-            Label
-        ).join(Category).filter(
-            CellAnnotation.user_id == user1_id,
-            CellAnnotation.text_cell_id == cell_id
-        ).all()
-        
-        # Etichette dell'utente 2
-        user2_annotations = db.session.query(CellAnnotation, Label, Category).join(
-            Label
-        ).join(Category).filter(
-            CellAnnotation.user_id == user2_id,
-            CellAnnotation.text_cell_id == cell_id
-        ).all()
-        
-        user1_label_ids = set([ann[0].label_id for ann in user1_annotations])
-        user2_label_ids = set([ann[0].label_id for ann in user2_annotations])
-        
+    for cell_id in sorted(label_sets):
+        user1_labels = label_sets[cell_id][user1_id]
+        user2_labels = label_sets[cell_id][user2_id]
         # Se ci sono differenze, è un conflitto
-        if user1_label_ids != user2_label_ids:
+        if user1_labels and user2_labels and user1_labels != user2_labels:
+            first_label = labels.get(min(user1_labels))
             conflicts.append({
                 'cell_id': cell_id,
-                'user1_labels': [{'name': ann[1].name, 'color': ann[1].color} for ann in user1_annotations],
-                'user2_labels': [{'name': ann[1].name, 'color': ann[1].color} for ann in user2_annotations],
-                'category': user1_annotations[0][2].name if user1_annotations else 'N/A'
+                'user1_labels': describe(user1_labels),
+                'user2_labels': describe(user2_labels),
+                'category': (first_label.category_name if first_label else None) or 'N/A'
             })
     
     return conflicts
 
-def _compare_label_usage(user1_id, user2_id):
+def _compare_label_usage(user1_counts, user2_counts, labels):
     """Confronta l'uso delle etichette tra due utenti"""
-    # Etichette usate dall'utente 1
-    user1_labels = db.session.query(
-        Label.id, Label.name, Label.color,
-        func.count(CellAnnotation.id).label('count')
-    ).join(CellAnnotation).filter(
-        CellAnnotation.user_id == user1_id
-    ).group_by(Label.id).all()
-    
-    # Etichette usate dall'utente 2
-    user2_labels = db.session.query(
-        Label.id, Label.name, Label.color,
-        func.count(CellAnnotation.id).label('count')
-    ).join(CellAnnotation).filter(
-        CellAnnotation.user_id == user2_id
-    ).group_by(Label.id).all()
-    
-    user1_label_ids = set([l.id for l in user1_labels])
-    user2_label_ids = set([l.id for l in user2_labels])
-    
-    # Crea dizionari per accesso rapido
-    user1_dict = {l.id: l for l in user1_labels}
-    user2_dict = {l.id: l for l in user2_labels}
+    user1_label_ids = set(user1_counts)
+    user2_label_ids = set(user2_counts)
     
     # Etichette in comune
-    common_label_ids = user1_label_ids.intersection(user2_label_ids)
-    common_labels = []
-    for label_id in common_label_ids:
-        label1 = user1_dict[label_id]
-        label2 = user2_dict[label_id]
-        common_labels.append({
+    common_labels = [
+        {
             'id': label_id,
-            'name': label1.name,
-            'color': label1.color,
-            'user1_count': label1.count,
-            'user2_count': label2.count
-        })
+            'name': labels[label_id].name,
+            'color': labels[label_id].color,
+            'user1_count': user1_counts[label_id],
+            'user2_count': user2_counts[label_id]
+        }
+        for label_id in user1_label_ids & user2_label_ids
+    ]
     
     # Etichette specifiche dell'utente 1
-    user1_only_ids = user1_label_ids - user2_label_ids
     user1_only = [
-        {'name': user1_dict[lid].name, 'color': user1_dict[lid].color, 'count': user1_dict[lid].count}
-        for lid in user1_only_ids
+        {'name': labels[lid].name, 'color': labels[lid].color, 'count': user1_counts[lid]}
+        for lid in user1_label_ids - user2_label_ids
     ]
     
     # Etichette specifiche dell'utente 2
-    user2_only_ids = user2_label_ids - user1_label_ids
     user2_only = [
-        {'name': user2_dict[lid].name, 'color': user2_dict[lid].color, 'count': user2_dict[lid].count}
-        for lid in user2_only_ids
+        {'name': labels[lid].name, 'color': labels[lid].color, 'count': user2_counts[lid]}
+        for lid in user2_label_ids - user1_label_ids
     ]
     
     return common_labels, user1_only, user2_only
 
-def _prepare_chart_data(user1_id, user2_id):
+def _prepare_chart_data(user1_counts, user2_counts, labels):
     """Prepara dati per i grafici di confronto"""
-    # Ottieni tutte le etichette usate da entrambi
-    all_labels = db.session.query(Label.id, Label.name).join(CellAnnotation).filter(
-        (CellAnnotation.user_id == user1_id) | (CellAnnotation.user_id == user2_id)
-    ).distinct().all()
-    
-    label_names = [l.name for l in all_labels]
-    user1_counts = []
-    user2_counts = []
-    
-    for label in all_labels:
-        # Count per utente 1
-        count1 = CellAnnotation.query.filter_by(user_id=user1_id, label_id=label.id).count()
-        user1_counts.append(count1)
-        
-        # Count per utente 2
-        count2 = CellAnnotation.query.filter_by(user_id=user2_id, label_id=label.id).count()
-        user2_counts.append(count2)
+    # Etichette usate da almeno uno dei due
+    label_ids = sorted(set(user1_counts) | set(user2_counts), key=lambda label_id: labels[label_id].name)
     
     return {
-        'label_names': label_names,
-        'user1_counts': user1_counts,
-        'user2_counts': user2_counts
+        'label_names': [labels[label_id].name for label_id in label_ids],
+        'user1_counts': [user1_counts.get(label_id, 0) for label_id in label_ids],
+        'user2_counts': [user2_counts.get(label_id, 0) for label_id in label_ids]
     }
 
-def _prepare_timeline_data(user1_id, user2_id):
+def _prepare_timeline_data(user1_id, user2_id, daily_counts):
     """Prepara dati timeline per confronto"""
-    # Date di tutte le annotazioni
-    all_dates = db.session.query(
-        func.date(CellAnnotation.created_at).label('date')
-    ).filter(
-        (CellAnnotation.user_id == user1_id) | (CellAnnotation.user_id == user2_id)
-    ).distinct().order_by('date').all()
-    
-    dates = []
-    for d in all_dates:
-        if isinstance(d.date, str):
-            # Se date è una stringa, usa direttamente
-            dates.append(d.date)
-        else:
-            # Altrimenti usa strftime
-            dates.append(d.date.strftime('%Y-%m-%d'))
-    
-    user1_counts = []
-    user2_counts = []
-    
-    for date_obj in all_dates:
-        # Estrai la data in formato corretto per il confronto
-        if isinstance(date_obj.date, str):
-            date_value = date_obj.date
-        else:
-            date_value = date_obj.date
-        
-        # Count per utente 1
-        count1 = CellAnnotation.query.filter(
-            CellAnnotation.user_id == user1_id,
-            func.date(CellAnnotation.created_at) == date_value
-        ).count()
-        user1_counts.append(count1)
-        
-        # Count per utente 2
-        count2 = CellAnnotation.query.filter(
-            CellAnnotation.user_id == user2_id,
-            func.date(CellAnnotation.created_at) == date_value
-        ).count()
-        user2_counts.append(count2)
+    counts = defaultdict(dict)
+    for row in daily_counts:
+        # SQLite restituisce la data come stringa, PostgreSQL come date
+        date_value = row.date if isinstance(row.date, str) else row.date.strftime('%Y-%m-%d')
+        counts[date_value][row.user_id] = row.count
+    dates = sorted(counts)
     
     return {
         'dates': dates,
-        'user1_counts': user1_counts,
-        'user2_counts': user2_counts
+        'user1_counts': [counts[date_value].get(user1_id, 0) for date_value in dates],
+        'user2_counts': [counts[date_value].get(user2_id, 0) for date_value in dates]
     }
 
 @statistics_bp.route('/api/chart_data/<chart_type>')
@@ -556,12 +571,13 @@ def chart_data(chart_type):
     
     elif chart_type == 'annotations_timeline':
         data = db.session.query(
-            func.date(CellAnnotation.created_at).label('date'),
+            date_bucket(CellAnnotation.created_at).label('date'),
             func.count(CellAnnotation.id).label('count')
-        ).group_by(func.date(CellAnnotation.created_at)).order_by('date').all()
+        ).group_by(date_bucket(CellAnnotation.created_at)).order_by('date').all()
         
+        # date_bucket restituisce già la stringa 'YYYY-MM-DD' su SQLite e PostgreSQL
         return jsonify({
-            'dates': [item.date.isoformat() for item in data],
+            'dates': [item.date for item in data],
             'values': [item.count for item in data]
         })
     
@@ -592,7 +608,7 @@ def api_global_stats():
     """API per statistiche globali del sistema"""
     total_annotations = CellAnnotation.query.count()
     total_users = User.query.count()
-    total_cells = TextCell.query.count()
+    total_cells = TextCell.query.filter(TextCell.is_current).count()
     total_labels = Label.query.count()
     
     return jsonify({
@@ -605,6 +621,247 @@ def api_global_stats():
         }
     })
 
+@statistics_bp.route('/api/agreement/<int:file_id>')
+@login_required
+def api_agreement(file_id):
+    """
+    API per l'accordo tra tutti gli annotatori di un file o di un quesito
+
+    Parametri: question (colonna, opzionale). Restituisce il kappa di Fleiss
+    (medio e per etichetta) e l'alpha di Krippendorff con distanza MASI.
+    """
+    ExcelFile.query.get_or_404(file_id)
+    question = request.args.get('question') or None
+    summary = agreement_summary(load_annotation_matrix(file_id=file_id, question=question))
+    summary['label_fleiss_kappa'] = _named_label_scores(summary['label_fleiss_kappa'])
+
+    return jsonify({
+        'success': True,
+        'file_id': file_id,
+        'question': question,
+        'agreement': summary
+    })
+
+@statistics_bp.route('/agreement/<int:file_id>')
+@login_required
+def agreement_matrix(file_id):
+    """Matrice di accordo tra tutte le coppie di annotatori di un file o di un quesito"""
+    file_obj = ExcelFile.query.get_or_404(file_id)
+    question = request.args.get('question') or None
+    questions = [
+        row[0] for row in db.session.query(TextCell.column_name).filter(
+            TextCell.excel_file_id == file_id,
+            TextCell.column_name.isnot(None),
+            TextCell.is_current
+        ).distinct().order_by(TextCell.column_name)
+    ]
+
+    return render_template('statistics/agreement_matrix.html',
+                         file=file_obj,
+                         question=question,
+                         questions=questions)
+
+@statistics_bp.route('/api/agreement/<int:file_id>/matrix')
+@login_required
+def api_agreement_matrix(file_id):
+    """
+    API con la matrice N×N di accordo tra annotatori, pronta per una heatmap
+
+    Parametri: question (colonna, opzionale). Per ogni metrica (overlap =
+    celle in comune, exact_matches, percent = accordo esatto %, kappa = media
+    dei kappa di Cohen per etichetta) z[i][j] è il valore della coppia
+    (y[i], x[j]); null se non definito.
+    """
+    ExcelFile.query.get_or_404(file_id)
+    question = request.args.get('question') or None
+    result = pairwise_matrix(
+        load_annotation_matrix(file_id=file_id, question=question),
+        workers=current_app.config.get('AGREEMENT_PROCESS_WORKERS', 1),
+        min_parallel_annotations=current_app.config.get('AGREEMENT_PARALLEL_MIN_ANNOTATIONS', 0)
+    )
+    usernames = dict(db.session.query(User.id, User.username).filter(User.id.in_(result['user_ids'])).all())
+    names = [usernames.get(user_id, f'#{user_id}') for user_id in result['user_ids']]
+
+    return jsonify({
+        'success': True,
+        'file_id': file_id,
+        'question': question,
+        'annotators': [{'id': user_id, 'username': name} for user_id, name in zip(result['user_ids'], names)],
+        'x': names,
+        'y': names,
+        'metrics': {
+            metric: _heatmap_values(result[metric])
+            for metric in ('overlap', 'exact_matches', 'percent', 'kappa')
+        }
+    })
+
+def _heatmap_values(values):
+    """Matrice numpy -> liste annidate per JSON (NaN -> None)"""
+    if values.dtype.kind in 'iu':
+        return values.tolist()
+    return [[None if value != value else round(value, 4) for value in row] for row in values.tolist()]
+
+@statistics_bp.route('/cooccurrence')
+@login_required
+def cooccurrence():
+    """Co-occorrenza delle etichette in un quesito, un file, un progetto o in tutti i file"""
+    scope = _cooccurrence_scope()
+    cooc = _scope_cooccurrence(scope)
+    labels = _cooccurrence_labels()
+    top_pairs = cooc.pairs(scope['measure'], min_count=scope['min_count'], limit=100)
+    for pair in top_pairs:
+        pair['first'] = labels.get(pair['first_label_id'], {'name': f"#{pair['first_label_id']}"})
+        pair['second'] = labels.get(pair['second_label_id'], {'name': f"#{pair['second_label_id']}"})
+
+    # Heatmap tra le etichette più frequenti
+    top = cooc.top_labels(30)
+    names = [labels.get(label_id, {}).get('name', f'#{label_id}') for label_id in cooc.label_ids[top].tolist()]
+    heatmap = {'x': names, 'y': names, 'z': _heatmap_values(cooc.dense(top, scope['measure']))}
+
+    questions = []
+    if scope['file_id'] is not None:
+        questions = [
+            row[0] for row in db.session.query(TextCell.column_name).filter(
+                TextCell.excel_file_id == scope['file_id'],
+                TextCell.column_name.isnot(None),
+                TextCell.is_current
+            ).distinct().order_by(TextCell.column_name)
+        ]
+
+    return render_template('statistics/cooccurrence.html',
+                         scope=scope,
+                         export_args=_cooccurrence_args(scope),
+                         files=ExcelFile.query.order_by(ExcelFile.original_filename).all(),
+                         projects=_accessible_projects().order_by(Project.name).all(),
+                         questions=questions,
+                         units=UNITS,
+                         measures=MEASURES,
+                         n_units=cooc.n_units,
+                         n_labels=len(cooc.label_ids),
+                         n_pairs=int((cooc.counts >= scope['min_count']).sum()),
+                         top_pairs=top_pairs,
+                         heatmap=heatmap)
+
+@statistics_bp.route('/api/cooccurrence')
+@login_required
+def api_cooccurrence():
+    """
+    API con le coppie di etichette che co-occorrono in un ambito
+
+    Parametri: file_id, question, project_id (ambito; nessuno = tutti i file),
+    unit ('cell' o 'annotator'), measure (ordinamento: count, jaccard, lift,
+    pmi), min_count, limit (default 1000, 0 = tutte le coppie).
+    """
+    scope = _cooccurrence_scope()
+    limit = request.args.get('limit', 1000, type=int)
+    cooc = _scope_cooccurrence(scope)
+    labels = _cooccurrence_labels()
+
+    return jsonify({
+        'success': True,
+        'scope': scope,
+        'n_units': cooc.n_units,
+        'labels': [
+            {'id': label_id, 'count': count, **labels.get(label_id, {'name': f'#{label_id}'})}
+            for label_id, count in zip(cooc.label_ids.tolist(), cooc.label_counts.tolist())
+        ],
+        'pairs': cooc.pairs(scope['measure'], min_count=scope['min_count'], limit=limit or None)
+    })
+
+@statistics_bp.route('/export/cooccurrence')
+@login_required
+def export_cooccurrence():
+    """Esporta in CSV tutte le coppie di etichette che co-occorrono nell'ambito"""
+    import csv
+    import io
+    from flask import Response
+
+    scope = _cooccurrence_scope()
+    cooc = _scope_cooccurrence(scope)
+    labels = _cooccurrence_labels()
+    columns = cooc.pair_columns(scope['measure'], min_count=scope['min_count'])
+
+    def generate():
+        output = io.StringIO()
+        writer = csv.writer(output)
+        writer.writerow(['Etichetta 1', 'Categoria 1', 'Etichetta 2', 'Categoria 2', 'Unità Etichetta 1',
+                         'Unità Etichetta 2', 'Unità con Entrambe', 'Jaccard', 'Lift', 'PMI'])
+        # Blocchi di righe: le coppie possono essere milioni
+        for start in range(0, len(columns['count']), 10000):
+            block = {name: values[start:start + 10000].tolist() for name, values in columns.items()}
+            for first_id, second_id, first_count, second_count, count, jaccard, lift, pmi in zip(
+                    block['first_label_id'], block['second_label_id'], block['first_count'],
+                    block['second_count'], block['count'], block['jaccard'], block['lift'], block['pmi']):
+                first = labels.get(first_id, {})
+                second = labels.get(second_id, {})
+                writer.writerow([first.get('name', f'#{first_id}'), first.get('category') or '',
+                                 second.get('name', f'#{second_id}'), second.get('category') or '',
+                                 first_count, second_count, count, jaccard, lift, pmi])
+            yield output.getvalue()
+            output.seek(0)
+            output.truncate(0)
+        yield output.getvalue()
+
+    if scope['file_id'] is not None:
+        name = f"file{scope['file_id']}" + (f"_{scope['question']}" if scope['question'] else '')
+    elif scope['project_id'] is not None:
+        name = f"progetto{scope['project_id']}"
+    else:
+        name = 'tutti'
+    safe_name = "".join(c for c in name if c.isalnum() or c in ('-', '_')).rstrip()
+    filename = f"cooccorrenze_{safe_name}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+
+    return Response(generate(), mimetype='text/csv',
+                    headers={'Content-Disposition': f'attachment; filename="{filename}"'})
+
+def _cooccurrence_scope():
+    """Ambito, unità e ordinamento delle co-occorrenze dai parametri della richiesta"""
+    file_id = request.args.get('file_id', type=int)
+    project_id = request.args.get('project_id', type=int) if file_id is None else None
+    # Oggetti dell'ambito e permessi letti dal principale (la copia può essere indietro)
+    with primary_reads():
+        if file_id is not None:
+            ExcelFile.query.get_or_404(file_id)
+        if project_id is not None:
+            project = Project.query.get_or_404(project_id)
+            if not project.can_access(current_user):
+                abort(403)
+    measure = request.args.get('measure', 'count')
+    unit = request.args.get('unit', 'cell')
+    return {
+        'file_id': file_id,
+        'question': (request.args.get('question') or None) if file_id is not None else None,
+        'project_id': project_id,
+        'unit': unit if unit in UNITS else 'cell',
+        'measure': measure if measure in MEASURES else 'count',
+        'min_count': max(1, request.args.get('min_count', 1, type=int)),
+    }
+
+def _accessible_projects():
+    """Progetti che l'utente corrente può scegliere come ambito"""
+    if current_user.is_admin:
+        return Project.query
+    return Project.query.filter(Project.accessible_filter(current_user))
+
+def _scope_cooccurrence(scope):
+    """Co-occorrenze (dalla cache delle statistiche) dell'ambito della richiesta"""
+    return label_cooccurrence(file_id=scope['file_id'], question=scope['question'],
+                              project_id=scope['project_id'], unit=scope['unit'])
+
+def _cooccurrence_args(scope):
+    """Parametri di query dell'ambito (senza i valori vuoti), per i link di esportazione"""
+    return {key: value for key, value in scope.items() if value is not None}
+
+def _cooccurrence_labels():
+    """ID etichetta -> nome, colore effettivo e categoria (una query per tutte le etichette)"""
+    rows = db.session.query(
+        Label.id,
+        Label.name,
+        func.coalesce(Category.color, Label.color).label('color'),
+        func.coalesce(Category.name, Label.category).label('category')
+    ).outerjoin(Category, Label.category_id == Category.id).all()
+    return {row.id: {'name': row.name, 'color': row.color, 'category': row.category} for row in rows}
+
 @statistics_bp.route('/api/question_chart_data/<int:file_id>/<chart_type>')
 @login_required
 def question_chart_data(file_id, chart_type):
@@ -658,9 +915,9 @@ def _get_labels_histogram_data(file_id, question, category_filter=None, label_na
     ).join(CellAnnotation)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
-     .group_by(Label.id)
+     .group_by(Label.id, Category.id)
     
     # Applica filtri
     if category_filter:
@@ -705,7 +962,7 @@ def _get_annotators_histogram_data(file_id, question, category_filter=None, labe
                           .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
                           .join(Label, Label.id == CellAnnotation.label_id)\
                           .outerjoin(Category, Label.category_id == Category.id)\
-                          .filter(TextCell.excel_file_id == file_id)\
+                          .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
                           .filter(TextCell.column_name == question)
     
     # Applica filtri etichette
@@ -720,7 +977,7 @@ def _get_annotators_histogram_data(file_id, question, category_filter=None, labe
         valid_labels_query = db.session.query(Label.id)\
                                       .join(CellAnnotation)\
                                       .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-                                      .filter(TextCell.excel_file_id == file_id)\
+                                      .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
                                       .filter(TextCell.column_name == question)\
                                       .group_by(Label.id)
         
@@ -765,7 +1022,7 @@ def _get_categories_distribution_data(file_id, question):
     ).join(Label, Label.category_id == Category.id)\
      .join(CellAnnotation, CellAnnotation.label_id == Label.id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .group_by(Category.id)\
      .order_by(desc('annotation_count'))\
@@ -777,7 +1034,7 @@ def _get_categories_distribution_data(file_id, question):
         func.count(distinct(Label.id)).label('unique_labels')
     ).join(Label, Label.id == CellAnnotation.label_id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .filter(Label.category_id.is_(None))\
      .first()
@@ -803,11 +1060,11 @@ def _get_coverage_analysis_data(file_id, question):
     total_cells = TextCell.query.filter_by(
         excel_file_id=file_id, 
         column_name=question
-    ).count()
+    ).filter(TextCell.is_current).count()
     
     # Celle annotate
     annotated_cells = db.session.query(TextCell.id)\
-        .filter(TextCell.excel_file_id == file_id)\
+        .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
         .filter(TextCell.column_name == question)\
         .join(CellAnnotation)\
         .distinct().count()
@@ -821,7 +1078,7 @@ def _get_coverage_analysis_data(file_id, question):
         func.count(TextCell.id).label('cell_count')
     ).select_from(TextCell)\
      .outerjoin(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .group_by(TextCell.id)\
      .subquery()
@@ -862,9 +1119,9 @@ def file_detail(file_id):
     file_obj = ExcelFile.query.get_or_404(file_id)
     
     # Statistiche generali del file
-    total_cells = TextCell.query.filter_by(excel_file_id=file_id).count()
+    total_cells = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current).count()
     annotated_cells = db.session.query(TextCell.id)\
-        .filter(TextCell.excel_file_id == file_id)\
+        .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
         .join(CellAnnotation)\
         .distinct().count()
     
@@ -875,7 +1132,7 @@ def file_detail(file_id):
         func.count(CellAnnotation.id).label('annotation_count')
     ).join(CellAnnotation, User.id == CellAnnotation.user_id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .group_by(User.id)\
      .order_by(desc('annotation_count'))\
      .all()
@@ -889,8 +1146,8 @@ def file_detail(file_id):
     ).join(CellAnnotation)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
-     .group_by(Label.id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
+     .group_by(Label.id, Category.id)\
      .order_by(desc('usage_count'))\
      .all()
     
@@ -901,7 +1158,7 @@ def file_detail(file_id):
         func.count(CellAnnotation.id).label('total_annotations'),
         func.count(distinct(CellAnnotation.user_id)).label('annotator_count')
     ).outerjoin(CellAnnotation, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .group_by(TextCell.column_name)\
      .order_by(TextCell.column_name)\
      .all()
@@ -924,7 +1181,7 @@ def question_detail(file_id, question):
     question_exists = TextCell.query.filter_by(
         excel_file_id=file_id, 
         column_name=question
-    ).first()
+    ).filter(TextCell.is_current).first()
     
     if not question_exists:
         flash('Quesito non trovato.', 'error')
@@ -942,7 +1199,7 @@ def question_detail(file_id, question):
     cells = TextCell.query.filter_by(
         excel_file_id=file_id, 
         column_name=question
-    ).all()
+    ).filter(TextCell.is_current).all()
     
     # Statistiche annotatori per questo quesito
     annotator_stats = db.session.query(
@@ -952,7 +1209,7 @@ def question_detail(file_id, question):
         func.count(distinct(CellAnnotation.text_cell_id)).label('cell_count')
     ).join(CellAnnotation, User.id == CellAnnotation.user_id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .group_by(User.id)\
      .order_by(desc('annotation_count'))\
@@ -968,9 +1225,9 @@ def question_detail(file_id, question):
     ).join(CellAnnotation)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
-     .group_by(Label.id)
+     .group_by(Label.id, Category.id)
     
     # Applica filtri se specificati
     if category_filter:
@@ -1009,7 +1266,7 @@ def question_detail(file_id, question):
         .join(Label, Label.category_id == Category.id)\
         .join(CellAnnotation, CellAnnotation.label_id == Label.id)\
         .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-        .filter(TextCell.excel_file_id == file_id)\
+        .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
         .filter(TextCell.column_name == question)\
         .distinct()\
         .order_by(Category.name)\
@@ -1022,7 +1279,7 @@ def question_detail(file_id, question):
     ).select_from(Label)\
      .join(CellAnnotation)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .group_by(Label.id)\
      .subquery()
@@ -1053,7 +1310,7 @@ def question_detail(file_id, question):
      .join(Label, Label.id == CellAnnotation.label_id)\
      .join(User, User.id == CellAnnotation.user_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .order_by(TextCell.id, Label.name)\
      .all()
@@ -1081,7 +1338,7 @@ def question_detail(file_id, question):
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
      .join(User, User.id == CellAnnotation.user_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .order_by(Label.name, TextCell.row_index)\
      .all()
@@ -1123,7 +1380,7 @@ def question_compare(file_id, question):
     annotators = db.session.query(User)\
         .join(CellAnnotation, User.id == CellAnnotation.user_id)\
         .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-        .filter(TextCell.excel_file_id == file_id)\
+        .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
         .filter(TextCell.column_name == question)\
         .distinct()\
         .all()
@@ -1162,7 +1419,7 @@ def calculate_question_comparison(file_id, question, user1_id, user2_id):
         Label.color.label('label_color')
     ).join(Label, Label.id == CellAnnotation.label_id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .filter(CellAnnotation.user_id == user1_id)\
      .all()
@@ -1177,7 +1434,7 @@ def calculate_question_comparison(file_id, question, user1_id, user2_id):
         Label.color.label('label_color')
     ).join(Label, Label.id == CellAnnotation.label_id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .filter(CellAnnotation.user_id == user2_id)\
      .all()
@@ -1241,7 +1498,7 @@ def export_question_report(file_id, question, format):
     question_exists = TextCell.query.filter_by(
         excel_file_id=file_id, 
         column_name=question
-    ).first()
+    ).filter(TextCell.is_current).first()
     
     if not question_exists:
         flash('Quesito non trovato.', 'error')
@@ -1269,7 +1526,7 @@ def _collect_question_report_data(file_id, question, file_obj):
     cells = TextCell.query.filter_by(
         excel_file_id=file_id, 
         column_name=question
-    ).all()
+    ).filter(TextCell.is_current).all()
     
     # Statistiche annotatori
     annotator_stats = db.session.query(
@@ -1279,7 +1536,7 @@ def _collect_question_report_data(file_id, question, file_obj):
         func.count(distinct(CellAnnotation.text_cell_id)).label('cell_count')
     ).join(CellAnnotation, User.id == CellAnnotation.user_id)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .group_by(User.id)\
      .order_by(desc('annotation_count'))\
@@ -1294,9 +1551,9 @@ def _collect_question_report_data(file_id, question, file_obj):
     ).join(CellAnnotation)\
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
-     .group_by(Label.id)\
+     .group_by(Label.id, Category.id)\
      .order_by(desc('usage_count'))\
      .all()
     
@@ -1318,7 +1575,7 @@ def _collect_question_report_data(file_id, question, file_obj):
      .join(TextCell, TextCell.id == CellAnnotation.text_cell_id)\
      .join(User, User.id == CellAnnotation.user_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .order_by(Label.name, TextCell.row_index)\
      .all()
@@ -1344,7 +1601,7 @@ def _collect_question_report_data(file_id, question, file_obj):
      .join(Label, Label.id == CellAnnotation.label_id)\
      .join(User, User.id == CellAnnotation.user_id)\
      .outerjoin(Category, Label.category_id == Category.id)\
-     .filter(TextCell.excel_file_id == file_id)\
+     .filter(TextCell.excel_file_id == file_id, TextCell.is_current)\
      .filter(TextCell.column_name == question)\
      .order_by(TextCell.id, Label.name)\
      .all()
@@ -13,6 +13,7 @@ import bleach
 
 from models import db, TextDocument, TextAnnotation, Label, Category
 from forms import TextDocumentForm
+from services.bulk_delete import delete_text_document
 
 text_documents_bp = Blueprint('text_documents', __name__, url_prefix='/text-documents')
 
@@ -55,6 +56,56 @@ def read_text_file(file_path, file_format):
         current_app.logger.error(f"Errore nella lettura del file {file_path}: {str(e)}")
         return None
 
+def create_text_document(file_path, filename, original_filename, document_type, user_id):
+    """
+    Legge il file salvato e crea il TextDocument corrispondente
+    
+    Args:
+        file_path: Percorso del file salvato
+        filename: Nome del file sul server
+        original_filename: Nome originale (già reso sicuro)
+        document_type: Tipo di documento
+        user_id: Utente che ha caricato il file
+    
+    Returns:
+        Il documento creato e committato
+    
+    Raises:
+        ValueError: Se il file non è leggibile o il contenuto è troppo lungo
+    """
+    file_format = get_file_format(original_filename)
+    
+    # Lettura contenuto (con logging per debug)
+    current_app.logger.info(f"Inizio lettura file: {original_filename} ({file_format})")
+    content = read_text_file(file_path, file_format)
+    
+    if content is None:
+        raise ValueError('Errore nella lettura del file')
+    
+    current_app.logger.info(f"Contenuto letto: {len(content)} caratteri")
+    
+    # Verifica lunghezza contenuto
+    if len(content) > MAX_CONTENT_LENGTH:
+        raise ValueError(f'Contenuto troppo lungo. Massimo: {MAX_CONTENT_LENGTH//1000}KB di testo')
+    
+    # Salvataggio nel database
+    current_app.logger.info(f"Salvataggio nel database: {len(content)} caratteri")
+    new_document = TextDocument(
+        filename=filename,  # Nome file sul server
+        original_name=original_filename,  # Nome originale
+        content=content,
+        document_type=document_type,
+        file_format=file_format,
+        user_id=user_id
+    )
+    
+    # Aggiorna statistiche
+    new_document.update_stats()
+    
+    db.session.add(new_document)
+    db.session.commit()
+    return new_document
+
 @text_documents_bp.route('/upload-ajax', methods=['POST'])
 @login_required
 def upload_ajax():
@@ -83,7 +134,6 @@ def upload_ajax():
         
         # Step 2: Salvataggio file
         original_filename = secure_filename(file.filename)
-        file_format = get_file_format(original_filename)
         filename = f"{uuid.uuid4().hex}_{original_filename}"
         
         uploads_dir = current_app.config.get('UPLOAD_FOLDER', 'uploads')
@@ -94,38 +144,13 @@ def upload_ajax():
         file.save(file_path)
         current_app.logger.info(f"File salvato: {filename}")
         
-        # Step 3: Lettura contenuto (con logging per debug)
-        current_app.logger.info(f"Inizio lettura file: {original_filename} ({file_format})")
-        content = read_text_file(file_path, file_format)
-        
-        if content is None:
-            os.remove(file_path)  # Cleanup
-            return jsonify({'error': 'Errore nella lettura del file'}), 400
-        
-        current_app.logger.info(f"Contenuto letto: {len(content)} caratteri")
-        
-        # Verifica lunghezza contenuto
-        if len(content) > MAX_CONTENT_LENGTH:
+        # Step 3: Lettura contenuto e salvataggio nel database
+        try:
+            new_document = create_text_document(file_path, filename, original_filename,
+                                                 document_type, current_user.id)
+        except ValueError as e:
             os.remove(file_path)  # Cleanup
-            return jsonify({'error': f'Contenuto troppo lungo. Massimo: {MAX_CONTENT_LENGTH//1000}KB di testo'}), 400
-        
-        # Step 4: Salvataggio nel database
-        current_app.logger.info(f"Salvataggio nel database: {len(content)} caratteri")
-        new_document = TextDocument(
-            filename=filename,  # Nome file sul server
-            original_name=original_filename,  # Nome originale
-            content=content,
-            document_type=document_type,
-            file_format=file_format,
-            user_id=current_user.id  # Corretto nome campo
-        )
-        
-        # Aggiorna statistiche
-        new_document.word_count = len(content.split()) if content else 0
-        new_document.character_count = len(content) if content else 0
-        
-        db.session.add(new_document)
-        db.session.commit()
+            return jsonify({'error': str(e)}), 400
         
         current_app.logger.info(f"Upload completato: {original_filename}")
         
@@ -417,14 +442,10 @@ def delete_document(document_id):
         # I file sono salvati nel filesystem ma non tracciamo il path nel DB
         # TODO: Implementare tracciamento path se necessario
         
-        # Elimina annotazioni associate
-        TextAnnotation.query.filter_by(document_id=document_id).delete()
-        
-        # Elimina documento
-        db.session.delete(document)
-        db.session.commit()
+        # Elimina annotazioni e documento con DELETE in blocco
+        counts = delete_text_document(document_id)
         
-        flash('Documento eliminato con successo', 'success')
+        flash(f'Documento eliminato con successo ({counts["text_annotations"]} annotazioni)', 'success')
         
     except Exception as e:
         db.session.rollback()
@@ -0,0 +1,201 @@
+"""
+API per i caricamenti a blocchi riprendibili (file oltre MAX_CONTENT_LENGTH)
+
+Flusso del client (vedi static/js/chunked_upload.js):
+    POST /uploads/init                      -> apre la sessione
+    PUT  /uploads/<id>/chunks/<n>           -> invia il blocco n con header X-Chunk-SHA256
+    GET  /uploads/<id>                      -> blocchi ricevuti e mancanti (per riprendere)
+    POST /uploads/<id>/finalize             -> avvia l'ingestione del file completo
+"""
+
+import json
+import os
+import uuid
+
+import pandas as pd
+from flask import Blueprint, jsonify, request, url_for, current_app
+from flask_login import login_required, current_user
+from sqlalchemy.exc import IntegrityError
+from werkzeug.utils import secure_filename
+
+from models import db, UploadSession
+from routes.excel import allowed_file, duplicate_payload, start_ingestion
+from routes.text_documents import allowed_file as allowed_text_file, create_text_document
+from services.chunked_uploads import (
+    cleanup_stale_sessions, complete_file, create_session, discard_session, restore_partial, write_chunk
+)
+from services.deduplication import find_duplicate_file
+
+uploads_bp = Blueprint('uploads', __name__)
+
+TARGETS = ('excel', 'text_document')
+
+
+def get_session_or_error(upload_id):
+    """
+    Restituisce la sessione dell'utente corrente
+
+    Returns:
+        Tupla (sessione, risposta di errore): uno dei due è None
+    """
+    upload = db.session.get(UploadSession, upload_id)
+    if upload is None:
+        return None, (jsonify({'success': False, 'error': 'Sessione di caricamento non trovata'}), 404)
+    if upload.user_id != current_user.id and not current_user.is_admin:
+        return None, (jsonify({'success': False, 'error': 'Accesso negato'}), 403)
+    return upload, None
+
+
+@uploads_bp.route('/init', methods=['POST'])
+@login_required
+def init_upload():
+    """Apre una sessione di caricamento a blocchi"""
+    data = request.get_json(silent=True) or {}
+    target = data.get('target', 'excel')
+    original_filename = secure_filename(data.get('filename') or '')
+
+    if target not in TARGETS:
+        return jsonify({'success': False, 'error': f'Destinazione non valida: {target}'}), 400
+    valid_extension = allowed_file(original_filename) if target == 'excel' else allowed_text_file(original_filename)
+    if not original_filename or not valid_extension:
+        return jsonify({'success': False, 'error': 'Formato file non supportato'}), 400
+
+    try:
+        total_size = int(data.get('size') or 0)
+        chunk_size = int(data['chunk_size']) if data.get('chunk_size') else None
+        # Le sessioni abbandonate non devono occupare spazio indefinitamente
+        cleanup_stale_sessions()
+        upload = create_session(current_user.id, original_filename, total_size, target,
+                                document_type=data.get('document_type'), chunk_size=chunk_size)
+        db.session.commit()
+    except (TypeError, ValueError) as e:
+        db.session.rollback()
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    return jsonify({'success': True, **upload.to_dict()}), 201
+
+
+@uploads_bp.route('/<upload_id>/chunks/<int:index>', methods=['PUT'])
+@login_required
+def upload_chunk(upload_id, index):
+    """Riceve un blocco del file e ne verifica il checksum"""
+    upload, error = get_session_or_error(upload_id)
+    if error:
+        return error
+
+    try:
+        chunk = write_chunk(upload, index, request.stream, request.headers.get('X-Chunk-SHA256'))
+        db.session.commit()
+    except ValueError as e:
+        # Il blocco rifiutato risulta mancante e va reinviato
+        db.session.commit()
+        return jsonify({'success': False, 'error': str(e), 'chunk_index': index}), 400
+    except IntegrityError:
+        # Lo stesso blocco inviato in parallelo (es. nuovo tentativo dopo un timeout):
+        # l'altra richiesta ha già scritto gli stessi byte e registrato il blocco
+        db.session.rollback()
+        chunk = upload.chunks.filter_by(chunk_index=index).first()
+        if chunk is None:
+            return jsonify({'success': False, 'error': f'Blocco {index} non registrato', 'chunk_index': index}), 409
+
+    return jsonify({
+        'success': True,
+        'chunk_index': index,
+        'sha256': chunk.sha256,
+        'received': upload.chunks.count(),
+        'total_chunks': upload.total_chunks
+    })
+
+
+@uploads_bp.route('/<upload_id>', methods=['GET'])
+@login_required
+def upload_status(upload_id):
+    """Stato della sessione: blocchi ricevuti e mancanti"""
+    upload, error = get_session_or_error(upload_id)
+    if error:
+        return error
+    return jsonify({'success': True, **upload.to_dict()})
+
+
+@uploads_bp.route('/<upload_id>', methods=['DELETE'])
+@login_required
+def cancel_upload(upload_id):
+    """Annulla il caricamento ed elimina il file parziale"""
+    upload, error = get_session_or_error(upload_id)
+    if error:
+        return error
+    if upload.status == 'finalized':
+        return jsonify({'success': False, 'error': 'Il caricamento è già stato completato'}), 400
+    discard_session(upload)
+    db.session.commit()
+    return jsonify({'success': True})
+
+
+@uploads_bp.route('/<upload_id>/finalize', methods=['POST'])
+@login_required
+def finalize_upload(upload_id):
+    """Completa il caricamento e passa il file all'ingestione Excel o dei documenti di testo"""
+    upload, error = get_session_or_error(upload_id)
+    if error:
+        return error
+
+    # Finalizzazione ripetuta (es. risposta persa): restituisce lo stesso risultato
+    if upload.status == 'finalized':
+        return jsonify(json.loads(upload.result))
+
+    data = request.get_json(silent=True) or {}
+    if upload.target == 'excel':
+        timestamp = str(int(pd.Timestamp.now().timestamp()))
+        filename = f"{timestamp}_{upload.original_filename}"
+    else:
+        filename = f"{uuid.uuid4().hex}_{upload.original_filename}"
+    file_path = os.path.join(current_app.config['UPLOAD_FOLDER'], filename)
+
+    try:
+        sha256 = complete_file(upload, file_path)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e), **upload.to_dict()}), 409
+
+    try:
+        if upload.target == 'excel':
+            duplicate = find_duplicate_file(sha256)
+            if duplicate and not data.get('allow_duplicate'):
+                # Il file resta pronto: "carica comunque" ripete solo la finalizzazione
+                restore_partial(upload, file_path)
+                db.session.commit()
+                return jsonify({**duplicate_payload(duplicate), 'upload_id': upload.id}), 409
+
+            excel_file, job = start_ingestion(file_path, filename, upload.original_filename, sha256)
+            result = {
+                'success': True,
+                'job_id': job.id,
+                'file_id': excel_file.id,
+                'status_url': url_for('excel.job_status', job_id=job.id),
+                'redirect_url': url_for('excel.view_file', file_id=excel_file.id)
+            }
+            status_code = 202
+        else:
+            document = create_text_document(file_path, filename, upload.original_filename,
+                                            upload.document_type or 'other', current_user.id)
+            result = {
+                'success': True,
+                'document_id': document.id,
+                'redirect_url': url_for('text_documents.annotate', document_id=document.id)
+            }
+            status_code = 200
+    except Exception as e:
+        db.session.rollback()
+        if os.path.exists(file_path):
+            os.remove(file_path)
+        upload.status = 'failed'
+        upload.error_message = str(e)
+        db.session.commit()
+        current_app.logger.error(f"Errore nella finalizzazione del caricamento {upload_id}: {str(e)}")
+        return jsonify({'success': False, 'error': str(e)}), 400
+
+    upload.status = 'finalized'
+    upload.result = json.dumps(result)
+    # I checksum dei blocchi non servono più una volta ricomposto il file
+    upload.chunks.delete()
+    db.session.commit()
+    return jsonify(result), status_code
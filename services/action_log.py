@@ -0,0 +1,309 @@
+"""
+Conservazione e compattazione del registro delle azioni (AnnotationAction).
+
+Ogni aggiunta, rimozione o revisione di un'annotazione scrive una riga in
+annotation_action, che cresce senza limiti. compact_action_log mantiene
+"calde" solo le azioni degli ultimi ACTION_LOG_RETENTION_DAYS giorni; le più
+vecchie vengono:
+
+- riassunte in annotation_action_daily (conteggi per giorno, utente,
+  etichetta e tipo di azione);
+- spostate nell'archivio: la tabella annotation_action_archive (default)
+  oppure file JSONL compressi per mese (ACTION_ARCHIVE_BACKEND='jsonl',
+  <ACTION_ARCHIVE_DIR>/actions-AAAA-MM.jsonl.gz).
+
+action_history e daily_action_counts leggono da entrambi i livelli, quindi
+le viste non devono sapere dove si trova un'azione.
+"""
+
+import glob
+import gzip
+import json
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+from typing import Dict, Iterable, Iterator, List, Optional, Set
+
+from flask import current_app, has_app_context
+from sqlalchemy import func, select, union_all
+
+from models import db, AnnotationAction, AnnotationActionArchive, AnnotationActionDaily
+from utils.sql_compat import date_bucket
+
+DEFAULT_RETENTION_DAYS = 90
+DEFAULT_BATCH_SIZE = 5000
+ARCHIVE_BACKENDS = ('table', 'jsonl')
+
+# Colonne copiate nell'archivio (id diventa action_id)
+ACTION_COLUMNS = (
+    'text_cell_id', 'label_id', 'action_type', 'performed_by', 'target_user_id',
+    'annotation_id', 'notes', 'timestamp', 'was_ai_generated', 'ai_confidence',
+    'ai_model', 'ai_provider',
+)
+
+ActionRecord = namedtuple('ActionRecord', ('action_id',) + ACTION_COLUMNS)
+DailyActionCount = namedtuple('DailyActionCount', ['day', 'performed_by', 'label_id', 'action_type', 'count'])
+
+
+def _config(name: str, default):
+    return current_app.config.get(name, default) if has_app_context() else default
+
+
+def archive_backend() -> str:
+    """Dove finiscono le azioni compattate: 'table' o 'jsonl'"""
+    backend = _config('ACTION_ARCHIVE_BACKEND', 'table')
+    if backend not in ARCHIVE_BACKENDS:
+        raise ValueError(f"Archivio delle azioni non supportato: {backend}")
+    return backend
+
+
+def archive_dir() -> str:
+    """Cartella dei segmenti JSONL"""
+    return _config('ACTION_ARCHIVE_DIR', os.path.join('instance', 'action_archive'))
+
+
+def retention_cutoff(retention_days: Optional[int] = None, now: Optional[datetime] = None) -> datetime:
+    """Inizio (mezzanotte UTC) della finestra recente: le azioni precedenti vengono compattate"""
+    if retention_days is None:
+        retention_days = _config('ACTION_LOG_RETENTION_DAYS', DEFAULT_RETENTION_DAYS)
+    now = now or datetime.utcnow()
+    return datetime.combine((now - timedelta(days=retention_days)).date(), datetime.min.time())
+
+
+def compact_action_log(retention_days: Optional[int] = None, backend: Optional[str] = None,
+                       batch_size: int = DEFAULT_BATCH_SIZE, now: Optional[datetime] = None) -> Dict[str, int]:
+    """
+    Riassume e archivia le azioni più vecchie della finestra recente
+
+    Lavora a blocchi di batch_size azioni, con un commit per blocco: un
+    blocco viene riassunto, copiato nell'archivio e rimosso da
+    annotation_action nella stessa transazione (con l'archivio JSONL il file
+    viene scritto prima del commit; se il commit fallisce le righe restano
+    nella tabella e alla prossima esecuzione vengono riscritte, e
+    iter_segment_actions scarta i duplicati per action_id).
+
+    Args:
+        retention_days: Giorni di azioni da lasciare in annotation_action
+        backend: 'table' o 'jsonl' (default ACTION_ARCHIVE_BACKEND)
+        batch_size: Azioni per transazione
+        now: Istante di riferimento (default adesso)
+
+    Returns:
+        Dizionario con 'archived' (azioni spostate) e 'summaries' (righe
+        giornaliere create o aggiornate)
+    """
+    backend = backend or archive_backend()
+    if backend not in ARCHIVE_BACKENDS:
+        raise ValueError(f"Archivio delle azioni non supportato: {backend}")
+    cutoff = retention_cutoff(retention_days, now)
+    actions = AnnotationAction.__table__
+    columns = [actions.c.id] + [actions.c[name] for name in ACTION_COLUMNS]
+
+    archived = summaries = 0
+    while True:
+        rows = db.session.execute(
+            select(*columns).where(actions.c.timestamp < cutoff)
+            .order_by(actions.c.id).limit(batch_size)
+        ).all()
+        if not rows:
+            break
+        records = [ActionRecord(*row) for row in rows]
+        try:
+            summaries += _merge_daily_summaries(records)
+            if backend == 'table':
+                _archive_to_table(records)
+            else:
+                _archive_to_segments(records, archive_dir())
+            db.session.execute(actions.delete().where(actions.c.id.in_([r.action_id for r in records])))
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        archived += len(records)
+    return {'archived': archived, 'summaries': summaries}
+
+
+def _merge_daily_summaries(records: List[ActionRecord]) -> int:
+    """Somma le azioni di un blocco ai riepiloghi giornalieri"""
+    totals = {}
+    for record in records:
+        key = (record.timestamp.date(), record.performed_by, record.label_id, record.action_type)
+        count, ai_count, first_at, last_at = totals.get(key, (0, 0, record.timestamp, record.timestamp))
+        totals[key] = (count + 1, ai_count + (1 if record.was_ai_generated else 0),
+                       min(first_at, record.timestamp), max(last_at, record.timestamp))
+
+    days = {key[0] for key in totals}
+    users = {key[1] for key in totals}
+    existing = {
+        (row.day, row.performed_by, row.label_id, row.action_type): row
+        for row in AnnotationActionDaily.query.filter(
+            AnnotationActionDaily.day.in_(days),
+            AnnotationActionDaily.performed_by.in_(users)
+        )
+    }
+    for key, (count, ai_count, first_at, last_at) in totals.items():
+        summary = existing.get(key)
+        if summary is None:
+            day, performed_by, label_id, action_type = key
+            db.session.add(AnnotationActionDaily(
+                day=day, performed_by=performed_by, label_id=label_id, action_type=action_type,
+                action_count=count, ai_generated_count=ai_count, first_at=first_at, last_at=last_at
+            ))
+        else:
+            summary.action_count += count
+            summary.ai_generated_count += ai_count
+            summary.first_at = min(summary.first_at or first_at, first_at)
+            summary.last_at = max(summary.last_at or last_at, last_at)
+    db.session.flush()
+    return len(totals)
+
+
+def _archive_to_table(records: List[ActionRecord]):
+    db.session.execute(AnnotationActionArchive.__table__.insert(), [record._asdict() for record in records])
+
+
+def _segment_path(directory: str, month: str) -> str:
+    return os.path.join(directory, f'actions-{month}.jsonl.gz')
+
+
+def _archive_to_segments(records: List[ActionRecord], directory: str):
+    """Aggiunge le azioni ai segmenti JSONL compressi del loro mese"""
+    os.makedirs(directory, exist_ok=True)
+    by_month = {}
+    for record in records:
+        by_month.setdefault(record.timestamp.strftime('%Y-%m'), []).append(record)
+    for month, month_records in by_month.items():
+        # Ogni append aggiunge un membro gzip: il file resta leggibile come un unico flusso
+        with gzip.open(_segment_path(directory, month), 'at', encoding='utf-8') as segment:
+            for record in month_records:
+                data = record._asdict()
+                data['timestamp'] = record.timestamp.isoformat()
+                segment.write(json.dumps(data, ensure_ascii=False) + '\n')
+
+
+def iter_segment_actions(directory: Optional[str] = None, since: Optional[datetime] = None,
+                         until: Optional[datetime] = None) -> Iterator[ActionRecord]:
+    """Azioni archiviate nei segmenti JSONL (solo i mesi nell'intervallo richiesto)"""
+    directory = directory or archive_dir()
+    seen = set()
+    for path in sorted(glob.glob(_segment_path(directory, '*'))):
+        month = os.path.basename(path)[len('actions-'):-len('.jsonl.gz')]
+        if since is not None and month < since.strftime('%Y-%m'):
+            continue
+        if until is not None and month > until.strftime('%Y-%m'):
+            continue
+        with gzip.open(path, 'rt', encoding='utf-8') as segment:
+            for line in segment:
+                data = json.loads(line)
+                if data['action_id'] in seen:
+                    continue
+                seen.add(data['action_id'])
+                data['timestamp'] = datetime.fromisoformat(data['timestamp'])
+                yield ActionRecord(**data)
+
+
+def segment_cell_ids(cell_ids: Iterable[int], directory: Optional[str] = None) -> Set[int]:
+    """
+    Celle (tra quelle indicate) con azioni nei segmenti JSONL dell'archivio
+
+    I segmenti vengono letti anche se ACTION_ARCHIVE_BACKEND è tornato a
+    'table': le azioni già scritte nei file restano lo storico delle celle.
+    """
+    wanted = set(cell_ids)
+    found = set()
+    if not wanted:
+        return found
+    for record in iter_segment_actions(directory):
+        if record.text_cell_id in wanted:
+            found.add(record.text_cell_id)
+            if len(found) == len(wanted):
+                break
+    return found
+
+
+def _filters(columns, performed_by, text_cell_id, label_id, since, until):
+    conditions = []
+    if performed_by is not None:
+        conditions.append(columns.performed_by == performed_by)
+    if text_cell_id is not None:
+        conditions.append(columns.text_cell_id == text_cell_id)
+    if label_id is not None:
+        conditions.append(columns.label_id == label_id)
+    if since is not None:
+        conditions.append(columns.timestamp >= since)
+    if until is not None:
+        conditions.append(columns.timestamp < until)
+    return conditions
+
+
+def action_history(performed_by: Optional[int] = None, text_cell_id: Optional[int] = None,
+                   label_id: Optional[int] = None, since: Optional[datetime] = None,
+                   until: Optional[datetime] = None, limit: Optional[int] = None) -> List[ActionRecord]:
+    """
+    Azioni filtrate, dalla più recente, lette dalla finestra recente e dall'archivio
+
+    Returns:
+        Lista di ActionRecord (action_id è l'ID originale in annotation_action)
+    """
+    hot = AnnotationAction.__table__.c
+    cold = AnnotationActionArchive.__table__.c
+    # La tabella di archivio viene letta sempre (anche dopo il passaggio all'archivio JSONL)
+    history = union_all(
+        select(hot.id.label('action_id'), *[hot[name] for name in ACTION_COLUMNS])
+        .where(*_filters(hot, performed_by, text_cell_id, label_id, since, until)),
+        select(cold.action_id, *[cold[name] for name in ACTION_COLUMNS])
+        .where(*_filters(cold, performed_by, text_cell_id, label_id, since, until))
+    ).subquery()
+    statement = select(history).order_by(history.c.timestamp.desc(), history.c.action_id.desc())
+    if limit is not None:
+        statement = statement.limit(limit)
+    records = [ActionRecord(*row) for row in db.session.execute(statement)]
+    if archive_backend() != 'jsonl':
+        return records
+
+    segment_since = since
+    if limit is not None and len(records) >= limit:
+        # Servono solo le azioni archiviate più recenti dell'ultima già trovata
+        segment_since = max(since or records[-1].timestamp, records[-1].timestamp)
+    for record in iter_segment_actions(since=segment_since, until=until):
+        if ((performed_by is None or record.performed_by == performed_by)
+                and (text_cell_id is None or record.text_cell_id == text_cell_id)
+                and (label_id is None or record.label_id == label_id)
+                and (segment_since is None or record.timestamp >= segment_since)
+                and (until is None or record.timestamp < until)):
+            records.append(record)
+    records.sort(key=lambda record: (record.timestamp, record.action_id), reverse=True)
+    return records[:limit] if limit is not None else records
+
+def daily_action_counts(performed_by: Optional[int] = None, label_id: Optional[int] = None,
+                        since: Optional[date] = None) -> List[DailyActionCount]:
+    """
+    Numero di azioni per giorno, utente, etichetta e tipo di azione su tutto
+    lo storico (riepiloghi delle azioni compattate più finestra recente)
+    """
+    summaries = AnnotationActionDaily.__table__.c
+    summary_select = select(summaries.day, summaries.performed_by, summaries.label_id,
+                            summaries.action_type, summaries.action_count)
+    hot = AnnotationAction.__table__.c
+    day = date_bucket(hot.timestamp, 'day')
+    hot_select = select(day, hot.performed_by, hot.label_id, hot.action_type, func.count())\
+        .group_by(day, hot.performed_by, hot.label_id, hot.action_type)
+    if performed_by is not None:
+        summary_select = summary_select.where(summaries.performed_by == performed_by)
+        hot_select = hot_select.where(hot.performed_by == performed_by)
+    if label_id is not None:
+        summary_select = summary_select.where(summaries.label_id == label_id)
+        hot_select = hot_select.where(hot.label_id == label_id)
+    if since is not None:
+        summary_select = summary_select.where(summaries.day >= since)
+        hot_select = hot_select.where(hot.timestamp >= datetime.combine(since, datetime.min.time()))
+
+    totals = {}
+    for rows in (db.session.execute(summary_select), db.session.execute(hot_select)):
+        for row_day, user_id, row_label_id, action_type, count in rows:
+            if isinstance(row_day, str):
+                row_day = date.fromisoformat(row_day)
+            key = (row_day, user_id, row_label_id, action_type)
+            totals[key] = totals.get(key, 0) + count
+    return [DailyActionCount(*key, count) for key, count in sorted(totals.items())]
+
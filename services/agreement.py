@@ -0,0 +1,509 @@
+"""
+Accordo inter-annotatore sulle annotazioni delle celle.
+
+Tutte le triple (cella, utente, etichetta) di un ambito (file, quesito,
+insieme di utenti o di celle) vengono lette con una sola query e raccolte in
+AnnotationMatrix: per ogni annotatore una matrice sparsa binaria
+celle × etichette. Le misure sono calcolate con prodotti e somme su queste
+matrici, senza cicli Python sulle celle:
+
+- accordo esatto e Jaccard medio (insiemi di etichette) tra due annotatori;
+- kappa di Cohen per etichetta (presente/assente) tra due annotatori;
+- kappa di Fleiss per etichetta tra più annotatori (numero di annotatori
+  variabile per cella);
+- alpha di Krippendorff con distanza MASI tra gli insiemi di etichette.
+
+Una cella entra nel confronto solo se gli annotatori considerati le hanno
+assegnato almeno un'etichetta. Le annotazioni AI rifiutate e le celle
+rimosse da una nuova versione del file sono escluse. Le misure non definite
+(es. etichetta mai usata, o usata da tutti su tutte le celle) valgono None.
+"""
+
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from itertools import chain
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import or_
+
+from models import db, CellAnnotation, TextCell
+
+# Elementi (etichette × annotatori × annotatori) per blocco nel calcolo di tutte le coppie
+PAIRWISE_BLOCK_SIZE = 2_000_000
+
+_process_pool: Optional[ProcessPoolExecutor] = None
+_process_pool_workers = 0
+_process_pool_lock = threading.Lock()
+
+
+class AnnotationMatrix:
+    """
+    Triple (cella, utente, etichetta) di un ambito in forma matriciale
+
+    Gli ID di celle, utenti ed etichette sono ordinati e gli indici delle
+    matrici seguono quell'ordine (cell_ids[i] è la riga i).
+    """
+
+    def __init__(self, triples):
+        data = np.asarray(triples, dtype=np.int64).reshape(-1, 3)
+        # Ordinate per (cella, utente, etichetta), senza duplicati
+        data = data[np.lexsort((data[:, 2], data[:, 1], data[:, 0]))]
+        if len(data):
+            data = data[np.append(True, (np.diff(data, axis=0) != 0).any(axis=1))]
+        self.cell_ids, self.cells = np.unique(data[:, 0], return_inverse=True)
+        self.user_ids, self.users = np.unique(data[:, 1], return_inverse=True)
+        self.label_ids, self.labels = np.unique(data[:, 2], return_inverse=True)
+        self.cells, self.users, self.labels = (a.reshape(-1) for a in (self.cells, self.users, self.labels))
+
+        # Unità = coppia (cella, utente): l'insieme di etichette di un annotatore su una cella
+        new_unit = np.ones(len(data), dtype=bool)
+        new_unit[1:] = (np.diff(self.cells) != 0) | (np.diff(self.users) != 0)
+        self.unit_starts = np.flatnonzero(new_unit)
+        self.unit_cells = self.cells[self.unit_starts]
+        self.unit_users = self.users[self.unit_starts]
+        self._user_matrices = {}
+
+    @property
+    def shape(self):
+        return len(self.cell_ids), len(self.label_ids)
+
+    def user_index(self, user_id: int) -> Optional[int]:
+        position = np.searchsorted(self.user_ids, user_id)
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return int(position)
+        return None
+
+    def user_matrix(self, user_id: int) -> sparse.csr_matrix:
+        """Matrice binaria celle × etichette di un annotatore"""
+        if user_id not in self._user_matrices:
+            index = self.user_index(user_id)
+            mask = self.users == index if index is not None else np.zeros(len(self.users), dtype=bool)
+            self._user_matrices[user_id] = sparse.csr_matrix(
+                (np.ones(int(mask.sum()), dtype=np.int32), (self.cells[mask], self.labels[mask])),
+                shape=self.shape
+            )
+        return self._user_matrices[user_id]
+
+    def annotated_cells(self, user_id: int) -> np.ndarray:
+        """Maschera delle celle a cui l'annotatore ha assegnato almeno un'etichetta"""
+        annotated = np.zeros(len(self.cell_ids), dtype=bool)
+        index = self.user_index(user_id)
+        if index is not None:
+            annotated[self.unit_cells[self.unit_users == index]] = True
+        return annotated
+
+    def unit_values(self, units: np.ndarray):
+        """
+        Insiemi di etichette distinti delle unità indicate
+
+        Returns:
+            (valori, valore di ogni unità): i valori sono righe di indici di
+            etichetta ordinati, completate con -1
+        """
+        unit_ends = np.append(self.unit_starts[1:], len(self.labels))
+        sizes = unit_ends[units] - self.unit_starts[units]
+        positions = np.arange(sizes.sum()) - np.repeat(np.cumsum(sizes) - sizes, sizes)
+        entries = np.repeat(self.unit_starts[units], sizes) + positions
+        padded = np.full((len(units), int(sizes.max(initial=1))), -1, dtype=np.int64)
+        padded[np.repeat(np.arange(len(units)), sizes), positions] = self.labels[entries]
+        return _unique_rows(padded, len(self.label_ids))
+
+    def user_indexes(self, user_ids: Optional[Iterable[int]] = None) -> np.ndarray:
+        if user_ids is None:
+            return np.arange(len(self.user_ids))
+        indexes = [self.user_index(user_id) for user_id in user_ids]
+        return np.array(sorted({index for index in indexes if index is not None}), dtype=np.int64)
+
+
+def is_agreement_annotation(status: Optional[str], removed_at) -> bool:
+    """Criterio di load_annotation_matrix, per annotazioni già lette"""
+    return removed_at is None and status != 'rejected'
+
+
+def load_annotation_matrix(file_id: Optional[int] = None, question: Optional[str] = None,
+                           user_ids: Optional[Iterable[int]] = None,
+                           cell_ids: Optional[Iterable[int]] = None) -> AnnotationMatrix:
+    """
+    Legge con una sola query le annotazioni di un ambito
+
+    Args:
+        file_id: Limita alle celle di un file Excel
+        question: Limita alle celle di una colonna (quesito) del file
+        user_ids: Limita a questi annotatori
+        cell_ids: Limita a queste celle
+
+    Returns:
+        AnnotationMatrix dell'ambito
+    """
+    query = db.session.query(
+        CellAnnotation.text_cell_id, CellAnnotation.user_id, CellAnnotation.label_id
+    ).join(TextCell, TextCell.id == CellAnnotation.text_cell_id).filter(
+        TextCell.is_current,
+        or_(CellAnnotation.status.is_(None), CellAnnotation.status != 'rejected')
+    )
+    if file_id is not None:
+        query = query.filter(TextCell.excel_file_id == file_id)
+    if question is not None:
+        query = query.filter(TextCell.column_name == question)
+    if user_ids is not None:
+        query = query.filter(CellAnnotation.user_id.in_(list(user_ids)))
+    if cell_ids is not None:
+        query = query.filter(CellAnnotation.text_cell_id.in_(list(cell_ids)))
+    rows = query.all()
+    # np.asarray sulle Row di SQLAlchemy è lento (cerca l'interfaccia array in ogni riga)
+    return AnnotationMatrix(np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)))
+
+
+def cohen_kappa_per_label(first: sparse.spmatrix, second: sparse.spmatrix) -> np.ndarray:
+    """
+    Kappa di Cohen di ogni etichetta (presente/assente) tra due annotatori
+
+    Args:
+        first, second: Matrici binarie celle × etichette sulle stesse celle
+
+    Returns:
+        Array di kappa per colonna (NaN se l'etichetta è costante per entrambi)
+    """
+    n_cells = first.shape[0]
+    if n_cells == 0:
+        return np.full(first.shape[1], np.nan)
+    both = np.asarray(first.multiply(second).sum(axis=0), dtype=float).ravel()
+    p_first = np.asarray(first.sum(axis=0), dtype=float).ravel() / n_cells
+    p_second = np.asarray(second.sum(axis=0), dtype=float).ravel() / n_cells
+    # Disaccordi: celle con l'etichetta per uno solo dei due
+    observed = 1 - (p_first + p_second - 2 * both / n_cells)
+    expected = p_first * p_second + (1 - p_first) * (1 - p_second)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kappa = (observed - expected) / (1 - expected)
+    kappa[np.isclose(expected, 1)] = np.nan
+    return kappa
+
+
+def pairwise_agreement(matrix: AnnotationMatrix, user1_id: int, user2_id: int) -> Dict:
+    """
+    Accordo tra due annotatori sulle celle annotate da entrambi
+
+    Returns:
+        Dizionario con common_cells, exact_matches, agreement_percentage,
+        jaccard (medio), kappa (media dei kappa di Cohen per etichetta),
+        label_kappa ({label_id: kappa}) e krippendorff_alpha (MASI)
+    """
+    common = np.flatnonzero(matrix.annotated_cells(user1_id) & matrix.annotated_cells(user2_id))
+    if not len(common):
+        return {
+            'common_cells': 0,
+            'exact_matches': 0,
+            'agreement_percentage': 0.0,
+            'jaccard': None,
+            'kappa': None,
+            'label_kappa': {},
+            'krippendorff_alpha': None
+        }
+
+    first = matrix.user_matrix(user1_id)[common]
+    second = matrix.user_matrix(user2_id)[common]
+    intersection = np.asarray(first.multiply(second).sum(axis=1)).ravel()
+    first_sizes = np.asarray(first.sum(axis=1)).ravel()
+    second_sizes = np.asarray(second.sum(axis=1)).ravel()
+    union = first_sizes + second_sizes - intersection
+    exact_matches = int(np.count_nonzero((intersection == first_sizes) & (intersection == second_sizes)))
+
+    # Solo le etichette usate da almeno uno dei due nelle celle comuni
+    kappa = cohen_kappa_per_label(first, second)
+    used = np.flatnonzero(np.asarray((first + second).sum(axis=0)).ravel() > 0)
+    label_kappa = {int(matrix.label_ids[j]): _optional(kappa[j]) for j in used}
+    defined = kappa[used][~np.isnan(kappa[used])]
+
+    return {
+        'common_cells': len(common),
+        'exact_matches': exact_matches,
+        'agreement_percentage': exact_matches / len(common) * 100,
+        'jaccard': float(np.mean(intersection / union)),
+        'kappa': float(defined.mean()) if len(defined) else None,
+        'label_kappa': label_kappa,
+        'krippendorff_alpha': krippendorff_alpha_masi(matrix, [user1_id, user2_id])
+    }
+
+
+def fleiss_kappa_per_label(matrix: AnnotationMatrix,
+                           user_ids: Optional[Iterable[int]] = None) -> Dict[int, Optional[float]]:
+    """
+    Kappa di Fleiss di ogni etichetta (presente/assente) tra più annotatori
+
+    Ogni cella conta con il proprio numero di annotatori (almeno due);
+    l'accordo della cella i per l'etichetta j è
+    1 - 2·n_ij·(n_i - n_ij) / (n_i·(n_i - 1)).
+
+    Returns:
+        Dizionario label_id -> kappa (None se non definito)
+    """
+    users = matrix.user_indexes(user_ids)
+    selected = np.isin(matrix.users, users)
+    raters = np.bincount(matrix.unit_cells[np.isin(matrix.unit_users, users)], minlength=len(matrix.cell_ids))
+    items = raters >= 2
+    if not items.any():
+        return {}
+
+    entries = selected & items[matrix.cells]
+    counts = sparse.coo_matrix(
+        (np.ones(int(entries.sum())), (matrix.cells[entries], matrix.labels[entries])),
+        shape=matrix.shape
+    ).tocsr().tocoo()  # somma le triple della stessa cella ed etichetta
+    n_items = int(items.sum())
+    n_rows = raters[counts.row].astype(float)
+    disagreement = np.bincount(
+        counts.col,
+        weights=counts.data * (n_rows - counts.data) / (n_rows * (n_rows - 1)),
+        minlength=len(matrix.label_ids)
+    )
+    observed = 1 - 2 * disagreement / n_items
+    prevalence = np.bincount(counts.col, weights=counts.data, minlength=len(matrix.label_ids)) / raters[items].sum()
+    expected = prevalence ** 2 + (1 - prevalence) ** 2
+    with np.errstate(divide='ignore', invalid='ignore'):
+        kappa = (observed - expected) / (1 - expected)
+    kappa[np.isclose(expected, 1)] = np.nan
+
+    used = np.unique(counts.col)
+    return {int(matrix.label_ids[j]): _optional(kappa[j]) for j in used}
+
+
+def krippendorff_alpha_masi(matrix: AnnotationMatrix, user_ids: Optional[Iterable[int]] = None) -> Optional[float]:
+    """
+    Alpha di Krippendorff con distanza MASI tra insiemi di etichette
+
+    I valori sono gli insiemi di etichette delle unità (cella, annotatore);
+    le celle con un solo annotatore non sono confrontabili. Le coincidenze
+    sono calcolate sui valori distinti: U (celle × valori) pesata per
+    1/(m_i - 1) dà la matrice delle coincidenze U'·W·U, e la similarità
+    1 - δ (Jaccard × monotonia) è diversa da zero solo per gli insiemi che
+    si intersecano (prodotto sparso V·V').
+
+    Returns:
+        Alpha, oppure None se non calcolabile (nessuna cella confrontabile o
+        un solo valore usato)
+    """
+    users = matrix.user_indexes(user_ids)
+    units = np.flatnonzero(np.isin(matrix.unit_users, users))
+    raters = np.bincount(matrix.unit_cells[units], minlength=len(matrix.cell_ids))
+    units = units[raters[matrix.unit_cells[units]] >= 2]
+    if not len(units):
+        return None
+
+    values, value_of_unit = matrix.unit_values(units)
+    if len(values) < 2:
+        return None
+
+    # V: valori × etichette; similarità MASI sulle coppie che si intersecano
+    value_rows, value_cols = np.nonzero(values >= 0)
+    value_sets = sparse.csr_matrix(
+        (np.ones(len(value_rows)), (value_rows, values[value_rows, value_cols])),
+        shape=(len(values), len(matrix.label_ids))
+    )
+    value_sizes = (values >= 0).sum(axis=1)
+    overlap = (value_sets @ value_sets.T).tocoo()
+    a_sizes, b_sizes = value_sizes[overlap.row], value_sizes[overlap.col]
+    monotonicity = np.where(
+        (overlap.data == a_sizes) & (overlap.data == b_sizes), 1.0,
+        np.where(overlap.data == np.minimum(a_sizes, b_sizes), 2 / 3, 1 / 3)
+    )
+    similarity = sparse.csr_matrix(
+        (overlap.data / (a_sizes + b_sizes - overlap.data) * monotonicity, (overlap.row, overlap.col)),
+        shape=overlap.shape
+    )
+
+    # Coincidenze: U'·W·U, con W = 1/(m_i - 1) per cella
+    cell_rows = matrix.unit_cells[units]
+    unit_values = sparse.csr_matrix(
+        (1.0 / (raters[cell_rows] - 1), (cell_rows, value_of_unit)),
+        shape=(len(matrix.cell_ids), len(values))
+    )
+    counts_matrix = sparse.csr_matrix(
+        (np.ones(len(units)), (cell_rows, value_of_unit)),
+        shape=(len(matrix.cell_ids), len(values))
+    )
+    coincidences = counts_matrix.T @ unit_values
+    value_counts = np.bincount(value_of_unit, minlength=len(values)).astype(float)
+    n_values = value_counts.sum()
+
+    observed = coincidences.sum() - coincidences.multiply(similarity).sum()
+    expected = n_values ** 2 - value_counts @ (similarity @ value_counts)
+    if expected <= 0:
+        return None
+    return float(1 - (n_values - 1) * observed / expected)
+
+
+def pairwise_matrix(matrix: AnnotationMatrix, user_ids: Optional[Iterable[int]] = None,
+                    workers: int = 1, min_parallel_annotations: int = 0) -> Dict:
+    """
+    Accordo di tutte le coppie di annotatori in un solo calcolo
+
+    Con A (celle × annotatori, cella annotata) le celle comuni sono A'·A; con
+    B (coppie cella-insieme di etichette × annotatori) gli accordi esatti sono
+    B'·B. I kappa di Cohen per etichetta di tutte le coppie vengono da un
+    prodotto sparso diagonale a blocchi (una colonna per etichetta e
+    annotatore), calcolato a blocchi di etichette: con workers > 1 e almeno
+    min_parallel_annotations annotazioni i blocchi sono distribuiti su un
+    ProcessPoolExecutor. I risultati coincidono con pairwise_agreement.
+
+    Returns:
+        Dizionario con user_ids e le matrici N×N overlap (celle in comune;
+        sulla diagonale le celle annotate), exact_matches, percent
+        (accordo esatto %) e kappa (media dei kappa per etichetta); i valori
+        non definiti, diagonale compresa, sono NaN
+    """
+    users = matrix.user_indexes(user_ids)
+    n_users = len(users)
+    position = np.full(len(matrix.user_ids), -1, dtype=np.int64)
+    position[users] = np.arange(n_users)
+
+    units = np.flatnonzero(position[matrix.unit_users] >= 0)
+    unit_positions = position[matrix.unit_users[units]]
+    annotated = sparse.csr_matrix(
+        (np.ones(len(units)), (matrix.unit_cells[units], unit_positions)),
+        shape=(len(matrix.cell_ids), n_users)
+    )
+    overlap = np.rint((annotated.T @ annotated).toarray()).astype(np.int64)
+
+    # Accordi esatti: stessa cella e stesso insieme di etichette
+    exact_matches = np.zeros((n_users, n_users), dtype=np.int64)
+    if len(units):
+        values, value_of_unit = matrix.unit_values(units)
+        _, cell_values = np.unique(matrix.unit_cells[units] * len(values) + value_of_unit, return_inverse=True)
+        same_set = sparse.csr_matrix(
+            (np.ones(len(units)), (cell_values.reshape(-1), unit_positions)),
+            shape=(int(cell_values.max()) + 1, n_users)
+        )
+        exact_matches = np.rint((same_set.T @ same_set).toarray()).astype(np.int64)
+
+    # Kappa per etichetta, a blocchi di etichette
+    entries = np.flatnonzero(position[matrix.users] >= 0)
+    n_labels = len(matrix.label_ids)
+    parallel = workers > 1 and len(entries) >= min_parallel_annotations
+    block_labels = max(1, PAIRWISE_BLOCK_SIZE // max(1, n_users * n_users))
+    if parallel:
+        block_labels = min(block_labels, -(-n_labels // workers))
+    tasks = []
+    for first_label in range(0, n_labels, block_labels):
+        in_block = entries[(matrix.labels[entries] >= first_label) & (matrix.labels[entries] < first_label + block_labels)]
+        tasks.append((
+            matrix.cells[in_block], position[matrix.users[in_block]], matrix.labels[in_block] - first_label,
+            min(block_labels, n_labels - first_label), annotated, overlap
+        ))
+
+    kappa_sum = np.zeros((n_users, n_users))
+    kappa_count = np.zeros((n_users, n_users))
+    if parallel and len(tasks) > 1:
+        results = list(_get_process_pool(workers).map(_pairwise_kappa_block, tasks))
+    else:
+        results = map(_pairwise_kappa_block, tasks)
+    for block_sum, block_count in results:
+        kappa_sum += block_sum
+        kappa_count += block_count
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        percent = np.where(overlap > 0, exact_matches / overlap * 100, np.nan)
+        kappa = np.where(kappa_count > 0, kappa_sum / kappa_count, np.nan)
+    np.fill_diagonal(percent, np.nan)
+    np.fill_diagonal(kappa, np.nan)
+
+    return {
+        'user_ids': [int(matrix.user_ids[index]) for index in users],
+        'overlap': overlap,
+        'exact_matches': exact_matches,
+        'percent': percent,
+        'kappa': kappa
+    }
+
+
+def _get_process_pool(workers: int) -> ProcessPoolExecutor:
+    global _process_pool, _process_pool_workers
+    with _process_pool_lock:
+        if _process_pool is None or _process_pool_workers != workers:
+            if _process_pool is not None:
+                _process_pool.shutdown(wait=False)
+            # Come l'ingestione parallela: 'spawn' evita il fork di un processo con thread attivi.
+            # Il pool resta aperto: l'avvio dei processi si paga una volta sola
+            _process_pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+            _process_pool_workers = workers
+        return _process_pool
+
+
+def _pairwise_kappa_block(task):
+    """
+    Somma e numero dei kappa di Cohen definiti, per coppia, su un blocco di etichette
+
+    Colonna j·N + u = etichetta j dell'annotatore u: T'·T è diagonale a
+    blocchi e dà le celle in cui u e v hanno entrambi l'etichetta j;
+    X'·A le celle con l'etichetta j di u tra quelle annotate anche da v.
+    """
+    cells, users, labels, n_labels, annotated, overlap = task
+    n_cells, n_users = annotated.shape
+    columns = labels * n_users + users
+    if not len(cells):
+        return np.zeros((n_users, n_users)), np.zeros((n_users, n_users))
+
+    _, cell_labels = np.unique(cells * n_labels + labels, return_inverse=True)
+    by_cell_label = sparse.csr_matrix(
+        (np.ones(len(cells)), (cell_labels.reshape(-1), columns)),
+        shape=(int(cell_labels.max()) + 1, n_labels * n_users)
+    )
+    both = (by_cell_label.T @ by_cell_label).tocoo()
+    both_counts = np.zeros((n_labels, n_users, n_users))
+    both_counts[both.row // n_users, both.row % n_users, both.col % n_users] = both.data
+
+    by_cell = sparse.csr_matrix(
+        (np.ones(len(cells)), (cells, columns)), shape=(n_cells, n_labels * n_users)
+    )
+    # with_label[j, u, v]: celle comuni a u e v in cui u ha l'etichetta j
+    with_label = (by_cell.T @ annotated).toarray().reshape(n_labels, n_users, n_users)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        p_first = with_label / overlap
+        p_second = with_label.transpose(0, 2, 1) / overlap
+        observed = 1 - (p_first + p_second - 2 * both_counts / overlap)
+        expected = p_first * p_second + (1 - p_first) * (1 - p_second)
+        kappa = (observed - expected) / (1 - expected)
+    defined = (overlap > 0) & ~np.isclose(expected, 1) & ~np.isnan(kappa)
+    return np.where(defined, kappa, 0).sum(axis=0), defined.sum(axis=0)
+
+
+def agreement_summary(matrix: AnnotationMatrix, user_ids: Optional[Iterable[int]] = None) -> Dict:
+    """
+    Accordo complessivo tra più annotatori
+
+    Returns:
+        Dizionario con annotators, cells (con almeno due annotatori),
+        fleiss_kappa (media delle etichette), label_fleiss_kappa e
+        krippendorff_alpha
+    """
+    user_ids = list(user_ids) if user_ids is not None else None
+    users = matrix.user_indexes(user_ids)
+    raters = np.bincount(matrix.unit_cells[np.isin(matrix.unit_users, users)], minlength=len(matrix.cell_ids))
+    label_kappa = fleiss_kappa_per_label(matrix, user_ids)
+    defined = [kappa for kappa in label_kappa.values() if kappa is not None]
+    return {
+        'annotators': [int(matrix.user_ids[index]) for index in users],
+        'cells': int(np.count_nonzero(raters >= 2)),
+        'fleiss_kappa': float(np.mean(defined)) if defined else None,
+        'label_fleiss_kappa': label_kappa,
+        'krippendorff_alpha': krippendorff_alpha_masi(matrix, user_ids)
+    }
+
+
+def _unique_rows(rows: np.ndarray, base: int):
+    """np.unique(rows, axis=0, return_inverse=True), con le righe codificate in un intero se possibile"""
+    if (base + 1) ** rows.shape[1] < 2 ** 62:
+        keys = np.zeros(len(rows), dtype=np.int64)
+        for column in range(rows.shape[1]):
+            keys = keys * (base + 1) + (rows[:, column] + 1)
+        _, first, inverse = np.unique(keys, return_index=True, return_inverse=True)
+        return rows[first], inverse.reshape(-1)
+    values, inverse = np.unique(rows, axis=0, return_inverse=True)
+    return values, inverse.reshape(-1)
+
+
+def _optional(value) -> Optional[float]:
+    return None if np.isnan(value) else float(value)
@@ -12,6 +12,7 @@ from models import (
     db, User, Label, TextCell, CellAnnotation, 
     AIConfiguration, OpenRouterModel, OllamaModel
 )
+from services.deduplication import group_cells_by_text_hash
 from services.ollama_client import OllamaClient
 from services.openrouter_client import OpenRouterClient
 
@@ -170,7 +171,7 @@ class AIAnnotatorService:
             for label in sorted(cat_labels, key=lambda x: x.name):
                 # Aggiunge descrizione se disponibile e numero di utilizzi per contesto
                 desc_part = f" - {label.description}" if label.description else ""
-                usage_count = len(label.annotations) if hasattr(label, 'annotations') else 0
+                usage_count = label.annotation_count
                 usage_info = f" (usata {usage_count} volte)" if usage_count > 0 else " (mai usata)"
                 categories_text += f"• {label.name}{desc_part}{usage_info}\n"
 
@@ -273,16 +274,17 @@ class AIAnnotatorService:
             # Ottiene i testi da annotare in base alla modalità
             if mode == 'replace':
                 # Ri-etichettatura: tutte le celle
-                target_cells = TextCell.query.filter_by(excel_file_id=file_id).all()
+                target_cells = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current).all()
                 print(f"🔄 Modalità sostituzione: {len(target_cells)} celle totali")
             elif mode == 'additional':
                 # Etichettatura aggiuntiva: tutte le celle (anche quelle già annotate)
-                target_cells = TextCell.query.filter_by(excel_file_id=file_id).all()
+                target_cells = TextCell.query.filter_by(excel_file_id=file_id).filter(TextCell.is_current).all()
                 print(f"➕ Modalità aggiuntiva: {len(target_cells)} celle totali")
             else:  # mode == 'new'
                 # Modalità normale: solo celle non annotate
                 target_cells = TextCell.query.filter(
                     TextCell.excel_file_id == file_id,
+                    TextCell.is_current,
                     ~TextCell.id.in_(
                         db.session.query(CellAnnotation.text_cell_id).distinct()
                     )
@@ -293,6 +295,12 @@ class AIAnnotatorService:
                 message = f"Nessuna cella da elaborare per modalità '{mode}'"
                 return {"message": message, "annotations": []}
 
+            # Le risposte identiche vengono inviate una sola volta: l'annotazione
+            # del rappresentante viene poi copiata sulle celle duplicate
+            target_cells, duplicates = group_cells_by_text_hash(target_cells)
+            if duplicates:
+                print(f"♻️ {sum(len(d) for d in duplicates.values())} risposte duplicate riutilizzeranno l'annotazione")
+
             # Processa in batch più piccoli per evitare timeout
             all_annotations = []
             total_processed = 0
@@ -311,12 +319,13 @@ class AIAnnotatorService:
 
                 # Genera le annotazioni per questo batch
                 batch_annotations = self._process_batch(
-                    batch_texts, batch_cells, labels, config, mode, template_id, max_tokens, timeout
+                    batch_texts, batch_cells, labels, config, mode, template_id, max_tokens, timeout,
+                    duplicates=duplicates
                 )
 
                 print(f"✅ Batch {batch_num}: {len(batch_annotations)} annotazioni generate")
                 all_annotations.extend(batch_annotations)
-                total_processed += len(batch_cells)
+                total_processed += sum(1 + len(duplicates.get(cell.id, [])) for cell in batch_cells)
 
                 # Pausa tra i batch per evitare overload
                 import time
@@ -335,7 +344,8 @@ class AIAnnotatorService:
     
     def _process_batch(self, texts: List[str], cells: List[TextCell], 
                       labels: List[Label], config: AIConfiguration, mode: str = 'new', 
-                      template_id: int = None, max_tokens: int = 500, timeout: int = 90) -> List[Dict]:
+                      template_id: int = None, max_tokens: int = 500, timeout: int = 90,
+                      duplicates: Dict[int, List[TextCell]] = None) -> List[Dict]:
         """
         Processa un batch di testi
         
@@ -348,6 +358,7 @@ class AIAnnotatorService:
             template_id: ID del template prompt da usare
             max_tokens: Numero massimo di token per risposta
             timeout: Timeout in secondi per chiamata AI
+            duplicates: Celle con lo stesso testo di ogni cella del batch (per ID), annotate allo stesso modo
         """
         annotations = []
         
@@ -446,33 +457,36 @@ class AIAnnotatorService:
                                 break
                         
                         if label:
-                            # Se è modalità ri-etichettatura, rimuovi le annotazioni esistenti dell'utente AI
-                            if re_annotate:
-                                existing_ai_annotations = CellAnnotation.query.filter_by(
-                                    text_cell_id=cell.id,
+                            same_text_cells = [cell] + (duplicates or {}).get(cell.id, [])
+                            for target_cell in same_text_cells:
+                                # Se è modalità ri-etichettatura, rimuovi le annotazioni esistenti dell'utente AI
+                                if re_annotate:
+                                    existing_ai_annotations = CellAnnotation.query.filter_by(
+                                        text_cell_id=target_cell.id,
+                                        user_id=ai_user.id,
+                                        is_ai_generated=True
+                                    ).all()
+                                    for existing_ann in existing_ai_annotations:
+                                        db.session.delete(existing_ann)
+                                
+                                # Crea la nuova annotazione con status pending_review
+                                annotation = CellAnnotation(
+                                    text_cell_id=target_cell.id,
+                                    label_id=label.id,
                                     user_id=ai_user.id,
-                                    is_ai_generated=True
-                                ).all()
-                                for existing_ann in existing_ai_annotations:
-                                    db.session.delete(existing_ann)
-                            
-                            # Crea la nuova annotazione con status pending_review
-                            annotation = CellAnnotation(
-                                text_cell_id=cell.id,
-                                label_id=label.id,
-                                user_id=ai_user.id,
-                                is_ai_generated=True,
-                                ai_confidence=ai_ann.get('confidence', 0.5),
-                                ai_model=config.ollama_model or config.openrouter_model,
-                                ai_provider=config.provider,
-                                status='pending_review'  # SEMPRE pending_review
-                            )
-                            
-                            db.session.add(annotation)
+                                    is_ai_generated=True,
+                                    ai_confidence=ai_ann.get('confidence', 0.5),
+                                    ai_model=config.ollama_model or config.openrouter_model,
+                                    ai_provider=config.provider,
+                                    status='pending_review'  # SEMPRE pending_review
+                                )
+                                
+                                db.session.add(annotation)
                             annotations.append({
                                 'text': cell.text_content[:100] + '...',
                                 'label': label.name,
-                                'confidence': ai_ann.get('confidence', 0.5)
+                                'confidence': ai_ann.get('confidence', 0.5),
+                                'cells': len(same_text_cells)
                             })
             
             db.session.commit()
@@ -26,7 +26,7 @@ class AILabelService:
                 'description': label.description or '',
                 'category': category_name,
                 'color': label.color,
-                'usage_count': len(label.annotations)
+                'usage_count': label.annotation_count
             })
         
         return labels_data
@@ -57,7 +57,7 @@ class AILabelService:
                     'name': label.name,
                     'description': label.description or '',
                     'color': label.color,
-                    'usage_count': len(label.annotations)
+                    'usage_count': label.annotation_count
                 })
             
             categories_data.append(category_data)
@@ -219,7 +219,7 @@ Rispondi SOLO con un JSON nel formato:
             }
         
         # Etichette più e meno usate
-        labels_with_usage = [(label, len(label.annotations)) for label in labels]
+        labels_with_usage = [(label, label.annotation_count) for label in labels]
         labels_with_usage.sort(key=lambda x: x[1], reverse=True)
         
         stats['most_used_labels'] = [
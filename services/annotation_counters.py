@@ -0,0 +1,185 @@
+"""
+Contatori delle annotazioni su celle, etichette e utenti.
+
+Le colonne annotation_count, distinct_annotators e last_annotated_at di
+TextCell, Label e User (User senza distinct_annotators) vengono aggiornate
+dal listener di services.annotation_events a ogni aggiunta, rimozione o
+spostamento di CellAnnotation, così le viste non caricano tutte le
+annotazioni solo per contarle. rebuild_annotation_counters le ricalcola in
+blocco (migrazione, comando repair_counters.py, dopo modifiche in blocco).
+"""
+
+from collections import Counter
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import bindparam, case, func, or_, select
+
+from models import db, CellAnnotation, Label, TextCell, User
+
+# Tabella -> (colonna di cell_annotation, contatori mantenuti)
+COUNTER_TARGETS = {
+    'text_cell': (TextCell, 'text_cell_id', ('annotation_count', 'distinct_annotators', 'last_annotated_at')),
+    'label': (Label, 'label_id', ('annotation_count', 'distinct_annotators', 'last_annotated_at')),
+    'user': (User, 'user_id', ('annotation_count', 'last_annotated_at')),
+}
+
+
+def _counter_values(target, foreign_key: str, columns: Iterable[str]) -> Dict[str, object]:
+    """Sottoquery correlate che calcolano i contatori di ogni riga di target"""
+    annotations = CellAnnotation.__table__
+    correlated = annotations.c[foreign_key] == target.c.id
+    expressions = {
+        'annotation_count': func.count(),
+        'distinct_annotators': func.count(func.distinct(annotations.c.user_id)),
+        'last_annotated_at': func.max(annotations.c.created_at),
+    }
+    values = {
+        name: select(expressions[name]).where(correlated).scalar_subquery()
+        for name in columns
+    }
+    return {**values, **_keep_updated_at(target)}
+
+
+def _keep_updated_at(target) -> Dict[str, object]:
+    """Evita che l'onupdate di updated_at scatti per il solo aggiornamento dei contatori"""
+    return {'updated_at': target.c.updated_at} if 'updated_at' in target.c else {}
+
+
+def rebuild_annotation_counters(ids: Optional[Dict[str, Iterable[int]]] = None) -> Dict[str, int]:
+    """
+    Ricalcola da zero i contatori delle annotazioni
+
+    Args:
+        ids: Dizionario tabella ('text_cell', 'label', 'user') -> ID da
+            ricalcolare; None = tutte le righe di tutte le tabelle
+
+    Returns:
+        Dizionario tabella -> numero di righe aggiornate
+    """
+    updated = {}
+    for name, (model, foreign_key, columns) in COUNTER_TARGETS.items():
+        if ids is not None and name not in ids:
+            continue
+        target = model.__table__
+        update = target.update().values(**_counter_values(target, foreign_key, columns))
+        if ids is not None:
+            update = update.where(target.c.id.in_(list(ids[name])))
+        updated[name] = db.session.execute(update).rowcount
+    return updated
+
+
+def find_counter_drift() -> Dict[str, int]:
+    """
+    Conta le righe con contatori diversi dai valori calcolati
+
+    Returns:
+        Dizionario tabella -> numero di righe non allineate
+    """
+    drift = {}
+    for name, (model, foreign_key, columns) in COUNTER_TARGETS.items():
+        target = model.__table__
+        expected = _counter_values(target, foreign_key, columns)
+        # IS DISTINCT FROM: last_annotated_at può essere NULL su entrambi i lati
+        mismatch = [target.c[column].is_distinct_from(expected[column]) for column in columns]
+        drift[name] = db.session.execute(
+            select(func.count()).select_from(target).where(or_(*mismatch))
+        ).scalar()
+    return drift
+
+
+def apply_annotation_counters(session, changes):
+    """
+    Gestore di services.annotation_events: aggiorna i contatori dopo un flush.
+
+    Le celle (poche annotazioni ciascuna) vengono ricalcolate con le stesse
+    sottoquery di rebuild_annotation_counters. Per etichette e utenti
+    annotation_count varia di ±1 per annotazione; distinct_annotators
+    dell'etichetta confronta il numero di annotazioni dell'utente con
+    l'etichetta dopo il flush con quello precedente; last_annotated_at prende
+    la data più recente tra quelle inserite e, se il flush rimuove
+    annotazioni, viene ricalcolato.
+    """
+    connection = session.connection()
+    annotations = CellAnnotation.__table__
+
+    cells = TextCell.__table__
+    connection.execute(
+        cells.update()
+        .where(cells.c.id.in_(list(changes.text_cell_ids)))
+        .values(**_counter_values(cells, 'text_cell_id', COUNTER_TARGETS['text_cell'][2]))
+    )
+
+    label_delta = Counter()
+    user_delta = Counter()
+    pair_delta = Counter()
+    label_latest = {}
+    user_latest = {}
+    for sign, refs in ((1, changes.inserted), (-1, changes.deleted)):
+        for ref in refs:
+            label_delta[ref.label_id] += sign
+            user_delta[ref.user_id] += sign
+            pair_delta[(ref.label_id, ref.user_id)] += sign
+            if sign > 0 and ref.created_at is not None:
+                label_latest[ref.label_id] = max(ref.created_at, label_latest.get(ref.label_id, ref.created_at))
+                user_latest[ref.user_id] = max(ref.created_at, user_latest.get(ref.user_id, ref.created_at))
+
+    pair_counts = {
+        (row.label_id, row.user_id): row.count
+        for row in connection.execute(
+            select(annotations.c.label_id, annotations.c.user_id, func.count().label('count'))
+            .where(
+                annotations.c.label_id.in_(list(label_delta)),
+                annotations.c.user_id.in_(list(user_delta))
+            )
+            .group_by(annotations.c.label_id, annotations.c.user_id)
+        )
+    }
+    annotator_delta = Counter()
+    for (label_id, user_id), delta in pair_delta.items():
+        after = pair_counts.get((label_id, user_id), 0)
+        annotator_delta[label_id] += (after > 0) - (after - delta > 0)
+
+    labels = Label.__table__
+    _apply_deltas(connection, labels, [
+        {'b_id': label_id, 'b_count': delta, 'b_annotators': annotator_delta[label_id],
+         'b_latest': label_latest.get(label_id)}
+        for label_id, delta in label_delta.items()
+    ], distinct_annotators=labels.c.distinct_annotators + bindparam('b_annotators'))
+
+    users = User.__table__
+    _apply_deltas(connection, users, [
+        {'b_id': user_id, 'b_count': delta, 'b_latest': user_latest.get(user_id)}
+        for user_id, delta in user_delta.items()
+    ])
+
+    # Una rimozione può togliere l'annotazione più recente
+    for name, key in (('label', 'label_id'), ('user', 'user_id')):
+        removed = {getattr(ref, key) for ref in changes.deleted}
+        if removed:
+            model, foreign_key, _ = COUNTER_TARGETS[name]
+            target = model.__table__
+            connection.execute(
+                target.update().where(target.c.id.in_(list(removed)))
+                .values(**_counter_values(target, foreign_key, ['last_annotated_at']))
+            )
+
+
+def _apply_deltas(connection, target, rows, **extra_values):
+    """UPDATE in blocco di annotation_count e last_annotated_at (più eventuali altre colonne)"""
+    if not rows:
+        return
+    latest = bindparam('b_latest', type_=db.DateTime)
+    connection.execute(
+        target.update().where(target.c.id == bindparam('b_id')).values(
+            annotation_count=target.c.annotation_count + bindparam('b_count'),
+            last_annotated_at=case(
+                (latest.is_(None), target.c.last_annotated_at),
+                (target.c.last_annotated_at.is_(None), latest),
+                (target.c.last_annotated_at < latest, latest),
+                else_=target.c.last_annotated_at
+            ),
+            **_keep_updated_at(target),
+            **extra_values
+        ),
+        rows
+    )
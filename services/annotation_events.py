@@ -0,0 +1,117 @@
+"""
+Eventi di scrittura delle annotazioni delle celle.
+
+Un listener after_flush sulla sessione raccoglie le CellAnnotation inserite,
+eliminate o spostate (cambio di cella, utente o etichetta) e le passa ai
+gestori registrati, che aggiornano in modo incrementale i dati derivati
+(aggregati per domanda, contatori, cache) nella stessa transazione.
+
+Le modifiche fatte con UPDATE/DELETE in blocco non passano da qui: chi le
+esegue deve ricalcolare i dati derivati (es. rebuild_question_stats,
+rebuild_annotation_counters).
+"""
+
+from collections import namedtuple
+from typing import Callable, List
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session
+
+from models import CellAnnotation
+
+# created_at è informativo (data dell'annotazione) e non identifica uno spostamento
+AnnotationRef = namedtuple('AnnotationRef', ['text_cell_id', 'user_id', 'label_id', 'created_at'],
+                           defaults=(None,))
+MOVE_KEYS = ('text_cell_id', 'user_id', 'label_id')
+
+_handlers: List[Callable] = []
+
+
+class AnnotationChanges:
+    """Annotazioni aggiunte e rimosse in un flush"""
+
+    def __init__(self):
+        self.inserted: List[AnnotationRef] = []
+        self.deleted: List[AnnotationRef] = []
+
+    def __bool__(self):
+        return bool(self.inserted or self.deleted)
+
+    @property
+    def text_cell_ids(self):
+        return {ref.text_cell_id for ref in self.inserted + self.deleted}
+
+    @property
+    def user_ids(self):
+        return {ref.user_id for ref in self.inserted + self.deleted}
+
+    @property
+    def label_ids(self):
+        return {ref.label_id for ref in self.inserted + self.deleted}
+
+
+def _previous_value(state, key):
+    """Valore dell'attributo prima delle modifiche non ancora scritte"""
+    history = state.attrs[key].history
+    if history.deleted:
+        return history.deleted[0]
+    return getattr(state.obj(), key)
+
+
+def collect_changes(session: Session) -> AnnotationChanges:
+    """Raccoglie le modifiche alle CellAnnotation pendenti nella sessione"""
+    changes = AnnotationChanges()
+    for obj in session.new:
+        if isinstance(obj, CellAnnotation):
+            changes.inserted.append(AnnotationRef(obj.text_cell_id, obj.user_id, obj.label_id,
+                                                  obj.created_at))
+    for obj in session.deleted:
+        if isinstance(obj, CellAnnotation):
+            state = inspect(obj)
+            changes.deleted.append(AnnotationRef(
+                _previous_value(state, 'text_cell_id'),
+                _previous_value(state, 'user_id'),
+                _previous_value(state, 'label_id'),
+                _previous_value(state, 'created_at')
+            ))
+    for obj in session.dirty:
+        if not isinstance(obj, CellAnnotation):
+            continue
+        state = inspect(obj)
+        # Uno spostamento equivale a una rimozione seguita da un inserimento
+        if any(state.attrs[key].history.has_changes() for key in MOVE_KEYS):
+            changes.deleted.append(AnnotationRef(
+                _previous_value(state, 'text_cell_id'),
+                _previous_value(state, 'user_id'),
+                _previous_value(state, 'label_id'),
+                _previous_value(state, 'created_at')
+            ))
+            changes.inserted.append(AnnotationRef(obj.text_cell_id, obj.user_id, obj.label_id,
+                                                  obj.created_at))
+    return changes
+
+
+def _after_flush(session, flush_context):
+    if not _handlers:
+        return
+    changes = collect_changes(session)
+    if not changes:
+        return
+    for handler in _handlers:
+        handler(session, changes)
+
+
+def register_annotation_events(*handlers: Callable):
+    """
+    Installa il listener (una sola volta) e registra i gestori
+
+    Args:
+        handlers: Funzioni handler(session, changes) eseguite dopo ogni flush
+            con modifiche alle annotazioni; le query vanno eseguite su
+            session.connection() perché il flush è ancora in corso
+    """
+    for handler in handlers:
+        if handler not in _handlers:
+            _handlers.append(handler)
+    if not event.contains(Session, 'after_flush', _after_flush):
+        event.listen(Session, 'after_flush', _after_flush)
@@ -39,7 +39,7 @@ class BulkAnnotationService:
         query = TextCell.query.filter_by(
             excel_file_id=file_id,
             column_name=question
-        )
+        ).filter(TextCell.is_current)
         
         # Filtra celle valide se richiesto
         if options.get('filter_valid_cells', True):
@@ -145,7 +145,7 @@ class BulkAnnotationService:
                 {
                     'id': cell.id,
                     'text': cell.text_content[:100] + "..." if len(cell.text_content) > 100 else cell.text_content,
-                    'has_annotations': len(cell.annotations) > 0
+                    'has_annotations': cell.annotation_count > 0
                 }
                 for cell in cells[:10]  # Mostra solo i primi 10
             ]
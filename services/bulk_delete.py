@@ -0,0 +1,258 @@
+"""
+Eliminazione in blocco di file Excel e documenti di testo.
+
+db.session.delete(excel_file) lascia al cascade dell'ORM la rimozione delle
+righe collegate: tutte le celle e le loro annotazioni vengono caricate nella
+sessione e cancellate una alla volta. Qui ogni tabella dipendente viene
+svuotata con un solo DELETE ... WHERE ... IN (sottoquery), nell'ordine delle
+chiavi esterne e in un'unica transazione; i contatori di etichette e utenti
+vengono poi ricalcolati per le sole righe coinvolte.
+
+I file molto grandi possono essere eliminati in background
+(submit_excel_file_delete): il file passa allo stato 'deleting' e l'esito,
+con il numero di righe eliminate per tabella, si legge con delete_job_status.
+I job restano solo in memoria: all'avvio recover_interrupted_deletes riporta
+a 'ready' i file che un riavvio ha lasciato in eliminazione.
+"""
+
+import logging
+import os
+import threading
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, Optional
+
+from sqlalchemy import select
+
+from models import (db, AnnotationAction, AnnotationActionArchive, CellAnnotation, DiaryEntry,
+                    ExcelFile, ForumCategory, ForumComment, ForumPost, IngestionJob, QuestionStats,
+                    TextAnnotation, TextCell, TextDocument)
+from services.annotation_counters import rebuild_annotation_counters
+from services.stats_cache import GLOBAL, file_scope, invalidate_on_commit, user_scope
+
+logger = logging.getLogger(__name__)
+
+# Esiti dei job in background (solo in memoria: si perdono al riavvio)
+_jobs: Dict[str, dict] = {}
+_jobs_lock = threading.Lock()
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor() -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        # Un solo thread: le eliminazioni in blocco non devono contendersi il lock di scrittura
+        _executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='bulk-delete')
+    return _executor
+
+
+def delete_excel_file(file_id: int, remove_files: bool = True) -> Dict[str, int]:
+    """
+    Elimina un file Excel con celle, annotazioni, azioni, forum e aggregati
+
+    Tutte le istruzioni vengono eseguite e committate in un'unica
+    transazione; in caso di errore non viene eliminato nulla.
+
+    Args:
+        file_id: ID del file da eliminare
+        remove_files: Se True rimuove anche i file caricati dal disco
+
+    Returns:
+        Dizionario tabella -> righe eliminate (più 'diary_entries' per le voci
+        del diario scollegate e 'files' per i file rimossi dal disco)
+    """
+    excel_file = db.session.get(ExcelFile, file_id)
+    if excel_file is None:
+        raise ValueError(f"File {file_id} non trovato")
+    paths = {excel_file.file_path} | {
+        path for (path,) in db.session.query(IngestionJob.source_path)
+        .filter(IngestionJob.excel_file_id == file_id, IngestionJob.source_path.isnot(None))
+    }
+
+    cells = select(TextCell.id).where(TextCell.excel_file_id == file_id).scalar_subquery()
+    categories = select(ForumCategory.id).where(ForumCategory.excel_file_id == file_id).scalar_subquery()
+    posts = select(ForumPost.id).where(ForumPost.category_id.in_(categories)).scalar_subquery()
+
+    # Etichette e utenti i cui contatori cambiano
+    affected = db.session.execute(
+        select(CellAnnotation.label_id, CellAnnotation.user_id)
+        .where(CellAnnotation.text_cell_id.in_(cells)).distinct()
+    ).all()
+
+    counts = {}
+    try:
+        # Ordine delle chiavi esterne: prima le righe che puntano alle celle e al file
+        statements = [
+            ('annotation_action', AnnotationAction.__table__.delete()
+             .where(AnnotationAction.text_cell_id.in_(cells))),
+            ('annotation_action_archive', AnnotationActionArchive.__table__.delete()
+             .where(AnnotationActionArchive.text_cell_id.in_(cells))),
+            ('cell_annotation', CellAnnotation.__table__.delete()
+             .where(CellAnnotation.text_cell_id.in_(cells))),
+            ('forum_comment', ForumComment.__table__.delete().where(ForumComment.post_id.in_(posts))),
+            ('forum_post', ForumPost.__table__.delete().where(ForumPost.category_id.in_(categories))),
+            ('forum_category', ForumCategory.__table__.delete().where(ForumCategory.excel_file_id == file_id)),
+            ('diary_entries', DiaryEntry.__table__.update()
+             .where(DiaryEntry.project_id == file_id).values(project_id=None)),
+            ('question_stats', QuestionStats.__table__.delete().where(QuestionStats.excel_file_id == file_id)),
+            ('ingestion_jobs', IngestionJob.__table__.delete().where(IngestionJob.excel_file_id == file_id)),
+            ('text_cell', TextCell.__table__.delete().where(TextCell.excel_file_id == file_id)),
+            ('excel_file', ExcelFile.__table__.delete().where(ExcelFile.id == file_id)),
+        ]
+        for table_name, statement in statements:
+            counts[table_name] = db.session.execute(statement).rowcount
+
+        if affected:
+            rebuild_annotation_counters({
+                'label': {label_id for label_id, _ in affected},
+                'user': {user_id for _, user_id in affected},
+            })
+        # I DELETE in blocco non passano dai listener della cache delle statistiche
+        invalidate_on_commit(db.session, GLOBAL, file_scope(file_id),
+                             *(user_scope(user_id) for user_id in {user_id for _, user_id in affected}))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    # Gli oggetti caricati prima dei DELETE non esistono più
+    db.session.expunge_all()
+
+    counts['files'] = _remove_files(paths) if remove_files else 0
+    logger.info('File %s eliminato: %s', file_id, counts)
+    return counts
+
+
+def delete_text_document(document_id: int) -> Dict[str, int]:
+    """
+    Elimina un documento di testo con le sue annotazioni
+
+    Returns:
+        Dizionario tabella -> righe eliminate
+    """
+    if db.session.get(TextDocument, document_id) is None:
+        raise ValueError(f"Documento {document_id} non trovato")
+    try:
+        counts = {
+            'text_annotations': db.session.execute(
+                TextAnnotation.__table__.delete().where(TextAnnotation.document_id == document_id)
+            ).rowcount,
+            'text_documents': db.session.execute(
+                TextDocument.__table__.delete().where(TextDocument.id == document_id)
+            ).rowcount,
+        }
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    db.session.expunge_all()
+    return counts
+
+
+def _remove_files(paths) -> int:
+    removed = 0
+    for path in paths:
+        try:
+            if path and os.path.exists(path):
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logger.warning('Impossibile rimuovere %s: %s', path, str(e))
+    return removed
+
+
+def submit_excel_file_delete(app, file_id: int, user_id: Optional[int] = None) -> str:
+    """
+    Elimina un file Excel fuori dal ciclo della richiesta
+
+    Il file passa subito allo stato 'deleting' (committato dal chiamante
+    insieme alla sessione corrente).
+
+    Args:
+        app: Istanza reale dell'applicazione Flask
+        file_id: ID del file da eliminare
+        user_id: ID dell'utente che ha chiesto l'eliminazione (l'unico, con gli
+            amministratori, che può seguirne lo stato)
+
+    Returns:
+        ID del job, da passare a delete_job_status
+    """
+    excel_file = db.session.get(ExcelFile, file_id)
+    excel_file.status = 'deleting'
+    job_id = str(uuid.uuid4())
+    with _jobs_lock:
+        _jobs[job_id] = {
+            'id': job_id,
+            'target': 'excel_file',
+            'target_id': file_id,
+            'name': excel_file.original_filename,
+            'requested_by': user_id,
+            'status': 'pending',
+            'counts': None,
+            'error_message': None,
+            'created_at': datetime.utcnow().isoformat(),
+            'finished_at': None,
+        }
+    db.session.commit()
+    _get_executor().submit(_run_delete_job, app, job_id, file_id)
+    return job_id
+
+
+def recover_interrupted_deletes(app) -> int:
+    """
+    Riporta a 'ready' i file rimasti in eliminazione dall'esecuzione precedente
+
+    I job vivono solo in memoria e l'eliminazione è un'unica transazione:
+    dopo un riavvio il file è intatto ma resterebbe 'deleting' e
+    l'eliminazione non potrebbe essere ripetuta.
+
+    Args:
+        app: Istanza reale dell'applicazione Flask
+
+    Returns:
+        Numero di file ripristinati
+    """
+    with app.app_context():
+        try:
+            restored = db.session.execute(
+                ExcelFile.__table__.update()
+                .where(ExcelFile.status == 'deleting')
+                .values(status='ready')
+            ).rowcount
+            db.session.commit()
+        finally:
+            db.session.remove()
+    if restored:
+        logger.info('%d file in eliminazione riportati allo stato ready', restored)
+    return restored
+
+
+def _run_delete_job(app, job_id: str, file_id: int):
+    with app.app_context():
+        _update_job(job_id, status='processing')
+        try:
+            counts = delete_excel_file(file_id)
+            _update_job(job_id, status='completed', counts=counts)
+        except Exception as e:
+            logger.exception('Eliminazione del file %s fallita', file_id)
+            excel_file = db.session.get(ExcelFile, file_id)
+            if excel_file is not None and excel_file.status == 'deleting':
+                excel_file.status = 'ready'
+                db.session.commit()
+            _update_job(job_id, status='failed', error_message=str(e))
+        finally:
+            db.session.remove()
+
+
+def _update_job(job_id: str, **values):
+    with _jobs_lock:
+        _jobs[job_id].update(values)
+        if values.get('status') in ('completed', 'failed'):
+            _jobs[job_id]['finished_at'] = datetime.utcnow().isoformat()
+
+
+def delete_job_status(job_id: str) -> Optional[dict]:
+    """Stato di un job di eliminazione (None se sconosciuto)"""
+    with _jobs_lock:
+        job = _jobs.get(job_id)
+        return dict(job) if job else None
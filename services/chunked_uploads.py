@@ -0,0 +1,211 @@
+"""
+Servizio per i caricamenti a blocchi riprendibili.
+
+Il client apre una sessione indicando nome e dimensione del file, poi invia i
+blocchi (anche in ordine sparso o ripetendoli dopo un errore di rete) con il
+loro SHA-256. Ogni blocco viene scritto in streaming alla sua posizione in un
+file parziale sotto UPLOAD_FOLDER, quindi né la richiesta né il file intero
+vengono mai tenuti in memoria.
+"""
+
+import hashlib
+import logging
+import os
+import uuid
+from datetime import datetime, timedelta
+from typing import Optional
+
+from flask import current_app
+
+from models import db, UploadChunk, UploadSession
+from services.deduplication import file_sha256
+
+logger = logging.getLogger(__name__)
+
+# Dimensione dei blocchi letti dallo stream della richiesta
+STREAM_BLOCK_SIZE = 64 * 1024
+
+# Cartella dei file parziali, relativa a UPLOAD_FOLDER
+PARTIAL_DIR = 'chunked'
+
+
+def _partial_dir() -> str:
+    path = os.path.join(current_app.config['UPLOAD_FOLDER'], PARTIAL_DIR)
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+def partial_path(upload: UploadSession) -> str:
+    """Percorso del file parziale della sessione"""
+    return os.path.join(_partial_dir(), f'{upload.id}.part')
+
+
+def create_session(user_id: int, original_filename: str, total_size: int, target: str,
+                   document_type: Optional[str] = None, chunk_size: Optional[int] = None) -> UploadSession:
+    """
+    Apre una sessione di caricamento e prealloca il file parziale
+
+    Args:
+        user_id: Utente che carica il file
+        original_filename: Nome del file (già reso sicuro)
+        total_size: Dimensione totale in byte
+        target: 'excel' o 'text_document'
+        document_type: Tipo di documento per i documenti di testo
+        chunk_size: Dimensione dei blocchi richiesta dal client (limitata da UPLOAD_CHUNK_SIZE)
+
+    Returns:
+        La sessione creata (non ancora committata)
+
+    Raises:
+        ValueError: Se la dimensione non è valida
+    """
+    max_size = current_app.config['UPLOAD_MAX_SIZE']
+    if total_size <= 0:
+        raise ValueError('Il file è vuoto')
+    if total_size > max_size:
+        raise ValueError(f'File troppo grande. Dimensione massima: {max_size // 1024 // 1024}MB')
+
+    max_chunk = current_app.config['UPLOAD_CHUNK_SIZE']
+    chunk_size = min(chunk_size or max_chunk, max_chunk)
+    if chunk_size <= 0:
+        raise ValueError('Dimensione dei blocchi non valida')
+
+    upload = UploadSession(
+        id=str(uuid.uuid4()),
+        user_id=user_id,
+        original_filename=original_filename,
+        target=target,
+        document_type=document_type,
+        total_size=total_size,
+        chunk_size=chunk_size,
+        total_chunks=(total_size + chunk_size - 1) // chunk_size
+    )
+    # Il file parziale ha subito la dimensione finale: ogni blocco viene scritto al proprio offset
+    with open(partial_path(upload), 'wb') as handle:
+        handle.truncate(total_size)
+    db.session.add(upload)
+    return upload
+
+
+def write_chunk(upload: UploadSession, index: int, stream, expected_sha256: Optional[str] = None) -> UploadChunk:
+    """
+    Scrive un blocco alla sua posizione nel file parziale verificandone il checksum
+
+    Un blocco già ricevuto può essere reinviato: viene sovrascritto.
+
+    Args:
+        upload: Sessione di caricamento
+        index: Indice del blocco (da 0)
+        stream: Stream del corpo della richiesta
+        expected_sha256: SHA-256 dichiarato dal client (header X-Chunk-SHA256)
+
+    Returns:
+        Il record del blocco (non ancora committato)
+
+    Raises:
+        ValueError: Se l'indice, la dimensione o il checksum non corrispondono;
+            il blocco viene segnato come mancante e la sessione va committata
+    """
+    if upload.status != 'uploading':
+        raise ValueError('Il caricamento è già stato completato')
+    if not 0 <= index < upload.total_chunks:
+        raise ValueError(f'Indice del blocco non valido: {index}')
+
+    expected_size = upload.expected_chunk_size(index)
+    digest = hashlib.sha256()
+    written = 0
+    with open(partial_path(upload), 'r+b') as handle:
+        handle.seek(index * upload.chunk_size)
+        while True:
+            block = stream.read(STREAM_BLOCK_SIZE)
+            if not block:
+                break
+            written += len(block)
+            if written > expected_size:
+                # Non scrive oltre il blocco: invaderebbe quello successivo
+                break
+            digest.update(block)
+            handle.write(block)
+
+    chunk = upload.chunks.filter_by(chunk_index=index).first()
+    sha256 = digest.hexdigest()
+    error = None
+    if written != expected_size:
+        error = f'Dimensione del blocco {index} non valida: attesi {expected_size} byte'
+    elif expected_sha256 and expected_sha256.strip().lower() != sha256:
+        error = f'Checksum del blocco {index} non corrispondente'
+    if error:
+        # I byte già scritti hanno sostituito il blocco precedente, che va quindi reinviato
+        if chunk is not None:
+            db.session.delete(chunk)
+        raise ValueError(error)
+
+    if chunk is None:
+        chunk = UploadChunk(session_id=upload.id, chunk_index=index)
+        db.session.add(chunk)
+    chunk.size = written
+    chunk.sha256 = sha256
+    chunk.received_at = datetime.utcnow()
+    upload.updated_at = datetime.utcnow()
+    return chunk
+
+
+def complete_file(upload: UploadSession, destination: str) -> str:
+    """
+    Sposta il file parziale completo nella destinazione finale
+
+    Args:
+        upload: Sessione con tutti i blocchi ricevuti
+        destination: Percorso finale sotto UPLOAD_FOLDER
+
+    Returns:
+        SHA-256 dell'intero file (calcolato leggendo il file a blocchi)
+
+    Raises:
+        ValueError: Se mancano dei blocchi
+    """
+    missing = upload.total_chunks - upload.chunks.count()
+    if missing:
+        raise ValueError(f'Caricamento incompleto: mancano {missing} blocchi')
+
+    os.replace(partial_path(upload), destination)
+    upload.file_sha256 = file_sha256(destination)
+    return upload.file_sha256
+
+
+def restore_partial(upload: UploadSession, source: str):
+    """
+    Riporta un file ricomposto da complete_file nella posizione del file parziale
+
+    La sessione resta completa e può essere finalizzata di nuovo (es. dopo
+    aver confermato il caricamento di un duplicato) senza reinviare i blocchi.
+    """
+    os.replace(source, partial_path(upload))
+
+
+def discard_session(upload: UploadSession):
+    """Elimina la sessione e il suo file parziale"""
+    path = partial_path(upload)
+    if os.path.exists(path):
+        os.remove(path)
+    db.session.delete(upload)
+
+
+def cleanup_stale_sessions(max_age_hours: Optional[int] = None) -> int:
+    """
+    Elimina le sessioni non completate e non aggiornate da più di max_age_hours
+
+    Returns:
+        Numero di sessioni eliminate
+    """
+    if max_age_hours is None:
+        max_age_hours = current_app.config.get('UPLOAD_SESSION_TTL_HOURS', 24)
+    threshold = datetime.utcnow() - timedelta(hours=max_age_hours)
+    stale = UploadSession.query.filter(
+        UploadSession.status != 'finalized',
+        UploadSession.updated_at < threshold
+    ).all()
+    for upload in stale:
+        logger.info('Sessione di caricamento %s scaduta', upload.id)
+        discard_session(upload)
+    return len(stale)
@@ -0,0 +1,230 @@
+"""
+Servizio per la classificazione del tipo di domanda al momento dell'ingestione.
+
+Ogni colonna (file, foglio, colonna) viene classificata una sola volta a
+partire dall'intestazione e da alcune caratteristiche calcolate in modo
+vettoriale con pandas sulle risposte: quota di valori numerici, cardinalità
+dei valori distinti, lunghezza media e occorrenze di termini Likert.
+
+Le viste di annotazione mostrano solo le domande aperte o non classificate:
+il tipo rilevato viene scritto sulle celle (con un unico UPDATE) solo se è
+'aperta', altrimenti resta un suggerimento in question_stats.suggested_type
+e le celle restano non classificate finché il tipo non viene confermato
+dalla gestione delle domande (routes/questions.py).
+"""
+
+from typing import Dict, List, Optional, Tuple
+
+import pandas as pd
+from sqlalchemy import bindparam
+
+from models import db, QuestionStats, TextCell
+from question_classifier import QuestionClassifier, QuestionType
+
+# Risposte per colonna usate per calcolare le caratteristiche
+SAMPLE_SIZE = 2000
+
+# Termini delle scale di accordo/frequenza/soddisfazione (italiano e inglese)
+LIKERT_PATTERN = (
+    r'\b(?:molto|abbastanza|poco|per niente|per nulla|mai|raramente|a volte|spesso|sempre|'
+    r'd\'accordo|disaccordo|soddisfatt[oaie]|insoddisfatt[oaie]|neutrale|'
+    r'strongly|somewhat|agree|disagree|never|rarely|sometimes|often|always|neutral)\b'
+)
+BINARY_PATTERN = r'(?:s[iì]|no|vero|falso|true|false|yes)[.!]?'
+NUMERIC_PATTERN = r'[+-]?\d+(?:[.,]\d+)?(?:\s*/\s*\d+)?'
+
+# Tipi proposti nella gestione delle domande (routes/questions.py):
+# le scale numeriche ricadono in 'likert', le date in 'anagrafica'
+STORED_TYPES = {
+    QuestionType.SCALE: QuestionType.LIKERT,
+    QuestionType.DATE: QuestionType.DEMOGRAPHIC,
+}
+
+# Tipi scritti sulle celle senza conferma: non nascondono la colonna dalle viste di annotazione
+AUTO_APPLIED_TYPES = {QuestionType.OPEN.value}
+
+
+def profile_values(values: pd.Series) -> Dict[str, float]:
+    """
+    Calcola le caratteristiche di una colonna con operazioni vettoriali
+
+    Args:
+        values: Serie delle risposte (stringhe non vuote)
+
+    Returns:
+        Dizionario con count, numeric_ratio, binary_ratio, likert_ratio,
+        distinct, distinct_ratio, mean_length e max_numeric
+    """
+    lowered = values.str.strip().str.lower()
+    count = len(lowered)
+    numeric_mask = lowered.str.fullmatch(NUMERIC_PATTERN)
+    numbers = pd.to_numeric(
+        lowered[numeric_mask].str.split('/').str[0].str.replace(',', '.', regex=False),
+        errors='coerce'
+    )
+    distinct = lowered.nunique()
+    return {
+        'count': count,
+        'numeric_ratio': float(numeric_mask.mean()) if count else 0.0,
+        'binary_ratio': float(lowered.str.fullmatch(BINARY_PATTERN).mean()) if count else 0.0,
+        'likert_ratio': float(lowered.str.contains(LIKERT_PATTERN, regex=True).mean()) if count else 0.0,
+        'distinct': int(distinct),
+        'distinct_ratio': distinct / count if count else 0.0,
+        'mean_length': float(lowered.str.len().mean()) if count else 0.0,
+        'max_numeric': float(numbers.max()) if len(numbers) else None,
+    }
+
+
+class ColumnProfiler:
+    """Classifica le colonne dei file importati: tipo delle celle o suggerimento per domanda"""
+
+    def __init__(self, sample_size: int = SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.classifier = QuestionClassifier()
+
+    def classify_column(self, header: str, features: Dict[str, float]) -> Tuple[QuestionType, float]:
+        """
+        Classifica una colonna combinando intestazione e caratteristiche delle risposte
+
+        Args:
+            header: Intestazione della colonna (testo della domanda)
+            features: Risultato di profile_values()
+
+        Returns:
+            Tupla (tipo_domanda, confidenza)
+        """
+        header_type, header_confidence = self.classifier.classify_question(header or '')
+
+        # Dati anagrafici riconoscibili dall'intestazione (età, genere, titolo di studio...)
+        if header_type == QuestionType.DEMOGRAPHIC and header_confidence >= 0.7:
+            return header_type, header_confidence
+
+        # Per le altre colonne le caratteristiche delle risposte prevalgono sull'intestazione
+        if features['count']:
+            if features['numeric_ratio'] >= 0.9:
+                if features['max_numeric'] is not None and features['max_numeric'] <= 10 and features['distinct'] <= 11:
+                    return QuestionType.SCALE, features['numeric_ratio']
+                return QuestionType.NUMERIC, features['numeric_ratio']
+            if features['binary_ratio'] >= 0.8:
+                return QuestionType.CLOSED_BINARY, features['binary_ratio']
+            if features['likert_ratio'] >= 0.6 and features['distinct'] <= 10:
+                return QuestionType.LIKERT, features['likert_ratio']
+
+        if features['count'] >= 20 and features['distinct'] <= 12 and features['mean_length'] < 40:
+            # Poche risposte brevi ripetute: opzioni predefinite
+            return QuestionType.CLOSED_MULTIPLE, 1.0 - features['distinct_ratio']
+        if features['mean_length'] > 50 or features['distinct_ratio'] > 0.5:
+            return QuestionType.OPEN, min(1.0, 0.5 + features['distinct_ratio'] / 2)
+        return header_type, header_confidence
+
+    def _load_samples(self, excel_file_id: int) -> Tuple[Dict[Tuple[str, str], List[str]], Dict[Tuple[str, str], str]]:
+        """
+        Legge le prime sample_size risposte delle colonne con celle non classificate
+
+        Returns:
+            Tupla (campioni per colonna, tipo già assegnato alla colonna se presente)
+        """
+        active = db.and_(TextCell.excel_file_id == excel_file_id, TextCell.is_current)
+        columns = db.session.query(
+            TextCell.sheet_name, TextCell.column_name,
+            db.func.max(TextCell.question_type),
+            db.func.sum(db.case((TextCell.question_type.is_(None), 1), else_=0))
+        ).filter(active).group_by(TextCell.sheet_name, TextCell.column_name).all()
+
+        assigned = {(sheet, column): qtype for sheet, column, qtype, _ in columns if qtype is not None}
+        pending = {(sheet, column) for sheet, column, _, unclassified in columns if unclassified}
+        samples = {key: [] for key in pending if key not in assigned}
+        if not samples:
+            return {key: [] for key in pending}, assigned
+
+        # Le prime sample_size risposte (in ordine di riga) di tutte le colonne da classificare in una query
+        position = db.func.row_number().over(
+            partition_by=(TextCell.sheet_name, TextCell.column_name),
+            order_by=(TextCell.row_index, TextCell.id)
+        ).label('position')
+        ranked = db.session.query(
+            TextCell.sheet_name, TextCell.column_name, TextCell.text_content, position
+        ).filter(
+            active, TextCell.column_name.in_({column for _, column in samples})
+        ).subquery()
+        rows = db.session.query(ranked.c.sheet_name, ranked.c.column_name, ranked.c.text_content)\
+            .filter(ranked.c.position <= self.sample_size)\
+            .order_by(ranked.c.sheet_name, ranked.c.column_name, ranked.c.position)
+        for sheet_name, column_name, text in rows:
+            texts = samples.get((sheet_name, column_name))
+            if texts is not None:
+                texts.append(text)
+
+        return {key: samples.get(key, []) for key in pending}, assigned
+
+    def profile_file(self, excel_file_id: int) -> Dict[Tuple[str, str], str]:
+        """
+        Classifica le colonne del file con celle ancora senza tipo
+
+        Le colonne già classificate (anche manualmente, ad es. prima di una
+        nuova versione del file) mantengono il loro tipo, che viene esteso
+        alle nuove celle. Delle altre viene scritto sulle celle solo un tipo
+        in AUTO_APPLIED_TYPES; i tipi restituiti ma non scritti vanno salvati
+        come suggerimenti con store_suggestions() dopo aver ricostruito
+        gli aggregati per domanda.
+
+        Args:
+            excel_file_id: ID del file importato
+
+        Returns:
+            Dizionario (foglio, colonna) -> tipo rilevato o già assegnato
+        """
+        samples, assigned = self._load_samples(excel_file_id)
+        results = {}
+        applied = {}
+        for (sheet_name, column_name), texts in samples.items():
+            question_type = assigned.get((sheet_name, column_name))
+            if question_type is None:
+                detected, _ = self.classify_column(column_name, profile_values(pd.Series(texts, dtype=object)))
+                question_type = STORED_TYPES.get(detected, detected).value
+                if question_type in AUTO_APPLIED_TYPES:
+                    applied[(sheet_name, column_name)] = question_type
+            else:
+                applied[(sheet_name, column_name)] = question_type
+            results[(sheet_name, column_name)] = question_type
+
+        self.apply(excel_file_id, applied)
+        return results
+
+    def store_suggestions(self, excel_file_id: int, results: Dict[Tuple[str, str], str]):
+        """
+        Salva i tipi rilevati come suggerimento sulle domande ancora non classificate
+
+        Args:
+            excel_file_id: ID del file importato
+            results: Risultato di profile_file()
+        """
+        if not results:
+            return
+        table = QuestionStats.__table__
+        stmt = table.update().where(
+            table.c.excel_file_id == excel_file_id,
+            table.c.sheet_name == bindparam('b_sheet'),
+            table.c.column_name == bindparam('b_column'),
+            table.c.question_type.is_(None)
+        ).values(suggested_type=bindparam('b_type'))
+        db.session.execute(stmt, [
+            {'b_sheet': sheet_name, 'b_column': column_name, 'b_type': question_type}
+            for (sheet_name, column_name), question_type in results.items()
+        ])
+
+    def apply(self, excel_file_id: int, results: Dict[Tuple[str, str], Optional[str]]):
+        """Scrive i tipi sulle celle non classificate con un unico UPDATE executemany"""
+        if not results:
+            return
+        table = TextCell.__table__
+        stmt = table.update().where(
+            table.c.excel_file_id == excel_file_id,
+            table.c.sheet_name == bindparam('b_sheet'),
+            table.c.column_name == bindparam('b_column'),
+            table.c.question_type.is_(None)
+        ).values(question_type=bindparam('b_type'))
+        db.session.execute(stmt, [
+            {'b_sheet': sheet_name, 'b_column': column_name, 'b_type': question_type}
+            for (sheet_name, column_name), question_type in results.items()
+        ])
@@ -0,0 +1,243 @@
+"""
+Co-occorrenza e associazione tra le etichette delle celle.
+
+Le coppie (unità, etichetta) di un ambito (quesito, file, progetto o intero
+database) vengono lette con una sola query e raccolte nella matrice sparsa
+binaria X unità × etichette. Il prodotto Xᵀ·X dà in un colpo solo, per ogni
+coppia di etichette, il numero di unità che le hanno entrambe (fuori dalla
+diagonale) e, per ogni etichetta, il numero di unità che la hanno (sulla
+diagonale). Le misure di associazione vengono calcolate in blocco sugli
+elementi non nulli, senza cicli Python sulle coppie:
+
+- jaccard = n(a∧b) / n(a∨b)
+- lift = n(a∧b) · N / (n(a) · n(b)), con N unità annotate nell'ambito
+- pmi = log2(lift)
+
+L'unità è la cella (etichette assegnate da chiunque) o la cella di un
+annotatore (etichette assegnate dalla stessa persona). Come per l'accordo
+(services/agreement.py) sono escluse le celle rimosse da una nuova versione
+del file e le annotazioni AI rifiutate. I conteggi restano nella cache delle
+statistiche finché la versione dell'ambito non cambia.
+"""
+
+from itertools import chain
+from typing import Dict, List, Optional
+
+import numpy as np
+from scipy import sparse
+from sqlalchemy import or_
+
+from models import db, CellAnnotation, ExcelFile, TextCell
+from services.stats_cache import GLOBAL, cached, file_scope, question_scope
+
+UNITS = ('cell', 'annotator')
+MEASURES = ('count', 'jaccard', 'lift', 'pmi')
+
+
+class LabelCooccurrence:
+    """Conteggi di co-occorrenza delle etichette di un ambito"""
+
+    def __init__(self, label_ids, label_counts, n_units: int, first, second, counts):
+        """
+        Args:
+            label_ids: ID delle etichette usate nell'ambito (ordinati)
+            label_counts: Unità con ciascuna etichetta
+            n_units: Unità con almeno un'etichetta
+            first, second: Indici (in label_ids) delle coppie che co-occorrono, first < second
+            counts: Unità con entrambe le etichette di ogni coppia
+        """
+        self.label_ids = np.asarray(label_ids, dtype=np.int64)
+        self.label_counts = np.asarray(label_counts, dtype=np.int64)
+        self.n_units = int(n_units)
+        self.first = np.asarray(first, dtype=np.int64)
+        self.second = np.asarray(second, dtype=np.int64)
+        self.counts = np.asarray(counts, dtype=np.int64)
+        self._measures: Optional[Dict[str, np.ndarray]] = None
+
+    @classmethod
+    def from_annotations(cls, units: np.ndarray, labels: np.ndarray) -> 'LabelCooccurrence':
+        """
+        Conta le co-occorrenze da una coppia (unità, etichetta) per annotazione
+
+        Args:
+            units: Codice dell'unità di ogni annotazione
+            labels: ID dell'etichetta di ogni annotazione
+        """
+        unit_codes, unit_index = np.unique(units, return_inverse=True)
+        label_ids, label_index = np.unique(labels, return_inverse=True)
+        presence = sparse.csr_matrix(
+            (np.ones(len(units), dtype=np.int64), (unit_index, label_index)),
+            shape=(len(unit_codes), len(label_ids))
+        )
+        # La stessa etichetta sulla stessa unità (più annotatori) conta una volta
+        presence.sum_duplicates()
+        presence.data[:] = 1
+        pairs = sparse.triu(presence.T @ presence, k=1).tocoo()
+        return cls(label_ids, np.asarray(presence.sum(axis=0)).ravel(), len(unit_codes),
+                   pairs.row, pairs.col, pairs.data)
+
+    @classmethod
+    def from_payload(cls, payload: dict) -> 'LabelCooccurrence':
+        return cls(payload['label_ids'], payload['label_counts'], payload['n_units'],
+                   payload['first'], payload['second'], payload['counts'])
+
+    def to_payload(self) -> dict:
+        """Conteggi come liste (valore della cache delle statistiche)"""
+        return {
+            'label_ids': self.label_ids.tolist(),
+            'label_counts': self.label_counts.tolist(),
+            'n_units': self.n_units,
+            'first': self.first.tolist(),
+            'second': self.second.tolist(),
+            'counts': self.counts.tolist(),
+        }
+
+    def measures(self) -> Dict[str, np.ndarray]:
+        """Misura -> array allineato a first/second/counts"""
+        if self._measures is None:
+            counts = self.counts.astype(float)
+            first_counts = self.label_counts[self.first].astype(float)
+            second_counts = self.label_counts[self.second].astype(float)
+            lift = counts * self.n_units / (first_counts * second_counts)
+            self._measures = {
+                'count': self.counts,
+                'jaccard': counts / (first_counts + second_counts - counts),
+                'lift': lift,
+                'pmi': np.log2(lift),
+            }
+        return self._measures
+
+    def matrix(self, measure: str = 'count') -> sparse.csr_matrix:
+        """
+        Matrice sparsa simmetrica etichette × etichette di una misura
+
+        Le coppie che non co-occorrono (e la diagonale) non sono memorizzate.
+        """
+        values = self.measures()[measure]
+        size = len(self.label_ids)
+        return sparse.csr_matrix(
+            (np.concatenate([values, values]),
+             (np.concatenate([self.first, self.second]), np.concatenate([self.second, self.first]))),
+            shape=(size, size)
+        )
+
+    def top_labels(self, limit: int) -> np.ndarray:
+        """Indici delle etichette più frequenti"""
+        return np.argsort(-self.label_counts, kind='stable')[:limit]
+
+    def dense(self, indices, measure: str = 'count') -> np.ndarray:
+        """Sottomatrice densa tra le etichette indicate (NaN dove non co-occorrono)"""
+        indices = np.asarray(indices, dtype=np.int64)
+        present = self.matrix('count')[indices][:, indices].toarray() > 0
+        values = self.matrix(measure)[indices][:, indices].toarray().astype(float)
+        values[~present] = np.nan
+        return values
+
+    def pair_columns(self, measure: str = 'count', min_count: int = 1,
+                     limit: Optional[int] = None) -> Dict[str, np.ndarray]:
+        """
+        Colonne delle coppie ordinate per misura decrescente (a parità, per conteggio)
+
+        Args:
+            measure: Una di MEASURES
+            min_count: Scarta le coppie presenti in meno unità
+            limit: Numero massimo di coppie (None = tutte)
+
+        Returns:
+            Dizionario colonna -> array (ID e frequenze delle due etichette,
+            conteggio della coppia e misure di associazione)
+        """
+        measures = self.measures()
+        selected = np.flatnonzero(self.counts >= min_count)
+        order = selected[np.lexsort((-self.counts[selected], -measures[measure][selected]))]
+        if limit is not None:
+            order = order[:limit]
+        return {
+            'first_label_id': self.label_ids[self.first[order]],
+            'second_label_id': self.label_ids[self.second[order]],
+            'first_count': self.label_counts[self.first[order]],
+            'second_count': self.label_counts[self.second[order]],
+            'count': self.counts[order],
+            'jaccard': np.round(measures['jaccard'][order], 4),
+            'lift': np.round(measures['lift'][order], 4),
+            'pmi': np.round(measures['pmi'][order], 4),
+        }
+
+    def pairs(self, measure: str = 'count', min_count: int = 1, limit: Optional[int] = None) -> List[dict]:
+        """Coppie come dizionari (vedi pair_columns)"""
+        columns = {name: values.tolist() for name, values in self.pair_columns(measure, min_count, limit).items()}
+        return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+def load_label_units(file_id: Optional[int] = None, question: Optional[str] = None,
+                     project_id: Optional[int] = None, unit: str = 'cell'):
+    """
+    Legge con una sola query le etichette delle unità di un ambito
+
+    Args:
+        file_id: Limita alle celle di un file Excel
+        question: Limita alle celle di una colonna (quesito) del file
+        project_id: Limita ai file di un progetto
+        unit: 'cell' o 'annotator' (cella di ogni annotatore)
+
+    Returns:
+        Tupla (unità, etichette) di array allineati, un elemento per annotazione
+    """
+    query = db.session.query(
+        CellAnnotation.text_cell_id, CellAnnotation.user_id, CellAnnotation.label_id
+    ).join(TextCell, TextCell.id == CellAnnotation.text_cell_id).filter(
+        TextCell.is_current,
+        or_(CellAnnotation.status.is_(None), CellAnnotation.status != 'rejected')
+    )
+    if file_id is not None:
+        query = query.filter(TextCell.excel_file_id == file_id)
+    if question is not None:
+        query = query.filter(TextCell.column_name == question)
+    if project_id is not None:
+        query = query.join(ExcelFile, ExcelFile.id == TextCell.excel_file_id)\
+            .filter(ExcelFile.project_id == project_id)
+    rows = query.all()
+    # np.asarray sulle Row di SQLAlchemy è lento (cerca l'interfaccia array in ogni riga)
+    triples = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+    cells, users, labels = triples[:, 0], triples[:, 1], triples[:, 2]
+    if unit == 'annotator':
+        return cells * (int(users.max(initial=0)) + 1) + users, labels
+    return cells, labels
+
+
+def cooccurrence_scopes(file_id: Optional[int] = None, question: Optional[str] = None) -> List[str]:
+    """Ambiti della cache delle statistiche da cui dipendono i conteggi"""
+    if file_id is None:
+        # Progetto o intero database: qualunque scrittura può cambiarli
+        return [GLOBAL]
+    if question is None:
+        return [file_scope(file_id)]
+    return [question_scope(file_id, question)]
+
+
+def label_cooccurrence(file_id: Optional[int] = None, question: Optional[str] = None,
+                       project_id: Optional[int] = None, unit: str = 'cell') -> LabelCooccurrence:
+    """
+    Co-occorrenze delle etichette di un ambito, dalla cache delle statistiche
+
+    Args:
+        file_id: File Excel (None = tutti i file, o quelli del progetto)
+        question: Colonna (quesito) del file
+        project_id: Progetto (ignorato se è indicato un file)
+        unit: 'cell' o 'annotator'
+    """
+    if unit not in UNITS:
+        raise ValueError(f"Unità non valida: {unit}")
+    if file_id is None:
+        question = None
+    else:
+        project_id = None
+
+    def compute():
+        units, labels = load_label_units(file_id=file_id, question=question, project_id=project_id, unit=unit)
+        return LabelCooccurrence.from_annotations(units, labels).to_payload()
+
+    payload = cached('label_cooccurrence', compute,
+                     scopes=cooccurrence_scopes(file_id, question),
+                     params={'file_id': file_id, 'question': question, 'project_id': project_id, 'unit': unit})
+    return LabelCooccurrence.from_payload(payload)
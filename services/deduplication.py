@@ -0,0 +1,122 @@
+"""
+Servizio per la deduplicazione dei file caricati e dei testi delle risposte
+"""
+
+import hashlib
+import re
+import unicodedata
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from models import ExcelFile, TextCell
+
+# Dimensione dei blocchi letti durante il calcolo degli hash dei file
+HASH_BLOCK_SIZE = 1024 * 1024
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_text(text: str) -> str:
+    """
+    Normalizza una risposta per il confronto tra testi identici:
+    forma Unicode NFKC, minuscole (casefold) e spazi compattati
+
+    Args:
+        text: Testo della cella
+
+    Returns:
+        Testo normalizzato
+    """
+    text = unicodedata.normalize('NFKC', text or '')
+    return _WHITESPACE_RE.sub(' ', text.casefold()).strip()
+
+
+def text_hash(text: str) -> str:
+    """
+    Hash del testo normalizzato, salvato in TextCell.text_hash
+
+    Args:
+        text: Testo della cella
+
+    Returns:
+        Stringa esadecimale di 32 caratteri
+    """
+    return hashlib.blake2b(normalize_text(text).encode('utf-8'), digest_size=16).hexdigest()
+
+
+def save_with_sha256(file_storage, destination: str) -> str:
+    """
+    Salva un file caricato calcolandone lo SHA-256 durante la scrittura,
+    senza tenere l'intero file in memoria
+
+    Args:
+        file_storage: FileStorage di Werkzeug
+        destination: Percorso di destinazione
+
+    Returns:
+        SHA-256 esadecimale del contenuto
+    """
+    digest = hashlib.sha256()
+    with open(destination, 'wb') as output:
+        while True:
+            block = file_storage.stream.read(HASH_BLOCK_SIZE)
+            if not block:
+                break
+            digest.update(block)
+            output.write(block)
+    return digest.hexdigest()
+
+
+def file_sha256(file_path: str) -> str:
+    """Calcola lo SHA-256 di un file su disco"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as handle:
+        for block in iter(lambda: handle.read(HASH_BLOCK_SIZE), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def find_duplicate_file(sha256: str) -> Optional[ExcelFile]:
+    """
+    Cerca un file già caricato con lo stesso contenuto (ricerca indicizzata)
+
+    Args:
+        sha256: Hash del file appena caricato
+
+    Returns:
+        Il primo ExcelFile non fallito con lo stesso hash, se esiste
+    """
+    if not sha256:
+        return None
+    return ExcelFile.query.filter(
+        ExcelFile.file_sha256 == sha256,
+        ExcelFile.status != 'failed'
+    ).order_by(ExcelFile.uploaded_at).first()
+
+
+def group_cells_by_text_hash(cells: Iterable[TextCell]) -> Tuple[List[TextCell], Dict[int, List[TextCell]]]:
+    """
+    Raggruppa le celle con risposte identiche alla stessa domanda
+
+    La stessa risposta data a domande diverse può avere significati diversi:
+    i gruppi sono distinti per colonna.
+
+    Args:
+        cells: Celle da raggruppare
+
+    Returns:
+        Tupla (rappresentanti, duplicati) dove duplicati mappa l'ID del
+        rappresentante alle altre celle della stessa colonna con lo stesso testo normalizzato
+    """
+    groups: 'OrderedDict[Tuple[str, str], List[TextCell]]' = OrderedDict()
+    for cell in cells:
+        key = (cell.column_name, cell.text_hash or text_hash(cell.text_content))
+        groups.setdefault(key, []).append(cell)
+
+    representatives = []
+    duplicates = {}
+    for group in groups.values():
+        representatives.append(group[0])
+        if len(group) > 1:
+            duplicates[group[0].id] = group[1:]
+    return representatives, duplicates
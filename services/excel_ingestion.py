@@ -0,0 +1,234 @@
+"""
+Servizio per l'ingestione in streaming dei file caricati (Excel, ODS, CSV, Parquet)
+"""
+
+import multiprocessing
+import os
+import queue
+from datetime import datetime
+from typing import Any, Callable, Dict, Iterable, Iterator, Optional
+
+from models import db
+from services.deduplication import text_hash
+from services.file_loaders import column_name_for, get_loader
+from services.search import bulk_insert
+from services.sheet_parser import QUEUE_DEPTH, count_sheets, iter_text_values, parse_sheets_worker
+
+# Numero di celle scritte per ogni batch executemany
+DEFAULT_CHUNK_SIZE = 5000
+
+
+def _worker_context():
+    """
+    Contesto multiprocessing dei processi di analisi
+
+    'forkserver' crea i processi da un server a thread singolo (niente fork
+    di un processo con thread attivi, come i job in background) che ha già
+    importato solo services.sheet_parser: l'avvio di ogni processo costa una
+    fork invece di un nuovo interprete che reimporta l'applicazione, come
+    accadrebbe con 'spawn' (usato dove forkserver non è disponibile).
+    """
+    if 'forkserver' not in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('spawn')
+    context = multiprocessing.get_context('forkserver')
+    context.set_forkserver_preload(['services.sheet_parser'])
+    return context
+
+
+class ExcelIngestionService:
+    """
+    Estrae le celle testuali da un file caricato leggendo le righe in streaming
+    (vedi services.file_loaders) e le inserisce con executemany a blocchi.
+
+    La memoria occupata dipende solo dalla dimensione del blocco e non dalla
+    dimensione del file, anche con workers > 1 (fogli analizzati in parallelo,
+    vedi iter_cells_parallel).
+    """
+
+    def __init__(self, chunk_size: Optional[int] = None, workers: Optional[int] = None):
+        self.chunk_size = chunk_size or DEFAULT_CHUNK_SIZE
+        # Con più di un worker i fogli vengono analizzati in parallelo (vedi iter_cells_parallel)
+        self.workers = workers or 1
+        # Righe di dati lette finora (consultabile dalle callback di avanzamento)
+        self.rows_read = 0
+
+    def iter_cells(self, file_path: str, excel_file_id: int) -> Iterator[Dict[str, Any]]:
+        """
+        Genera i dizionari pronti per l'inserimento di TextCell.
+
+        Sceglie il percorso più veloce offerto dal loader del formato:
+        blocchi colonnari (Parquet), fogli in parallelo (xlsx con workers > 1)
+        o lettura riga per riga.
+
+        Args:
+            file_path: Percorso del file caricato
+            excel_file_id: ID del record ExcelFile
+
+        Yields:
+            Dizionari con le colonne della tabella text_cell
+        """
+        loader = get_loader(file_path)
+        if loader.supports_columnar:
+            self.rows_read = 0
+            yield from self._expand_batches(loader.iter_text_batches(file_path), excel_file_id)
+            return
+        if self.workers > 1 and loader.supports_parallel:
+            yield from self.iter_cells_parallel(file_path, excel_file_id)
+            return
+
+        yield from self._iter_cells_serial(loader, file_path, excel_file_id)
+
+    def _iter_cells_serial(self, loader, file_path: str, excel_file_id: int) -> Iterator[Dict[str, Any]]:
+        """Lettura riga per riga con il loader del formato"""
+        now = datetime.utcnow()
+        self.rows_read = 0
+        for sheet_name, headers, rows in loader.iter_sheets(file_path):
+            for row_idx, col_idx, text in iter_text_values(self._count_rows(rows)):
+                yield {
+                    'excel_file_id': excel_file_id,
+                    'sheet_name': sheet_name,
+                    'row_index': row_idx,
+                    'column_index': col_idx,
+                    'column_name': column_name_for(headers, col_idx),
+                    'text_content': text,
+                    'created_at': now,
+                }
+
+    def iter_cells_parallel(self, file_path: str, excel_file_id: int) -> Iterator[Dict[str, Any]]:
+        """
+        Come iter_cells, ma analizza i fogli in processi separati.
+
+        Il processo k analizza i fogli k, k + workers, ... e invia blocchi di
+        al più chunk_size celle su una coda limitata (vedi services.sheet_parser);
+        il processo principale legge i fogli nell'ordine del workbook, quindi
+        l'ordine di inserimento e i valori di sheet_name/row_index/column_index
+        sono identici a quelli della modalità seriale. Conviene solo con più
+        core liberi e fogli grandi: l'analisi XML dei fogli procede in parallelo
+        con le scritture nel database, ma ogni processo paga l'avvio e la
+        lettura delle stringhe condivise del workbook.
+
+        Args:
+            file_path: Percorso del file Excel
+            excel_file_id: ID del record ExcelFile
+
+        Yields:
+            Dizionari con le colonne della tabella text_cell
+        """
+        # Più processi dei core disponibili o dei fogli non servono a nulla
+        workers = min(self.workers, os.cpu_count() or 1, count_sheets(file_path))
+        if workers <= 1:
+            yield from self._iter_cells_serial(get_loader(file_path), file_path, excel_file_id)
+            return
+
+        self.rows_read = 0
+        context = _worker_context()
+        queues = [context.Queue(maxsize=QUEUE_DEPTH) for _ in range(workers)]
+        processes = [
+            context.Process(target=parse_sheets_worker, daemon=True,
+                            args=(file_path, k, workers, queues[k], self.chunk_size))
+            for k in range(workers)
+        ]
+        for process in processes:
+            process.start()
+        try:
+            yield from self._expand_batches(self._collect_batches(queues, processes), excel_file_id)
+        finally:
+            for process in processes:
+                if process.is_alive():
+                    process.terminate()
+                process.join()
+
+    @staticmethod
+    def _collect_batches(queues, processes) -> Iterator[Dict[str, Any]]:
+        """Legge i blocchi dei processi di lavoro nell'ordine dei fogli"""
+        sheet_index = 0
+        while True:
+            worker = sheet_index % len(queues)
+            try:
+                batch = queues[worker].get(timeout=1)
+            except queue.Empty:
+                if not processes[worker].is_alive():
+                    raise RuntimeError(f"Il processo di analisi del foglio {sheet_index} è terminato "
+                                       f"(codice {processes[worker].exitcode})")
+                continue
+            if batch is None:
+                # Il processo non ha il foglio: i fogli sono finiti
+                return
+            if isinstance(batch, tuple):
+                raise RuntimeError(f"Analisi del foglio {sheet_index} non riuscita:\n{batch[1]}")
+            yield batch
+            if batch['last']:
+                sheet_index += 1
+
+    def _expand_batches(self, batches: Iterable[Dict[str, Any]], excel_file_id: int) -> Iterator[Dict[str, Any]]:
+        """Converte i blocchi colonnari (vedi services.sheet_parser) in righe di text_cell"""
+        now = datetime.utcnow()
+        for batch in batches:
+            headers = batch['headers']
+            sheet_name = batch['sheet_name']
+            for row_idx, col_idx, text in zip(batch['row_index'], batch['column_index'],
+                                              batch['text_content']):
+                yield {
+                    'excel_file_id': excel_file_id,
+                    'sheet_name': sheet_name,
+                    'row_index': row_idx,
+                    'column_index': col_idx,
+                    'column_name': column_name_for(headers, col_idx),
+                    'text_content': text,
+                    'created_at': now,
+                }
+            self.rows_read += batch['rows_read']
+
+    def _count_rows(self, rows):
+        """Aggiorna rows_read mentre le righe vengono consumate"""
+        for row in rows:
+            self.rows_read += 1
+            yield row
+
+    def ingest(self, file_path: str, excel_file_id: int,
+               progress_callback: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Inserisce tutte le celle testuali del file con batch executemany
+
+        Args:
+            file_path: Percorso del file caricato
+            excel_file_id: ID del record ExcelFile
+            progress_callback: Funzione chiamata con il numero di celle inserite dopo ogni batch
+
+        Returns:
+            Numero di celle inserite
+        """
+        return self.insert_rows(self.iter_cells(file_path, excel_file_id), progress_callback)
+
+    def insert_rows(self, rows: Iterator[Dict[str, Any]],
+                    progress_callback: Optional[Callable[[int], None]] = None) -> int:
+        """
+        Scrive le righe di text_cell a blocchi di chunk_size con un insert Core,
+        calcolando l'hash del testo normalizzato se non già presente; ogni blocco
+        viene aggiunto all'indice di ricerca con un'unica istruzione (bulk_insert)
+
+        Args:
+            rows: Iteratore di dizionari con le colonne di text_cell
+            progress_callback: Funzione chiamata con il totale inserito dopo ogni batch
+
+        Returns:
+            Numero di righe inserite
+        """
+        inserted = 0
+        batch = []
+        for row in rows:
+            if 'text_hash' not in row:
+                row['text_hash'] = text_hash(row['text_content'])
+            batch.append(row)
+            if len(batch) >= self.chunk_size:
+                bulk_insert(db.session, 'cells', batch)
+                inserted += len(batch)
+                batch = []
+                if progress_callback:
+                    progress_callback(inserted)
+        if batch:
+            bulk_insert(db.session, 'cells', batch)
+            inserted += len(batch)
+            if progress_callback:
+                progress_callback(inserted)
+        return inserted
@@ -0,0 +1,223 @@
+"""
+Servizio per il caricamento di una nuova versione di un file già importato.
+
+Il confronto avviene in un'unica passata sul nuovo file: ogni cella è
+identificata da (foglio, chiave di riga, colonna) e confrontata con l'hash
+del testo già presente. Vengono inserite solo le celle nuove o modificate;
+le celle invariate (e quindi le loro annotazioni) restano al loro posto.
+"""
+
+import hashlib
+from datetime import datetime
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import bindparam
+
+from models import db, AnnotationAction, AnnotationActionArchive, CellAnnotation, ExcelFile, TextCell
+from services.action_log import segment_cell_ids
+from services.excel_ingestion import ExcelIngestionService, iter_text_values
+from services.file_loaders import column_name_for, get_loader
+from services.stats_cache import invalidate_on_commit, question_scope
+
+CellKey = Tuple[str, str, str]
+
+
+def content_digest(text: str) -> bytes:
+    """Hash compatto del contenuto esatto di una cella"""
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+
+def format_row_key(value) -> Optional[str]:
+    """
+    Normalizza il valore della colonna chiave (es. ID rispondente, timestamp)
+
+    Returns:
+        La chiave come stringa, o None se la cella è vuota
+    """
+    if value is None:
+        return None
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    key = str(value).strip()
+    return key or None
+
+
+class ExcelVersionService:
+    """Confronta una nuova versione del file con le TextCell esistenti e applica le differenze"""
+
+    def __init__(self, chunk_size: Optional[int] = None):
+        self.ingestion = ExcelIngestionService(chunk_size=chunk_size)
+        self.chunk_size = self.ingestion.chunk_size
+        self.started_at = None
+
+    @property
+    def rows_read(self):
+        return self.ingestion.rows_read
+
+    def _row_keys(self, headers, key_column, row_idx, row):
+        """Chiave della riga: valore della colonna chiave oppure posizione della riga"""
+        if key_column and key_column in headers:
+            key_idx = headers.index(key_column)
+            if key_idx < len(row):
+                key = format_row_key(row[key_idx])
+                if key is not None:
+                    return key
+        return f'#{row_idx}'
+
+    def _old_row_keys(self, excel_file: ExcelFile, key_column: str) -> Dict[Tuple[str, int], str]:
+        """
+        Ricostruisce le chiavi di riga della versione corrente dal file su disco
+        (per le celle importate prima che la chiave venisse salvata)
+        """
+        loader = get_loader(excel_file.file_path)
+        keys = {}
+        for sheet_name, headers, rows in loader.iter_sheets(excel_file.file_path):
+            for row_idx, row in enumerate(rows, start=1):
+                keys[(sheet_name, row_idx)] = self._row_keys(headers, key_column, row_idx, row)
+        return keys
+
+    def _load_existing(self, excel_file: ExcelFile, key_column: Optional[str]) -> Dict[CellKey, Dict[str, Any]]:
+        """Carica le celle attive del file indicizzate per (foglio, chiave di riga, colonna)"""
+        query = db.session.query(
+            TextCell.id, TextCell.sheet_name, TextCell.row_index, TextCell.column_index,
+            TextCell.column_name, TextCell.row_key, TextCell.text_content
+        ).filter(
+            TextCell.excel_file_id == excel_file.id,
+            TextCell.is_current
+        ).execution_options(yield_per=10000)
+
+        fallback_keys = None
+        existing = {}
+        for cell in query:
+            row_key = cell.row_key
+            if row_key is None:
+                if key_column:
+                    if fallback_keys is None:
+                        fallback_keys = self._old_row_keys(excel_file, key_column)
+                    row_key = fallback_keys.get((cell.sheet_name, cell.row_index), f'#{cell.row_index}')
+                else:
+                    row_key = f'#{cell.row_index}'
+            existing[(cell.sheet_name, row_key, cell.column_name)] = {
+                'id': cell.id,
+                'digest': content_digest(cell.text_content),
+                'row_index': cell.row_index,
+                'column_index': cell.column_index,
+                'row_key': cell.row_key,
+            }
+        return existing
+
+    def apply_new_version(self, excel_file: ExcelFile, new_file_path: str,
+                          key_column: Optional[str] = None, progress_callback=None) -> Dict[str, int]:
+        """
+        Applica una nuova versione del file con scritture a blocchi
+
+        Args:
+            excel_file: File di cui caricare la nuova versione
+            new_file_path: Percorso del nuovo file
+            key_column: Colonna che identifica il rispondente (None = posizione della riga)
+            progress_callback: Funzione chiamata con il numero di celle inserite dopo ogni batch
+
+        Returns:
+            Dizionario con i conteggi inserted (celle nuove o modificate),
+            changed, unchanged, moved, removed
+        """
+        existing = self._load_existing(excel_file, key_column)
+        loader = get_loader(new_file_path)
+        # Marca temporale delle celle inserite: permette di annullarle se il job fallisce
+        now = self.started_at = datetime.utcnow()
+
+        summary = {'inserted': 0, 'changed': 0, 'unchanged': 0, 'moved': 0, 'removed': 0}
+        position_updates = []
+        removed_ids = []
+
+        def new_cells():
+            self.ingestion.rows_read = 0
+            for sheet_name, headers, rows in loader.iter_sheets(new_file_path):
+                # Una riga alla volta: serve la chiave di riga prima delle sue celle
+                for row_idx, row in enumerate(rows, start=1):
+                    self.ingestion.rows_read += 1
+                    row_key = self._row_keys(headers, key_column, row_idx, row)
+                    for _, col_idx, text in iter_text_values([row]):
+                        column_name = column_name_for(headers, col_idx)
+                        old = existing.pop((sheet_name, row_key, column_name), None)
+                        if old is not None and old['digest'] == content_digest(text):
+                            summary['unchanged'] += 1
+                            moved = (old['row_index'], old['column_index']) != (row_idx, col_idx)
+                            if moved:
+                                summary['moved'] += 1
+                            if moved or old['row_key'] != row_key:
+                                position_updates.append({
+                                    'b_id': old['id'], 'b_row_index': row_idx,
+                                    'b_column_index': col_idx, 'b_row_key': row_key
+                                })
+                            continue
+                        if old is not None:
+                            summary['changed'] += 1
+                            removed_ids.append(old['id'])
+                        yield {
+                            'excel_file_id': excel_file.id,
+                            'sheet_name': sheet_name,
+                            'row_index': row_idx,
+                            'column_index': col_idx,
+                            'column_name': column_name,
+                            'row_key': row_key,
+                            'text_content': text,
+                            'created_at': now,
+                        }
+
+        summary['inserted'] = self.ingestion.insert_rows(new_cells(), progress_callback)
+        # Le celle rimaste non compaiono più nella nuova versione
+        removed_ids.extend(old['id'] for old in existing.values())
+        summary['removed'] = len(removed_ids) - summary['changed']
+
+        self._update_positions(position_updates)
+        self._retire_cells(removed_ids, now)
+
+        excel_file.file_path = new_file_path
+        excel_file.version = (excel_file.version or 1) + 1
+        excel_file.row_key_column = key_column
+        return summary
+
+    def _update_positions(self, updates):
+        """Aggiorna riga/colonna delle celle invariate che si sono spostate"""
+        table = TextCell.__table__
+        stmt = table.update().where(table.c.id == bindparam('b_id')).values(
+            row_index=bindparam('b_row_index'),
+            column_index=bindparam('b_column_index'),
+            row_key=bindparam('b_row_key')
+        )
+        for start in range(0, len(updates), self.chunk_size):
+            db.session.execute(stmt, updates[start:start + self.chunk_size])
+
+    def _retire_cells(self, cell_ids, removed_at):
+        """
+        Ritira le celle modificate o rimosse: quelle annotate vengono solo
+        marcate come rimosse (le annotazioni restano consultabili), le altre eliminate
+        """
+        table = TextCell.__table__
+        # Storico compattato nei segmenti JSONL (ACTION_ARCHIVE_BACKEND='jsonl'): letto una volta sola
+        archived = segment_cell_ids(cell_ids)
+        for start in range(0, len(cell_ids), self.chunk_size):
+            chunk = cell_ids[start:start + self.chunk_size]
+            # Le annotazioni delle celle ritirate escono dalle statistiche dei loro quesiti
+            questions = db.session.execute(
+                db.select(table.c.excel_file_id, table.c.column_name).where(table.c.id.in_(chunk)).distinct()
+            ).all()
+            invalidate_on_commit(db.session, *(question_scope(file_id, column_name)
+                                               for file_id, column_name in questions))
+            # Celle con annotazioni o con storico delle azioni da conservare
+            annotated = db.union(
+                db.select(CellAnnotation.text_cell_id).where(CellAnnotation.text_cell_id.in_(chunk)),
+                db.select(AnnotationAction.text_cell_id).where(AnnotationAction.text_cell_id.in_(chunk)),
+                db.select(AnnotationActionArchive.text_cell_id).where(AnnotationActionArchive.text_cell_id.in_(chunk))
+            )
+            keep = db.or_(table.c.id.in_(annotated), table.c.id.in_([cell_id for cell_id in chunk if cell_id in archived]))
+            db.session.execute(
+                table.update()
+                .where(table.c.id.in_(chunk), keep)
+                .values(removed_at=removed_at)
+            )
+            db.session.execute(
+                table.delete()
+                .where(table.c.id.in_(chunk), db.not_(keep))
+            )
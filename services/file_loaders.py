@@ -0,0 +1,378 @@
+"""
+Loader dei formati tabellari supportati in ingestione (xlsx, xls, ods, csv, parquet).
+
+Tutti i loader espongono la stessa interfaccia: iter_sheets() restituisce per
+ogni foglio il nome, le intestazioni e un iteratore delle righe di dati, così
+il servizio di ingestione produce gli stessi record ExcelFile/TextCell a
+prescindere dal formato di partenza.
+"""
+
+import codecs
+import csv
+import os
+import re
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from openpyxl import load_workbook
+
+try:
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Nome del foglio per i formati a tabella singola: è lo stesso che si otteneva
+# convertendo il file in Excel prima del caricamento
+SINGLE_SHEET_NAME = 'Sheet1'
+
+# Valori CSV trattati come numeri (e quindi ignorati come nelle celle numeriche Excel)
+NUMERIC_RE = re.compile(r'^\s*[+-]?(\d+([.,]\d*)?|[.,]\d+)\s*$')
+
+
+def build_headers(header_row) -> List[str]:
+    """
+    Costruisce i nomi delle colonne a partire dalla prima riga del foglio,
+    replicando le convenzioni di pandas.read_excel(header=0)
+
+    Args:
+        header_row: Tupla dei valori della prima riga
+
+    Returns:
+        Lista dei nomi di colonna ('Unnamed: N' per le intestazioni vuote,
+        suffisso '.N' per i duplicati)
+    """
+    headers = []
+    seen = {}
+    for col_idx, value in enumerate(header_row or ()):
+        if value is None or (isinstance(value, str) and value == ''):
+            name = f'Unnamed: {col_idx}'
+        else:
+            name = value if isinstance(value, str) else str(value)
+
+        if name in seen:
+            # Stessa regola di deduplica di pandas: 'Q', 'Q.1', 'Q.2', ...
+            counter = seen[name]
+            candidate = f'{name}.{counter}'
+            while candidate in seen:
+                counter += 1
+                candidate = f'{name}.{counter}'
+            seen[name] = counter + 1
+            seen[candidate] = 1
+            name = candidate
+        else:
+            seen[name] = 1
+        headers.append(name)
+    return headers
+
+
+def column_name_for(headers: List[str], col_idx: int) -> str:
+    """Restituisce il nome della colonna, anche oltre la larghezza dell'intestazione"""
+    if col_idx < len(headers):
+        return headers[col_idx]
+    return f'Unnamed: {col_idx}'
+
+
+class SheetLoader:
+    """
+    Interfaccia comune dei loader.
+
+    Le sottoclassi implementano iter_sheets(); quelle che leggono formati
+    colonnari possono fornire anche iter_text_batches() come percorso veloce.
+    """
+
+    extensions: Tuple[str, ...] = ()
+    # True se i fogli possono essere analizzati in processi separati (vedi services.sheet_parser)
+    supports_parallel = False
+    # True se il loader implementa iter_text_batches()
+    supports_columnar = False
+
+    def iter_sheets(self, file_path: str) -> Iterator[Tuple[str, List[str], Iterator[tuple]]]:
+        """
+        Itera sui fogli del file
+
+        Args:
+            file_path: Percorso del file
+
+        Yields:
+            Tuple (nome_foglio, intestazioni, iteratore delle righe di dati)
+        """
+        raise NotImplementedError
+
+    def iter_text_batches(self, file_path: str) -> Iterator[Dict[str, Any]]:
+        """
+        Restituisce le celle di testo già filtrate in blocchi colonnari
+
+        Yields:
+            Dizionari con sheet_name, headers, rows_read e le sequenze
+            row_index, column_index, text_content
+        """
+        raise NotImplementedError
+
+    def estimate_rows(self, file_path: str) -> Optional[int]:
+        """Stima il numero di righe di dati (None se non è possibile senza leggere il file)"""
+        return None
+
+
+class XlsxLoader(SheetLoader):
+    """File .xlsx letti in streaming con openpyxl in modalità read_only"""
+
+    extensions = ('xlsx', 'xlsm')
+    supports_parallel = True
+
+    def iter_sheets(self, file_path):
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for worksheet in workbook.worksheets:
+                # Le dimensioni salvate nel file non sono affidabili (es. export di Google Forms)
+                worksheet.reset_dimensions()
+                rows = worksheet.iter_rows(values_only=True)
+                header_row = next(rows, None)
+                if header_row is None:
+                    continue
+                yield worksheet.title, build_headers(header_row), rows
+        finally:
+            workbook.close()
+
+    def estimate_rows(self, file_path):
+        try:
+            workbook = load_workbook(file_path, read_only=True)
+        except Exception:
+            return None
+        try:
+            total = 0
+            for worksheet in workbook.worksheets:
+                if worksheet.max_row is None:
+                    return None
+                total += max(0, worksheet.max_row - 1)
+            return total
+        finally:
+            workbook.close()
+
+
+class PandasSheetLoader(SheetLoader):
+    """
+    Formati senza lettura in streaming (.xls, .ods): ogni foglio viene letto
+    con pandas uno alla volta, senza intestazione, e restituito riga per riga.
+    """
+
+    engine: Optional[str] = None
+
+    def iter_sheets(self, file_path):
+        import pandas as pd
+
+        with pd.ExcelFile(file_path, engine=self.engine) as workbook:
+            for sheet_name in workbook.sheet_names:
+                df = workbook.parse(sheet_name, header=None, dtype=object)
+                if df.empty:
+                    continue
+                df = df.astype(object).where(df.notna(), None)
+                rows = df.itertuples(index=False, name=None)
+                yield sheet_name, build_headers(next(rows)), rows
+
+
+class XlsLoader(PandasSheetLoader):
+    """File Excel 97-2003 (.xls)"""
+
+    extensions = ('xls',)
+
+
+class OdsLoader(PandasSheetLoader):
+    """Fogli OpenDocument (.ods), richiede odfpy"""
+
+    extensions = ('ods',)
+    engine = 'odf'
+
+
+class CsvLoader(SheetLoader):
+    """File CSV letti in streaming con il modulo csv"""
+
+    extensions = ('csv', 'tsv')
+
+    # Codifiche provate in ordine dopo il controllo del BOM: UTF-8, poi quella
+    # degli export di Excel per Windows in italiano (compatibile con latin-1 per le lettere accentate)
+    fallback_encodings = ('utf-8', 'cp1252')
+    read_size = 1024 * 1024
+
+    def iter_sheets(self, file_path):
+        with open(file_path, newline='', encoding=self.detect_encoding(file_path)) as handle:
+            dialect = self._sniff_dialect(handle.read(64 * 1024))
+            handle.seek(0)
+            reader = csv.reader(handle, dialect)
+            header_row = next(reader, None)
+            if header_row is None:
+                return
+            yield SINGLE_SHEET_NAME, build_headers(header_row), (
+                [self._coerce(value) for value in row] for row in reader
+            )
+
+    def detect_encoding(self, file_path: str) -> str:
+        """
+        Riconosce la codifica del file dal BOM o provando a decodificarlo per intero
+
+        Il file viene letto a blocchi con un decoder incrementale, senza
+        tenerlo in memoria: un carattere non valido in fondo al file fa
+        scartare la codifica quanto uno all'inizio.
+
+        Raises:
+            ValueError: Se il file non è valido in nessuna delle codifiche supportate
+        """
+        with open(file_path, 'rb') as handle:
+            head = handle.read(4)
+        if head.startswith(codecs.BOM_UTF8):
+            return 'utf-8-sig'
+        if head.startswith((codecs.BOM_UTF16_LE, codecs.BOM_UTF16_BE)):
+            return 'utf-16'
+
+        for encoding in self.fallback_encodings:
+            decoder = codecs.getincrementaldecoder(encoding)()
+            try:
+                with open(file_path, 'rb') as handle:
+                    for block in iter(lambda: handle.read(self.read_size), b''):
+                        decoder.decode(block)
+                decoder.decode(b'', final=True)
+                return encoding
+            except UnicodeDecodeError:
+                continue
+        raise ValueError('Codifica del file CSV non riconosciuta: salvarlo come "CSV UTF-8" e ricaricarlo')
+
+    @staticmethod
+    def _sniff_dialect(sample):
+        """Riconosce il separatore (virgola, punto e virgola, tab) dal campione iniziale"""
+        try:
+            return csv.Sniffer().sniff(sample, delimiters=',;\t|')
+        except csv.Error:
+            return csv.excel
+
+    @staticmethod
+    def _coerce(value):
+        """I valori numerici non sono testo: vengono scartati come le celle numeriche Excel"""
+        if NUMERIC_RE.match(value):
+            return None
+        return value
+
+
+class ParquetLoader(SheetLoader):
+    """
+    File Parquet letti con pyarrow in memory-map.
+
+    Il percorso veloce (iter_text_batches) filtra le celle con le funzioni
+    vettoriali di pyarrow senza mai costruire le righe in Python.
+    """
+
+    extensions = ('parquet',)
+    supports_columnar = True
+    batch_rows = 65536
+
+    def _open(self, file_path):
+        if not PARQUET_AVAILABLE:
+            raise RuntimeError('Il supporto Parquet richiede il pacchetto pyarrow')
+        return pq.ParquetFile(file_path, memory_map=True)
+
+    def iter_sheets(self, file_path):
+        parquet_file = self._open(file_path)
+        headers = build_headers(parquet_file.schema_arrow.names)
+
+        def rows():
+            for record_batch in parquet_file.iter_batches(batch_size=self.batch_rows):
+                columns = [column.to_pylist() for column in record_batch.columns]
+                yield from zip(*columns)
+
+        yield SINGLE_SHEET_NAME, headers, rows()
+
+    def iter_text_batches(self, file_path):
+        import numpy as np
+
+        parquet_file = self._open(file_path)
+        schema = parquet_file.schema_arrow
+        headers = build_headers(schema.names)
+        text_columns = [
+            idx for idx, field in enumerate(schema)
+            if pa.types.is_string(field.type) or pa.types.is_large_string(field.type)
+            or (pa.types.is_dictionary(field.type) and pa.types.is_string(field.type.value_type))
+        ]
+
+        row_offset = 0
+        for record_batch in parquet_file.iter_batches(batch_size=self.batch_rows):
+            row_parts, col_parts, text_parts = [], [], []
+            for col_idx in text_columns:
+                column = record_batch.column(col_idx)
+                if pa.types.is_dictionary(column.type):
+                    column = column.cast(pa.string())
+                trimmed = pc.utf8_trim_whitespace(column)
+                mask = pc.fill_null(pc.greater(pc.utf8_length(trimmed), 0), False)
+                positions = pc.indices_nonzero(mask).to_numpy()
+                if len(positions) == 0:
+                    continue
+                row_parts.append(positions + row_offset + 1)
+                col_parts.append(np.full(len(positions), col_idx))
+                text_parts.extend(pc.filter(trimmed, mask).to_pylist())
+
+            row_index, column_index, text_content = [], [], []
+            if row_parts:
+                rows_array = np.concatenate(row_parts)
+                columns_array = np.concatenate(col_parts)
+                # Ordine riga per riga, come nella lettura dei fogli Excel
+                order = np.lexsort((columns_array, rows_array))
+                row_index = rows_array[order].tolist()
+                column_index = columns_array[order].tolist()
+                text_content = [text_parts[i] for i in order]
+
+            yield {
+                'sheet_name': SINGLE_SHEET_NAME,
+                'headers': headers,
+                'rows_read': record_batch.num_rows,
+                'row_index': row_index,
+                'column_index': column_index,
+                'text_content': text_content,
+            }
+            row_offset += record_batch.num_rows
+
+    def estimate_rows(self, file_path):
+        try:
+            return self._open(file_path).metadata.num_rows
+        except Exception:
+            return None
+
+
+LOADERS = (XlsxLoader, XlsLoader, OdsLoader, CsvLoader, ParquetLoader)
+
+# Estensioni accettate in caricamento
+SUPPORTED_EXTENSIONS = tuple(ext for loader in LOADERS for ext in loader.extensions)
+
+
+def read_headers(file_path: str) -> List[str]:
+    """
+    Restituisce le intestazioni di tutti i fogli del file, senza duplicati
+
+    Args:
+        file_path: Percorso del file
+
+    Returns:
+        Lista ordinata dei nomi di colonna
+    """
+    headers = []
+    for _, sheet_headers, _ in get_loader(file_path).iter_sheets(file_path):
+        headers.extend(h for h in sheet_headers if h not in headers)
+    return headers
+
+
+def get_loader(file_path: str) -> SheetLoader:
+    """
+    Restituisce il loader adatto all'estensione del file
+
+    Args:
+        file_path: Percorso o nome del file
+
+    Returns:
+        Istanza del loader
+
+    Raises:
+        ValueError: Se l'estensione non è supportata
+    """
+    extension = os.path.splitext(file_path)[1].lstrip('.').lower()
+    for loader in LOADERS:
+        if extension in loader.extensions:
+            return loader()
+    raise ValueError(f'Formato di file non supportato: .{extension}')
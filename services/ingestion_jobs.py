@@ -0,0 +1,320 @@
+"""
+Servizio per l'esecuzione in background dell'ingestione dei file caricati
+"""
+
+import json
+import logging
+import os
+import socket
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Optional
+
+from models import db, ExcelFile, IngestionJob, TextCell
+from services.column_profiler import ColumnProfiler
+from services.excel_ingestion import ExcelIngestionService
+from services.excel_versioning import ExcelVersionService
+from services.file_loaders import get_loader
+from services.question_stats import rebuild_question_stats
+from services.stats_cache import GLOBAL, file_scope, invalidate_on_commit
+
+logger = logging.getLogger(__name__)
+
+# Identifica il processo che prende in carico i job interrotti
+WORKER_ID = f'{socket.gethostname()[:40]}:{os.getpid()}:{uuid.uuid4().hex[:8]}'
+
+# Executor condiviso dal processo; creato alla prima richiesta
+_executor: Optional[ThreadPoolExecutor] = None
+
+
+def _get_executor(app) -> ThreadPoolExecutor:
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(
+            max_workers=app.config.get('INGESTION_WORKER_THREADS', 1),
+            thread_name_prefix='ingestion'
+        )
+    return _executor
+
+
+def estimate_total_rows(file_path: str) -> Optional[int]:
+    """
+    Stima il numero di righe di dati con il loader del formato
+
+    Args:
+        file_path: Percorso del file caricato
+
+    Returns:
+        Numero stimato di righe (esclusa l'intestazione) o None se non disponibile
+    """
+    try:
+        return get_loader(file_path).estimate_rows(file_path)
+    except ValueError:
+        return None
+
+
+def create_job(excel_file: ExcelFile, user_id: Optional[int] = None, source_path: Optional[str] = None,
+               key_column: Optional[str] = None, file_sha256: Optional[str] = None) -> IngestionJob:
+    """
+    Crea un job di ingestione per un file appena registrato o per una sua nuova versione
+
+    Args:
+        excel_file: Record ExcelFile già aggiunto alla sessione
+        user_id: ID dell'utente che ha avviato il caricamento
+        source_path: Percorso della nuova versione (None = prima importazione)
+        key_column: Colonna che identifica il rispondente tra le versioni
+        file_sha256: SHA-256 della nuova versione, assegnato al file solo se il job riesce
+
+    Returns:
+        Il job creato (non ancora committato)
+    """
+    excel_file.status = 'pending'
+    job = IngestionJob(
+        id=str(uuid.uuid4()),
+        excel_file_id=excel_file.id,
+        status='pending',
+        mode='version' if source_path else 'full',
+        source_path=source_path,
+        key_column=key_column,
+        file_sha256=file_sha256,
+        created_by=user_id
+    )
+    db.session.add(job)
+    return job
+
+
+def submit_job(app, job_id: str):
+    """
+    Avvia il job fuori dal ciclo della richiesta
+
+    Con INGESTION_ASYNC disattivato il job viene eseguito in modo sincrono
+    (utile per script e ambienti senza thread di lavoro).
+
+    Args:
+        app: Istanza reale dell'applicazione Flask
+        job_id: ID del job da eseguire
+    """
+    if not app.config.get('INGESTION_ASYNC', True):
+        run_job(app, job_id)
+        return None
+    return _get_executor(app).submit(run_job, app, job_id)
+
+
+def recover_interrupted_jobs(app) -> int:
+    """
+    Riprende i job rimasti in sospeso dopo un riavvio del server
+
+    I job girano nei thread del processo: se il processo termina, quelli
+    'pending' o 'processing' non avanzano più e il file resta bloccato. Le
+    celle già committate dai blocchi del tentativo interrotto vengono
+    rimosse (tutte per una prima importazione, solo quelle inserite dal job
+    per una nuova versione) e il job viene rimesso in coda da capo.
+
+    Ogni job viene prima preso in carico con un UPDATE condizionato allo
+    stato letto: se più processi eseguono il ripristino insieme, solo uno
+    cancella le celle e rimette in coda il job.
+
+    Args:
+        app: Istanza reale dell'applicazione Flask
+
+    Returns:
+        Numero di job rimessi in coda
+    """
+    with app.app_context():
+        jobs = IngestionJob.query.filter(IngestionJob.status.in_(('pending', 'processing')))\
+            .order_by(IngestionJob.created_at).all()
+        seen = [(job.id, job.excel_file_id, job.mode, job.status, job.started_at, job.claimed_by)
+                for job in jobs]
+        db.session.remove()
+
+        jobs_table = IngestionJob.__table__
+        cells = TextCell.__table__
+        job_ids = []
+        for job_id, excel_file_id, mode, status, started_at, claimed_by in seen:
+            # Presa in carico atomica: se un altro processo ha già ripreso o avviato il job
+            # nel frattempo lo stato (o il processo indicato) non corrisponde e il job viene lasciato stare
+            claimed = db.session.execute(
+                jobs_table.update()
+                .where(jobs_table.c.id == job_id,
+                       jobs_table.c.status == status,
+                       jobs_table.c.claimed_by.is_(None) if claimed_by is None
+                       else jobs_table.c.claimed_by == claimed_by)
+                .values(status='pending', started_at=None, rows_parsed=0, cells_inserted=0,
+                        claimed_by=WORKER_ID)
+            ).rowcount
+            if not claimed:
+                db.session.rollback()
+                continue
+            if status == 'processing':
+                if mode == 'version':
+                    # Le celle della nuova versione sono marcate con l'istante di avvio del servizio,
+                    # successivo all'avvio del job; quelle precedenti non vengono toccate
+                    db.session.execute(cells.delete().where(
+                        cells.c.excel_file_id == excel_file_id,
+                        cells.c.created_at >= started_at
+                    ))
+                else:
+                    db.session.execute(cells.delete().where(cells.c.excel_file_id == excel_file_id))
+                invalidate_on_commit(db.session, GLOBAL, file_scope(excel_file_id))
+            excel_file = db.session.get(ExcelFile, excel_file_id)
+            if excel_file is not None:
+                excel_file.status = 'pending'
+            db.session.commit()
+            job_ids.append(job_id)
+        db.session.remove()
+
+    for job_id in job_ids:
+        logger.warning('Job di ingestione %s interrotto da un riavvio: rimesso in coda', job_id)
+        submit_job(app, job_id)
+    return len(job_ids)
+
+
+def run_job(app, job_id: str):
+    """
+    Esegue l'estrazione delle celle aggiornando l'avanzamento del job.
+
+    Le celle vengono committate a ogni blocco: i lock di scrittura restano
+    brevi e le viste di annotazione continuano a funzionare durante l'ingestione.
+    Se il job o il file vengono eliminati nel frattempo, le celle già
+    inserite vengono rimosse e il job termina senza errori.
+
+    Args:
+        app: Istanza reale dell'applicazione Flask
+        job_id: ID del job da eseguire
+    """
+    with app.app_context():
+        job = db.session.get(IngestionJob, job_id)
+        if job is None:
+            logger.warning('Job di ingestione %s non trovato', job_id)
+            return
+        excel_file_id, mode = job.excel_file_id, job.mode
+
+        excel_file = db.session.get(ExcelFile, excel_file_id)
+        if excel_file is None:
+            _discard_job(job_id, excel_file_id)
+            return
+
+        # Avvio atomico: un job già avviato (ad esempio rimesso in coda due volte) non viene rieseguito
+        jobs_table = IngestionJob.__table__
+        started = db.session.execute(
+            jobs_table.update()
+            .where(jobs_table.c.id == job_id, jobs_table.c.status == 'pending')
+            .values(status='processing', started_at=datetime.utcnow())
+        ).rowcount
+        if not started:
+            db.session.rollback()
+            logger.warning('Job di ingestione %s già avviato altrove: ignorato', job_id)
+            return
+        db.session.refresh(job)
+
+        source_path = job.source_path if mode == 'version' else excel_file.file_path
+        job.rows_total = estimate_total_rows(source_path)
+        excel_file.status = 'processing'
+        db.session.commit()
+
+        chunk_size = app.config.get('INGESTION_CHUNK_SIZE')
+        if mode == 'version':
+            service = ExcelVersionService(chunk_size=chunk_size)
+        else:
+            service = ExcelIngestionService(
+                chunk_size=chunk_size,
+                workers=app.config.get('INGESTION_PROCESS_WORKERS')
+            )
+
+        def on_chunk(inserted):
+            db.session.execute(
+                jobs_table.update()
+                .where(jobs_table.c.id == job_id)
+                .values(rows_parsed=service.rows_read, cells_inserted=inserted)
+            )
+            # Celle inserite con INSERT in blocco: la cache delle statistiche va invalidata a mano
+            invalidate_on_commit(db.session, GLOBAL, file_scope(excel_file_id))
+            db.session.commit()
+
+        previous_path = excel_file.file_path
+        try:
+            summary = None
+            if mode == 'version':
+                summary = service.apply_new_version(excel_file, source_path, job.key_column,
+                                                    progress_callback=on_chunk)
+                cells_count = summary['inserted']
+            else:
+                cells_count = service.ingest(excel_file.file_path, excel_file_id, progress_callback=on_chunk)
+
+            # Tipo di domanda calcolato una volta per colonna, poi gli aggregati per domanda
+            # con i tipi non applicati come suggerimento
+            profiler = ColumnProfiler()
+            detected_types = profiler.profile_file(excel_file_id)
+            rebuild_question_stats(excel_file_id)
+            profiler.store_suggestions(excel_file_id, detected_types)
+
+            job = db.session.get(IngestionJob, job_id)
+            excel_file = db.session.get(ExcelFile, excel_file_id)
+            if job is None or excel_file is None:
+                db.session.rollback()
+                _discard_job(job_id, excel_file_id)
+                return
+            job.status = 'ready'
+            job.rows_parsed = service.rows_read
+            job.cells_inserted = cells_count
+            job.summary = json.dumps(summary) if summary else None
+            job.finished_at = datetime.utcnow()
+            excel_file.status = 'ready'
+            if job.file_sha256:
+                excel_file.file_sha256 = job.file_sha256
+            db.session.commit()
+            logger.info('Job %s completato: %d celle estratte', job_id, cells_count)
+
+            # Il file della versione sostituita non è più referenziato
+            if excel_file.file_path != previous_path:
+                try:
+                    if previous_path and os.path.exists(previous_path):
+                        os.remove(previous_path)
+                except OSError as e:
+                    logger.warning('Impossibile rimuovere %s: %s', previous_path, str(e))
+
+        except Exception as e:
+            db.session.rollback()
+            job = db.session.get(IngestionJob, job_id)
+            excel_file = db.session.get(ExcelFile, excel_file_id)
+            if job is None or excel_file is None:
+                _discard_job(job_id, excel_file_id)
+                return
+            logger.exception('Job di ingestione %s fallito', job_id)
+            cells = TextCell.__table__
+            if mode == 'version':
+                # Annulla solo le celle inserite da questo job: la versione precedente resta valida
+                if service.started_at is not None:
+                    db.session.execute(cells.delete().where(
+                        cells.c.excel_file_id == excel_file_id,
+                        cells.c.created_at == service.started_at
+                    ))
+                file_status = 'ready'
+            else:
+                # Rimuove le celle già committate dai blocchi precedenti
+                db.session.execute(cells.delete().where(cells.c.excel_file_id == excel_file_id))
+                file_status = 'failed'
+            job.status = 'failed'
+            job.error_message = str(e)
+            job.finished_at = datetime.utcnow()
+            excel_file.status = file_status
+            db.session.commit()
+        finally:
+            db.session.remove()
+
+
+def _discard_job(job_id: str, excel_file_id: int):
+    """
+    Chiude un job il cui file è stato eliminato durante l'esecuzione
+
+    Le celle inserite dopo l'eliminazione resterebbero orfane (su SQLite le
+    chiavi esterne non sono verificate): vengono rimosse insieme al job.
+    """
+    logger.warning('File %s eliminato durante il job di ingestione %s: celle inserite rimosse',
+                   excel_file_id, job_id)
+    if db.session.get(ExcelFile, excel_file_id) is None:
+        db.session.execute(TextCell.__table__.delete().where(TextCell.excel_file_id == excel_file_id))
+        invalidate_on_commit(db.session, GLOBAL, file_scope(excel_file_id))
+    db.session.execute(IngestionJob.__table__.delete().where(IngestionJob.id == job_id))
+    db.session.commit()
@@ -0,0 +1,206 @@
+"""
+Servizio per gli aggregati per domanda (tabella question_stats).
+
+Le righe vengono ricostruite al termine di ogni ingestione e aggiornate in
+modo incrementale dal listener di services.annotation_events a ogni
+aggiunta o rimozione di CellAnnotation, così le viste per domanda leggono
+valori già calcolati invece di raggruppare text_cell ⟕ cell_annotation.
+"""
+
+from collections import Counter
+from typing import Iterable, Optional
+
+from sqlalchemy import bindparam, func, select
+
+from models import db, CellAnnotation, ExcelFile, QuestionStats, TextCell
+
+SCOPE_COLUMNS = ('excel_file_id', 'sheet_name', 'column_name')
+
+
+def _aggregate_select(excel_file_id: Optional[int] = None):
+    """SELECT degli aggregati per domanda calcolati da text_cell e cell_annotation"""
+    cells = TextCell.__table__
+    annotations = CellAnnotation.__table__
+    query = select(
+        cells.c.excel_file_id,
+        cells.c.sheet_name,
+        cells.c.column_name,
+        func.count(func.distinct(cells.c.id)).label('total_responses'),
+        func.count(func.distinct(annotations.c.text_cell_id)).label('annotated_responses'),
+        func.count(annotations.c.id).label('annotation_count'),
+        func.count(func.distinct(annotations.c.user_id)).label('distinct_annotators'),
+        func.max(cells.c.question_type).label('question_type'),
+    ).select_from(
+        cells.outerjoin(annotations, annotations.c.text_cell_id == cells.c.id)
+    ).where(
+        cells.c.removed_at.is_(None)
+    ).group_by(cells.c.excel_file_id, cells.c.sheet_name, cells.c.column_name)
+    if excel_file_id is not None:
+        query = query.where(cells.c.excel_file_id == excel_file_id)
+    return query
+
+
+def rebuild_question_stats(excel_file_id: Optional[int] = None) -> int:
+    """
+    Ricalcola da zero gli aggregati di un file (o di tutti i file)
+
+    Args:
+        excel_file_id: ID del file (None = tutti i file)
+
+    Returns:
+        Numero di domande scritte
+    """
+    table = QuestionStats.__table__
+    delete = table.delete()
+    if excel_file_id is not None:
+        delete = delete.where(table.c.excel_file_id == excel_file_id)
+    db.session.execute(delete)
+
+    aggregate = _aggregate_select(excel_file_id)
+    result = db.session.execute(table.insert().from_select(
+        [*SCOPE_COLUMNS, 'total_responses', 'annotated_responses', 'annotation_count',
+         'distinct_annotators', 'question_type'],
+        aggregate
+    ))
+    return result.rowcount
+
+
+def ensure_question_stats(excel_file: ExcelFile):
+    """Costruisce gli aggregati dei file importati prima dell'introduzione della tabella"""
+    if not excel_file.is_ready:
+        return
+    if db.session.query(QuestionStats.id).filter_by(excel_file_id=excel_file.id).first() is None:
+        if rebuild_question_stats(excel_file.id):
+            db.session.commit()
+
+
+def sync_question_types(column_names: Optional[Iterable[str]] = None):
+    """
+    Riallinea question_stats.question_type dopo una classificazione manuale
+    (gli UPDATE in blocco su text_cell non generano eventi)
+    """
+    stats = QuestionStats.__table__
+    cells = TextCell.__table__
+    current_type = select(func.max(cells.c.question_type)).where(
+        cells.c.excel_file_id == stats.c.excel_file_id,
+        cells.c.sheet_name == stats.c.sheet_name,
+        cells.c.column_name == stats.c.column_name,
+        cells.c.removed_at.is_(None)
+    ).scalar_subquery()
+    update = stats.update().values(question_type=current_type)
+    if column_names is not None:
+        update = update.where(stats.c.column_name.in_(list(column_names)))
+    db.session.execute(update)
+
+
+def apply_annotation_changes(session, changes):
+    """
+    Gestore di services.annotation_events: applica le variazioni di un flush.
+
+    annotation_count varia di ±1 per annotazione; per annotated_responses e
+    distinct_annotators si confronta il numero di annotazioni della cella
+    (o dell'utente nella domanda) dopo il flush con quello precedente,
+    ricavato togliendo le variazioni del flush stesso.
+    """
+    connection = session.connection()
+    cells = TextCell.__table__
+    annotations = CellAnnotation.__table__
+
+    # Domanda di appartenenza delle celle coinvolte (le celle eliminate nello stesso flush vengono ignorate)
+    scopes = {
+        row.id: (row.excel_file_id, row.sheet_name, row.column_name)
+        for row in connection.execute(
+            select(cells.c.id, *[cells.c[name] for name in SCOPE_COLUMNS]).where(
+                cells.c.id.in_(list(changes.text_cell_ids)),
+                cells.c.removed_at.is_(None)
+            )
+        )
+    }
+    if not scopes:
+        return
+
+    cell_delta = Counter()
+    user_delta = Counter()
+    for sign, refs in ((1, changes.inserted), (-1, changes.deleted)):
+        for ref in refs:
+            scope = scopes.get(ref.text_cell_id)
+            if scope is not None:
+                cell_delta[ref.text_cell_id] += sign
+                user_delta[(scope, ref.user_id)] += sign
+
+    cell_counts = dict(connection.execute(
+        select(annotations.c.text_cell_id, func.count())
+        .where(annotations.c.text_cell_id.in_(list(cell_delta)))
+        .group_by(annotations.c.text_cell_id)
+    ).all())
+
+    file_ids = {scope[0] for scope in scopes.values()}
+    user_counts = {
+        ((row.excel_file_id, row.sheet_name, row.column_name), row.user_id): row.count
+        for row in connection.execute(
+            select(*[cells.c[name] for name in SCOPE_COLUMNS], annotations.c.user_id,
+                   func.count().label('count'))
+            .select_from(annotations.join(cells, cells.c.id == annotations.c.text_cell_id))
+            .where(
+                annotations.c.user_id.in_(list({user_id for _, user_id in user_delta})),
+                cells.c.excel_file_id.in_(list(file_ids)),
+                cells.c.removed_at.is_(None)
+            )
+            .group_by(*[cells.c[name] for name in SCOPE_COLUMNS], annotations.c.user_id)
+        )
+    }
+
+    deltas = {}
+    for cell_id, delta in cell_delta.items():
+        entry = deltas.setdefault(scopes[cell_id], Counter())
+        after = cell_counts.get(cell_id, 0)
+        entry['annotation_count'] += delta
+        entry['annotated_responses'] += (after > 0) - (after - delta > 0)
+    for (scope, user_id), delta in user_delta.items():
+        after = user_counts.get((scope, user_id), 0)
+        deltas.setdefault(scope, Counter())['distinct_annotators'] += (after > 0) - (after - delta > 0)
+
+    stats = QuestionStats.__table__
+    connection.execute(
+        stats.update().where(
+            stats.c.excel_file_id == bindparam('b_file'),
+            stats.c.sheet_name == bindparam('b_sheet'),
+            stats.c.column_name == bindparam('b_column')
+        ).values(
+            annotation_count=stats.c.annotation_count + bindparam('b_annotations'),
+            annotated_responses=stats.c.annotated_responses + bindparam('b_annotated'),
+            distinct_annotators=stats.c.distinct_annotators + bindparam('b_annotators')
+        ),
+        [
+            {
+                'b_file': scope[0], 'b_sheet': scope[1], 'b_column': scope[2],
+                'b_annotations': entry['annotation_count'],
+                'b_annotated': entry['annotated_responses'],
+                'b_annotators': entry['distinct_annotators'],
+            }
+            for scope, entry in deltas.items()
+        ]
+    )
+
+
+def question_stats_query(excel_file_id: Optional[int] = None, sheet_name: Optional[str] = None,
+                         column_name: Optional[str] = None):
+    """
+    Aggregati per nome di domanda (sommati sui fogli) per le viste
+
+    Returns:
+        Query con le colonne column_name, total_responses, annotated_responses,
+        ordinata per nome della domanda
+    """
+    query = db.session.query(
+        QuestionStats.column_name,
+        func.sum(QuestionStats.total_responses).label('total_responses'),
+        func.sum(QuestionStats.annotated_responses).label('annotated_responses')
+    )
+    if excel_file_id:
+        query = query.filter(QuestionStats.excel_file_id == excel_file_id)
+    if sheet_name:
+        query = query.filter(QuestionStats.sheet_name == sheet_name)
+    if column_name:
+        query = query.filter(QuestionStats.column_name == column_name)
+    return query.group_by(QuestionStats.column_name).order_by(QuestionStats.column_name)
@@ -0,0 +1,392 @@
+"""
+Ricerca full-text su risposte, documenti, forum, diario, etichette e progetti.
+
+Su SQLite ogni tabella indicizzata ha una tabella virtuale FTS5 a contenuto
+esterno (<tabella>_fts, stessi rowid della tabella) mantenuta da trigger di
+INSERT/UPDATE/DELETE, con tokenizzazione unicode61 senza diacritici ("perché"
+trova "perche") e ordinamento BM25 con estratti evidenziati (snippet).
+
+Su PostgreSQL l'equivalente è un indice GIN sull'espressione tsvector delle
+stesse colonne (configurazione 'italian', con unaccent se disponibile),
+aggiornato automaticamente dal database; ts_rank_cd e ts_headline
+sostituiscono bm25 e snippet.
+
+Gli inserimenti in blocco delle celle (bulk_insert) sospendono il trigger di
+INSERT nella propria transazione e indicizzano ogni blocco con un'unica istruzione.
+
+Se FTS5 non è disponibile la ricerca ricade su LIKE (stesse funzioni, senza
+ordinamento per pertinenza).
+"""
+
+import html
+import logging
+import re
+from collections import namedtuple
+from typing import Callable, Dict, Iterable, List, Optional
+
+from sqlalchemy import column, func, null, or_, select, text
+
+from models import (db, DiaryEntry, ForumComment, ForumPost, Label, Project,
+                    TextCell, TextDocument)
+
+logger = logging.getLogger(__name__)
+
+# Colonne indicizzate con il loro peso (A = più importante)
+SearchSource = namedtuple('SearchSource', ['model', 'columns'])
+
+SEARCH_SOURCES = {
+    'cells': SearchSource(TextCell, [('text_content', 'A')]),
+    'documents': SearchSource(TextDocument, [('original_name', 'A'), ('content', 'B')]),
+    'forum_posts': SearchSource(ForumPost, [('title', 'A'), ('content', 'B')]),
+    'forum_comments': SearchSource(ForumComment, [('content', 'A')]),
+    'diary': SearchSource(DiaryEntry, [('title', 'A'), ('content', 'B'), ('tags', 'C')]),
+    'labels': SearchSource(Label, [('name', 'A'), ('description', 'B')]),
+    'projects': SearchSource(Project, [('name', 'A'), ('description', 'B'), ('tags', 'C')]),
+}
+
+# Pesi delle colonne per bm25() di FTS5
+BM25_WEIGHTS = {'A': 10.0, 'B': 2.0, 'C': 1.0}
+
+FTS_TOKENIZER = 'unicode61 remove_diacritics 2'
+PG_CONFIG = 'analisi_it'        # italian + unaccent, se l'estensione è installabile
+PG_FALLBACK_CONFIG = 'italian'
+
+# Delimitatori dell'evidenziazione, sostituiti da <mark> dopo l'escape HTML
+_MARK_START, _MARK_END = '\x02', '\x03'
+_TERM_PATTERN = re.compile(r'\w+', re.UNICODE)
+
+SearchHit = namedtuple('SearchHit', ['id', 'rank', 'snippet'])
+
+# Tabelle per cui il trigger di INSERT è sospeso (righe scritte e cancellate nella stessa
+# transazione da bulk_insert: non sono mai visibili alle altre connessioni)
+SYNC_SUSPENDED_TABLE = 'search_sync_suspended'
+
+_pg_configs: Dict[str, str] = {}
+_backends: Dict[str, str] = {}
+
+
+def search_backend(engine) -> str:
+    """'fts5', 'tsvector' o 'like' a seconda del database"""
+    key = str(engine.url)
+    if key not in _backends:
+        if engine.dialect.name == 'postgresql':
+            _backends[key] = 'tsvector'
+        elif engine.dialect.name == 'sqlite' and _fts5_available(engine):
+            _backends[key] = 'fts5'
+        else:
+            _backends[key] = 'like'
+    return _backends[key]
+
+
+def _fts5_available(engine) -> bool:
+    with engine.connect() as connection:
+        options = {row[0] for row in connection.exec_driver_sql('PRAGMA compile_options')}
+    return 'ENABLE_FTS5' in options
+
+
+def search_terms(query: str, max_terms: int = 8) -> List[str]:
+    """Parole della ricerca (gli operatori e la punteggiatura vengono ignorati)"""
+    return _TERM_PATTERN.findall(query or '')[:max_terms]
+
+
+def fts5_match(terms: Iterable[str]) -> str:
+    """Espressione MATCH di FTS5: tutte le parole, ciascuna anche come prefisso"""
+    return ' '.join(f'"{term}"*' for term in terms)
+
+
+def pg_tsquery(terms: Iterable[str]) -> str:
+    """Espressione to_tsquery equivalente (AND di prefissi)"""
+    return ' & '.join(f'{term}:*' for term in terms)
+
+
+def highlight(snippet: Optional[str]) -> str:
+    """Estratto con escape HTML e termini trovati in <mark>"""
+    if not snippet:
+        return ''
+    return html.escape(snippet).replace(_MARK_START, '<mark>').replace(_MARK_END, '</mark>')
+
+
+def _fts_table(source: SearchSource) -> str:
+    return f'{source.model.__tablename__}_fts'
+
+
+def _pg_vector(source: SearchSource, config: str, alias: Optional[str] = None) -> str:
+    """Espressione tsvector pesata (identica nell'indice e nelle query)"""
+    prefix = f'{alias}.' if alias else ''
+    parts = [
+        f"setweight(to_tsvector('{config}'::regconfig, coalesce({prefix}{name}, '')), '{weight}')"
+        for name, weight in source.columns
+    ]
+    return ' || '.join(parts)
+
+
+def pg_search_config(connection) -> str:
+    """Configurazione di ricerca PostgreSQL in uso (creata da install_search_index)"""
+    key = str(connection.engine.url)
+    if key not in _pg_configs:
+        exists = connection.execute(
+            text('SELECT 1 FROM pg_ts_config WHERE cfgname = :name'), {'name': PG_CONFIG}
+        ).scalar()
+        _pg_configs[key] = PG_CONFIG if exists else PG_FALLBACK_CONFIG
+    return _pg_configs[key]
+
+
+def _install_sqlite(connection, source: SearchSource) -> List[str]:
+    """Tabella FTS5 a contenuto esterno e trigger di sincronizzazione"""
+    table = source.model.__tablename__
+    fts = _fts_table(source)
+    names = [name for name, _ in source.columns]
+    columns = ', '.join(names)
+    new_values = ', '.join(f'new.{name}' for name in names)
+    old_values = ', '.join(f'old.{name}' for name in names)
+
+    existing = {row[0]: row[1] or '' for row in connection.execute(
+        text("SELECT name, sql FROM sqlite_master WHERE name LIKE :pattern"), {'pattern': f'{fts}%'}
+    )}
+    created = []
+    connection.exec_driver_sql(f'CREATE TABLE IF NOT EXISTS {SYNC_SUSPENDED_TABLE} (table_name VARCHAR(100))')
+    if fts not in existing:
+        connection.exec_driver_sql(
+            f"CREATE VIRTUAL TABLE {fts} USING fts5({columns}, content='{table}', "
+            f"content_rowid='id', tokenize='{FTS_TOKENIZER}')"
+        )
+        connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+        created.append(fts)
+    triggers = {
+        f'{fts}_ai': f"AFTER INSERT ON {table} WHEN NOT EXISTS "
+                     f"(SELECT 1 FROM {SYNC_SUSPENDED_TABLE} WHERE table_name = '{table}') BEGIN "
+                     f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+        f'{fts}_ad': f"AFTER DELETE ON {table} BEGIN "
+                     f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); END",
+        f'{fts}_au': f"AFTER UPDATE OF {columns} ON {table} BEGIN "
+                     f"INSERT INTO {fts}({fts}, rowid, {columns}) VALUES ('delete', old.id, {old_values}); "
+                     f"INSERT INTO {fts}(rowid, {columns}) VALUES (new.id, {new_values}); END",
+    }
+    # Trigger di INSERT creato prima della sospensione per gli inserimenti in blocco: va ricreato
+    if f'{fts}_ai' in existing and SYNC_SUSPENDED_TABLE not in existing[f'{fts}_ai']:
+        connection.exec_driver_sql(f'DROP TRIGGER {fts}_ai')
+        del existing[f'{fts}_ai']
+    for name, body in triggers.items():
+        if name not in existing:
+            connection.exec_driver_sql(f'CREATE TRIGGER {name} {body}')
+            created.append(name)
+    return created
+
+
+def _install_postgresql(connection, source: SearchSource, config: str) -> List[str]:
+    """Indice GIN sull'espressione tsvector"""
+    table = source.model.__tablename__
+    index = f'ix_{table}_search'
+    exists = connection.execute(text('SELECT 1 FROM pg_indexes WHERE indexname = :name'),
+                                {'name': index}).scalar()
+    if exists:
+        return []
+    quoted = connection.dialect.identifier_preparer.quote(table)
+    connection.exec_driver_sql(f'CREATE INDEX {index} ON {quoted} USING gin (({_pg_vector(source, config)}))')
+    return [index]
+
+
+def _install_pg_config(connection) -> str:
+    """Configurazione italiana senza accenti, se l'estensione unaccent è disponibile"""
+    if connection.execute(text('SELECT 1 FROM pg_ts_config WHERE cfgname = :name'),
+                          {'name': PG_CONFIG}).scalar():
+        return PG_CONFIG
+    try:
+        with connection.begin_nested():
+            connection.exec_driver_sql('CREATE EXTENSION IF NOT EXISTS unaccent')
+            connection.exec_driver_sql(f'CREATE TEXT SEARCH CONFIGURATION {PG_CONFIG} (COPY = italian)')
+            connection.exec_driver_sql(
+                f'ALTER TEXT SEARCH CONFIGURATION {PG_CONFIG} '
+                'ALTER MAPPING FOR hword, hword_part, word WITH unaccent, italian_stem'
+            )
+        return PG_CONFIG
+    except Exception as e:
+        logger.info(f"unaccent non disponibile, ricerca con la configurazione '{PG_FALLBACK_CONFIG}': {str(e)}")
+        return PG_FALLBACK_CONFIG
+
+
+def install_search_index(engine) -> List[str]:
+    """
+    Crea (una sola volta) indici e trigger della ricerca full-text
+
+    Le tabelle FTS5 create vengono popolate con 'rebuild'; chiamarla di nuovo
+    non ha effetti.
+
+    Returns:
+        Nomi degli oggetti creati
+    """
+    backend = search_backend(engine)
+    created = []
+    with engine.begin() as connection:
+        if backend == 'fts5':
+            for source in SEARCH_SOURCES.values():
+                created += _install_sqlite(connection, source)
+        elif backend == 'tsvector':
+            config = _install_pg_config(connection)
+            _pg_configs.pop(str(engine.url), None)
+            for source in SEARCH_SOURCES.values():
+                created += _install_postgresql(connection, source, config)
+    return created
+
+
+def rebuild_search_index(engine) -> int:
+    """Ricostruisce le tabelle FTS5 dal contenuto delle tabelle (solo SQLite)"""
+    if search_backend(engine) != 'fts5':
+        return 0
+    with engine.begin() as connection:
+        for source in SEARCH_SOURCES.values():
+            fts = _fts_table(source)
+            connection.exec_driver_sql(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    return len(SEARCH_SOURCES)
+
+
+def bulk_insert(session, source_name: str, rows: List[dict]) -> None:
+    """
+    Inserisce un blocco di righe indicizzandole con una sola istruzione
+
+    Con FTS5 il trigger di INSERT aggiornerebbe l'indice riga per riga: qui
+    viene sospeso per la durata dell'INSERT e le nuove righe vengono aggiunte
+    all'indice con un INSERT ... SELECT sull'intervallo di ID appena
+    assegnato. Tutto avviene nella transazione della sessione, che tiene il
+    lock di scrittura: gli ID del blocco sono consecutivi, le altre
+    connessioni non vedono la sospensione e un rollback annulla tutto.
+    Con gli altri backend (o se l'indice non è installato) è un normale insert Core.
+
+    Args:
+        session: Sessione SQLAlchemy (la transazione resta aperta)
+        source_name: Chiave di SEARCH_SOURCES della tabella
+        rows: Dizionari con le colonne della tabella
+    """
+    source = SEARCH_SOURCES[source_name]
+    table = source.model.__table__
+    if not rows:
+        return
+    fts = _fts_table(source)
+    if search_backend(session.get_bind()) != 'fts5' or not session.execute(
+            text("SELECT 1 FROM sqlite_master WHERE name = :name"), {'name': fts}).scalar():
+        session.execute(table.insert(), rows)
+        return
+
+    suspended = {'table_name': table.name}
+    session.execute(text(f'INSERT INTO {SYNC_SUSPENDED_TABLE} (table_name) VALUES (:table_name)'), suspended)
+    session.execute(table.insert(), rows)
+    session.execute(text(f'DELETE FROM {SYNC_SUSPENDED_TABLE} WHERE table_name = :table_name'), suspended)
+
+    last_id = session.execute(select(func.max(table.c.id))).scalar()
+    columns = ', '.join(name for name, _ in source.columns)
+    session.execute(
+        text(f'INSERT INTO {fts}(rowid, {columns}) '
+             f'SELECT id, {columns} FROM {table.name} WHERE id BETWEEN :first AND :last'),
+        {'first': last_id - len(rows) + 1, 'last': last_id}
+    )
+
+
+def matching_ids(source_name: str, query: str):
+    """
+    SELECT degli ID che corrispondono alla ricerca, da usare in filtri del tipo
+    Model.id.in_(matching_ids('diary', testo))
+    """
+    source = SEARCH_SOURCES[source_name]
+    model = source.model
+    terms = search_terms(query)
+    if not terms:
+        return select(model.id).where(model.id.is_(None))
+    backend = search_backend(db.engine)
+    if backend == 'fts5':
+        fts = _fts_table(source)
+        return text(f'SELECT rowid FROM {fts} WHERE {fts} MATCH :match')\
+            .bindparams(match=fts5_match(terms)).columns(column('rowid'))
+    if backend == 'tsvector':
+        config = pg_search_config(db.session.connection())
+        table = model.__tablename__
+        quoted = db.engine.dialect.identifier_preparer.quote(table)
+        return text(f'SELECT id FROM {quoted} '
+                    f"WHERE ({_pg_vector(source, config)}) @@ to_tsquery('{config}'::regconfig, :tsquery)")\
+            .bindparams(tsquery=pg_tsquery(terms)).columns(column('id'))
+    return select(model.id).where(*[
+        or_(*[getattr(model, name).ilike(f'%{term}%') for name, _ in source.columns])
+        for term in terms
+    ])
+
+
+def search(query: str, sources: Optional[Iterable[str]] = None, limit: int = 20,
+           visible: Optional[Callable] = None) -> Dict[str, List[SearchHit]]:
+    """
+    Risultati più pertinenti per ogni sorgente
+
+    Args:
+        query: Testo cercato
+        sources: Nomi delle sorgenti in SEARCH_SOURCES (None = tutte)
+        limit: Risultati massimi per sorgente
+        visible: Funzione (sorgente, query ORM) -> query ORM che filtra le
+            righe visibili; il filtro è applicato prima dell'ordinamento e del
+            limite, così le righe nascoste non occupano i posti disponibili
+
+    Returns:
+        Dizionario sorgente -> lista di SearchHit (id, rank, snippet HTML) in
+        ordine di pertinenza
+    """
+    terms = search_terms(query)
+    names = [name for name in (sources or SEARCH_SOURCES) if name in SEARCH_SOURCES]
+    if not terms:
+        return {name: [] for name in names}
+    backend = search_backend(db.engine)
+    connection = db.session.connection()
+    results = {}
+    for name in names:
+        source = SEARCH_SOURCES[name]
+        if backend == 'fts5':
+            hits = _ranked_fts5(source, terms)
+        elif backend == 'tsvector':
+            hits = _ranked_postgresql(connection, source, terms)
+        else:
+            hits = _ranked_like(name, source, query)
+        model = source.model
+        rows = db.session.query(hits.c.id, hits.c.rank, hits.c.snippet).join(model, model.id == hits.c.id)
+        if visible is not None:
+            rows = visible(name, rows)
+        rows = rows.order_by(hits.c.rank.desc(), hits.c.id.desc()).limit(limit).all()
+        results[name] = [SearchHit(row_id, rank, highlight(snippet)) for row_id, rank, snippet in rows]
+    return results
+
+
+def _ranked_fts5(source, terms):
+    """Sottoquery (id, rank, snippet) delle righe trovate da FTS5"""
+    fts = _fts_table(source)
+    weights = ', '.join(str(BM25_WEIGHTS[weight]) for _, weight in source.columns)
+    # bm25() è negativo: più piccolo = più pertinente
+    return text(
+        f"SELECT rowid AS id, -bm25({fts}, {weights}) AS rank, "
+        f"snippet({fts}, -1, :mark_start, :mark_end, '…', 16) AS snippet "
+        f"FROM {fts} WHERE {fts} MATCH :match"
+    ).bindparams(
+        match=fts5_match(terms), mark_start=_MARK_START, mark_end=_MARK_END
+    ).columns(column('id'), column('rank'), column('snippet')).subquery('hits')
+
+
+def _ranked_postgresql(connection, source, terms):
+    """Sottoquery (id, rank, snippet) delle righe trovate dall'indice tsvector"""
+    config = pg_search_config(connection)
+    table = connection.dialect.identifier_preparer.quote(source.model.__tablename__)
+    vector = _pg_vector(source, config, alias='t')
+    document = " || ' ' || ".join(f"coalesce(t.{name}, '')" for name, _ in source.columns)
+    return text(
+        f"SELECT t.id AS id, ts_rank_cd({vector}, q.query) AS rank, "
+        f"ts_headline('{config}'::regconfig, {document}, q.query, :headline) AS snippet "
+        f"FROM {table} t, to_tsquery('{config}'::regconfig, :tsquery) AS q(query) "
+        f"WHERE ({vector}) @@ q.query"
+    ).bindparams(
+        tsquery=pg_tsquery(terms),
+        headline=f'StartSel={_MARK_START}, StopSel={_MARK_END}, MaxWords=24, MinWords=8'
+    ).columns(column('id'), column('rank'), column('snippet')).subquery('hits')
+
+
+def _ranked_like(source_name, source, query):
+    """Sottoquery (id, rank, snippet) con LIKE: nessun punteggio, i più recenti per primi"""
+    model = source.model
+    first_column = getattr(model, source.columns[0][0])
+    return select(
+        model.id.label('id'),
+        null().label('rank'),
+        func.substr(func.coalesce(first_column, ''), 1, 200).label('snippet')
+    ).where(model.id.in_(matching_ids(source_name, query))).subquery('hits')
@@ -0,0 +1,134 @@
+"""
+Analisi dei fogli xlsx nei processi dell'ingestione parallela.
+
+Il modulo importa solo openpyxl e i loader, così il server 'forkserver' che
+genera i processi (vedi excel_ingestion._worker_context) non carica Flask né
+i modelli.
+Ogni processo apre il workbook una volta, analizza i fogli che gli sono
+assegnati nell'ordine del workbook e invia le celle in blocchi colonnari di
+al più chunk_size celle su una coda limitata: un processo più veloce del
+processo principale (che scrive nel database) si ferma invece di accumulare
+in memoria fogli interi.
+"""
+
+import traceback
+from array import array
+from typing import Any, Dict, Iterator, List, Tuple
+
+from openpyxl import load_workbook
+from openpyxl.reader.excel import ExcelReader
+
+from services.file_loaders import build_headers
+
+# Blocchi in attesa per ogni processo: la memoria resta sotto
+# processi × (QUEUE_DEPTH + 1) × chunk_size celle
+QUEUE_DEPTH = 2
+
+
+def iter_text_values(rows) -> Iterator[Tuple[int, int, str]]:
+    """
+    Filtra le celle di testo non vuote delle righe di dati di un foglio
+
+    Args:
+        rows: Iteratore delle righe di dati (intestazione esclusa)
+
+    Yields:
+        Tuple (row_index, column_index, testo) con row_index a partire da 1
+    """
+    for row_idx, row in enumerate(rows, start=1):
+        for col_idx, cell_value in enumerate(row):
+            # Solo celle di testo non vuote, come nella versione basata su pandas
+            if not isinstance(cell_value, str):
+                continue
+            text = cell_value.strip()
+            if text:
+                yield row_idx, col_idx, text
+
+
+def _new_batch(sheet_index: int, sheet_name: str, headers: List[str]) -> Dict[str, Any]:
+    return {
+        'sheet_index': sheet_index,
+        'sheet_name': sheet_name,
+        'headers': headers,
+        'rows_read': 0,
+        'row_index': array('i'),
+        'column_index': array('i'),
+        'text_content': [],
+        'last': False,
+    }
+
+
+def iter_sheet_batches(worksheet, sheet_index: int, chunk_size: int) -> Iterator[Dict[str, Any]]:
+    """
+    Analizza un foglio in blocchi colonnari di al più chunk_size celle
+
+    L'ultimo blocco del foglio ha last=True (anche se vuoto); rows_read di
+    ogni blocco conta le righe lette dopo il blocco precedente.
+
+    Args:
+        worksheet: Foglio di un workbook aperto in modalità read_only
+        sheet_index: Indice del foglio nel workbook
+        chunk_size: Numero massimo di celle per blocco
+    """
+    # Le dimensioni salvate nel file non sono affidabili (es. export di Google Forms)
+    worksheet.reset_dimensions()
+    rows = worksheet.iter_rows(values_only=True)
+    header_row = next(rows, None)
+    batch = _new_batch(sheet_index, worksheet.title, build_headers(header_row) if header_row is not None else [])
+    if header_row is not None:
+        def counted(rows):
+            for row in rows:
+                batch['rows_read'] += 1
+                yield row
+
+        for row_idx, col_idx, text in iter_text_values(counted(rows)):
+            batch['row_index'].append(row_idx)
+            batch['column_index'].append(col_idx)
+            batch['text_content'].append(text)
+            if len(batch['text_content']) >= chunk_size:
+                yield batch
+                batch = _new_batch(sheet_index, batch['sheet_name'], batch['headers'])
+    batch['last'] = True
+    yield batch
+
+
+def count_sheets(file_path: str) -> int:
+    """
+    Numero di fogli dichiarati nel workbook, senza leggere le stringhe condivise
+
+    Comprende gli eventuali fogli grafico: è un limite superiore dei fogli di dati.
+    """
+    reader = ExcelReader(file_path, read_only=True)
+    try:
+        reader.read_manifest()
+        reader.read_workbook()
+        return len(reader.parser.sheets)
+    finally:
+        reader.archive.close()
+
+
+def parse_sheets_worker(file_path: str, worker_index: int, workers: int, queue, chunk_size: int):
+    """
+    Corpo di un processo di lavoro: invia sulla coda i blocchi dei fogli
+    worker_index, worker_index + workers, ... seguiti da None
+
+    In caso di errore invia il traceback come stringa ('error', testo) e termina.
+
+    Args:
+        file_path: Percorso del file xlsx
+        worker_index: Indice del processo (primo foglio da analizzare)
+        workers: Numero di processi
+        queue: Coda limitata letta dal processo principale
+        chunk_size: Numero massimo di celle per blocco
+    """
+    try:
+        workbook = load_workbook(file_path, read_only=True, data_only=True)
+        try:
+            for sheet_index in range(worker_index, len(workbook.worksheets), workers):
+                for batch in iter_sheet_batches(workbook.worksheets[sheet_index], sheet_index, chunk_size):
+                    queue.put(batch)
+        finally:
+            workbook.close()
+        queue.put(None)
+    except Exception:
+        queue.put(('error', traceback.format_exc()))
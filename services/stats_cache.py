@@ -0,0 +1,379 @@
+"""
+Cache delle statistiche con invalidazione guidata dalle scritture.
+
+Le pagine di riepilogo (home, /statistics, /annotation/statistics, pagine di
+amministrazione) ricalcolano a ogni richiesta conteggi e aggregati
+sull'intero database. StatsCache conserva i risultati, serializzati in JSON,
+in un file SQLite condiviso da tutti i processi (STATS_CACHE_PATH), con una
+scadenza (STATS_CACHE_TTL) e un numero di versione per ambito:
+
+- 'global': tutti i dati;
+- 'file:<id>', 'question:<file_id>:<colonna>', 'user:<id>': le celle e le
+  annotazioni di un file, di un quesito, di un utente;
+- 'labels': nomi, colori e categorie delle etichette.
+
+Ogni voce ricorda le versioni degli ambiti da cui dipende ed è valida finché
+nessuna di esse cambia. Le scritture fatte con la sessione incrementano le
+versioni al commit: le annotazioni tramite services.annotation_events
+(apply_annotation_scopes), file, celle, etichette, categorie, utenti e stato
+di revisione delle annotazioni tramite un listener after_flush. Chi esegue
+INSERT/UPDATE/DELETE in blocco chiama invalidate_on_commit (o invalidate
+dopo il commit).
+
+Un valore calcolato sulla copia delle statistiche (utils/analytics_snapshot.py)
+viene memorizzato solo se nessun ambito è stato invalidato dopo l'istante
+della copia: altrimenti rifletterebbe dati già superati sotto le versioni
+correnti. I contatori di hit e miss si accumulano in memoria e vengono
+scritti nel file al più ogni COUNTER_FLUSH_INTERVAL secondi per processo.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from collections import Counter
+from datetime import date, datetime, timezone
+from decimal import Decimal
+from itertools import chain
+from typing import Callable, Dict, Iterable, List, Optional
+
+from flask import current_app, has_app_context
+from sqlalchemy import event, inspect, select
+from sqlalchemy.orm import Session
+
+from models import Category, CellAnnotation, ExcelFile, Label, TextCell, User
+from utils.analytics_snapshot import analytics_freshness
+
+logger = logging.getLogger(__name__)
+
+STATS_CACHE = 'stats_cache'
+GLOBAL = 'global'
+LABELS = 'labels'
+PENDING_SCOPES = 'stats_cache_scopes'
+
+# Secondi tra due scritture dei contatori di hit e miss (le letture dalla cache non scrivono il file)
+COUNTER_FLUSH_INTERVAL = 60
+
+# Modello -> attributi le cui modifiche cambiano le statistiche (None = tutti)
+WATCHED_MODELS = {
+    ExcelFile: None,
+    TextCell: None,
+    Label: None,
+    Category: None,
+    User: ('username', 'role', 'is_active'),
+}
+
+SCHEMA = (
+    'CREATE TABLE IF NOT EXISTS stats_cache_entry ('
+    ' key TEXT PRIMARY KEY, value TEXT NOT NULL, versions TEXT NOT NULL, expires_at REAL NOT NULL)',
+    'CREATE TABLE IF NOT EXISTS stats_cache_scope ('
+    ' scope TEXT PRIMARY KEY, version INTEGER NOT NULL, invalidated_at REAL)',
+    'CREATE TABLE IF NOT EXISTS stats_cache_counter ('
+    ' name TEXT PRIMARY KEY, hits INTEGER NOT NULL DEFAULT 0, misses INTEGER NOT NULL DEFAULT 0)',
+)
+
+
+def file_scope(file_id: int) -> str:
+    return f'file:{file_id}'
+
+
+def question_scope(file_id: int, column_name: str) -> str:
+    return f'question:{file_id}:{column_name}'
+
+
+def user_scope(user_id: int) -> str:
+    return f'user:{user_id}'
+
+
+def _json_default(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    if isinstance(value, Decimal):
+        return float(value)
+    if hasattr(value, '_asdict'):
+        # Righe dei risultati delle query: nel template restano accessibili per nome
+        return value._asdict()
+    raise TypeError(f'{type(value).__name__} non serializzabile nella cache delle statistiche')
+
+
+def _dumps(value) -> str:
+    return json.dumps(value, default=_json_default, separators=(',', ':'))
+
+
+class StatsCache:
+    """Cache condivisa tra i processi in un file SQLite"""
+
+    def __init__(self, path: str, ttl: int):
+        self.path = path
+        self.ttl = ttl
+        self._local = threading.local()
+        self._counters = Counter()
+        self._counters_lock = threading.Lock()
+        self._counters_flushed = time.monotonic()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        connection = self._connection()
+        for statement in SCHEMA:
+            connection.execute(statement)
+        # File creati prima dell'istante di invalidazione
+        columns = {row[1] for row in connection.execute('PRAGMA table_info(stats_cache_scope)')}
+        if 'invalidated_at' not in columns:
+            connection.execute('ALTER TABLE stats_cache_scope ADD COLUMN invalidated_at REAL')
+
+    def _connection(self) -> sqlite3.Connection:
+        # Una connessione per thread; isolation_level=None = autocommit
+        connection = getattr(self._local, 'connection', None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            self._local.connection = connection
+        return connection
+
+    def versions(self, scopes: Iterable[str]) -> Dict[str, int]:
+        """Versione corrente di ogni ambito (0 se mai invalidato)"""
+        return self._scope_state(scopes)[0]
+
+    def _scope_state(self, scopes: Iterable[str]):
+        """Versioni degli ambiti e istante (epoch) dell'ultima invalidazione di uno di essi"""
+        scopes = sorted(set(scopes))
+        placeholders = ', '.join('?' * len(scopes))
+        rows = self._connection().execute(
+            f'SELECT scope, version, invalidated_at FROM stats_cache_scope WHERE scope IN ({placeholders})', scopes
+        ).fetchall()
+        found = {scope: version for scope, version, _ in rows}
+        invalidated_at = max((value for _, _, value in rows if value is not None), default=0.0)
+        return {scope: found.get(scope, 0) for scope in scopes}, invalidated_at
+
+    def get_or_compute(self, name: str, compute: Callable, scopes: Iterable[str] = (GLOBAL,),
+                       params=None, ttl: Optional[int] = None, data_as_of: Optional[float] = None):
+        """
+        Restituisce il valore in cache o lo calcola e lo memorizza
+
+        Le versioni degli ambiti vengono lette prima del calcolo: se una
+        scrittura viene committata nel frattempo la voce nasce già superata
+        e la richiesta successiva la ricalcola.
+
+        Args:
+            name: Nome della statistica (usato anche per i contatori)
+            compute: Funzione senza argomenti che calcola il valore
+            scopes: Ambiti da cui dipende il valore
+            params: Parametri che distinguono più valori della stessa statistica
+            ttl: Scadenza in secondi (default STATS_CACHE_TTL)
+            data_as_of: Istante (epoch) a cui risalgono i dati letti da compute
+                (copia delle statistiche); se un ambito è stato invalidato
+                dopo, il valore viene restituito ma non memorizzato
+
+        Returns:
+            Valore come dopo un giro in JSON (date in formato ISO, righe come dizionari)
+        """
+        key = name if params is None else f'{name}:{_dumps(params)}'
+        connection = self._connection()
+        scope_versions, invalidated_at = self._scope_state(scopes)
+        versions = _dumps(scope_versions)
+        row = connection.execute(
+            'SELECT value, versions, expires_at FROM stats_cache_entry WHERE key = ?', (key,)
+        ).fetchone()
+        now = time.time()
+        if row is not None and row[1] == versions and row[2] > now:
+            self._count(name, 'hits')
+            return json.loads(row[0])
+
+        self._count(name, 'misses')
+        value = _dumps(compute())
+        if data_as_of is not None and invalidated_at > data_as_of:
+            return json.loads(value)
+        connection.execute('DELETE FROM stats_cache_entry WHERE expires_at <= ?', (now,))
+        connection.execute(
+            'INSERT OR REPLACE INTO stats_cache_entry (key, value, versions, expires_at) VALUES (?, ?, ?, ?)',
+            (key, value, versions, now + (self.ttl if ttl is None else ttl))
+        )
+        return json.loads(value)
+
+    def invalidate(self, *scopes: str):
+        """Incrementa la versione degli ambiti indicati"""
+        if not scopes:
+            return
+        connection = self._connection()
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            now = time.time()
+            connection.executemany(
+                'INSERT INTO stats_cache_scope (scope, version, invalidated_at) VALUES (?, 1, ?) '
+                'ON CONFLICT(scope) DO UPDATE SET version = version + 1, invalidated_at = excluded.invalidated_at',
+                [(scope, now) for scope in set(scopes)]
+            )
+            connection.execute('COMMIT')
+        except Exception:
+            connection.execute('ROLLBACK')
+            raise
+
+    def _count(self, name: str, counter: str):
+        with self._counters_lock:
+            self._counters[(name, counter)] += 1
+            due = time.monotonic() - self._counters_flushed >= COUNTER_FLUSH_INTERVAL
+        if due:
+            self.flush_counters()
+
+    def flush_counters(self):
+        """Scrive nel file i contatori accumulati dal processo"""
+        with self._counters_lock:
+            pending, self._counters = self._counters, Counter()
+            self._counters_flushed = time.monotonic()
+        if not pending:
+            return
+        by_name = {}
+        for (name, counter), count in pending.items():
+            by_name.setdefault(name, {'hits': 0, 'misses': 0})[counter] += count
+        self._connection().executemany(
+            'INSERT INTO stats_cache_counter (name, hits, misses) VALUES (?, ?, ?) '
+            'ON CONFLICT(name) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses',
+            [(name, counts['hits'], counts['misses']) for name, counts in by_name.items()]
+        )
+
+    def stats(self) -> List[dict]:
+        """Richieste servite dalla cache (hits) e ricalcolate (misses) per statistica"""
+        self.flush_counters()
+        rows = self._connection().execute(
+            'SELECT name, hits, misses FROM stats_cache_counter ORDER BY name'
+        ).fetchall()
+        return [{
+            'name': name,
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses) * 100, 1) if hits + misses else 0.0,
+        } for name, hits, misses in rows]
+
+
+def get_stats_cache() -> Optional[StatsCache]:
+    """Cache dell'applicazione corrente (None se disattivata o fuori contesto)"""
+    if not has_app_context():
+        return None
+    return current_app.extensions.get(STATS_CACHE)
+
+
+def cached(name: str, compute: Callable, scopes: Iterable[str] = (GLOBAL,), params=None,
+           ttl: Optional[int] = None):
+    """
+    Valore di una statistica letto dalla cache o calcolato
+
+    Con la cache disattivata, o se il file della cache non è utilizzabile,
+    il valore viene calcolato e restituito nella stessa forma (giro in JSON),
+    così i template ricevono sempre gli stessi tipi.
+
+    Args:
+        name: Nome della statistica (di solito l'endpoint della vista)
+        compute: Funzione senza argomenti che calcola il valore
+        scopes: Ambiti da cui dipende il valore
+        params: Parametri che distinguono più valori della stessa statistica
+        ttl: Scadenza in secondi (default STATS_CACHE_TTL)
+    """
+    cache = get_stats_cache()
+    if cache is not None:
+        # Letture instradate sulla copia delle statistiche: i dati risalgono all'istante della copia
+        freshness = analytics_freshness(current_app)
+        data_as_of = freshness.replace(tzinfo=timezone.utc).timestamp() if freshness is not None else None
+        try:
+            return cache.get_or_compute(name, compute, scopes=scopes, params=params, ttl=ttl,
+                                        data_as_of=data_as_of)
+        except sqlite3.Error as e:
+            logger.warning(f"Cache delle statistiche non disponibile per {name}: {str(e)}")
+    return json.loads(_dumps(compute()))
+
+
+def invalidate(*scopes: str):
+    """Invalida subito gli ambiti (da chiamare dopo il commit delle modifiche)"""
+    cache = get_stats_cache()
+    if cache is None:
+        return
+    try:
+        cache.invalidate(*scopes)
+    except sqlite3.Error as e:
+        logger.warning(f"Invalidazione della cache delle statistiche non riuscita: {str(e)}")
+
+
+def invalidate_on_commit(session: Session, *scopes: str):
+    """Invalida gli ambiti al commit della transazione corrente della sessione"""
+    session.info.setdefault(PENDING_SCOPES, set()).update(scopes)
+
+
+def apply_annotation_scopes(session, changes):
+    """
+    Gestore di services.annotation_events: annota gli ambiti toccati dalle
+    annotazioni aggiunte o rimosse (globale, file, quesito, utente)
+    """
+    invalidate_on_commit(session, *_annotation_scopes(session, changes.text_cell_ids, changes.user_ids))
+
+
+def _annotation_scopes(session, text_cell_ids, user_ids) -> set:
+    scopes = {GLOBAL} | {user_scope(user_id) for user_id in user_ids}
+    cells = TextCell.__table__
+    rows = session.connection().execute(
+        select(cells.c.excel_file_id, cells.c.column_name)
+        .where(cells.c.id.in_(list(text_cell_ids))).distinct()
+    )
+    for file_id, column_name in rows:
+        scopes.add(file_scope(file_id))
+        scopes.add(question_scope(file_id, column_name))
+    return scopes
+
+
+def _model_scopes(obj) -> set:
+    if isinstance(obj, ExcelFile):
+        return {GLOBAL, file_scope(obj.id)}
+    if isinstance(obj, TextCell):
+        return {GLOBAL, file_scope(obj.excel_file_id), question_scope(obj.excel_file_id, obj.column_name)}
+    if isinstance(obj, User):
+        return {GLOBAL, user_scope(obj.id)}
+    return {GLOBAL, LABELS}
+
+
+def _collect_model_scopes(session, flush_context):
+    scopes = set()
+    dirty = session.dirty
+    for obj in chain(session.new, session.deleted, dirty):
+        model = type(obj)
+        if model not in WATCHED_MODELS:
+            continue
+        if obj in dirty:
+            if not session.is_modified(obj):
+                continue
+            attributes = WATCHED_MODELS[model]
+            if attributes is not None and not any(
+                    inspect(obj).attrs[name].history.has_changes() for name in attributes):
+                continue
+        scopes |= _model_scopes(obj)
+    # Revisione delle annotazioni AI: lo stato 'rejected' le esclude da accordo e co-occorrenze
+    reviewed = [obj for obj in dirty
+                if isinstance(obj, CellAnnotation) and inspect(obj).attrs.status.history.has_changes()]
+    if reviewed:
+        scopes |= _annotation_scopes(session, {obj.text_cell_id for obj in reviewed},
+                                     {obj.user_id for obj in reviewed})
+    if scopes:
+        invalidate_on_commit(session, *scopes)
+
+
+def _after_commit(session):
+    # Un rollback lascia gli ambiti in sospeso: al commit successivo si invalida
+    # qualcosa in più, mai qualcosa in meno
+    scopes = session.info.pop(PENDING_SCOPES, None)
+    if scopes:
+        invalidate(*scopes)
+
+
+def configure_stats_cache(app):
+    """
+    Crea la cache delle statistiche e installa i listener della sessione
+
+    Configurazione usata:
+        STATS_CACHE_TTL: scadenza delle voci in secondi (0 = cache disattivata)
+        STATS_CACHE_PATH: file SQLite condiviso dai processi
+    """
+    if app.config.get('STATS_CACHE_TTL', 0) > 0:
+        app.extensions[STATS_CACHE] = StatsCache(os.path.abspath(app.config['STATS_CACHE_PATH']),
+                                                 app.config['STATS_CACHE_TTL'])
+    if not event.contains(Session, 'after_flush', _collect_model_scopes):
+        event.listen(Session, 'after_flush', _collect_model_scopes)
+    if not event.contains(Session, 'after_commit', _after_commit):
+        event.listen(Session, 'after_commit', _after_commit)
@@ -144,10 +144,10 @@ def main():
     print("=" * 50)
     
     # Importa l'app dopo aver configurato l'ambiente
-    from app import create_app
+    from app import create_app, is_serving_process
     
-    # Crea e avvia l'app
-    app = create_app()
+    # Crea e avvia l'app (i job in background partono solo nel processo figlio del reloader)
+    app = create_app(start_background_tasks=is_serving_process(use_reloader=True))
     
     try:
         app.run(
@@ -0,0 +1,167 @@
+// Caricamento a blocchi riprendibile per i file oltre il limite della singola richiesta
+//
+// Uso:
+//   const uploader = new ChunkedUploader(file, {
+//       target: 'excel',                       // oppure 'text_document'
+//       documentType: 'interview',             // solo per i documenti di testo
+//       onProgress: (sent, total) => { ... }
+//   });
+//   const result = await uploader.start();     // risposta di /uploads/<id>/finalize
+//   if (result.duplicate && confirm(...)) {
+//       await uploader.finalize(true);         // carica comunque, senza reinviare i blocchi
+//   }
+//
+// L'ID della sessione viene salvato in localStorage: ricaricando la pagina e
+// selezionando lo stesso file vengono inviati solo i blocchi mancanti.
+
+class ChunkedUploader {
+    constructor(file, options = {}) {
+        this.file = file;
+        this.target = options.target || 'excel';
+        this.documentType = options.documentType || null;
+        this.allowDuplicate = !!options.allowDuplicate;
+        this.baseUrl = options.baseUrl || '/uploads';
+        this.onProgress = options.onProgress || function() {};
+        this.concurrency = options.concurrency || 3;
+        this.maxRetries = options.maxRetries || 3;
+        this.session = null;
+        this.aborted = false;
+    }
+
+    get storageKey() {
+        return `chunked-upload:${this.target}:${this.file.name}:${this.file.size}:${this.file.lastModified}`;
+    }
+
+    csrfToken() {
+        const meta = document.querySelector('meta[name="csrf-token"]');
+        return meta ? meta.getAttribute('content') : '';
+    }
+
+    async request(method, url, body, headers = {}) {
+        const response = await fetch(url, {
+            method: method,
+            headers: Object.assign({'X-CSRFToken': this.csrfToken(), 'Accept': 'application/json'}, headers),
+            body: body,
+            credentials: 'same-origin'
+        });
+        let data = {};
+        try {
+            data = await response.json();
+        } catch (e) {
+            data = {error: `Risposta non valida dal server (${response.status})`};
+        }
+        return {status: response.status, ok: response.ok, data: data};
+    }
+
+    async sha256(buffer) {
+        // crypto.subtle è disponibile solo in contesti sicuri (HTTPS o localhost)
+        if (!window.crypto || !window.crypto.subtle) {
+            return null;
+        }
+        const digest = await window.crypto.subtle.digest('SHA-256', buffer);
+        return Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+    }
+
+    async resumeOrInit() {
+        const savedId = localStorage.getItem(this.storageKey);
+        if (savedId) {
+            const status = await this.request('GET', `${this.baseUrl}/${savedId}`);
+            if (status.ok && status.data.status === 'uploading') {
+                return status.data;
+            }
+            localStorage.removeItem(this.storageKey);
+        }
+
+        const init = await this.request('POST', `${this.baseUrl}/init`, JSON.stringify({
+            filename: this.file.name,
+            size: this.file.size,
+            target: this.target,
+            document_type: this.documentType
+        }), {'Content-Type': 'application/json'});
+        if (!init.ok) {
+            throw new Error(init.data.error || 'Impossibile avviare il caricamento');
+        }
+        localStorage.setItem(this.storageKey, init.data.upload_id);
+        return init.data;
+    }
+
+    async sendChunk(index) {
+        const start = index * this.session.chunk_size;
+        const blob = this.file.slice(start, Math.min(start + this.session.chunk_size, this.file.size));
+        const buffer = await blob.arrayBuffer();
+        const checksum = await this.sha256(buffer);
+        const headers = {'Content-Type': 'application/octet-stream'};
+        if (checksum) {
+            headers['X-Chunk-SHA256'] = checksum;
+        }
+
+        for (let attempt = 1; attempt <= this.maxRetries; attempt++) {
+            if (this.aborted) {
+                throw new Error('Caricamento annullato');
+            }
+            try {
+                const result = await this.request('PUT', `${this.baseUrl}/${this.session.upload_id}/chunks/${index}`, buffer, headers);
+                if (result.ok) {
+                    return buffer.byteLength;
+                }
+                if (result.status === 403 || result.status === 404) {
+                    throw new Error(result.data.error);
+                }
+            } catch (e) {
+                if (attempt === this.maxRetries) {
+                    throw e;
+                }
+            }
+            await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+        }
+        throw new Error(`Invio del blocco ${index} non riuscito`);
+    }
+
+    async start() {
+        this.session = await this.resumeOrInit();
+        const missing = this.session.missing_chunks.slice();
+        let sent = this.file.size - missing.reduce((total, index) => {
+            const start = index * this.session.chunk_size;
+            return total + Math.min(this.session.chunk_size, this.file.size - start);
+        }, 0);
+        this.onProgress(sent, this.file.size);
+
+        // Alcuni blocchi in parallelo: ognuno è una richiesta indipendente
+        const workers = [];
+        for (let w = 0; w < Math.min(this.concurrency, missing.length); w++) {
+            workers.push((async () => {
+                while (missing.length) {
+                    const index = missing.shift();
+                    sent += await this.sendChunk(index);
+                    this.onProgress(sent, this.file.size);
+                }
+            })());
+        }
+        await Promise.all(workers);
+
+        return this.finalize(this.allowDuplicate);
+    }
+
+    async finalize(allowDuplicate) {
+        // Per un duplicato il server conserva il file: la sessione resta valida per un nuovo tentativo
+        const result = await this.request('POST', `${this.baseUrl}/${this.session.upload_id}/finalize`,
+            JSON.stringify({allow_duplicate: !!allowDuplicate}), {'Content-Type': 'application/json'});
+        if (result.ok) {
+            localStorage.removeItem(this.storageKey);
+        }
+        if (!result.ok && !result.data.duplicate) {
+            throw new Error(result.data.error || 'Finalizzazione del caricamento non riuscita');
+        }
+        return result.data;
+    }
+
+    async cancel() {
+        this.aborted = true;
+        if (this.session) {
+            await this.request('DELETE', `${this.baseUrl}/${this.session.upload_id}`);
+            localStorage.removeItem(this.storageKey);
+        }
+    }
+}
+
+window.ChunkedUploader = ChunkedUploader;
@@ -0,0 +1,253 @@
+"""
+Copia in sola lettura del database per le statistiche
+
+Le pagine di /statistics eseguono aggregati pesanti: sullo stesso file SQLite
+in cui scrivono gli annotatori rallentano i clic di annotazione. Con il
+bind 'analytics' (un engine separato in app.extensions) le letture di queste
+pagine vanno su una copia separata:
+
+- SQLite: una copia del database fatta con l'API di backup online ogni
+  ANALYTICS_SNAPSHOT_INTERVAL secondi (SnapshotRefresher, in background),
+  aperta in sola lettura;
+- qualsiasi database (tipicamente una replica PostgreSQL): l'URL indicato in
+  ANALYTICS_DATABASE_URL.
+
+AnalyticsSession.get_bind instrada sul bind le sole SELECT eseguite in una
+richiesta che ha chiamato use_analytics_snapshot(); flush e scritture restano
+sul database principale. Finché la copia non esiste si legge dal principale.
+analytics_freshness() indica a quando risalgono i dati mostrati.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Dict, Optional
+
+from flask import current_app, g, has_app_context
+from flask_login import current_user
+from flask_sqlalchemy.session import Session
+from sqlalchemy import create_engine
+from sqlalchemy.sql import CompoundSelect, Select
+
+from utils.sql_compat import normalize_database_url
+
+logger = logging.getLogger(__name__)
+
+ANALYTICS_BIND = 'analytics'
+SNAPSHOT_INFO_TABLE = 'analytics_snapshot_info'
+
+_refreshers: Dict[str, 'SnapshotRefresher'] = {}
+_snapshot_mtimes: Dict[str, float] = {}
+_lock = threading.Lock()
+
+
+class AnalyticsSession(Session):
+    """Sessione che legge dal bind 'analytics' quando la richiesta lo chiede"""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if (bind is None and not self._flushing and isinstance(clause, (Select, CompoundSelect))
+                and has_app_context() and g.get('use_analytics_snapshot')):
+            analytics = current_app.extensions.get(ANALYTICS_BIND)
+            if analytics is not None:
+                return analytics.engine
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class AnalyticsBind:
+    """Engine delle letture delle statistiche e, per SQLite, file della copia"""
+
+    def __init__(self, engine, snapshot_path: Optional[str] = None):
+        self.engine = engine
+        self.snapshot_path = snapshot_path
+
+
+def configure_analytics_bind(app, db):
+    """
+    Crea il bind 'analytics' (da chiamare dopo db.init_app)
+
+    Non usa SQLALCHEMY_BINDS: db.create_all() proverebbe a creare le tabelle
+    anche sulla copia in sola lettura.
+
+    Configurazione usata:
+        ANALYTICS_DATABASE_URL: database di sola lettura (es. replica PostgreSQL)
+        ANALYTICS_SNAPSHOT_INTERVAL: secondi tra le copie di SQLite (0 = disattivato)
+        ANALYTICS_SNAPSHOT_PATH: file della copia di SQLite
+    """
+    url = app.config.get('ANALYTICS_DATABASE_URL')
+    if url:
+        engine = create_engine(normalize_database_url(url), **app.config.get('SQLALCHEMY_ENGINE_OPTIONS', {}))
+        app.extensions[ANALYTICS_BIND] = AnalyticsBind(engine)
+        return
+    with app.app_context():
+        dialect = db.engine.dialect.name
+    if dialect == 'sqlite' and app.config.get('ANALYTICS_SNAPSHOT_INTERVAL', 0) > 0:
+        path = os.path.abspath(app.config['ANALYTICS_SNAPSHOT_PATH'])
+        engine = create_engine(f'sqlite:///file:{path}?mode=ro&uri=true')
+        app.extensions[ANALYTICS_BIND] = AnalyticsBind(engine, path)
+
+
+def refresh_sqlite_snapshot(source_path: str, snapshot_path: str) -> datetime:
+    """
+    Copia il database con l'API di backup online di SQLite
+
+    La copia viene scritta in un file temporaneo e sostituisce quella
+    precedente con un rename atomico. In modalità WAL il backup in un solo
+    passo legge un'istantanea coerente senza bloccare gli scrittori.
+
+    Returns:
+        Istante (UTC) a cui si riferiscono i dati copiati
+    """
+    temporary = f'{snapshot_path}.tmp'
+    if os.path.exists(temporary):
+        os.remove(temporary)
+    os.makedirs(os.path.dirname(snapshot_path) or '.', exist_ok=True)
+    refreshed_at = datetime.utcnow()
+    source = sqlite3.connect(source_path)
+    target = sqlite3.connect(temporary)
+    try:
+        source.backup(target)
+        # La copia viene aperta in sola lettura: niente file -wal/-shm
+        target.execute('PRAGMA journal_mode=DELETE')
+        target.execute(f'CREATE TABLE IF NOT EXISTS {SNAPSHOT_INFO_TABLE} (refreshed_at TEXT NOT NULL)')
+        target.execute(f'DELETE FROM {SNAPSHOT_INFO_TABLE}')
+        target.execute(f'INSERT INTO {SNAPSHOT_INFO_TABLE} (refreshed_at) VALUES (?)', (refreshed_at.isoformat(),))
+        target.commit()
+    finally:
+        target.close()
+        source.close()
+    os.replace(temporary, snapshot_path)
+    return refreshed_at
+
+
+def refresh_analytics_snapshot(app, db) -> Optional[datetime]:
+    """Aggiorna la copia SQLite delle statistiche (None se non configurata)"""
+    analytics = app.extensions.get(ANALYTICS_BIND)
+    if analytics is None or analytics.snapshot_path is None:
+        return None
+    from utils.sqlite_tuning import database_path
+    with app.app_context():
+        source_path = database_path(db.engine)
+    refreshed_at = refresh_sqlite_snapshot(source_path, analytics.snapshot_path)
+    # Le connessioni già aperte leggono ancora il file sostituito
+    analytics.engine.dispose()
+    logger.info(f"Copia delle statistiche aggiornata: {analytics.snapshot_path}")
+    return refreshed_at
+
+
+class SnapshotRefresher(threading.Thread):
+    """Thread che aggiorna periodicamente la copia delle statistiche"""
+
+    def __init__(self, app, db, interval: float):
+        super().__init__(name='analytics-snapshot', daemon=True)
+        self.app = app
+        self.db = db
+        self.interval = interval
+        self._stop_event = threading.Event()
+
+    def run(self):
+        wait = 0
+        while not self._stop_event.wait(wait):
+            wait = self.interval
+            try:
+                path = self.app.extensions[ANALYTICS_BIND].snapshot_path
+                age = (datetime.now().timestamp() - os.path.getmtime(path)) if os.path.exists(path) else None
+                # Con più processi la copia fatta da un altro worker è già recente
+                if age is not None and age < self.interval:
+                    wait = self.interval - age
+                    continue
+                refresh_analytics_snapshot(self.app, self.db)
+            except Exception as e:
+                # Una copia mancata viene rifatta al giro successivo
+                logger.warning(f"Aggiornamento della copia delle statistiche non riuscito: {str(e)}")
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_snapshot_refresher(app, db) -> Optional[SnapshotRefresher]:
+    """Avvia (una sola volta per copia) l'aggiornamento periodico"""
+    analytics = app.extensions.get(ANALYTICS_BIND)
+    if analytics is None or analytics.snapshot_path is None:
+        return None
+    with _lock:
+        refresher = _refreshers.get(analytics.snapshot_path)
+        if refresher is None or not refresher.is_alive():
+            refresher = SnapshotRefresher(app, db, app.config['ANALYTICS_SNAPSHOT_INTERVAL'])
+            refresher.start()
+            _refreshers[analytics.snapshot_path] = refresher
+    return refresher
+
+
+def use_analytics_snapshot(app, required_since: Optional[datetime] = None):
+    """
+    Instrada sulla copia le letture della richiesta corrente
+
+    L'utente collegato viene caricato prima dal database principale (un
+    utente appena creato potrebbe non essere ancora nella copia).
+
+    Args:
+        app: Applicazione Flask
+        required_since: Se la copia è più vecchia di questo istante (es. file
+            caricato dopo l'ultima copia) la richiesta legge dal principale
+    """
+    current_user._get_current_object()
+    analytics = app.extensions.get(ANALYTICS_BIND)
+    if analytics is None:
+        return
+    path = analytics.snapshot_path
+    if path is not None:
+        if not os.path.exists(path):
+            return
+        # Copia sostituita da un altro processo: si riaprono le connessioni
+        mtime = os.path.getmtime(path)
+        if _snapshot_mtimes.get(path) != mtime:
+            if path in _snapshot_mtimes:
+                analytics.engine.dispose()
+            _snapshot_mtimes[path] = mtime
+    freshness = _read_freshness(analytics)
+    if required_since is not None and (freshness is None or freshness < required_since):
+        return
+    g.use_analytics_snapshot = True
+    g.analytics_freshness = freshness
+
+
+@contextmanager
+def primary_reads():
+    """
+    Esegue sul database principale le letture del blocco, anche in una
+    richiesta instradata sulla copia (es. oggetti indicati nell'URL e
+    controlli di accesso, che la copia potrebbe non avere ancora)
+    """
+    previous = g.get('use_analytics_snapshot')
+    g.use_analytics_snapshot = False
+    try:
+        yield
+    finally:
+        g.use_analytics_snapshot = previous
+
+
+def analytics_freshness(app) -> Optional[datetime]:
+    """
+    Istante (UTC) a cui risalgono i dati letti dal bind 'analytics'
+
+    None se la richiesta legge dal database principale.
+    """
+    if not g.get('use_analytics_snapshot'):
+        return None
+    return g.get('analytics_freshness')
+
+
+def _read_freshness(analytics: AnalyticsBind) -> Optional[datetime]:
+    with analytics.engine.connect() as connection:
+        if analytics.snapshot_path is not None:
+            value = connection.exec_driver_sql(f'SELECT refreshed_at FROM {SNAPSHOT_INFO_TABLE}').scalar()
+            return datetime.fromisoformat(value) if value else None
+        if analytics.engine.dialect.name == 'postgresql':
+            # Ultima transazione applicata dalla replica (NULL se non è una replica)
+            value = connection.exec_driver_sql('SELECT pg_last_xact_replay_timestamp()').scalar()
+            if value is not None:
+                return value.astimezone(timezone.utc).replace(tzinfo=None)
+    return datetime.utcnow()
@@ -0,0 +1,240 @@
+"""
+Paginazione a chiave (keyset/seek) per gli elenchi di celle molto lunghi
+
+.paginate() esegue OFFSET n e un COUNT(*) a ogni pagina: su un file con
+100k celle le pagine profonde diventano sempre più lente. Qui ogni pagina
+riparte dalla chiave di ordinamento dell'ultima (o prima) riga della pagina
+corrente:
+
+    WHERE (excel_file_id, sheet_name, row_index, column_index, id) > (:k1, ...)
+    ORDER BY ... LIMIT per_page + 1
+
+così la pagina 2000 costa quanto la pagina 1. La posizione viaggia in un
+cursore opaco nell'URL (?cursor=...); il totale esatto viene passato dalla
+vista (es. dagli aggregati di question_stats, quando coincidono con i filtri
+della query) o calcolato una volta e tenuto in cache per CACHE_TTL secondi.
+
+L'oggetto restituito espone gli stessi attributi di Pagination di
+Flask-SQLAlchemy (items, page, pages, total, has_prev, has_next,
+iter_pages...) più cursor_for(numero_pagina) per costruire i link.
+"""
+
+import base64
+import binascii
+import json
+import threading
+import time
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from sqlalchemy import tuple_
+
+# Durata (secondi) dei totali calcolati con COUNT(*)
+CACHE_TTL = 60
+
+_count_cache: Dict[Tuple, Tuple[float, int]] = {}
+_count_lock = threading.Lock()
+
+
+def encode_cursor(data: dict) -> str:
+    """Cursore opaco (base64 URL-safe del JSON) da inserire nei link"""
+    raw = json.dumps(data, separators=(',', ':'), default=str).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token: Optional[str]) -> Optional[dict]:
+    """Decodifica un cursore; None se assente o non valido (si torna alla prima pagina)"""
+    if not token:
+        return None
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+        data = json.loads(raw.decode('utf-8'))
+    except (binascii.Error, ValueError, UnicodeDecodeError):
+        return None
+    if not isinstance(data, dict) or data.get('d') not in ('after', 'before', 'last'):
+        return None
+    if not isinstance(data.get('p'), int) or data['p'] < 1:
+        return None
+    if not isinstance(data.get('s', 0), int) or data.get('s', 0) < 0:
+        return None
+    return data
+
+
+def cached_count(query, ttl: int = CACHE_TTL) -> int:
+    """
+    COUNT(*) di una query, memorizzato per ttl secondi
+
+    La chiave è l'SQL compilato con i suoi parametri, quindi filtri diversi
+    hanno totali distinti.
+    """
+    statement = query.order_by(None).statement
+    compiled = statement.compile()
+    key = (str(compiled), tuple(sorted((name, repr(value)) for name, value in compiled.params.items())))
+    now = time.monotonic()
+    with _count_lock:
+        entry = _count_cache.get(key)
+        if entry and entry[0] > now:
+            return entry[1]
+    total = query.order_by(None).count()
+    with _count_lock:
+        # Le voci scadute vengono rimosse a ogni scrittura (la cache resta piccola)
+        for stale in [k for k, (expires, _) in _count_cache.items() if expires <= now]:
+            del _count_cache[stale]
+        _count_cache[key] = (now + ttl, total)
+    return total
+
+
+class KeysetPagination:
+    """Pagina di risultati ottenuta con la paginazione a chiave"""
+
+    def __init__(self, items: List, page: int, per_page: int, total: int,
+                 has_prev: bool, has_next: bool, first_key: Optional[list],
+                 last_key: Optional[list], cursor: Optional[str]):
+        self.items = items
+        self.page = page
+        self.per_page = per_page
+        self.has_prev = has_prev
+        self.has_next = has_next
+        self.cursor = cursor
+        self._first_key = first_key
+        self._last_key = last_key
+        # Il totale può essere approssimato: sull'ultima pagina si corregge con le righe lette
+        if has_next:
+            self.pages = max(-(-total // per_page), page + 1)
+            self.total = max(total, page * per_page + 1)
+        else:
+            self.pages = page
+            self.total = (page - 1) * per_page + len(items)
+
+    @property
+    def prev_num(self) -> Optional[int]:
+        return self.page - 1 if self.has_prev else None
+
+    @property
+    def next_num(self) -> Optional[int]:
+        return self.page + 1 if self.has_next else None
+
+    @property
+    def prev_cursor(self) -> Optional[str]:
+        return self.cursor_for(self.page - 1) if self.has_prev else None
+
+    @property
+    def next_cursor(self) -> Optional[str]:
+        return self.cursor_for(self.page + 1) if self.has_next else None
+
+    def cursor_for(self, page_num: int) -> Optional[str]:
+        """
+        Cursore per raggiungere una pagina dai link della pagina corrente
+
+        Le pagine vicine partono dalla chiave della prima/ultima riga (saltando
+        le pagine intermedie), l'ultima viene letta in ordine inverso e la
+        prima non ha cursore.
+        """
+        if page_num <= 1:
+            return None
+        if page_num == self.page:
+            return self.cursor
+        if page_num == self.pages and page_num > self.page + 1:
+            return encode_cursor({'d': 'last', 'p': page_num})
+        if page_num > self.page and self._last_key is not None:
+            return encode_cursor({'d': 'after', 'p': page_num, 'k': self._last_key,
+                                  's': (page_num - self.page - 1) * self.per_page})
+        if page_num < self.page and self._first_key is not None:
+            return encode_cursor({'d': 'before', 'p': page_num, 'k': self._first_key,
+                                  's': (self.page - page_num - 1) * self.per_page})
+        return None
+
+    def iter_pages(self, *, left_current: int = 2, right_current: int = 3) -> Iterator[Optional[int]]:
+        """
+        Numeri di pagina per i link: la prima, l'ultima e quelle vicine alla
+        corrente (raggiungibili senza OFFSET sulle pagine precedenti); None
+        indica un salto.
+        """
+        start = max(2, self.page - left_current)
+        end = min(self.pages - 1, self.page + right_current)
+        yield 1
+        if start > 2:
+            yield None
+        yield from range(start, end + 1)
+        if end < self.pages - 1:
+            yield None
+        if self.pages > 1:
+            yield self.pages
+
+
+def keyset_paginate(query, keys: Sequence, cursor: Optional[str] = None, per_page: int = 20,
+                    total: Union[int, Callable[[], int], None] = None,
+                    page: Optional[int] = None) -> KeysetPagination:
+    """
+    Pagina una query ORM ordinandola per una chiave
+
+    Args:
+        query: Query ORM (senza order_by) degli oggetti da elencare
+        keys: Colonne o espressioni dell'ordinamento, tutte crescenti, non
+            nulle e che insieme identificano la riga (in coda la chiave primaria)
+        cursor: Cursore ricevuto nell'URL (None = prima pagina)
+        per_page: Righe per pagina
+        total: Totale noto (intero o funzione); None = COUNT(*) in cache.
+            Deve essere esatto: l'ultima pagina si legge a ritroso a partire
+            dal totale, e con una stima le pagine lette da lì verso l'inizio
+            non coinciderebbero con quelle lette in avanti
+        page: Numero di pagina senza cursore (vecchi link ?page=N), letto con OFFSET
+
+    Returns:
+        KeysetPagination
+    """
+    key_columns = [key.label(f'_page_key_{idx}') for idx, key in enumerate(keys)]
+    keyed = query.add_columns(*key_columns)
+    ascending = [key.asc() for key in keys]
+    descending = [key.desc() for key in keys]
+
+    def resolve_total():
+        value = total() if callable(total) else total
+        return cached_count(query) if value is None else value
+
+    state = decode_cursor(cursor)
+    if state is not None and state['d'] != 'last' and len(state.get('k') or []) != len(keys):
+        state = None
+
+    if state is None:
+        page = max(page or 1, 1)
+        rows = keyed.order_by(*ascending).offset((page - 1) * per_page).limit(per_page + 1).all()
+        has_prev, has_next = page > 1, len(rows) > per_page
+        rows = rows[:per_page]
+    elif state['d'] == 'after':
+        page = state['p']
+        rows = keyed.filter(tuple_(*keys) > tuple_(*state['k'])).order_by(*ascending)\
+                    .offset(state.get('s', 0)).limit(per_page + 1).all()
+        has_prev, has_next = True, len(rows) > per_page
+        rows = rows[:per_page]
+    else:
+        # Pagine precedenti e ultima pagina: lettura in ordine inverso
+        page = state['p']
+        if state['d'] == 'before':
+            limit = per_page
+            rows = keyed.filter(tuple_(*keys) < tuple_(*state['k'])).order_by(*descending)\
+                        .offset(state.get('s', 0)).limit(limit + 1).all()
+            has_next = True
+        else:
+            total = resolve_total()
+            limit = total % per_page or per_page
+            rows = keyed.order_by(*descending).limit(limit + 1).all()
+            has_next = False
+        has_prev = len(rows) > limit
+        rows = list(reversed(rows[:limit]))
+        if not has_prev and (page > 1 or len(rows) < limit):
+            # Raggiunto l'inizio: si mostra la prima pagina
+            return keyset_paginate(query, keys, None, per_page, total)
+
+    width = len(keys)
+    return KeysetPagination(
+        items=[row[0] for row in rows],
+        page=page,
+        per_page=per_page,
+        total=resolve_total(),
+        has_prev=has_prev,
+        has_next=has_next,
+        first_key=list(rows[0][-width:]) if rows else None,
+        last_key=list(rows[-1][-width:]) if rows else None,
+        # Le pagine lette con OFFSET (?page=N) non hanno un cursore proprio
+        cursor=encode_cursor(state) if state is not None else None
+    )
@@ -0,0 +1,113 @@
+"""
+Espressioni SQL portabili tra SQLite e PostgreSQL
+
+Le funzioni restituiscono elementi SQLAlchemy compilati in modo diverso per
+dialetto, così le query delle route restano identiche sui due database:
+
+    string_agg(colonna, distinct=True)   -> group_concat / string_agg
+    date_bucket(colonna, 'day')          -> strftime / to_char, sempre 'YYYY-MM-DD'
+"""
+
+from sqlalchemy import String, Text, cast
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import FunctionElement
+from sqlalchemy.sql.visitors import InternalTraversal
+
+# Driver usato per gli URL PostgreSQL senza driver esplicito (requirements.txt)
+POSTGRES_DRIVER = 'postgresql+psycopg2://'
+
+
+def normalize_database_url(url: str) -> str:
+    """
+    Uniforma l'URL del database per SQLAlchemy
+
+    Alcuni provider usano ancora lo schema 'postgres://', non più accettato da
+    SQLAlchemy; senza driver esplicito si usa psycopg2.
+    """
+    for scheme in ('postgres://', 'postgresql://'):
+        if url.startswith(scheme):
+            return POSTGRES_DRIVER + url[len(scheme):]
+    return url
+
+
+# Formato del primo giorno del periodo (stringa ISO, confrontabile e ordinabile)
+DATE_BUCKETS = {
+    'day': ('%Y-%m-%d', 'YYYY-MM-DD'),
+    'month': ('%Y-%m-01', 'YYYY-MM-01'),
+    'year': ('%Y-01-01', 'YYYY-01-01'),
+}
+
+
+class string_agg(FunctionElement):
+    """
+    Concatenazione dei valori di un gruppo
+
+    Args:
+        column: Colonna o espressione da concatenare
+        separator: Separatore tra i valori
+        distinct: Se True concatena solo i valori distinti (su SQLite il
+            separatore resta ',' perché group_concat(DISTINCT x, sep) non è ammesso)
+    """
+    type = Text()
+    inherit_cache = True
+    name = 'string_agg'
+    # Le opzioni fanno parte della chiave di cache dello statement compilato
+    _traverse_internals = FunctionElement._traverse_internals + [
+        ('separator', InternalTraversal.dp_string),
+        ('distinct', InternalTraversal.dp_boolean),
+    ]
+
+    def __init__(self, column, separator=',', distinct=False):
+        self.separator = separator
+        self.distinct = distinct
+        super().__init__(column)
+
+
+@compiles(string_agg)
+def _string_agg_default(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    if element.distinct:
+        return f'group_concat(DISTINCT {column})'
+    return f"group_concat({column}, {compiler.render_literal_value(element.separator, String())})"
+
+
+@compiles(string_agg, 'postgresql')
+def _string_agg_postgresql(element, compiler, **kw):
+    column = compiler.process(cast(list(element.clauses)[0], Text), **kw)
+    separator = compiler.render_literal_value(element.separator, String())
+    distinct = 'DISTINCT ' if element.distinct else ''
+    return f'string_agg({distinct}{column}, {separator})'
+
+
+class date_bucket(FunctionElement):
+    """
+    Periodo (giorno, mese o anno) di una colonna data/ora come stringa ISO
+
+    Args:
+        column: Colonna DateTime
+        unit: 'day', 'month' o 'year'
+    """
+    type = String()
+    inherit_cache = True
+    name = 'date_bucket'
+    _traverse_internals = FunctionElement._traverse_internals + [
+        ('unit', InternalTraversal.dp_string),
+    ]
+
+    def __init__(self, column, unit='day'):
+        if unit not in DATE_BUCKETS:
+            raise ValueError(f"Periodo non supportato: {unit}")
+        self.unit = unit
+        super().__init__(column)
+
+
+@compiles(date_bucket)
+def _date_bucket_default(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return f"strftime('{DATE_BUCKETS[element.unit][0]}', {column})"
+
+
+@compiles(date_bucket, 'postgresql')
+def _date_bucket_postgresql(element, compiler, **kw):
+    column = compiler.process(element.clauses, **kw)
+    return f"to_char({column}, '{DATE_BUCKETS[element.unit][1]}')"
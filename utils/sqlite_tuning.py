@@ -0,0 +1,213 @@
+"""
+Profilo di configurazione di SQLite per l'uso in produzione
+
+Ogni nuova connessione del pool riceve i PRAGMA del profilo scelto
+(SQLITE_PRAGMA_PROFILE, con eventuali override in SQLITE_PRAGMAS): in modalità
+WAL i lettori non bloccano lo scrittore, synchronous=NORMAL evita un fsync a
+ogni commit e busy_timeout fa attendere le scritture concorrenti invece di
+restituire subito "database is locked".
+
+In modalità WAL il file -wal cresce finché non viene eseguito un checkpoint:
+WalCheckpointer lo esegue periodicamente in un thread in background.
+"""
+
+import atexit
+import logging
+import os
+import threading
+from typing import Dict, Optional, Tuple
+
+from sqlalchemy import event
+
+logger = logging.getLogger(__name__)
+
+PRAGMA_PROFILES = {
+    # WAL con fsync solo ai checkpoint: sicuro contro i crash dell'applicazione,
+    # può perdere le ultime transazioni solo in caso di caduta del sistema
+    'production': {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+        'cache_size': -64000,          # 64 MB (valori negativi = KiB)
+        'mmap_size': 268435456,        # 256 MB
+        'temp_store': 'MEMORY',
+        'busy_timeout': 10000,         # millisecondi
+        'wal_autocheckpoint': 1000,    # pagine
+    },
+    # WAL con fsync a ogni commit
+    'safe': {
+        'journal_mode': 'WAL',
+        'synchronous': 'FULL',
+        'busy_timeout': 10000,
+    },
+    # Impostazioni predefinite di SQLite (rollback journal)
+    'none': {},
+}
+
+# PRAGMA accettati da configurazione (i valori vengono interpolati nel comando)
+ALLOWED_PRAGMAS = {
+    'journal_mode', 'synchronous', 'cache_size', 'mmap_size', 'temp_store',
+    'busy_timeout', 'wal_autocheckpoint', 'foreign_keys', 'journal_size_limit',
+}
+
+CHECKPOINT_MODES = ('PASSIVE', 'FULL', 'RESTART', 'TRUNCATE')
+
+_checkpointers: Dict[str, 'WalCheckpointer'] = {}
+_lock = threading.Lock()
+
+
+def resolve_pragmas(profile: str, overrides: Optional[Dict[str, object]] = None) -> Dict[str, object]:
+    """
+    PRAGMA del profilo con gli override di configurazione
+
+    Args:
+        profile: Nome del profilo in PRAGMA_PROFILES
+        overrides: PRAGMA aggiuntivi o sostitutivi (valore None = rimuovi)
+
+    Returns:
+        Dizionario nome -> valore
+    """
+    if profile not in PRAGMA_PROFILES:
+        raise ValueError(f"Profilo SQLite non valido: {profile}")
+    pragmas = dict(PRAGMA_PROFILES[profile])
+    for name, value in (overrides or {}).items():
+        if name not in ALLOWED_PRAGMAS:
+            raise ValueError(f"PRAGMA non supportato: {name}")
+        if value is None:
+            pragmas.pop(name, None)
+        else:
+            pragmas[name] = value
+    return pragmas
+
+
+def apply_pragmas(dbapi_connection, pragmas: Dict[str, object]):
+    """Esegue i PRAGMA su una connessione sqlite3"""
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in pragmas.items():
+            cursor.execute(f'PRAGMA {name}={value}')
+    finally:
+        cursor.close()
+
+
+def database_path(engine) -> Optional[str]:
+    """Percorso del file del database (None per i database in memoria)"""
+    path = engine.url.database
+    if not path or path == ':memory:' or path.startswith('file::memory:'):
+        return None
+    return os.path.abspath(path)
+
+
+def checkpoint_wal(engine, mode: str = 'PASSIVE') -> Tuple[int, int, int]:
+    """
+    Esegue un checkpoint del WAL
+
+    Args:
+        engine: Engine SQLAlchemy di un database SQLite
+        mode: PASSIVE (non attende i lettori), FULL, RESTART o TRUNCATE
+            (azzera anche il file -wal)
+
+    Returns:
+        Tupla (busy, pagine nel WAL, pagine copiate nel database)
+    """
+    mode = mode.upper()
+    if mode not in CHECKPOINT_MODES:
+        raise ValueError(f"Modalità di checkpoint non valida: {mode}")
+    with engine.connect() as connection:
+        row = connection.exec_driver_sql(f'PRAGMA wal_checkpoint({mode})').fetchone()
+    return tuple(row) if row else (0, 0, 0)
+
+
+class WalCheckpointer(threading.Thread):
+    """Thread che esegue periodicamente il checkpoint del WAL"""
+
+    def __init__(self, engine, interval: float, truncate_bytes: int):
+        super().__init__(name='sqlite-wal-checkpoint', daemon=True)
+        self.engine = engine
+        self.interval = interval
+        self.truncate_bytes = truncate_bytes
+        self.wal_path = f'{database_path(engine)}-wal'
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.checkpoint()
+
+    def checkpoint(self):
+        """Checkpoint PASSIVE, o TRUNCATE se il WAL ha superato la soglia"""
+        try:
+            wal_size = os.path.getsize(self.wal_path) if os.path.exists(self.wal_path) else 0
+            if not wal_size:
+                return None
+            mode = 'TRUNCATE' if wal_size > self.truncate_bytes else 'PASSIVE'
+            busy, log_pages, copied = checkpoint_wal(self.engine, mode)
+            logger.debug(f"Checkpoint WAL {mode}: {copied}/{log_pages} pagine (busy={busy})")
+            return busy, log_pages, copied
+        except Exception as e:
+            # Un checkpoint mancato viene recuperato al giro successivo
+            logger.warning(f"Checkpoint WAL non riuscito: {str(e)}")
+            return None
+
+    def stop(self):
+        self._stop_event.set()
+
+
+def start_wal_checkpointer(engine, interval: float, truncate_bytes: int) -> Optional[WalCheckpointer]:
+    """Avvia (una sola volta per database) il checkpoint periodico del WAL"""
+    path = database_path(engine)
+    if path is None or interval <= 0:
+        return None
+    with _lock:
+        checkpointer = _checkpointers.get(path)
+        if checkpointer is None or not checkpointer.is_alive():
+            checkpointer = WalCheckpointer(engine, interval, truncate_bytes)
+            checkpointer.start()
+            _checkpointers[path] = checkpointer
+    return checkpointer
+
+
+def stop_wal_checkpointers():
+    """Ferma i thread di checkpoint ed esegue un ultimo checkpoint"""
+    with _lock:
+        checkpointers = list(_checkpointers.values())
+        _checkpointers.clear()
+    for checkpointer in checkpointers:
+        checkpointer.stop()
+        checkpointer.checkpoint()
+
+
+atexit.register(stop_wal_checkpointers)
+
+
+def configure_sqlite(app, db):
+    """
+    Applica il profilo SQLite configurato alle connessioni dell'app
+
+    Configurazione usata:
+        SQLITE_PRAGMA_PROFILE: 'production', 'safe' o 'none'
+        SQLITE_PRAGMAS: dizionario di override dei PRAGMA
+        SQLITE_CHECKPOINT_INTERVAL: secondi tra i checkpoint del WAL (0 = disattivato)
+        SQLITE_CHECKPOINT_TRUNCATE_BYTES: dimensione del WAL oltre cui usare TRUNCATE
+        START_BACKGROUND_TASKS: False per non avviare il thread di checkpoint
+
+    Args:
+        app: Applicazione Flask (db.init_app già eseguito)
+        db: Istanza Flask-SQLAlchemy
+    """
+    with app.app_context():
+        engine = db.engine
+    if engine.dialect.name != 'sqlite':
+        return
+
+    pragmas = resolve_pragmas(app.config.get('SQLITE_PRAGMA_PROFILE', 'production'),
+                              app.config.get('SQLITE_PRAGMAS'))
+    if pragmas:
+        @event.listens_for(engine, 'connect')
+        def _set_sqlite_pragmas(dbapi_connection, connection_record):
+            apply_pragmas(dbapi_connection, pragmas)
+
+    if str(pragmas.get('journal_mode', '')).upper() == 'WAL' and app.config.get('START_BACKGROUND_TASKS', True):
+        start_wal_checkpointer(
+            engine,
+            app.config.get('SQLITE_CHECKPOINT_INTERVAL', 300),
+            app.config.get('SQLITE_CHECKPOINT_TRUNCATE_BYTES', 64 * 1024 * 1024)
+        )